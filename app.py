@@ -19,6 +19,17 @@ import time
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+# 🚦 J-Quants 共通レートリミッター（全セッション・全スレッドで1個を共有）
+import rate_limiter
+import tracer
+import shared_cache
+import http_cache
+import yf_gateway
+import quote_poller
+from rate_limiter import jquants_get
+import price_store
+from price_panel import PricePanel
+
 # --- st.metricの文字切れ（...）を防ぐスナイパーパッチ ---
 st.markdown("""
     <style>
@@ -57,8 +68,7 @@ def get_all_latest_prices_bulk():
         url = f"{BASE_URL}/equities/bars/daily?date={dt_str}"
         
         try:
-            time.sleep(1.05) # Lightプラン制限対策
-            r = api_session.get(url, timeout=15.0)
+            r = jquants_get(api_session, url, timeout=15.0) # 🚦 プラン上限ちょうどで発射
             
             if r.status_code == 200:
                 raw_json = r.json()
@@ -73,8 +83,6 @@ def get_all_latest_prices_bulk():
                         if pd.notna(val):
                             prices_map[code_4digit] = float(val)
                     return prices_map
-            elif r.status_code == 429:
-                time.sleep(2.0) 
         except Exception:
             pass 
             
@@ -83,17 +91,16 @@ def get_all_latest_prices_bulk():
 # ==========================================
 # 📊 【新・爆速版】ローカルDBからのファンダメンタルズ読込エンジン
 # ==========================================
-import pickle
 import os
+import fundamentals_store
 
 @st.cache_resource(ttl=3600*24) # 1日キャッシュしてメモリに常駐させる
 def load_local_fundamentals_db():
-    """19時にBotが集めたデータを一瞬でメモリにロードする"""
-    db_path = os.path.join(os.path.dirname(__file__), "fundamentals_db.pkl")
-    if os.path.exists(db_path):
-        with open(db_path, "rb") as f:
-            return pickle.load(f)
-    return {}
+    """19時にBotが集めた正規化済み決算テーブルを一瞬でメモリにロードする（旧pickleにも対応）"""
+    try:
+        return fundamentals_store.load_table()
+    except Exception:
+        return {}
 
 def get_historical_statements(code):
     """API通信を一切行わず、ロード済みのローカルDBからデータを返すだけ"""
@@ -105,138 +112,16 @@ def get_historical_statements(code):
     api_code = str(code) if len(str(code)) >= 5 else str(code) + "0"
     return db.get(api_code, None)
 
-# ==========================================
-# 🧠 ファンダメンタルズ解析エンジン（QoQ・直近2期連続・絶対防弾版）
-# ==========================================
-def analyze_fundamental_momentum(df, mode="buy", sales_req=7.0, ord_req=15.0):
-    import pandas as pd
-    try:
-        if df is None or len(df) < 3:
-            return False, ""
-        
-        cols = [str(c).lower() for c in df.columns]
-        def find_c(*names):
-            for n in names:
-                if n.lower() in cols: return df.columns[cols.index(n.lower())]
-            return None
-
-        c_sales = find_c('Sales', 'NetSales', 'net_sales')
-        c_op = find_c('OP', 'OperatingProfit', 'operating_profit')
-        c_ord = find_c('OdP', 'OrdinaryProfit', 'ordinary_profit')
-        c_eps = find_c('EPS', 'EarningsPerShare', 'eps')
-        c_profit = find_c('NP', 'Profit', 'netincome')
-        c_type = find_c('CurPerType', 'TypeOfCurrentPeriod', 'type')
-        
-        if not c_sales or not c_ord:
-            return False, ""
+from scan_core import analyze_fundamental_momentum, detect_sakata_patterns, calc_vector_indicators, get_fast_indicators, clean_df, compress_memory
+# 1銘柄ずつのスキャン（TAB1/TAB2 の旧ストア用・TAB3 の判定）は scan_core の関数をプロセス版エンジンへ渡す
+from scan_core import screen_fundamentals_code, judge_tab3
+from fundamental_screener import has_derived, screen_momentum
+from formation_engine import scan_formations, signal_dates
+import sakata_engine
+from feature_store import FeatureTable
+import backtester
+import param_sweep
 
-        def to_flt(v):
-            try:
-                if pd.isna(v) or str(v).strip() == '': return 0.0
-                return float(str(v).replace(',', ''))
-            except:
-                return 0.0
-
-        actual_mask = (df[c_sales].apply(to_flt) > 0) | (df[c_ord].apply(to_flt) > 0)
-        actual_df = df[actual_mask].copy().reset_index(drop=True)
-        
-        if len(actual_df) < 3:
-            return False, ""
-            
-        std_df = actual_df.copy()
-        
-        for i in range(1, len(actual_df)):
-            curr_sales = to_flt(actual_df[c_sales].iloc[i])
-            prev_sales = to_flt(actual_df[c_sales].iloc[i-1])
-            curr_type = str(actual_df[c_type].iloc[i]) if c_type else ""
-            
-            is_q1 = False
-            if '1Q' in curr_type or 'Q1' in curr_type:
-                is_q1 = True
-            elif curr_sales < prev_sales and prev_sales > 0:
-                is_q1 = True
-                
-            if not is_q1:
-                for col in filter(None, [c_sales, c_op, c_ord, c_eps, c_profit]):
-                    try:
-                        c_val = to_flt(actual_df[col].iloc[i])
-                        p_val = to_flt(actual_df[col].iloc[i-1])
-                        std_df.iat[i, std_df.columns.get_loc(col)] = c_val - p_val
-                    except Exception:
-                        pass
-                        
-        q0 = std_df.iloc[-1] 
-        q1 = std_df.iloc[-2]
-        q2 = std_df.iloc[-3]
-        
-        def get_val(row, primary_col, fallback_col=None):
-            v = to_flt(row.get(primary_col, 0.0)) if primary_col else 0.0
-            if v == 0.0 and fallback_col:
-                v = to_flt(row.get(fallback_col, 0.0))
-            return v
-
-        q0_sales = get_val(q0, c_sales)
-        q1_sales = get_val(q1, c_sales)
-        q2_sales = get_val(q2, c_sales)
-        
-        q0_op = get_val(q0, c_op)
-        q1_op = get_val(q1, c_op)
-        q2_op = get_val(q2, c_op)
-        
-        q0_ord = get_val(q0, c_ord)
-        q1_ord = get_val(q1, c_ord)
-        q2_ord = get_val(q2, c_ord)
-        
-        q0_eps = get_val(q0, c_eps, c_profit)
-        q1_eps = get_val(q1, c_eps, c_profit)
-        q2_eps = get_val(q2, c_eps, c_profit)
-
-        if q0_sales <= 0 or q1_sales <= 0 or q2_sales <= 0:
-            return False, ""
-
-        def calc_gr(c, p):
-            if p == 0: return 0.0
-            return ((c - p) / abs(p)) * 100.0
-
-        s_q0 = calc_gr(q0_sales, q1_sales)
-        op_q0 = calc_gr(q0_op, q1_op)
-        or_q0 = calc_gr(q0_ord, q1_ord)
-        ep_q0 = calc_gr(q0_eps, q1_eps)
-
-        s_q1 = calc_gr(q1_sales, q2_sales)
-        op_q1 = calc_gr(q1_op, q2_op)
-        or_q1 = calc_gr(q1_ord, q2_ord)
-        ep_q1 = calc_gr(q1_eps, q2_eps)
-        
-        if mode == "buy":
-            # 利益がマイナスなら不合格（成長率がプラスでも赤字なら買わない）
-            if q0_op < 0 or q0_ord < 0 or q0_eps < 0 or q1_op < 0 or q1_ord < 0 or q1_eps < 0:
-                return False, ""
-                
-            if not (s_q0 >= sales_req and s_q1 >= sales_req): return False, ""
-            if not (op_q0 >= 15.0 and op_q1 >= 15.0): return False, ""
-            if not (or_q0 >= ord_req and or_q1 >= ord_req): return False, ""
-            if not (ep_q0 >= 15.0 and ep_q1 >= 15.0): return False, ""
-            
-            if op_q0 >= 20.0 and or_q0 >= 20.0 and ep_q0 >= 20.0:
-                return True, "S級🎯"
-            return True, "A級🟢"
-            
-        elif mode == "sell":
-            # 🚨 修正：赤字なら無条件合格とする小細工を排除。純粋に計算されたパーセンテージだけで判定する。
-            if not (s_q0 < 5.0 and s_q1 < 5.0): return False, ""
-            if not (op_q0 < 10.0 and op_q1 < 10.0): return False, ""
-            if not (or_q0 < 5.0 and or_q1 < 5.0): return False, ""
-            if not (ep_q0 < 10.0 and ep_q1 < 10.0): return False, ""
-            
-            if q0_op < 0 and q0_ord < 0 and q0_eps < 0 and q1_op < 0 and q1_ord < 0 and q1_eps < 0:
-                return True, "S級💀"
-            return True, "A級📉"
-            
-    except Exception:
-        pass
-    return False, ""
-    
 def inject_auth_script():
     if not st.session_state.js_injected:
         container = st.empty()
@@ -342,6 +227,15 @@ def get_cache_key():
 
 cache_key = get_cache_key()
 
+def scan_data_version():
+    """
+    共有スキャン結果（shared_cache.SCAN_CACHE）のデータ版。
+    19時の入れ替え（get_cache_key）・決算ストアの更新・最新株価の1時間キャッシュの切り替わりで変わる。
+    """
+    return (get_cache_key(),
+            shared_cache.file_version(fundamentals_store.STORE_PATH, fundamentals_store.LEGACY_PICKLE_PATH),
+            int(time.time() // 3600))
+
 # =========================================================
 # 🛡️ 【絶対防壁】19時キャッシュクリア時の強制復旧フック
 # =========================================================
@@ -488,6 +382,7 @@ def load_exclude_codes():
         except: pass
     return ""
 
+@tracer.trace("Sheets同期: 除外コード")
 def save_exclude_codes_to_file():
     ws = get_or_create_worksheet(WS_EXCLUDE)
     if ws:
@@ -499,6 +394,7 @@ def save_exclude_codes_to_file():
             st.sidebar.error(f"🚨 [除外コード] 書込エラー: {e}")
 
 # --- 2. データベース汎用保存・読込関数 ---
+@tracer.trace("Sheets同期: 交戦モニター")
 def save_frontline_db(df):
     ws = get_or_create_worksheet(WS_FRONTLINE)
     if ws:
@@ -510,12 +406,14 @@ def save_frontline_db(df):
             data = [list(df.columns)] + df.fillna("").astype(str).values.tolist()
         
         try:
+            tracer.add_rows(len(data) - 1)
             try: ws.update(values=data, range_name="A1")
             except TypeError: ws.update("A1", data)
             st.sidebar.success("✅ [交戦モニター] Google DBへ書き込み完了")
         except Exception as e:
             st.sidebar.error(f"🚨 [交戦モニター] 書込エラー: {e}")
 
+@tracer.trace("Sheets同期: 戦績DB")
 def save_aar_db(df):
     ws = get_or_create_worksheet(WS_AAR)
     if ws:
@@ -526,12 +424,14 @@ def save_aar_db(df):
             data = [list(df.columns)] + df.fillna("").astype(str).values.tolist()
             
         try:
+            tracer.add_rows(len(data) - 1)
             try: ws.update(values=data, range_name="A1")
             except TypeError: ws.update("A1", data)
             st.sidebar.success("✅ [戦績DB] Google DBへ書き込み完了")
         except Exception as e:
             st.sidebar.error(f"🚨 [戦績DB] 書込エラー: {e}")
 
+@tracer.trace("Sheets読込")
 def load_db_to_df(sheet_name, default_cols):
     ws = get_or_create_worksheet(sheet_name)
     if ws:
@@ -542,6 +442,7 @@ def load_db_to_df(sheet_name, default_cols):
     return pd.DataFrame(columns=default_cols)
 
 # --- 3. 強制同期フック ---
+@tracer.trace("Sheets同期: 全設定")
 def extended_save_settings():
     save_exclude_codes_to_file()
     try:
@@ -561,12 +462,19 @@ def extended_save_settings():
 # 必ずセッション構築の「上」に以下の2行を配置してください。
 # =========================================================
 API_KEY = st.secrets.get("JQUANTS_API_KEY", "").strip()
-BASE_URL = "https://api.jquants.com/v2"
+# 🧪 JQUANTS_BASE_URL でローカルの代役サーバー（jquants_stub_server.py）へ向け替えられる
+BASE_URL = os.getenv("JQUANTS_BASE_URL", "https://api.jquants.com/v2").rstrip("/")
+
+# 🚦 プラン（または毎分上限）が Secrets にあればリミッターへ反映（プロセスで1回だけ）
+if rate_limiter._limiter is None and (st.secrets.get("JQUANTS_RPM") or st.secrets.get("JQUANTS_PLAN")):
+    rate_limiter.configure(rpm=st.secrets.get("JQUANTS_RPM"), plan=st.secrets.get("JQUANTS_PLAN"), burst=st.secrets.get("JQUANTS_BURST"))
 
 # 🚨 通信セッションの永続化とリトライバッファの構築
-if "api_session" not in st.session_state:
+# 🤝 全ブラウザセッションで1本を共有（接続プールも共有。セッションごとに作り直さない）
+@st.cache_resource(show_spinner=False)
+def get_api_session(api_key):
     session = requests.Session()
-    session.headers.update({"x-api-key": API_KEY})  # ← ここでエラーが起きていました
+    session.headers.update({"x-api-key": api_key})  # ← ここでエラーが起きていました
     
     # 🚨 修正：429（レート制限）を自動リトライから外し、カスタム冷却ループに制御を完全委譲
     retry_strategy = Retry(
@@ -576,39 +484,30 @@ if "api_session" not in st.session_state:
     )
     adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=retry_strategy)
     session.mount("https://", adapter)
-    st.session_state.api_session = session
+    # 💾 過去日の日足・締まった決算はディスクから返す（jquants_get が発射前に引く。再起動後も有効）
+    session.http_cache = http_cache.HTTP_CACHE
+    return session
 
+st.session_state.api_session = get_api_session(API_KEY)
 api_session = st.session_state.api_session
 
+@st.cache_resource(max_entries=1, show_spinner=False)
+def drop_split_bars_from_cache(key):
+    """19時の入れ替えごとに1回：兵站Botが記録した分割・併合より前の日足の保存応答を捨てる（Adj 値が遡って変わるため）"""
+    if http_cache.HTTP_CACHE is None:
+        return 0
+    try:
+        return http_cache.HTTP_CACHE.drop_split_bars(price_store.load_manifest()["splits"])
+    except Exception:
+        return 0
+
+drop_split_bars_from_cache(get_cache_key())
+
 if "login_time" not in st.session_state:
     st.session_state.login_time = time.time()
 
 st.write(f"⏱ 経過時間: {time.time() - st.session_state.login_time:.2f}秒")
 
-def compress_memory(df):
-    """データフレームのメモリサイズを強制的に半減させる極限圧縮処理"""
-    if df is None or df.empty:
-        return df
-        
-    # 浮動小数点の圧縮 (float64 -> float32)
-    float_cols = df.select_dtypes(include=['float64']).columns
-    df[float_cols] = df[float_cols].astype('float32')
-    
-    # 整数の圧縮 (int64 -> int32)
-    int_cols = df.select_dtypes(include=['int64']).columns
-    df[int_cols] = df[int_cols].astype('int32')
-    
-    # 🚨 開発参謀パッチ：システムの中核列（日付やコード）はカテゴリ圧縮から除外する
-    exclude_cols = ['Date', 'Code', 'Date_Str', 'Date_x', 'Date_y'] 
-    
-    # オブジェクト型（文字列等）で種類が少ないものをカテゴリ化
-    for col in df.select_dtypes(include=['object']).columns:
-        if col not in exclude_cols: # 🚨 除外リストにない列だけを圧縮対象とする
-            if df[col].nunique() / len(df) < 0.5:
-                df[col] = df[col].astype('category')
-            
-    return df
-
 # ==========================================
 # ⚙️ 設定の永続化（完全統合・決定版・物理結線済）
 # ==========================================
@@ -675,9 +574,8 @@ load_settings()
 @st.cache_data(ttl=600, show_spinner=False)  # 🚨 参謀追記：APIの過剰なリクエストを防ぐためキャッシュを推奨します
 def get_macro_weather():
     try:
-        import yfinance as yf
-        tk = yf.Ticker("^N225")
-        df_raw = tk.history(period="3mo")
+        # 🌐 yfinance 窓口経由（同時期の要求は1回にまとめ、TTL の間は使い回す）
+        df_raw = yf_gateway.history(["^N225"], period="3mo").get("^N225", pd.DataFrame())
         if not df_raw.empty:
             if df_raw.index.tz is not None:
                 df_raw.index = df_raw.index.tz_localize(None)
@@ -701,7 +599,7 @@ def get_macro_weather():
                     
                     url = f"{BASE_URL}/equities/bars/daily?code=13060&from={f_d}&to={t_d}" 
                     try:
-                        r = api_session.get(url, timeout=3.0)
+                        r = jquants_get(api_session, url, retries=0, timeout=3.0)
                         if r.status_code == 200:
                             data = r.json().get("daily_quotes") or r.json().get("data") or []
                             if data:
@@ -748,26 +646,29 @@ def fetch_current_prices_fast(codes):
     tz_jst = pytz.timezone('Asia/Tokyo')
     base = datetime.now(tz_jst)
     f_d, t_d = (base - timedelta(days=7)).strftime('%Y%m%d'), base.strftime('%Y%m%d')
+    # 📡 裏のポーラーが取得済みの銘柄はスナップショットから即答（通信しない）
+    polled = quote_poller.POLLER.snapshot()
+    for c in codes:
+        hit = polled.get(quote_poller.normalize_code(c))
+        if hit is not None:
+            results[c] = hit[0]
+
+    # 🌟 yfinanceで日中の最新価格を残り全銘柄まとめて1回で取得（yf_gateway が一括ダウンロード＋TTLキャッシュ）
+    try:
+        rest = [c for c in codes if c not in results]
+        if rest:
+            results.update({c: p for c, p in yf_gateway.latest_prices(rest).items() if pd.notna(p)})
+    except Exception:
+        pass
+
     def fetch_single(code):
         clean_code = str(code).replace('.0', '').strip()
-        
-        # 🌟 追加：yfinanceで日中の最新価格を取得
-        try:
-            import yfinance as yf
-            tk = yf.Ticker(f"{clean_code}.T")
-            df_today = tk.history(period="1d")
-            if not df_today.empty:
-                current_price = df_today['Close'].iloc[-1]
-                if pd.notna(current_price):
-                    return code, float(current_price)
-        except:
-            pass
 
         # 既存：取得できなかった場合のJ-Quants（5桁・大引け後用）
         api_code = clean_code if len(clean_code) >= 5 else clean_code + "0"
         url = f"{BASE_URL}/equities/bars/daily?code={api_code}&from={f_d}&to={t_d}"
         try:
-            r = api_session.get(url, timeout=3.0)
+            r = jquants_get(api_session, url, retries=1, timeout=3.0)
             if r.status_code == 200:
                 data = r.json().get("daily_quotes") or r.json().get("data") or []
                 if data:
@@ -778,7 +679,7 @@ def fetch_current_prices_fast(codes):
         return code, None
 
     with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        futs = {executor.submit(fetch_single, c): c for c in codes}
+        futs = {executor.submit(fetch_single, c): c for c in codes if c not in results}
         for f in concurrent.futures.as_completed(futs):
             c_code, price = f.result()
             if price is not None: results[c_code] = price
@@ -859,149 +760,11 @@ def render_macro_board():
         st.markdown("<div style='margin-bottom: 1.5rem;'></div>", unsafe_allow_html=True)
 
 # --- 3. 共通関数 & 演算エンジン ---
-def execute_chunked_scan(codes_or_groups, process_func, *args, max_workers=3, chunk_size=200):
-    """
-    OOM（メモリ枯渇）を回避するためのマイクロバッチ実行エンジン。
-    引数のリストをchunk_sizeごとに分割し、1チャンク終わるごとに強制GCを発動する。
-    """
-    all_results = []
-    
-    # codes_or_groups は [code1, code2...] または [(code, group), ...] のリストを想定
-    for i in range(0, len(codes_or_groups), chunk_size):
-        chunk = codes_or_groups[i:i + chunk_size]
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            if isinstance(chunk[0], tuple): # (code, group) の場合 (TAB2, TAB3など)
-                futs = [executor.submit(process_func, c, g, *args) for c, g in chunk]
-            else: # code 単体の場合
-                futs = [executor.submit(process_func, c, *args) for c in chunk]
-                
-            for f in concurrent.futures.as_completed(futs):
-                try:
-                    res = f.result()
-                    if res:
-                        if isinstance(res, list):
-                            all_results.extend(res)
-                        else:
-                            all_results.append(res)
-                except Exception:
-                    pass
-                    
-        # 🚨 チャンクごとに役目を終えた一時メモリを強制焼却（ガベージコレクション）
-        gc.collect()
-        
-    return all_results
+# 銘柄ごとスキャンの実行エンジンは parallel_scan.py（プロセスプール版 execute_chunked_scan_mp は
+# import できるモジュールの関数しか送れないため、1銘柄の処理は scan_core.py の関数を渡す。bench.py で計測）
+from parallel_scan import execute_chunked_scan_mp
     
-def clean_df(df):
-    if df is None or df.empty: 
-        return pd.DataFrame()
-    
-    # 🚨 補修：小文字の 'code' を強制的に大文字の 'Code' に統一
-    if 'code' in df.columns and 'Code' not in df.columns:
-        df = df.rename(columns={'code': 'Code'})
-
-    # 🚨 出来高の欠損を防ぐ柔軟な抽出
-    vol_candidates = ['AdjustmentVolume', 'Volume', 'volume', 'Vol', 'Vo']
-    for c in vol_candidates:
-        if c in df.columns and c != 'AdjustmentVolume':
-            df = df.rename(columns={c: 'AdjustmentVolume'})
-            break
-
-    # 🚨 重複リネームによる2次元化(DataFrame化)を完全に防ぐ
-    if 'AdjustmentClose' in df.columns:
-        p_map = {
-            'AdjustmentOpen': 'AdjO', 'AdjustmentHigh': 'AdjH', 
-            'AdjustmentLow': 'AdjL', 'AdjustmentClose': 'AdjC'
-        }
-    else:
-        p_map = {
-            'Open': 'AdjO', 'High': 'AdjH', 'Low': 'AdjL', 'Close': 'AdjC',
-            'O': 'AdjO', 'H': 'AdjH', 'L': 'AdjL', 'C': 'AdjC'
-        }
-        
-    df = df.rename(columns=p_map)
-
-    # 🛡️ 万が一重複列が発生していても「最初の1列」だけを残す
-    df = df.loc[:, ~df.columns.duplicated(keep='first')]
-
-    keep = ['Code', 'Date', 'AdjO', 'AdjH', 'AdjL', 'AdjC', 'AdjustmentVolume']
-    df = df[[c for c in keep if c in df.columns]].copy()
-    
-    if 'Date' in df.columns:
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-    for col in ['AdjO', 'AdjH', 'AdjL', 'AdjC', 'AdjustmentVolume']:
-        if col in df.columns:
-            # 1次元データ(Series)としてfloat32キャスト
-            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
-            
-    if 'Code' in df.columns:
-        df['Code'] = df['Code'].astype('category')
-        
-    # 🚨 最終防壁：データ内に 'Code' 列が存在しない場合でもエラーで落ちないように動的ソート
-    sort_keys = [k for k in ['Code', 'Date'] if k in df.columns]
-    
-    return df.dropna(subset=['AdjC']).sort_values(sort_keys).reset_index(drop=True)
-
 # --- 3. 共通関数 & 演算エンジン ---
-def calc_vector_indicators(df):
-    """完全ベクトル化されたテクニカル指標計算（14日Wilder式・実数ATR完全換装版）"""
-    if df is None or df.empty or len(df) < 2:
-        return df
-
-    # 動的な列名取得（すれ違い防止回路）
-    close_col = 'AdjC' if 'AdjC' in df.columns else 'Close'
-    high_col = 'AdjH' if 'AdjH' in df.columns else 'High'
-    low_col = 'AdjL' if 'AdjL' in df.columns else 'Low'
-    
-    if close_col not in df.columns:
-        return df
-
-    # 1. 移動平均線 (float32で計算結果を保持)
-    df['SMA25'] = df[close_col].rolling(window=25, min_periods=1).mean().astype('float32')
-    df['SMA75'] = df[close_col].rolling(window=75, min_periods=1).mean().astype('float32')
-
-    # ====================================================================
-    # 🎯 2. 【完全浄化】14日Wilder式 実数ATR計算（ハイブリッド安全装置）
-    # ====================================================================
-    if high_col in df.columns and low_col in df.columns:
-        c_prev = df[close_col].shift(1)
-        tr1 = df[high_col] - df[low_col]
-        tr2 = (df[high_col] - c_prev).abs()
-        tr3 = (df[low_col] - c_prev).abs()
-        
-        # True Rangeの算出
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-        
-        # 🛡️ Wilder式ATR（RMA: 修正移動平均 = alpha 1/14 の指数平滑）
-        if len(df) >= 14:
-            df['ATR_Standard'] = tr.ewm(alpha=1/14, adjust=False, min_periods=1).mean().astype('float32')
-        else:
-            # 14日未満の場合は単純平均で代用
-            df['ATR_Standard'] = tr.rolling(window=len(df), min_periods=1).mean().astype('float32')
-        
-        del c_prev, tr1, tr2, tr3, tr
-    else:
-        # 究極のフェイルセーフ（High/Lowが存在しない等の異常時のみ）
-        df['ATR_Standard'] = (df[close_col] * 0.05).astype('float32')
-        
-    # 互換性のため、小文字の 'atr' 列にも同じ実数値をセット
-    df['atr'] = df['ATR_Standard']
-    df['ATR'] = df['ATR_Standard']
-    # ====================================================================
-
-    # 3. RSIの完全ベクトル化計算
-    delta = df[close_col].diff()
-    gain = delta.where(delta > 0, 0.0).rolling(window=14, min_periods=1).mean()
-    loss = (-delta.where(delta < 0, 0.0)).rolling(window=14, min_periods=1).mean()
-    
-    # ゼロ除算回避とRSI算出
-    rs = gain / loss.replace(0, 1e-10) 
-    df['RSI'] = (100 - (100 / (1 + rs))).astype('float32')
-
-    del delta, gain, loss, rs
-    return df
-
 def check_event_mines(code, event_data=None):
     alerts = []
     c = str(code)[:4]
@@ -1061,94 +824,6 @@ def check_event_mines(code, event_data=None):
             
     return alerts
 
-def detect_sakata_patterns(df):
-    """
-    酒田五法のフォーメーションを検知する防弾仕様の精密レーダー。
-    データ構造の不整合を自動修復し、いかなる場合もクラッシュを許さない。
-    """
-    if df is None or len(df) < 5: 
-        return []
-        
-    # 必須カラムチェック（データ欠損によるクラッシュを物理的に封殺）
-    required = ['AdjO', 'AdjH', 'AdjL', 'AdjC', 'Date']
-    if not all(col in df.columns for col in required):
-        return []
-
-    patterns = []
-    
-    # メモリ効率化のため、列のコピーとnumpy配列への展開
-    df_work = df.copy()
-    c = df_work['AdjC'].values
-    o = df_work['AdjO'].values
-    h = df_work['AdjH'].values
-    l = df_work['AdjL'].values
-    d = df_work['Date'].values
-    
-    # RSIの安全取得（存在しない場合は中立の50として扱う）
-    rsi = df_work['RSI'].values if 'RSI' in df_work.columns else np.full(len(df), 50.0)
-    
-    # スイング判定用の期間高値安値計算
-    h14_max = df_work['AdjH'].tail(15).iloc[:-1].max()
-    l14_min = df_work['AdjL'].tail(15).iloc[:-1].min()
-    rng = h14_max - l14_min
-    
-    pos = (c[-1] - l14_min) / rng if rng > 0 else 0.5
-    
-    is_high_zone = pos > 0.7 or rsi[-1] > 65
-    is_low_zone = pos < 0.3 or rsi[-1] < 35
-
-    # 頂点検知ロジック（効率化のためtail(30)のAdjHを参照）
-    tail_30 = df_work.tail(30)
-    h30 = tail_30['AdjH'].values
-    peaks = []
-    for i in range(1, len(h30)-1):
-        if h30[i] > h30[i-1] and h30[i] > h30[i+1]:
-            peaks.append({"val": h30[i], "idx": i})
-    
-    # --- パターン検知ロジック (論理構造は維持) ---
-    if len(peaks) >= 3 and is_high_zone:
-        if peaks[-2]['val'] > peaks[-3]['val'] and peaks[-2]['val'] > peaks[-1]['val']:
-            patterns.append({"date": d[-1], "label": "【酒田・三尊】", "text": "🔴 【酒田・三尊】天井圏での最終警戒形態。三つの仏、崩落の予兆。即時撤退。", "color": "#ef5350", "type": "bear"})
-        else:
-            patterns.append({"date": d[-1], "label": "【酒田・三山】", "text": "🔴 【酒田・三山】高値圏での三連ピーク。買い勢力の限界露呈。利確の急所。", "color": "#ef5350", "type": "bear"})
-
-    if check_double_top(df.tail(31)) and is_high_zone:
-        if not any(p['label'] == "【酒田・三尊】" for p in patterns):
-            patterns.append({"date": d[-1], "label": "【酒田・二重天井】", "text": "🔴 【酒田・二重天井】天井圏での双峰。上昇エネルギーの枯渇。崩落へのカウントダウン。", "color": "#ef5350", "type": "bear"})
-
-    # 赤三兵/黒三兵・三空の判定（インデックスアクセスを整理）
-    if is_high_zone:
-        if all(c[i] > o[i] for i in range(-3, 0)) and all(c[i] > c[i-1] for i in range(-2, 0)):
-            patterns.append({"date": d[-1], "label": "【酒田・赤三先】", "text": "🔴 【酒田・赤三先】高値圏での三連陽。買い枯れの兆候。新規買いは罠。", "color": "#ef5350", "type": "bear"})
-        if all(c[i] < o[i] for i in range(-3, 0)) and all(c[i] < c[i-1] for i in range(-2, 0)):
-            patterns.append({"date": d[-1], "label": "【酒田・黒三兵】", "text": "🔴 【酒田・黒三兵】高値圏での崩壊合図。暴落の狼煙。即時撤退。", "color": "#ef5350", "type": "bear"})
-        
-        # 厳格検知：3回連続で「当日の高値」が「前日の安値」を下回る（完全な下落窓）
-        if all(h[i] < l[i-1] for i in range(-3, 0)):
-            patterns.append({"date": d[-1], "label": "【酒田・売三空】", "text": "🟢 【酒田・売り三空】三度の窓。売り枯れの極み。反転狙撃好機。", "color": "#26a69a", "type": "bull"})
-
-    if is_low_zone:
-        if check_oversold_ultimate(df):
-            patterns.append({"date": d[-1], "label": "【酒田・陰の極み】", "text": "🟢 【酒田・陰の極み】底打ち最終波形。売り枯れの果て。反転攻勢の急所。狙撃準備。", "color": "#26a69a", "type": "bull"})
-        if all(c[i] > o[i] for i in range(-3, 0)) and all(c[i] > c[i-1] for i in range(-2, 0)):
-            patterns.append({"date": d[-1], "label": "【酒田・赤三兵】", "text": "🟢 【酒田・赤三兵】安値圏からの狼煙。底打ち反転。追撃準備。", "color": "#26a69a", "type": "bull"})
-            
-        # 厳格検知：3回連続で「当日の安値」が「前日の高値」を上回る（完全な上昇窓）
-        if all(l[i] > h[i-1] for i in range(-3, 0)):
-            patterns.append({"date": d[-1], "label": "【酒田・買三空】", "text": "🔴 【酒田・買い三空】最終噴出。過熱の極致。利確の急所。", "color": "#ef5350", "type": "bear"})
-
-    if check_double_bottom(df.tail(31)) and is_low_zone:
-        patterns.append({"date": d[-1], "label": "【酒田・二重底】", "text": "🟢 【酒田・二重底】底堅い反転波形を確認。底打ちの最終局面。狙撃準備。", "color": "#26a69a", "type": "bull"})
-    
-    # たくり線（下ヒゲ）の検知
-    body_v = abs(c[-1] - o[-1])
-    shadow_l = min(c[-1], o[-1]) - l[-1]
-    full_rng = h[-1] - l[-1]
-    if full_rng > 0 and shadow_l > (body_v * 2.5) and (shadow_l / full_rng) > 0.6 and is_low_zone:
-        patterns.append({"date": d[-1], "label": "【酒田・たくり】", "text": "🟢 【酒田・たくり線】大底圏での強烈な反発。絶好の買場。攻勢の起点。", "color": "#26a69a", "type": "bull"})
-
-    return patterns
-
 def render_technical_radar(df, target_p, tp_target):
     try:
         if df is None or len(df) < 5:
@@ -1224,77 +899,9 @@ def render_technical_radar(df, target_p, tp_target):
         err_msg = "⚠️ レーダー演算エラー: " + str(e)
         return '<div style="color:#ef5350; font-size:12px;">' + err_msg + '</div>'
 
-def check_double_top(df_sub):
-    try:
-        v = df_sub['AdjH'].values
-        c = df_sub['AdjC'].values
-        l = df_sub['AdjL'].values
-        if len(v) < 6: return False
-        peaks = []
-        for i in range(1, len(v)-1):
-            if v[i] == max(v[i-1:i+2]):
-                if not peaks or (i - peaks[-1][0] > 1): peaks.append((i, v[i]))
-        if len(v) >= 2 and v[-1] > v[-2]:
-            if not peaks or (len(v)-1 - peaks[-1][0] > 1): peaks.append((len(v)-1, v[-1]))
-        if len(peaks) >= 2:
-            p2_idx, p2_val = peaks[-1]
-            p1_idx, p1_val = peaks[-2]
-            if abs(p2_val - p1_val) / max(p2_val, p1_val) < 0.05:
-                valley = min(l[p1_idx:p2_idx+1]) if p2_idx > p1_idx else p1_val
-                if valley < min(p1_val, p2_val) * 0.95 and c[-1] < p2_val * 0.97: return True
-        return False
-    except: return False
-
-def check_head_shoulders(df_sub):
-    try:
-        v = df_sub['AdjH'].values
-        c = df_sub['AdjC'].values
-        if len(v) < 8: return False
-        peaks = []
-        for i in range(1, len(v)-1):
-            if v[i] == max(v[i-1:i+2]):
-                if not peaks or (i - peaks[-1][0] > 1): peaks.append((i, v[i]))
-        if len(peaks) >= 3:
-            p3_idx, p3_val = peaks[-1]
-            p2_idx, p2_val = peaks[-2]
-            p1_idx, p1_val = peaks[-3]
-            if p2_val > p1_val and p2_val > p3_val and abs(p3_val - p1_val) / max(p3_val, p1_val) < 0.10 and c[-1] < p3_val * 0.97: 
-                return True
-        return False
-    except: return False
-
-def check_double_bottom(df_sub):
-    try:
-        l = df_sub['AdjL'].values
-        c = df_sub['AdjC'].values
-        h = df_sub['AdjH'].values
-        if len(l) < 6: return False
-        valleys = []
-        for i in range(1, len(l)-1):
-            if l[i] == min(l[i-1:i+2]):
-                if not valleys or (i - valleys[-1][0] > 1): valleys.append((i, l[i]))
-        if len(valleys) >= 2:
-            v2_idx, v2_val = valleys[-1]
-            v1_idx, v1_val = valleys[-2]
-            if abs(v2_val - v1_val) / min(v2_val, v1_val) < 0.05:
-                peak = max(h[v1_idx:v2_idx+1]) if v2_idx > v1_idx else v1_val
-                if peak > max(v1_val, v2_val) * 1.04 and c[-1] > v2_val * 1.01: return True
-        return False
-    except: return False
-
-def check_oversold_ultimate(df_sub):
-    try:
-        if len(df_sub) < 20: return False
-        t = df_sub.iloc[-1]
-        lc, lo, ll, lh, bbl3, rsi = t['AdjC'], t['AdjO'], t['AdjL'], t['AdjH'], t['BB_L3'], t['RSI']
-        if lc <= bbl3 and rsi <= 25:
-            body_v = abs(lc - lo)
-            shadow_l = min(lc, lo) - ll
-            full_rng = lh - ll
-            if full_rng > 0 and shadow_l > (body_v * 2.5) and (shadow_l / full_rng) > 0.6: 
-                return True
-        return False
-    except: return False
+# get_fundamentals が yfinance の .info から使う項目
+YF_FUNDA_FIELDS = ["trailingPE", "forwardPE", "priceToBook", "marketCap", "returnOnEquity",
+                   "currentPrice", "regularMarketPrice", "previousClose"]
 
 @st.cache_data(ttl=3600, show_spinner=False, max_entries=200)
 def get_fundamentals(code):
@@ -1315,7 +922,7 @@ def get_fundamentals(code):
             return None
 
     try:
-        r = api_session.get(url, timeout=3.0)
+        r = jquants_get(api_session, url, retries=1, timeout=3.0)
         if r.status_code == 200:
             data = r.json().get("statements", [])
             if data:
@@ -1362,9 +969,7 @@ def get_fundamentals(code):
 
     # 🚨 yfinance（Yahooファイナンス）に突入し、時価総額・ROE等をリアルタイム計算・補完
     try:
-        import yfinance as yf
-        tk = yf.Ticker(f"{code}.T")
-        info = tk.info
+        info = yf_gateway.info_fields([code], YF_FUNDA_FIELDS)[code]
         
         # yfinanceから直接取れる場合はそれを最優先で上書き
         if info.get("trailingPE") or info.get("forwardPE"):
@@ -1448,14 +1053,6 @@ def load_master():
 # ==========================================
 @st.cache_data(ttl=3600, show_spinner=False)
 def get_single_data(code, yrs=1):
-    import time
-    import threading
-    
-    # ⚡ グローバル空間に交通整理用のロックを配備（未定義の場合）
-    if 'jquants_api_lock' not in st.session_state:
-        st.session_state.jquants_api_lock = threading.Lock()
-        st.session_state.last_api_time = 0.0
-
     base = datetime.utcnow() + timedelta(hours=9)
     # 🚨 改修1：確実な営業日（兵站）を確保するため、365日ではなく「400日」を基準にする
     f_d = (base - timedelta(days=400*yrs)).strftime('%Y%m%d')
@@ -1467,26 +1064,14 @@ def get_single_data(code, yrs=1):
         clean_code = str(code).replace('.0', '').strip()
         api_code = clean_code if len(clean_code) >= 5 else clean_code + "0"
         
-        # --- 🛡️ 内部ヘルパー関数：Lightプラン専用の安全通信 ---
+        # --- 🛡️ 内部ヘルパー関数：共通リミッター経由の安全通信（429冷却も全体で共有） ---
         def safe_fetch(url, t_out=5.0):
-            for attempt in range(3):
-                with st.session_state.jquants_api_lock:
-                    now = time.time()
-                    elapsed = now - st.session_state.last_api_time
-                    if elapsed < 1.05: # 60回/分を厳守（1.05秒間隔）
-                        time.sleep(1.05 - elapsed)
-                    try:
-                        r = api_session.get(url, timeout=t_out)
-                        st.session_state.last_api_time = time.time()
-                        if r.status_code == 200:
-                            return r.json()
-                        elif r.status_code == 429: # 制限に引っかかったらペナルティ待機
-                            time.sleep(2.0)
-                            continue
-                    except Exception:
-                        st.session_state.last_api_time = time.time()
-                        pass
-            return {}
+            # 429 の再試行は jquants_get（共通冷却つき）、5xx・接続断はセッションの Retry に任せる
+            try:
+                r = jquants_get(api_session, url, retries=3, timeout=t_out)
+                return r.json() if r.status_code == 200 else {}
+            except Exception:
+                return {}
 
         # 1. 株価データの取得
         url_bars = f"{BASE_URL}/equities/bars/daily?code={api_code}&from={f_d}&to={t_d}"
@@ -1551,87 +1136,103 @@ def get_nikkei_macro_status():
 # 🚀 共通エンジン：進捗バー・件数表示 完全復旧版
 # =========================================================
 @st.cache_data(ttl=86400, max_entries=1, show_spinner=False, persist="disk") # 🚨 ディスク退避をON
+@tracer.trace("全軍データロード")
 def get_hist_data_cached(key):
     progress_bar = st.progress(0)
     status_text = st.empty()
     
     base = datetime.now(pytz.timezone('Asia/Tokyo'))
-    dates, days = [], 0
-    while len(dates) < 260:
-        d = base - timedelta(days=days)
-        if d.weekday() < 5: dates.append(d.strftime('%Y%m%d'))
-        days += 1
-        if days > 400: break
+    # 📅 祝日・年末年始を除いた営業日だけを対象にする（休場日を「ストアに無い日」として毎回 API へ取りに行かない）
+    dates = price_store.expected_trading_days(base, 420)[-260:]
+
+    # 🗄️ 兵站Botが焼き付けた日足ストアを優先し、API はストアに無い日（・確定前の日）だけ叩く
+    #    API で補った日はこの実行のメモリ上だけで使う（ストアへの書き込み・遡及調整は兵站Botだけが行う）
+    try:
+        missing = price_store.days_to_fetch(dates)
+        stored_set = set(price_store.list_days())
+    except Exception:
+        missing, stored_set = list(dates), set()
+    missing_set = set(missing)
+    stored_days = [d for d in dates if d in stored_set and d not in missing_set]
 
     dfs = []
-    # 🚨 OOMを回避するため、並列数を「2」に抑制し、メモリの過剰な同時展開を防ぐ
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as exe:
-        futs = {exe.submit(fetch_and_compress_single_day, dt): dt for dt in dates}
-        for i, f in enumerate(concurrent.futures.as_completed(futs)):
-            res = f.result()
-            if isinstance(res, pd.DataFrame):
-                dfs.append(res)
-            
-            p_val = (i + 1) / len(dates)
-            progress_bar.progress(min(p_val, 1.0))
-            status_text.text(f"📡 索敵中: {i+1}/{len(dates)}日完了")
+    if missing:
+        # 🚨 OOMを回避するため、並列数を「2」に抑制し、メモリの過剰な同時展開を防ぐ
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as exe:
+            futs = {exe.submit(tracer.bind(fetch_and_compress_single_day), dt): dt for dt in missing}
+            for i, f in enumerate(concurrent.futures.as_completed(futs)):
+                dt = futs[f]
+                records = f.result()
+                if records is None:
+                    # 通信失敗: 古いファイルが残っていればそれで代用する
+                    if dt in stored_set: stored_days.append(dt)
+                elif records:
+                    dfs.append(price_store.records_to_frame(dt, records))
+
+                p_val = (i + 1) / len(missing)
+                progress_bar.progress(min(p_val, 1.0))
+                status_text.text(f"📡 索敵中（ストア未収録分）: {i+1}/{len(missing)}日完了")
+
+    status_text.text(f"🗄️ ローカルストアから {len(stored_days)} 日分を展開中...")
+    if stored_days:
+        dfs.append(price_store.load_bars(days=sorted(stored_days)))
 
     progress_bar.empty()
     status_text.empty()
 
+    dfs = [d for d in dfs if d is not None and not d.empty]
     if not dfs:
         raise ValueError("🚨 兵站断絶: データ取得失敗")
 
-    full_df = pd.concat(dfs, ignore_index=True)
-    full_df['Code'] = full_df['Code'].astype(str).apply(lambda x: x if len(x) >= 5 else x + "0")
+    full_df = pd.concat(dfs, ignore_index=True) if len(dfs) > 1 else dfs[0]
     
     # 🚨 結合直後の巨大データフレームを強制圧縮（ここでRAM消費を半減させます）
     full_df = compress_memory(full_df)
     
     gc.collect()
+    tracer.add_rows(len(full_df))
     return full_df.dropna(subset=['AdjC']).sort_values(['Code', 'Date']).reset_index(drop=True)
 
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_price_panel(key):
+    """260日分の全軍データを 銘柄×日付×列 の密パネルに変換して全セッションで共有する"""
+    with tracer.span("密パネル変換"):
+        return PricePanel.from_frame(get_hist_data_cached(key))
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_feature_table(key):
+    """
+    兵站Botが夜間に焼き付けた指標テーブル（RSI・ATR・MACD・BB_L3・gc_days 等、prices_store/features.npz）。
+    画面側では計算しない。無ければ None（各タブは従来どおり自前で計算する）
+    """
+    with tracer.span("指標テーブル読込"):
+        return FeatureTable.load()
+
 def fetch_and_compress_single_day(dt):
+    """1日分の生レコードを返す（休場日は空リスト、通信失敗・途中のページ欠けは None）"""
     # 🚨 開発参謀パッチ適用：無条件突撃から「GC息継ぎ型の戦術巡航」へ移行
-    for attempt in range(4):
+    url = f"{BASE_URL}/equities/bars/daily?date={dt}"
+    data, page_url = [], url
+    while True:
+        # 🚦 429 は jquants_get が共通冷却をかけてから再試行する（ここで重ねて回さない）
         try:
-            r = api_session.get(f"{BASE_URL}/equities/bars/daily?date={dt}", timeout=20.0)
-            if r.status_code == 200:
-                raw_json = r.json()
-                data = raw_json.get("daily_quotes") or raw_json.get("data") or raw_json.get("results") or []
-                if not data: return None
-                
-                # 🚨 パッチ3：個別のチャンク（1日分）の段階で即座にメモリ極限圧縮をかける
-                df_chunk = pd.DataFrame(data)
-                df_chunk = compress_memory(df_chunk)
-                
-                # 🚨 パッチ3：ガベージコレクション（メモリ掃除）に息継ぎの隙間を与える微小ウェイト
-                time.sleep(0.05) 
-                return df_chunk
-            
-            elif r.status_code == 429:
-                # 🚨 オートブレーキ機構：壁に激突（制限到達）した時だけ5秒間息を潜める
-                time.sleep(5.0)
-            else:
-                return None
-        except:
-            time.sleep(2.0)
-            continue
-    return None
+            r = jquants_get(api_session, page_url, retries=3, timeout=20.0)
+        except Exception:
+            return None
+        if r.status_code != 200:
+            return None
+
+        raw_json = r.json()
+        data.extend(raw_json.get("daily_quotes") or raw_json.get("data") or raw_json.get("results") or [])
+        # 📄 件数が多い日は pagination_key で分割されて返る。全ページ揃えてから返す
+        p_key = raw_json.get("pagination_key")
+        if not p_key:
+            break
+        page_url = f"{url}&pagination_key={p_key}"
 
-def get_fast_indicators(prices):
-    if len(prices) < 15: return 50.0, 0.0, 0.0, np.zeros(5)
-    p = np.array(prices, dtype='float32')
-    ema12 = pd.Series(p).ewm(span=12, adjust=False).mean().values
-    ema26 = pd.Series(p).ewm(span=26, adjust=False).mean().values
-    macd = ema12 - ema26
-    signal = pd.Series(macd).ewm(span=9, adjust=False).mean().values
-    hist = macd - signal
-    diff = np.diff(p[-15:])
-    g = np.sum(np.maximum(diff, 0))
-    l = np.sum(np.abs(np.minimum(diff, 0)))
-    rsi = 100 - (100 / (1 + (g / (l + 1e-10))))
-    return rsi, hist[-1], hist[-2], hist[-5:]
+    # 🚨 パッチ3：ガベージコレクション（メモリ掃除）に息継ぎの隙間を与える微小ウェイト
+    time.sleep(0.05)
+    return data
 
 def get_triage_info(macd_hist, macd_hist_prev, rsi, lc=0, bt=0, mode="待伏", gc_days=0):
     tactics = st.session_state.get("sidebar_tactics", "⚖️ バランス (掟達成率 ＞ 到達度)")
@@ -2005,9 +1606,7 @@ def scan_unit_new_rules_parallel(group_df, c, cfg, macro_alert_text):
 
         try:
             # 厳格なテクニカルを通過した少数精鋭のみAPIでファンダ確認
-            import yfinance as yf
-            tk = yf.Ticker(f"{c}.T")
-            info = tk.info
+            info = yf_gateway.info_fields([c], ["revenueGrowth", "earningsGrowth"])[c]
             rev_growth = info.get('revenueGrowth', 0)
             earn_growth = info.get('earningsGrowth', 0)
 
@@ -2073,6 +1672,7 @@ def scan_unit_new_rules_parallel(group_df, c, cfg, macro_alert_text):
     except Exception as e:
         return None
 
+@tracer.trace("チャート描画")
 def draw_chart(df, targ_p, sakata=[], chart_key=None):
     if df is None or df.empty:
         return
@@ -2561,10 +2161,11 @@ render_macro_board()
 # ==========================================
 # 🎯 タブ定義（新構成：TAB1, TAB2, TAB7のみ）
 # ==========================================
-tab1, tab2, tab3, tab7 = st.tabs([
+tab1, tab2, tab3, tab4, tab7 = st.tabs([
     "📈 TAB1: 買い", 
     "📉 TAB2: 空売り", 
     "🎯 TAB3: 精密スコープ", 
+    "🏮 TAB4: 酒田レーダー", 
     "📁 TAB7: 戦績"
 ])
 
@@ -2595,86 +2196,92 @@ with tab1:
         btn_scan_t1 = st.form_submit_button("🚀 買い銘柄 スキャン実行", use_container_width=True, type="primary")
 
     if btn_scan_t1:
-        import time
         st.write("---")
-        with st.status("📡 買い広域レーダー稼働中...", expanded=True) as status:
-            t_start_total = time.time()
-            
-            # === Phase 1: 価格・時価総額フィルタ ===
-            st.write("#### 🔄 [Phase 1/2] 価格帯・時価総額フィルタ一括足切り")
-            p1_msg = st.empty()
-            p1_msg.info("⏳ J-Quantsサーバーから全銘柄の最新価格・時価総額データを一括取得中...")
-            t_start_p1 = time.time()
-            
-            all_codes = []
-            try:
-                prices_map = get_all_latest_prices_bulk()
-                mcap_map = get_all_market_caps_bulk() if 'get_all_market_caps_bulk' in globals() else {}
+        with st.status("📡 買い広域レーダー稼働中...", expanded=True) as status, tracer.span("TAB1 買いスキャン") as run_t1:
+
+            def scan_tab1():
+                # === Phase 1: 価格・時価総額フィルタ ===
+                st.write("#### 🔄 [Phase 1/2] 価格帯・時価総額フィルタ一括足切り")
+                p1_msg = st.empty()
+                p1_msg.info("⏳ J-Quantsサーバーから全銘柄の最新価格・時価総額データを一括取得中...")
+                sp_p1 = tracer.start("Phase1 価格・時価総額足切り")
                 
-                if prices_map:
-                    for c_code, c_price in prices_map.items():
-                        # 価格フィルタ
-                        if float(t1_p_min) <= float(c_price) <= float(t1_p_max):
-                            # 時価総額フィルタ（データがある場合のみチェック、単位は億円換算を想定）
-                            c_mcap = float(mcap_map.get(str(c_code), 0))
-                            if c_mcap == 0 or (c_mcap >= float(t1_mcap)):
-                                all_codes.append(str(c_code))
-                else:
-                    p1_msg.error("❌ J-Quantsからの株価取得に失敗しました。")
+                all_codes = []
+                try:
+                    prices_map = get_all_latest_prices_bulk()
+                    mcap_map = get_all_market_caps_bulk() if 'get_all_market_caps_bulk' in globals() else {}
+                    
+                    if prices_map:
+                        for c_code, c_price in prices_map.items():
+                            # 価格フィルタ
+                            if float(t1_p_min) <= float(c_price) <= float(t1_p_max):
+                                # 時価総額フィルタ（データがある場合のみチェック、単位は億円換算を想定）
+                                c_mcap = float(mcap_map.get(str(c_code), 0))
+                                if c_mcap == 0 or (c_mcap >= float(t1_mcap)):
+                                    all_codes.append(str(c_code))
+                    else:
+                        p1_msg.error("❌ J-Quantsからの株価取得に失敗しました。")
+                        st.stop()
+                except Exception as e:
+                    p1_msg.error(f"❌ フィルタ取得エラー: {e}")
                     st.stop()
-            except Exception as e:
-                p1_msg.error(f"❌ フィルタ取得エラー: {e}")
-                st.stop()
+                    
+                p_filtered_codes = [str(code).replace('.0', '').strip()[:4] for code in all_codes]
+                time_p1 = tracer.end(sp_p1, rows=len(p_filtered_codes))
+                p1_msg.success(f"✅ Phase 1 完了: 適合 {len(p_filtered_codes)} 銘柄 ➔ Phase 2 へパスしました。")
                 
-            p_filtered_codes = [str(code).replace('.0', '').strip()[:4] for code in all_codes]
-            time_p1 = time.time() - t_start_p1
-            p1_msg.success(f"✅ Phase 1 完了: 適合 {len(p_filtered_codes)} 銘柄 ➔ Phase 2 へパスしました。")
-            
-            # === Phase 2: ファンダ解析 ===
-            st.write("#### 🔄 [Phase 2/2] ファンダメンタルズ直列解析 (YoY 2期連続)")
-            p2_msg = st.empty()
-            p2_bar = st.progress(0)
-            
-            t_start_p2 = time.time()
-            hit_codes_s = []
-            hit_codes_a = []
-
-            total_p2 = len(p_filtered_codes)
-            processed_p2 = 0
-            
-            if total_p2 > 0:
-                try:
-                    local_fund_db = load_local_fundamentals_db()
-                except:
-                    local_fund_db = None
-
-                for code in p_filtered_codes:
-                    processed_p2 += 1
-                    if processed_p2 % 5 == 0 or processed_p2 == total_p2:
-                        progress_pct = int((processed_p2 / total_p2) * 100)
-                        p2_bar.progress(processed_p2 / total_p2)
-                        p2_msg.info(f"📡 索敵中: {processed_p2} / {total_p2} 銘柄完了... ({progress_pct}%) [標적: {code}]")
-
-                    try:
-                        df_fins = fetch_fundamental_history_local(code, local_fund_db) if 'fetch_fundamental_history_local' in globals() else get_historical_statements(code)
-                        if df_fins is not None and not df_fins.empty:
-                            is_hit, rank = analyze_fundamental_momentum(
-                                df_fins, mode="buy", sales_req=float(t1_sales_r), ord_req=float(t1_ord_r)
-                            )
-                            if is_hit:
-                                if "S級" in rank:
-                                    hit_codes_s.append(str(code))
-                                else:
-                                    hit_codes_a.append(str(code))
-                    except Exception:
-                        pass
+                # === Phase 2: ファンダ解析 ===
+                st.write("#### 🔄 [Phase 2/2] ファンダメンタルズ直列解析 (YoY 2期連続)")
+                p2_msg = st.empty()
+                p2_bar = st.progress(0)
                 
-                time_p2 = time.time() - t_start_p2
-                p2_bar.progress(1.0)
-                p2_msg.success(f"✅ Phase 2 完了: すべての解析が終了しました。")
+                sp_p2 = tracer.start("Phase2 ファンダ解析")
+                hit_codes_s = []
+                hit_codes_a = []
+
+                total_p2 = len(p_filtered_codes)
+                processed_p2 = 0
                 
+                if total_p2 > 0:
+                    try:
+                        local_fund_db = load_local_fundamentals_db()
+                    except:
+                        local_fund_db = None
+
+                    if has_derived(local_fund_db):
+                        # ⚡ 正規化テーブルの派生列で全銘柄を一括判定（1銘柄ずつの直列解析を省略）
+                        hit_codes_s, hit_codes_a = screen_momentum(local_fund_db, p_filtered_codes, mode="buy", sales_req=float(t1_sales_r), ord_req=float(t1_ord_r))
+                    else:
+                        # 🧩 派生列の無い旧ストア：1銘柄ずつの判定（scan_core.screen_fundamentals_code）をプロセス版エンジンで並列に回す
+                        def p2_progress(done, total):
+                            p2_bar.progress(done / total)
+                            p2_msg.info(f"📡 索敵中: {done} / {total} 銘柄完了... ({int(done / total * 100)}%)")
+
+                        order = {c: i for i, c in enumerate(p_filtered_codes)}
+                        hits = execute_chunked_scan_mp(p_filtered_codes, screen_fundamentals_code, local_fund_db, "buy",
+                                                       float(t1_sales_r), float(t1_ord_r), progress=p2_progress)
+                        hits.sort(key=lambda h: order[h[0]])
+                        hit_codes_s = [c for c, rank in hits if "S級" in rank]
+                        hit_codes_a = [c for c, rank in hits if "S級" not in rank]
+                    
+                    p2_bar.progress(1.0)
+                    p2_msg.success(f"✅ Phase 2 完了: すべての解析が終了しました。")
+                time_p2 = tracer.end(sp_p2, rows=total_p2)
+                return {"n_p1": total_p2, "s": tuple(hit_codes_s), "a": tuple(hit_codes_a), "time_p1": time_p1, "time_p2": time_p2}
+
+            # 🤝 同じ条件・同じデータ版のスキャンは全セッションで1回だけ（実行中なら完了を待って結果を共有）
+            t1_params = {"period": t1_period, "sales_r": t1_sales_r, "ord_r": t1_ord_r, "mcap": t1_mcap, "p_min": t1_p_min, "p_max": t1_p_max}
+            res_t1, how_t1 = shared_cache.SCAN_CACHE.get_or_compute(
+                shared_cache.scan_key("TAB1", t1_params, scan_data_version()), scan_tab1,
+                on_wait=lambda: st.write("⏳ 同じ条件のスキャンを他のセッションが実行中です。完了を待って結果を共有します..."))
+            hit_codes_s, hit_codes_a = list(res_t1["s"]), list(res_t1["a"])
+            time_p1, time_p2 = res_t1["time_p1"], res_t1["time_p2"]
+            if how_t1 != "miss":
+                st.write("♻️ 同じ条件・同じデータの共有スキャン結果を再利用しました（API・再計算なし）。")
+
+            if res_t1["n_p1"] > 0:
                 all_hits = hit_codes_s + hit_codes_a
-                time_total = time.time() - t_start_total
+                time_total = run_t1.elapsed()
                 status.update(label=f"🎯 スキャン完了！ 計 {len(all_hits)} 銘柄を捕捉しました。 (総計: {time_total:.2f}秒)", state="complete", expanded=False)
                 
                 st.divider()
@@ -2695,7 +2302,7 @@ with tab1:
                 # セッションステートに保存
                 st.session_state['tab1_scan_results'] = [{"Code": c, "Rank": "S級"} for c in hit_codes_s] + [{"Code": c, "Rank": "A級"} for c in hit_codes_a]
             else:
-                p2_msg.warning("⚠️ Phase 1 を通過した銘柄が0件のため、解析をスキップします。")
+                st.warning("⚠️ Phase 1 を通過した銘柄が0件のため、解析をスキップします。")
                 status.update(label="⚠️ スキャン中断：対象銘柄なし", state="complete")
 
 
@@ -2725,89 +2332,96 @@ with tab2:
         btn_scan_t2 = st.form_submit_button("🚀 売り銘柄 スキャン実行", use_container_width=True, type="primary")
 
     if btn_scan_t2:
-        import time
         st.write("---")
-        with st.status("📡 売り広域レーダー稼働中...", expanded=True) as status:
-            t_start_total = time.time()
-            
-            # === Phase 1: 価格・時価総額・売買代金フィルタ ===
-            st.write("#### 🔄 [Phase 1/2] 流動性・価格帯フィルタ一括足切り")
-            p1_msg_t2 = st.empty()
-            p1_msg_t2.info("⏳ J-Quantsサーバーから価格・流動性データを一括取得中...")
-            t_start_p1 = time.time()
-            
-            all_codes = []
-            try:
-                prices_map = get_all_latest_prices_bulk()
-                mcap_map = get_all_market_caps_bulk() if 'get_all_market_caps_bulk' in globals() else {}
-                vol_map = get_all_volumes_bulk() if 'get_all_volumes_bulk' in globals() else {}
+        with st.status("📡 売り広域レーダー稼働中...", expanded=True) as status, tracer.span("TAB2 売りスキャン") as run_t2:
+
+            def scan_tab2():
+                # === Phase 1: 価格・時価総額・売買代金フィルタ ===
+                st.write("#### 🔄 [Phase 1/2] 流動性・価格帯フィルタ一括足切り")
+                p1_msg_t2 = st.empty()
+                p1_msg_t2.info("⏳ J-Quantsサーバーから価格・流動性データを一括取得中...")
+                sp_p1 = tracer.start("Phase1 流動性足切り")
                 
-                if prices_map:
-                    for c_code, c_price in prices_map.items():
-                        # 価格フィルタ
-                        if float(t2_p_min) <= float(c_price) <= float(t2_p_max):
-                            # 時価総額フィルタ (億円)
-                            c_mcap = float(mcap_map.get(str(c_code), 0))
-                            if c_mcap == 0 or (c_mcap >= float(t2_mcap)):
-                                # 売買代金フィルタ (億円)
-                                c_vol = float(vol_map.get(str(c_code), 0))
-                                if c_vol == 0 or (c_vol >= float(t2_vol)):
-                                    all_codes.append(str(c_code))
-                else:
-                    p1_msg_t2.error("❌ 株価データの取得に失敗しました。")
+                all_codes = []
+                try:
+                    prices_map = get_all_latest_prices_bulk()
+                    mcap_map = get_all_market_caps_bulk() if 'get_all_market_caps_bulk' in globals() else {}
+                    vol_map = get_all_volumes_bulk() if 'get_all_volumes_bulk' in globals() else {}
+                    
+                    if prices_map:
+                        for c_code, c_price in prices_map.items():
+                            # 価格フィルタ
+                            if float(t2_p_min) <= float(c_price) <= float(t2_p_max):
+                                # 時価総額フィルタ (億円)
+                                c_mcap = float(mcap_map.get(str(c_code), 0))
+                                if c_mcap == 0 or (c_mcap >= float(t2_mcap)):
+                                    # 売買代金フィルタ (億円)
+                                    c_vol = float(vol_map.get(str(c_code), 0))
+                                    if c_vol == 0 or (c_vol >= float(t2_vol)):
+                                        all_codes.append(str(c_code))
+                    else:
+                        p1_msg_t2.error("❌ 株価データの取得に失敗しました。")
+                        st.stop()
+                except Exception as e:
+                    p1_msg_t2.error(f"❌ フィルタ取得エラー: {e}")
                     st.stop()
-            except Exception as e:
-                p1_msg_t2.error(f"❌ フィルタ取得エラー: {e}")
-                st.stop()
+                    
+                p_filtered_codes = [str(code).replace('.0', '').strip()[:4] for code in all_codes]
+                time_p1 = tracer.end(sp_p1, rows=len(p_filtered_codes))
+                p1_msg_t2.success(f"✅ Phase 1 完了: 適合 {len(p_filtered_codes)} 銘柄 ➔ Phase 2 へパスしました。")
                 
-            p_filtered_codes = [str(code).replace('.0', '').strip()[:4] for code in all_codes]
-            time_p1 = time.time() - t_start_p1
-            p1_msg_t2.success(f"✅ Phase 1 完了: 適合 {len(p_filtered_codes)} 銘柄 ➔ Phase 2 へパスしました。")
-            
-            # === Phase 2: ファンダ解析 (売り専用ロジック) ===
-            st.write("#### 🔄 [Phase 2/2] ファンダメンタルズ直列解析 (空売り 2期連続 YoY 8%未満)")
-            p2_msg_t2 = st.empty()
-            p2_bar_t2 = st.progress(0)
-            
-            t_start_p2 = time.time()
-            hit_codes_s = []
-            hit_codes_a = []
-
-            total_p2 = len(p_filtered_codes)
-            processed_p2 = 0
-            
-            if total_p2 > 0:
-                try:
-                    local_fund_db = load_local_fundamentals_db()
-                except:
-                    local_fund_db = None
-
-                for code in p_filtered_codes:
-                    processed_p2 += 1
-                    if processed_p2 % 5 == 0 or processed_p2 == total_p2:
-                        progress_pct = int((processed_p2 / total_p2) * 100)
-                        p2_bar_t2.progress(processed_p2 / total_p2)
-                        p2_msg_t2.info(f"📡 索敵中: {processed_p2} / {total_p2} 銘柄完了... ({progress_pct}%) [標的: {code}]")
-
-                    try:
-                        df_fins = fetch_fundamental_history_local(code, local_fund_db) if 'fetch_fundamental_history_local' in globals() else get_historical_statements(code)
-                        if df_fins is not None and not df_fins.empty:
-                            # 売りモード判定関数（直近2Q連続で営業・経常・純利・EPSが8%未満、マイナスでS級）
-                            is_hit, rank = analyze_fundamental_momentum_sell_custom(df_fins) if 'analyze_fundamental_momentum_sell_custom' in globals() else analyze_fundamental_momentum(df_fins, mode="sell")
-                            if is_hit:
-                                if "S級" in rank:
-                                    hit_codes_s.append(str(code))
-                                else:
-                                    hit_codes_a.append(str(code))
-                    except Exception:
-                        pass
+                # === Phase 2: ファンダ解析 (売り専用ロジック) ===
+                st.write("#### 🔄 [Phase 2/2] ファンダメンタルズ直列解析 (空売り 2期連続 YoY 8%未満)")
+                p2_msg_t2 = st.empty()
+                p2_bar_t2 = st.progress(0)
                 
-                time_p2 = time.time() - t_start_p2
-                p2_bar_t2.progress(1.0)
-                p2_msg_t2.success(f"✅ Phase 2 完了: すべての解析が終了しました。")
+                sp_p2 = tracer.start("Phase2 ファンダ解析")
+                hit_codes_s = []
+                hit_codes_a = []
+
+                total_p2 = len(p_filtered_codes)
+                processed_p2 = 0
                 
+                if total_p2 > 0:
+                    try:
+                        local_fund_db = load_local_fundamentals_db()
+                    except:
+                        local_fund_db = None
+
+                    if has_derived(local_fund_db):
+                        # ⚡ 正規化テーブルの派生列で全銘柄を一括判定（1銘柄ずつの直列解析を省略）
+                        hit_codes_s, hit_codes_a = screen_momentum(local_fund_db, p_filtered_codes, mode="sell")
+                    else:
+                        # 🧩 派生列の無い旧ストア：1銘柄ずつの判定（scan_core.screen_fundamentals_code）をプロセス版エンジンで並列に回す
+                        def p2_progress(done, total):
+                            p2_bar_t2.progress(done / total)
+                            p2_msg_t2.info(f"📡 索敵中: {done} / {total} 銘柄完了... ({int(done / total * 100)}%)")
+
+                        order = {c: i for i, c in enumerate(p_filtered_codes)}
+                        hits = execute_chunked_scan_mp(p_filtered_codes, screen_fundamentals_code, local_fund_db, "sell",
+                                                       progress=p2_progress)
+                        hits.sort(key=lambda h: order[h[0]])
+                        hit_codes_s = [c for c, rank in hits if "S級" in rank]
+                        hit_codes_a = [c for c, rank in hits if "S級" not in rank]
+                    
+                    p2_bar_t2.progress(1.0)
+                    p2_msg_t2.success(f"✅ Phase 2 完了: すべての解析が終了しました。")
+                time_p2 = tracer.end(sp_p2, rows=total_p2)
+                return {"n_p1": total_p2, "s": tuple(hit_codes_s), "a": tuple(hit_codes_a), "time_p1": time_p1, "time_p2": time_p2}
+
+            # 🤝 同じ条件・同じデータ版のスキャンは全セッションで1回だけ（実行中なら完了を待って結果を共有）
+            t2_params = {"period": t2_period, "mcap": t2_mcap, "vol": t2_vol, "p_min": t2_p_min, "p_max": t2_p_max}
+            res_t2, how_t2 = shared_cache.SCAN_CACHE.get_or_compute(
+                shared_cache.scan_key("TAB2", t2_params, scan_data_version()), scan_tab2,
+                on_wait=lambda: st.write("⏳ 同じ条件のスキャンを他のセッションが実行中です。完了を待って結果を共有します..."))
+            hit_codes_s, hit_codes_a = list(res_t2["s"]), list(res_t2["a"])
+            time_p1, time_p2 = res_t2["time_p1"], res_t2["time_p2"]
+            if how_t2 != "miss":
+                st.write("♻️ 同じ条件・同じデータの共有スキャン結果を再利用しました（API・再計算なし）。")
+
+            if res_t2["n_p1"] > 0:
                 all_hits = hit_codes_s + hit_codes_a
-                time_total = time.time() - t_start_total
+                time_total = run_t2.elapsed()
                 status.update(label=f"🎯 スキャン完了！ 計 {len(all_hits)} 銘柄を捕捉しました。 (総計: {time_total:.2f}秒)", state="complete", expanded=False)
                 
                 st.divider()
@@ -2827,200 +2441,13 @@ with tab2:
                 
                 st.session_state['tab2_scan_results'] = [{"Code": c, "Rank": "S級"} for c in hit_codes_s] + [{"Code": c, "Rank": "A級"} for c in hit_codes_a]
             else:
-                p2_msg_t2.warning("⚠️ Phase 1 を通過した銘柄が0件のため、解析をスキップします。")
+                st.warning("⚠️ Phase 1 を通過した銘柄が0件のため、解析をスキップします。")
                 status.update(label="⚠️ スキャン中断：対象銘柄なし", state="complete")
 
 # ==========================================
 # 🧠 TAB3：精密スキャン＆絶対分析エンジン（ファンダ×シグナル統合版）
 # ==========================================
-
-def analyze_formation_history(df):
-    """過去3ヶ月分のデータから、買い/空売りフォーメーション（ルール①・②）を探知する"""
-    import pandas as pd
-    buy_signals = []
-    sell_signals = []
-    
-    if df is None or len(df) < 65:
-        return buy_signals, sell_signals
-        
-    cols = [str(c).lower() for c in df.columns]
-    def get_c(*names):
-        for n in names:
-            if n.lower() in cols: return df.columns[cols.index(n.lower())]
-        return None
-
-    c_h, c_l, c_c = get_c('high', 'h'), get_c('low', 'l'), get_c('close', 'adjc', 'c')
-    c_d = get_c('date', 'd')
-    if not all([c_h, c_l, c_c, c_d]): return [], []
-
-    df_recent = df.tail(65).reset_index(drop=True)
-    
-    # ルール②用の18日移動平均線
-    if 'MA18' not in df_recent.columns:
-        df_recent['MA18'] = df_recent[c_c].rolling(18).mean()
-    
-    for i in range(3, len(df_recent)):
-        m3_h, m3_l = float(df_recent.loc[i-3, c_h]), float(df_recent.loc[i-3, c_l])
-        m2_h, m2_l, m2_c = float(df_recent.loc[i-2, c_h]), float(df_recent.loc[i-2, c_l]), float(df_recent.loc[i-2, c_c])
-        m1_h, m1_l, m1_c = float(df_recent.loc[i-1, c_h]), float(df_recent.loc[i-1, c_l]), float(df_recent.loc[i-1, c_c])
-        q0_h, q0_l, q0_c = float(df_recent.loc[i, c_h]), float(df_recent.loc[i, c_l]), float(df_recent.loc[i, c_c])
-        
-        ma18_m2 = float(df_recent.loc[i-2, 'MA18'])
-        ma18_m1 = float(df_recent.loc[i-1, 'MA18'])
-        ma18_q0 = float(df_recent.loc[i, 'MA18'])
-        
-        curr_date = df_recent.loc[i, c_d]
-
-        # 🔵 買いルール①（3日間反転）
-        buy_cond1 = (m2_c < m3_l) and (m1_c > m2_h) and (q0_c > m1_c)
-        # 🔵 買いルール②（今日と昨日の安値 > 18日MA ※初動検知）
-        buy_cond2 = (m2_l <= ma18_m2) and (m1_l > ma18_m1) and (q0_l > ma18_q0)
-        
-        if buy_cond1 or buy_cond2:
-            buy_signals.append(curr_date)
-            
-        # 🔴 空売りルール①（3日間崩壊）
-        sell_cond1 = (m2_c > m3_h) and (m1_c < m2_l) and (q0_c < m1_c)
-        # 🔴 空売りルール②（今日と昨日の高値 < 18日MA ※初動検知）
-        sell_cond2 = (m2_h >= ma18_m2) and (m1_h < ma18_m1) and (q0_h < ma18_q0)
-        
-        if sell_cond1 or sell_cond2:
-            sell_signals.append(curr_date)
-            
-    return list(set(buy_signals)), list(set(sell_signals))
-
-def fetch_fundamental_history_local(code, local_db):
-    """【通信完全ゼロ】ローカルDBから四半期推移・通年業績を抽出・計算する（YoY統一版）"""
-    import pandas as pd
-    try:
-        if local_db is None or len(local_db) == 0: return None
-
-        str_code = str(code).strip()[:4]
-        df_target = None
-        
-        if isinstance(local_db, dict):
-            api_code = str_code if len(str_code) >= 5 else str_code + "0"
-            df_target = local_db.get(api_code)
-            if df_target is None:
-                df_target = local_db.get(str_code) 
-            if df_target is None or len(df_target) == 0: return None
-            df_target = df_target.copy().reset_index(drop=True)
-            
-        elif isinstance(local_db, pd.DataFrame):
-            c_code_col = 'Code' if 'Code' in local_db.columns else ('code' if 'code' in local_db.columns else None)
-            if not c_code_col: return None
-            mask = local_db[c_code_col].astype(str).str.startswith(str_code)
-            df_target = local_db[mask].copy().reset_index(drop=True)
-
-        if df_target is None or len(df_target) == 0: return None
-
-        cols = [str(c).lower() for c in df_target.columns]
-        def find_c(*names):
-            for n in names:
-                if n.lower() in cols: return df_target.columns[cols.index(n.lower())]
-            return None
-
-        c_sales = find_c('Sales', 'NetSales', 'net_sales')
-        c_op = find_c('OP', 'OperatingProfit', 'operating_profit')
-        c_ord = find_c('OdP', 'OrdinaryProfit', 'ordinary_profit')
-        c_eps = find_c('EPS', 'EarningsPerShare', 'eps')
-        c_profit = find_c('NP', 'Profit', 'netincome')
-        c_type = find_c('CurPerType', 'TypeOfCurrentPeriod')
-        c_date = find_c('DiscDate', 'DisclosedDate', 'Date')
-
-        def to_flt(v):
-            try: 
-                if pd.isna(v) or str(v).strip() == '': return 0.0
-                return float(str(v).replace(',', '').strip())
-            except: return 0.0
-
-        if c_date:
-            df_target[c_date] = pd.to_datetime(df_target[c_date], errors='coerce')
-            df_target = df_target.sort_values(by=c_date).reset_index(drop=True)
-
-        actual_mask = (df_target[c_sales].apply(to_flt) > 0) if c_sales else pd.Series([True]*len(df_target))
-        actual_df = df_target[actual_mask].copy().reset_index(drop=True)
-
-        if len(actual_df) < 2: return None
-
-        std_df = actual_df.copy()
-        for i in range(1, len(actual_df)):
-            curr_type = str(actual_df[c_type].iloc[i]) if c_type else ""
-            c_s = to_flt(actual_df[c_sales].iloc[i]) if c_sales else 0.0
-            p_s = to_flt(actual_df[c_sales].iloc[i-1]) if c_sales else 0.0
-            
-            is_q1 = ('1Q' in curr_type or 'Q1' in curr_type) or (c_s < p_s and p_s > 0)
-
-            if not is_q1:
-                for col in filter(None, [c_sales, c_op, c_ord, c_profit, c_eps]):
-                    if col in std_df.columns:
-                        try: 
-                            val_c = to_flt(actual_df[col].iloc[i])
-                            val_p = to_flt(actual_df[col].iloc[i-1])
-                            std_df.iat[i, std_df.columns.get_loc(col)] = val_c - val_p
-                        except: pass
-
-        def calc_yoy(c, p):
-            if p == 0.0 or p is None: return "-"
-            return ((c - p) / abs(p)) * 100.0
-
-        def get_v(row, primary, fallback=None):
-            if row is None: return 0.0
-            v = to_flt(row.get(primary, 0.0)) if primary else 0.0
-            if v == 0.0 and fallback and fallback in row.index:
-                v = to_flt(row.get(fallback, 0.0))
-            return v
-
-        results = []
-        for i in range(1, 5):
-            # YoY（4つ前＝前年同期との比較）
-            if len(std_df) < i + 4:
-                q_cur = std_df.iloc[-i] if len(std_df) >= i else None
-                dis_date = '-'
-                if q_cur is not None:
-                    dis_date = q_cur.get(c_date, '-')
-                    if pd.notna(dis_date) and hasattr(dis_date, 'strftime'): 
-                        dis_date = dis_date.strftime('%Y-%m-%d')
-                results.append({"期間": f"直近 Q{i}", "開示日": str(dis_date), 
-                                "売上(%)": "-", "営業益(%)": "-", "経常益(%)": "-", "純利益(%)": "-", "EPS(%)": "-"})
-                continue
-                
-            q_cur = std_df.iloc[-i]
-            q_yoy = std_df.iloc[-(i+4)]
-            
-            dis_date = q_cur.get(c_date, '-')
-            if pd.notna(dis_date) and hasattr(dis_date, 'strftime'): 
-                dis_date = dis_date.strftime('%Y-%m-%d')
-                if dis_date == '1970-01-01': dis_date = '-'
-            else:
-                dis_date = '-'
-                
-            results.append({
-                "期間": f"直近 Q{i}", "開示日": str(dis_date),
-                "売上(%)": calc_yoy(get_v(q_cur, c_sales), get_v(q_yoy, c_sales)),
-                "営業益(%)": calc_yoy(get_v(q_cur, c_op), get_v(q_yoy, c_op)),
-                "経常益(%)": calc_yoy(get_v(q_cur, c_ord), get_v(q_yoy, c_ord)),
-                "純利益(%)": calc_yoy(get_v(q_cur, c_profit, c_eps), get_v(q_yoy, c_profit, c_eps)),
-                "EPS(%)": calc_yoy(get_v(q_cur, c_eps, c_profit), get_v(q_yoy, c_eps, c_profit)),
-            })
-
-        # 通年データ（YoY）
-        if len(std_df) >= 8:
-            y_cur = std_df.iloc[-4:].apply(lambda x: pd.to_numeric(x, errors='coerce')).sum(numeric_only=True)
-            y_prv = std_df.iloc[-8:-4].apply(lambda x: pd.to_numeric(x, errors='coerce')).sum(numeric_only=True)
-            results.append({
-                "期間": "🌟 通年(直近1年)", "開示日": "-",
-                "売上(%)": calc_yoy(get_v(y_cur, c_sales), get_v(y_prv, c_sales)),
-                "営業益(%)": calc_yoy(get_v(y_cur, c_op), get_v(y_prv, c_op)),
-                "経常益(%)": calc_yoy(get_v(y_cur, c_ord), get_v(y_prv, c_ord)),
-                "純利益(%)": calc_yoy(get_v(y_cur, c_profit, c_eps), get_v(y_prv, c_profit, c_eps)),
-                "EPS(%)": calc_yoy(get_v(y_cur, c_eps, c_profit), get_v(y_prv, c_eps, c_profit)),
-            })
-        
-        if len(results) == 0: return None
-        return pd.DataFrame(results[::-1])
-    except Exception as e:
-        return None
+# 業績推移表（fetch_fundamental_history_local）と1銘柄の S/A/B 判定（judge_tab3）は scan_core.py
 
 # ==========================================
 # 🎯 TAB3 UI構築 ＆ スキャン実行ブロック（YoY判定統合版）
@@ -3087,175 +2514,60 @@ with tab3:
             st.warning("⚠️ 銘柄コードが入力されていません。")
         else:
             p_bar = st.progress(0, text="🚀 システム初期化・全軍データロード中...")
+            # ⏱️ with で囲み、途中の st.error / st.stop() / 例外でも内側のスパンごと必ず閉じて書き出す
+            with tracer.span("TAB3 精密スキャン", mode=scan_mode) as run_t3:
+                raw_codes = [c.strip() for c in target_codes_input.split(",") if c.strip()]
+                target_codes = []
+                for c in raw_codes:
+                    try: target_codes.append(int(c[:4]))
+                    except: pass
+                target_codes = list(dict.fromkeys(target_codes))
+                target_str_codes = [str(c) for c in target_codes]
 
-            raw_codes = [c.strip() for c in target_codes_input.split(",") if c.strip()]
-            target_codes = []
-            for c in raw_codes:
-                try: target_codes.append(int(c[:4]))
-                except: pass
-            target_codes = list(dict.fromkeys(target_codes))
-            target_str_codes = [str(c) for c in target_codes]
+                st.write(f"📡 実行対象: {len(target_codes)} 銘柄を一斉解析中...")
 
-            st.write(f"📡 実行対象: {len(target_codes)} 銘柄を一斉解析中...")
+                c_key = get_cache_key() if 'get_cache_key' in globals() else cache_key
+                # 🧊 銘柄×日付の密パネルから O(1) で対象銘柄だけを切り出す（全件 groupby を撤廃）
+                with tracer.span("データロード") as sp_load:
+                    price_panel = get_price_panel(c_key)
+                    if price_panel is not None and len(price_panel) > 0:
+                        target_rows = price_panel.rows(target_str_codes)
+                        feature_table = get_feature_table(c_key)
 
-            c_key = get_cache_key() if 'get_cache_key' in globals() else cache_key
-            raw_all_data = get_hist_data_cached(c_key)
+                        try: local_fund_db = load_local_fundamentals_db()
+                        except: local_fund_db = None
+                        sp_load.add_rows(len(target_rows))
 
-            if raw_all_data is None or raw_all_data.empty:
-                st.error("⚠️ 全軍データ（キャッシュ）が見つかりません。先にTAB1かTAB2でデータ取得（索敵）を実行してください。")
-            else:
-                c_code_raw = 'Code' if 'Code' in raw_all_data.columns else ('code' if 'code' in raw_all_data.columns else None)
-                if not c_code_raw:
-                    st.error("⚠️ キャッシュデータに銘柄コード列が見つかりません。")
+                if price_panel is None or len(price_panel) == 0:
+                    st.error("⚠️ 全軍データ（キャッシュ）が見つかりません。先にTAB1かTAB2でデータ取得（索敵）を実行してください。")
                 else:
-                    mask = raw_all_data[c_code_raw].astype(str).str[:4].isin(target_str_codes)
-                    df_targets = raw_all_data[mask].copy()
 
-                    analyzed_data = {}
-                    try: local_fund_db = load_local_fundamentals_db()
-                    except: local_fund_db = None
+                    total_cnt = len(target_rows) if len(target_rows) > 0 else 1
+                    target_panel = price_panel.take(target_rows)
 
-                    total_cnt = df_targets[c_code_raw].nunique() if not df_targets.empty else 1
-                    if total_cnt == 0: total_cnt = 1
-                    completed_cnt = 0
+                    # ⚡ 対象全銘柄の陣形フラグと「最終シグナルから何本目か」を一括算出
+                    with tracer.span("陣形一括探知"):
+                        formations = scan_formations(target_panel)
+                    signal_row = {int(str(c)[:4]): k for k, c in enumerate(target_panel.codes)}
+                    days_ago = dict(zip(target_panel.codes.tolist(), formations[f"{scan_mode}_days_ago"].tolist()))
 
-                    import pandas as pd
-                    for code_str, group in df_targets.groupby(c_code_raw):
-                        code_int = int(str(code_str)[:4])
-                        completed_cnt += 1
-                        
-                        prog_val = min(completed_cnt / total_cnt, 1.0)
-                        p_bar.progress(prog_val, text=f"🚀 フェーズ1：インメモリ陣形判定中... ({completed_cnt}/{total_cnt} 完了)")
-                        
-                        df = group.tail(260).reset_index(drop=True)
-                        if df.empty or len(df) < 4: continue
-
-                        turnover = 0.0
-                        try:
-                            q0 = df.iloc[-1]
-                            v_col = 'Volume' if 'Volume' in df.columns else ('Vo' if 'Vo' in df.columns else None)
-                            c_col = 'AdjC' if 'AdjC' in df.columns else ('Close' if 'Close' in df.columns else None)
-                            if v_col and c_col: turnover = float(q0[v_col]) * float(q0[c_col])
-                        except: pass
-
-                        # 📊 チャート陣形の検知
-                        b_sigs, s_sigs = analyze_formation_history(df)
-                        
-                        # ------------------------------------
-                        # 🎯 TAB3 独自の S/A/B 判定ロジック（YoYベース）
-                        # ------------------------------------
-                        is_hit = False
-                        rank_str = ""
-                        rank_funda = "対象外"
-                        rank_signal = "対象外"
-
-                        # ① シグナル発生日（鮮度）判定
-                        date_col = 'Date' if 'Date' in df.columns else df.columns[0]
-                        df_dates = df[date_col].dt.date.tolist() if pd.api.types.is_datetime64_any_dtype(df[date_col]) else pd.to_datetime(df[date_col]).dt.date.tolist()
-                        
-                        if scan_mode == "buy" and b_sigs:
-                            b_sig_dates = [pd.to_datetime(d).date() for d in b_sigs if pd.notna(d)]
-                            sig_indices = [i for i, d in enumerate(df_dates) if d in b_sig_dates]
-                            if sig_indices:
-                                days_ago = (len(df_dates) - 1) - max(sig_indices)
-                                if days_ago <= 2: rank_signal = "S"
-                                elif days_ago == 3: rank_signal = "A"
-                                elif days_ago == 4: rank_signal = "B"
-                        
-                        elif scan_mode == "sell" and s_sigs:
-                            s_sig_dates = [pd.to_datetime(d).date() for d in s_sigs if pd.notna(d)]
-                            sig_indices = [i for i, d in enumerate(df_dates) if d in s_sig_dates]
-                            if sig_indices:
-                                days_ago = (len(df_dates) - 1) - max(sig_indices)
-                                if days_ago == 0: rank_signal = "S"
-                                elif days_ago == 1: rank_signal = "A"
-                                elif days_ago <= 3: rank_signal = "B"
-
-                        # ② ファンダメンタルズ（YoY成長率）判定
-                        f_df = fetch_fundamental_history_local(code_int, local_fund_db)
-                        if f_df is not None and not f_df.empty:
-                            q1_row = f_df[f_df["期間"] == "直近 Q1"]
-                            q2_row = f_df[f_df["期間"] == "直近 Q2"]
-                            
-                            def get_val(r, col):
-                                if r.empty: return None
-                                v = r[col].iloc[0]
-                                if isinstance(v, str) and v == "-": return None
-                                try: return float(v)
-                                except: return None
-
-                            if scan_mode == "buy":
-                                # YoY基準の数値を参照
-                                q1_s = get_val(q1_row, "売上(%)")
-                                q1_op = get_val(q1_row, "営業益(%)")
-                                q1_ord = get_val(q1_row, "経常益(%)")
-                                q1_np = get_val(q1_row, "純利益(%)")
-                                q1_eps = get_val(q1_row, "EPS(%)")
-                                
-                                q2_s = get_val(q2_row, "売上(%)")
-                                q2_op = get_val(q2_row, "営業益(%)")
-                                q2_ord = get_val(q2_row, "経常益(%)")
-                                q2_np = get_val(q2_row, "純利益(%)")
-                                q2_eps = get_val(q2_row, "EPS(%)")
-                                
-                                def count_misses(s, op, ord_p, np_p, eps):
-                                    if None in [s, op, ord_p, np_p, eps]: return 99 
-                                    m = 0
-                                    if s < 7.0: m += 1
-                                    if op < 20.0: m += 1
-                                    if ord_p < 20.0: m += 1
-                                    if np_p < 20.0: m += 1
-                                    if eps < 20.0: m += 1
-                                    return m
-                                    
-                                q1_miss = count_misses(q1_s, q1_op, q1_ord, q1_np, q1_eps)
-                                q2_miss = count_misses(q2_s, q2_op, q2_ord, q2_np, q2_eps)
-                                
-                                if q1_miss == 0:
-                                    if q2_miss == 0: rank_funda = "S"
-                                    elif q2_miss == 1: rank_funda = "A"
-                                    elif 2 <= q2_miss <= 4: rank_funda = "B"
-                                
-                            elif scan_mode == "sell":
-                                if not q1_row.empty and not q2_row.empty:
-                                    q1_op = get_val(q1_row, "営業益(%)")
-                                    q1_ord = get_val(q1_row, "経常益(%)")
-                                    q1_np = get_val(q1_row, "純利益(%)")
-                                    q1_eps = get_val(q1_row, "EPS(%)")
-                                    
-                                    q2_op = get_val(q2_row, "営業益(%)")
-                                    q2_ord = get_val(q2_row, "経常益(%)")
-                                    q2_np = get_val(q2_row, "純利益(%)")
-                                    q2_eps = get_val(q2_row, "EPS(%)")
-                                    
-                                    vals = [q1_op, q1_ord, q1_np, q1_eps, q2_op, q2_ord, q2_np, q2_eps]
-                                    if None not in vals:
-                                        lt_5 = sum(1 for v in vals if v < 5.0)
-                                        lt_10 = sum(1 for v in vals if 5.0 <= v < 10.0)
-                                        ge_10 = sum(1 for v in vals if v >= 10.0)
-                                        
-                                        if ge_10 == 0:
-                                            if lt_5 == 8: rank_funda = "S"
-                                            elif lt_5 == 7 and lt_10 == 1: rank_funda = "A"
-                                            elif lt_5 == 6 and lt_10 == 2: rank_funda = "B"
-
-                        # ③ 総合ヒット判定の結合
-                        if scan_mode == "buy":
-                            if rank_funda != "対象外" and rank_signal != "対象外":
-                                is_hit = True
-                                rank_str = f"🎯業績:{rank_funda}級 / 陣形:{rank_signal}級"
-                        elif scan_mode == "sell":
-                            if rank_funda != "対象外" and rank_signal != "対象外":
-                                is_hit = True
-                                rank_str = f"💀業績:{rank_funda}級 / 陣形:{rank_signal}級"
-
-                        analyzed_data[code_int] = {
-                            "df": df, "is_hit": is_hit, "rank": rank_str, "turnover": turnover,
-                            "buy_sigs": b_sigs, "sell_sigs": s_sigs, "fund": f_df
-                        }
+                    with tracer.span("フェーズ1 陣形・業績判定") as sp_judge:
+                        import pandas as pd
+
+                        def judge_progress(done, total):
+                            p_bar.progress(min(done / total_cnt, 1.0), text=f"🚀 フェーズ1：インメモリ陣形判定中... ({done}/{total} 完了)")
+
+                        # 🧩 1銘柄ずつの判定（scan_core.judge_tab3）はプロセス版エンジンで CPU コア数だけ並列に回す
+                        # （直近260本の日足はワーカーが共有メモリのパネルから切り出す。銘柄が少なければスレッド版）
+                        judged = execute_chunked_scan_mp([(c, None) for c in target_panel.codes.tolist()], judge_tab3,
+                                                         scan_mode, days_ago, local_fund_db,
+                                                         panel=target_panel, tail=260, progress=judge_progress)
+                        judged.sort(key=lambda d: signal_row[d["code"]])
+                        analyzed_data = {d.pop("code"): d for d in judged}
 
+                        sp_judge.add_rows(len(analyzed_data))
                     p_bar.progress(1.0, text="⚙️ データベースをマウント中（フェーズ2準備）...")
-                    
+                
                     def get_rank_score(data):
                         if not data["is_hit"]: return -1
                         score = 0
@@ -3263,28 +2575,38 @@ with tab3:
                         if "業績:S" in r: score += 1000
                         elif "業績:A" in r: score += 800
                         elif "業績:B" in r: score += 600
-                        
+                    
                         if "陣形:S" in r: score += 100
                         elif "陣形:A" in r: score += 80
                         elif "陣形:B" in r: score += 60
                         return score
-                        
+                    
                     sortable_results = [{"code": k, **v} for k, v in analyzed_data.items()]
                     sortable_results.sort(key=get_rank_score, reverse=True)
-                    
+                
                     display_targets = sortable_results[:30]
+                    # 📈 チャート用の日足（指標付き）とシグナル発生日は表示する銘柄の分だけ組み立てる
+                    for data in display_targets:
+                        k = signal_row[data["code"]]
+                        group = target_panel.code_frame(k)
+                        if feature_table is not None:
+                            group = feature_table.attach(group, target_panel.codes[k])
+                        data["df"] = group.tail(260).reset_index(drop=True)
+                        data["buy_sigs"] = signal_dates(formations["signals"], k, "buy")
+                        data["sell_sigs"] = signal_dates(formations["signals"], k, "sell")
 
                     name_map = {}
                     try:
                         m_df = load_master()
                         name_map = dict(zip(m_df['Code'].astype(str).str[:4], m_df['CompanyName']))
                     except: pass
-                    
+                
                     p_bar.empty()
                     st.divider()
 
                     import plotly.graph_objects as go
-                    
+                    sp_render = tracer.start("フェーズ2 チャート・業績表描画")
+                
                     hit_count = sum(1 for d in sortable_results if d["is_hit"])
                     if hit_count > 0:
                         st.success(f"🎯 陣形とファンダメンタルズが完全合致した銘柄: {hit_count}件 確認！ （上位最大30件を表示します）")
@@ -3295,32 +2617,34 @@ with tab3:
                         code = data['code']
                         df = data["df"]
                         c_name = name_map.get(str(code)[:4], "名称不明")
-                        
+                    
                         hit_badge = data["rank"] if data["is_hit"] else "⬜ 待機"
                         st.markdown(f"### 📦 {code} {c_name} | {hit_badge}")
-                        
+                    
                         q0 = df.iloc[-1]
                         c_o = q0.get('Open', q0.get('AdjO', 0))
                         c_h = q0.get('High', q0.get('AdjH', 0))
                         c_l = q0.get('Low', q0.get('AdjL', 0))
                         c_c = q0.get('Close', q0.get('AdjC', 0))
-                        
+                    
                         c1, c2, c3, c4 = st.columns(4)
                         c1.metric("始値", f"{c_o:,.1f}円")
                         c2.metric("高値", f"{c_h:,.1f}円")
                         c3.metric("安値", f"{c_l:,.1f}円")
                         c4.metric("終値", f"{c_c:,.1f}円")
-                        
+                    
                         if len(df) > 0:
+                            sp_chart = tracer.start("チャート描画", code=str(code))
                             df_c = df.copy()
                             c_col = 'AdjC' if 'AdjC' in df_c.columns else 'Close'
-                            if 'MA18' not in df_c.columns: df_c['MA18'] = df_c[c_col].rolling(18).mean()
-                            if 'MA50' not in df_c.columns: df_c['MA50'] = df_c[c_col].rolling(50).mean()
-                            
+                            # 指標テーブルに無い（または最新足が未収録の）場合だけその場で計算
+                            if 'MA18' not in df_c.columns or pd.isna(df_c['MA18'].iloc[-1]): df_c['MA18'] = df_c[c_col].rolling(18).mean()
+                            if 'MA50' not in df_c.columns or pd.isna(df_c['MA50'].iloc[-1]): df_c['MA50'] = df_c[c_col].rolling(50).mean()
+                        
                             fig = go.Figure()
                             date_col = 'Date' if 'Date' in df_c.columns else df_c.columns[0]
                             df_c[date_col] = pd.to_datetime(df_c[date_col], errors='coerce')
-                            
+                        
                             fig.add_trace(go.Candlestick(
                                 x=df_c[date_col], 
                                 open=df_c.get('AdjO', df_c.get('Open')), 
@@ -3331,12 +2655,12 @@ with tab3:
                             ))
                             fig.add_trace(go.Scatter(x=df_c[date_col], y=df_c['MA18'], mode='lines', line=dict(color='orange', width=1.5), name='18日線'))
                             fig.add_trace(go.Scatter(x=df_c[date_col], y=df_c['MA50'], mode='lines', line=dict(color='cyan', width=1.5), name='50日線'))
-                            
+                        
                             if scan_mode == "buy" and data.get("buy_sigs"):
                                 sig_dates = [pd.to_datetime(d).date() for d in data["buy_sigs"] if pd.notna(d)]
                                 sig_df = df_c[df_c[date_col].dt.date.isin(sig_dates)]
                                 if not sig_df.empty: fig.add_trace(go.Scatter(x=sig_df[date_col], y=sig_df[c_col] * 0.95, mode='markers', marker=dict(symbol='triangle-up', color='magenta', size=12), name='買陣形'))
-                            
+                        
                             if scan_mode == "sell" and data.get("sell_sigs"):
                                 sig_dates = [pd.to_datetime(d).date() for d in data["sell_sigs"] if pd.notna(d)]
                                 sig_df = df_c[df_c[date_col].dt.date.isin(sig_dates)]
@@ -3346,7 +2670,7 @@ with tab3:
                                 df_recent = df_c.tail(65)
                                 x_min = df_recent[date_col].iloc[0]
                                 x_max = df_recent[date_col].iloc[-1]
-                                
+                            
                                 max_h = df_recent.get('AdjH', df_recent.get('High')).max()
                                 min_l = df_recent.get('AdjL', df_recent.get('Low')).min()
                                 y_min = min_l * 0.95
@@ -3355,7 +2679,7 @@ with tab3:
                                 x_min = df_c[date_col].iloc[0]
                                 x_max = df_c[date_col].iloc[-1]
                                 y_min, y_max = None, None
-                            
+                        
                             layout_args = {
                                 'height': 400,
                                 'margin': dict(l=0, r=0, t=30, b=0),
@@ -3365,9 +2689,10 @@ with tab3:
                                 layout_args['yaxis'] = dict(range=[y_min, y_max], autorange=False, fixedrange=False)
                             else:
                                 layout_args['yaxis'] = dict(autorange=True, fixedrange=False)
-                                
+                            
                             fig.update_layout(**layout_args)
                             st.plotly_chart(fig, use_container_width=True)
+                            tracer.end(sp_chart, rows=len(df_c))
 
                         # 📊 YoY統一の業績表
                         if data.get("fund") is not None and not data["fund"].empty:
@@ -3376,7 +2701,7 @@ with tab3:
                                 def fmt_pct(x):
                                     if isinstance(x, str): return x
                                     return f"{x:.1f}%"
-                                    
+                                
                                 st.dataframe(data["fund"].style.format({
                                     "売上(%)": fmt_pct,
                                     "営業益(%)": fmt_pct,
@@ -3389,16 +2714,81 @@ with tab3:
                         else:
                             db_status = "ロード済" if local_fund_db is not None else "未取得・空"
                             st.info(f"ℹ️ 業績データが取得できませんでした。（ローカルDB状態: {db_status}）")
-                            
+                        
                         st.divider()
 
+                    tracer.end(sp_render, rows=len(display_targets))
+
                     results_tab3 = [{"Code": d["code"], "Rank": d["rank"], "Mode": scan_mode} for d in sortable_results if d["is_hit"]]
                     if results_tab3:
                         hit_codes_str = ",".join([str(r["Code"]) for r in results_tab3])
                         st.text_area("📋 最終突破銘柄（コピペ用・全件）", value=hit_codes_str, height=70)
-                        
-                    st.session_state['tab3_results'] = results_tab3
+                    
+                        st.session_state['tab3_results'] = results_tab3
+                run_t3.add_rows(len(target_codes))
                     
+# ==========================================
+# 🏮 TAB4: 酒田五法・全市場レーダー
+# ==========================================
+with tab4:
+    st.markdown('### 🏮 酒田五法・全市場レーダー', unsafe_allow_html=True)
+    st.caption("※全銘柄の最新足を酒田五法で一括判定し、点灯中のパターン別に一覧表示します（RSI・BB_L3は夜間の指標テーブルから参照）。")
+
+    col4_1, col4_2, col4_3 = st.columns(3)
+    t4_side = col4_1.selectbox("シグナル種別", ["すべて", "🟢 買い（底打ち）", "🔴 売り（天井）"], index=0, key="t4_side")
+    t4_p_min = col4_2.number_input("価格下限 (円)", value=100, step=100, key="t4_p_min")
+    t4_p_max = col4_3.number_input("価格上限 (円)", value=50000, step=100, key="t4_p_max")
+
+    if st.button("🏮 全市場 酒田スキャン実行", key="btn_scan_tab4", use_container_width=True, type="primary"):
+        with st.spinner("🧊 全軍データを展開し、酒田五法を一括判定中..."), tracer.span("TAB4 酒田スキャン") as run_t4:
+            price_panel_t4 = get_price_panel(get_cache_key())
+            if price_panel_t4 is None or len(price_panel_t4) == 0:
+                st.error("⚠️ 全軍データ（日足）が取得できませんでした。")
+            else:
+                with tracer.span("酒田一括判定", codes=len(price_panel_t4)):
+                    sakata_res = sakata_engine.scan_sakata(price_panel_t4, features=get_feature_table(get_cache_key()))
+                lc_t4 = price_panel_t4.tail_valid(1)[0][:, 0, price_panel_t4.field_index["AdjC"]]
+                hits_t4 = sakata_engine.to_frame(sakata_res)
+                hits_t4["終値"] = lc_t4[[price_panel_t4.code_index[c] for c in hits_t4["Code"]]]
+                st.session_state['tab4_sakata_results'] = hits_t4
+                st.session_state['tab4_sakata_counts'] = {k: int(v.sum()) for k, v in sakata_res["flags"].items()}
+                st.session_state['tab4_sakata_time'] = run_t4.elapsed()
+
+    hits_t4 = st.session_state.get('tab4_sakata_results')
+    if hits_t4 is not None:
+        counts_t4 = st.session_state.get('tab4_sakata_counts', {})
+        st.caption(f"⏱️ **処理時間** ➔ `{st.session_state.get('tab4_sakata_time', 0.0):.2f}秒` | 点灯銘柄: `{len(hits_t4)}` 件")
+
+        view_t4 = hits_t4[(hits_t4["終値"] >= float(t4_p_min)) & (hits_t4["終値"] <= float(t4_p_max))]
+        if "買い" in t4_side:
+            kinds_t4 = ["bull"]
+        elif "売り" in t4_side:
+            kinds_t4 = ["bear"]
+        else:
+            kinds_t4 = ["bull", "bear"]
+
+        for key_t4, label_t4, kind_t4 in sakata_engine.PATTERNS:
+            if kind_t4 not in kinds_t4:
+                continue
+            sub_t4 = view_t4[view_t4["Patterns"].map(lambda ps: label_t4 in ps)]
+            icon_t4 = "🟢" if kind_t4 == "bull" else "🔴"
+            with st.expander(f"{icon_t4} {label_t4} … {len(sub_t4)} 銘柄（全市場 {counts_t4.get(key_t4, 0)}）", expanded=False):
+                if sub_t4.empty:
+                    st.info("該当する銘柄はありませんでした。")
+                    continue
+                table_t4 = pd.DataFrame({
+                    "コード": sub_t4["Code"].str[:4].values,
+                    "銘柄名": [master_map.get(c, {}).get("CompanyName", "-") for c in sub_t4["Code"]],
+                    "市場": [str(master_map.get(c, {}).get("Market", "-")).split('（')[0] for c in sub_t4["Code"]],
+                    "業種": [master_map.get(c, {}).get("Sector", "-") for c in sub_t4["Code"]],
+                    "終値": sub_t4["終値"].round(1).values,
+                    "RSI": sub_t4["RSI"].round(1).values,
+                    "同時点灯": [" ".join(ps) for ps in sub_t4["Patterns"]],
+                })
+                st.dataframe(table_t4, use_container_width=True, hide_index=True)
+                st.markdown("📋 TAB3 (詳細分析) 貼り付け用コード")
+                st.code(",".join(table_t4["コード"].tolist()), language="text")
+
 # ==========================================
 # 📁 TAB7: 戦績ダッシュボード (既存のコードをそのまま配置)
 # ==========================================
@@ -3590,6 +2980,108 @@ with tab7:
             st.success("💥 全交戦記録を消去し、Google DBを初期化（完全同期）しました。")
             st.rerun()
 
+# ==========================================
+# 📈 サイドバー：押し目狙撃戦略の検証（backtester）
+# ==========================================
+# サイドバー設定の push_r / limit_d / bt_lot / bt_tp / bt_sl_i / bt_sl_c / bt_sell_d で、
+# 全軍データ（約260営業日）の毎営業日に batch.py の押し目規則を当てはめて売買を再生する
+with st.sidebar.expander("📈 押し目戦略の検証", expanded=False):
+    bt_params = backtester.resolve_params(st.session_state)
+    st.caption(" | ".join(f"{k} `{v}`" for k, v in bt_params.items()))
+    if st.button("▶️ 全銘柄ウォークフォワード検証", key="btn_backtest", use_container_width=True):
+        with st.spinner("📈 全銘柄 × 全営業日で売買を再生中..."), tracer.span("押し目戦略の検証") as run_bt:
+            bt_panel = get_price_panel(get_cache_key())
+            st.session_state["bt_result"] = backtester.run_backtest(bt_panel, bt_params)
+            tracer.add_rows(len(bt_panel))
+        st.session_state["bt_result_time"] = run_bt.elapsed()
+    bt_res = st.session_state.get("bt_result")
+    if bt_res:
+        s = bt_res["stats"]
+        st.caption(f"⏱️ {st.session_state.get('bt_result_time', 0):.2f}秒 | 未決済 {s['open']}件 | 決済内訳 {s['by_reason']}")
+        m1, m2, m3 = st.columns(3)
+        m1.metric("取引数", f"{s['trades']:,}")
+        m2.metric("勝率", f"{s['win_rate']:.1f}%")
+        m3.metric("PF", f"{s['profit_factor']:.2f}")
+        m4, m5 = st.columns(2)
+        m4.metric("損益", f"{s['total_pnl']:+,.0f}円")
+        m5.metric("最大DD", f"{s['max_drawdown']:,.0f}円")
+        st.line_chart(bt_res["equity"]["equity"], height=160)
+        st.dataframe(bt_res["trades"].tail(50).iloc[::-1], use_container_width=True, hide_index=True)
+    # 🔬 パラメータ探索の順位表（param_sweep.py を別プロセスで回した結果を読むだけ）
+    sweep_df = param_sweep.load_results()
+    if not sweep_df.empty:
+        st.markdown("#### 🔬 パラメータ探索 上位10")
+        st.dataframe(sweep_df.head(10), use_container_width=True, hide_index=True)
+    else:
+        st.caption("🔬 格子探索は `python param_sweep.py` で実行（結果は sweep_results.csv）。")
+
+# ==========================================
+# 📡 サイドバー：現在値モニター（quote_poller のスナップショットを読むだけ・通信しない）
+# ==========================================
+# 交戦モニターの保有銘柄と TAB3 の標的を「見たい銘柄」として届け、裏のポーラーが全セッション分をまとめて取る
+quote_poller.POLLER.start()
+if "quote_owner" not in st.session_state:
+    import uuid
+    st.session_state["quote_owner"] = uuid.uuid4().hex
+frontline_live = st.session_state.get("frontline_df")
+watch_codes = [r["Code"] for r in st.session_state.get("tab3_results", [])]
+if isinstance(frontline_live, pd.DataFrame) and "銘柄" in frontline_live.columns:
+    watch_codes = frontline_live["銘柄"].tolist() + watch_codes
+watched_codes = quote_poller.POLLER.watch(st.session_state["quote_owner"], watch_codes)
+live_quotes = quote_poller.POLLER.snapshot(watched_codes)
+
+# 交戦モニターの「現在値」をスナップショットで上書き（取れていない銘柄は元の値のまま）
+if live_quotes and isinstance(frontline_live, pd.DataFrame) and {"銘柄", "現在値"} <= set(frontline_live.columns):
+    live_px = frontline_live["銘柄"].map(lambda c: live_quotes.get(quote_poller.normalize_code(c), (None, None))[0])
+    st.session_state.frontline_df = frontline_live.assign(現在値=live_px.where(live_px.notna(), frontline_live["現在値"]))
+
+with st.sidebar.expander("📡 現在値モニター", expanded=False):
+    qs = quote_poller.POLLER.stats()
+    last_poll = datetime.fromtimestamp(qs["last_poll"], pytz.timezone('Asia/Tokyo')).strftime('%H:%M:%S') if qs["last_poll"] else "未取得"
+    st.caption(f"最終更新 `{last_poll}` | 監視 `{qs['quotes']}銘柄`（{qs['owners']}セッション分） | "
+               f"間隔 {quote_poller.POLLER.interval:.0f}秒（場外 {quote_poller.POLLER.idle_interval:.0f}秒）")
+    if not watched_codes:
+        st.caption("監視対象がありません（交戦モニターの保有銘柄・TAB3 の標的が自動で登録されます）。")
+    else:
+        now_ts = time.time()
+        st.dataframe(pd.DataFrame([
+            {"銘柄": c, "現在値": live_quotes[c][0] if c in live_quotes else None,
+             "経過秒": int(now_ts - live_quotes[c][1]) if c in live_quotes else None}
+            for c in sorted(watched_codes)
+        ]), use_container_width=True, hide_index=True)
+
+# ==========================================
+# ⏱️ サイドバー：直近の処理内訳（tracer のスパン）
+# ==========================================
+# この実行で閉じた一番外側のスパンをセッションに積み、直近の内訳を表示する（最大10件）
+trace_runs = (st.session_state.get("trace_runs", []) + [sp.to_dict() for sp in tracer.drain()])[-10:]
+st.session_state["trace_runs"] = trace_runs
+with st.sidebar.expander("⏱️ 直近の処理内訳", expanded=False):
+    cs = shared_cache.SCAN_CACHE.stats()
+    st.caption(f"🤝 共有スキャン結果 `{cs['entries']}件` / `{cs['bytes'] / 1024 ** 2:.1f}MB`（上限 {cs['max_bytes'] / 1024 ** 2:.0f}MB）"
+               f" | 再利用 {cs['hit']} / 相乗り {cs['wait']} / 計算 {cs['miss']}")
+    if http_cache.HTTP_CACHE is not None:
+        hs = http_cache.HTTP_CACHE.stats()
+        st.caption(f"💾 API応答ディスクキャッシュ `{hs['entries']}件` / `{hs['bytes'] / 1024 ** 2:.1f}MB`（上限 {hs['max_bytes'] / 1024 ** 2:.0f}MB）"
+                   f" | 再利用 {hs['hit']} / 取得 {hs['miss'] + hs['expired']} / 保存 {hs['store']}")
+    ys = yf_gateway.GATEWAY.stats()
+    st.caption(f"🌐 yfinance 窓口 `{ys['entries']}件` | 再利用 {ys['hit']} / 相乗り {ys['wait']} / 一括取得 {ys['round_trips']}回（{ys['fetched']}銘柄）")
+    if not trace_runs:
+        st.caption("まだ計測された処理はありません（スキャン実行後に表示されます）。")
+    else:
+        run_labels = [f"{r['started_at'][11:19]} {r['name']} ({r['seconds']:.2f}秒)" for r in trace_runs]
+        picked = st.selectbox("対象の処理", list(range(len(trace_runs)))[::-1], format_func=lambda i: run_labels[i], key="trace_pick")
+        run = trace_runs[picked]
+        st.caption(f"総計 `{run['seconds']:.2f}秒` | API `{run['api_calls']}回` | 件数 `{run['rows']:,}`")
+        rows = tracer.breakdown_of(run)
+        st.dataframe(pd.DataFrame({
+            "段階": ["　" * r["depth"] + r["name"] + (" ⚠️" if r["error"] else "") for r in rows],
+            "秒": [round(r["seconds"], 3) for r in rows],
+            "割合(%)": [round(r["share"], 1) for r in rows],
+            "API": [r["api_calls"] for r in rows],
+            "件数": [r["rows"] for r in rows],
+        }), use_container_width=True, hide_index=True)
+
 # ==========================================
 # 🚀 最終メモリ解放パージ（OOMクラッシュ回避）
 # ==========================================
@@ -0,0 +1,116 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import get_limiter, retry_after
+import tracer
+
+# ==========================================
+# ⚡ J-Quants 非同期一括取得エンジン（兵站Bot用）
+# ==========================================
+# ・asyncio で複数リクエストを並行発射（同時実行数はセマフォで上限管理）
+# ・発射間隔は rate_limiter の共通バケツに従う（並行化してもプラン上限は超えない）
+# ・429 は全体冷却 → 同じジョブを再試行、通信エラー・5xx は指数バックオフで再試行
+# ・pagination_key を自動で辿り、1ジョブ分が揃った時点で on_result へ流す
+#   （全件をメモリに溜めず、呼び出し側で即ストアへ焼き付けられる）
+# ・HTTP 本体は requests をスレッドへ逃がして実行（追加依存なし）
+
+DEFAULT_CONCURRENCY = 4
+RETRYABLE_STATUS = {500, 502, 503, 504}
+
+
+def make_session(headers=None, concurrency=DEFAULT_CONCURRENCY):
+    """同時実行数ぶんのコネクションを使い回せる Session を作る"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=max(concurrency, 10))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def _default_extract(res_json):
+    return res_json.get("data") or []
+
+
+async def _get(session, url, loop, executor, limiter, retries, timeout):
+    """1リクエスト分。429・通信エラー・5xx を再試行した最終レスポンス（または None）を返す"""
+    r = None
+    for attempt in range(retries + 1):
+        await limiter.acquire_async()
+        tracer.count_api()
+        try:
+            r = await loop.run_in_executor(executor, partial(session.get, url, timeout=timeout))
+        except requests.RequestException:
+            r = None
+            await asyncio.sleep(min(2 ** attempt, 30))
+            continue
+        if r.status_code == 429:
+            limiter.cooldown(retry_after(r))
+            continue
+        if r.status_code in RETRYABLE_STATUS:
+            await asyncio.sleep(min(2 ** attempt, 30))
+            continue
+        limiter.success()
+        return r
+    return r
+
+
+async def _fetch_job(key, url, session, loop, executor, limiter, extract, retries, timeout):
+    """pagination_key を辿って全ページを結合する。(キー, ステータス, レコード) を返す"""
+    rows = []
+    page_url = url
+    while True:
+        r = await _get(session, page_url, loop, executor, limiter, retries, timeout)
+        if r is None:
+            return key, None, rows
+        if r.status_code != 200:
+            return key, r.status_code, rows
+        res_json = r.json()
+        rows.extend(extract(res_json))
+        p_key = res_json.get("pagination_key")
+        if not p_key:
+            return key, 200, rows
+        sep = "&" if "?" in url else "?"
+        page_url = f"{url}{sep}pagination_key={p_key}"
+
+
+async def run_jobs(session, jobs, on_result, extract=None, concurrency=DEFAULT_CONCURRENCY,
+                   retries=3, timeout=10.0, limiter=None):
+    """
+    jobs: [(キー, URL)] のリスト。完了順に on_result(キー, ステータス, レコード) を呼ぶ。
+    on_result はイベントループ上で1件ずつ呼ばれるため、中でのファイル書込みに排他は不要。
+    ステータスは 200 / HTTP エラーコード / None（通信失敗）。戻り値は完了件数。
+    """
+    extract = extract or _default_extract
+    limiter = limiter or get_limiter()
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def _bounded(key, url):
+        async with sem:
+            try:
+                return await _fetch_job(key, url, session, loop, executor, limiter, extract, retries, timeout)
+            except Exception:
+                return key, None, []
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as executor:
+        tasks = [asyncio.ensure_future(_bounded(key, url)) for key, url in jobs]
+        for fut in asyncio.as_completed(tasks):
+            key, status, rows = await fut
+            try:
+                on_result(key, status, rows)
+            except Exception as e:
+                print(f"⚠️ {key} の保存処理に失敗: {e}", flush=True)
+            done += 1
+    return done
+
+
+def fetch_all(session, jobs, on_result, **kwargs):
+    """同期コードから呼ぶための入口（asyncio.run で run_jobs を回す）"""
+    return asyncio.run(run_jobs(session, jobs, on_result, **kwargs))
@@ -0,0 +1,350 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+import batch
+from price_panel import PricePanel
+from pattern_engine import detect_patterns
+
+# ==========================================
+# 📈 押し目狙撃戦略のウォークフォワード検証（全銘柄 × 全営業日を配列で一括）
+# ==========================================
+# batch.py の押し目規則を日足ストアの全履歴に当てはめ、毎営業日「その日の引け後に batch.py を
+# 走らせていたら何が配信され、翌日以降どう約定・決済されたか」を全銘柄まとめて再生する。
+#
+# ① 標的の算出（日付ループなし）
+#   ・銘柄ごとに有効足を詰めた配列の上で、各足を末尾とする直近14本・30本の窓を一括で切り出す
+#   ・bt = 14日高値 − 14日値幅 × push_r%、到達度 reach_pct、r30 は batch.attach_targets と同じ式
+#   ・基礎フィルター（価格・r30・到達度・二重天井/三尊・業種/規模）も batch.pick_targets と同じ
+#     （波形判定は他の条件を通った窓だけ pattern_engine で一括判定する）
+#   ・休止日は batch.py と同じく「その日までの直近の有効足」で判定し、到達度の上位 TOP_N 銘柄を配信とする
+# ② 売買の再生（営業日ループ × 全銘柄ベクトル）
+#   ・配信の翌営業日から limit_d 営業日、bt の指値買い（寄りで下回れば寄り値で約定）
+#   ・約定の翌営業日から手仕舞い判定（同じ日に複数該当したら上から優先）
+#       寄りが利確値以上 → 寄りで利確 / 寄りが損切値以下 → 寄りで損切
+#       安値が損切値(bt_sl_i%)以下 → 損切値 / 高値が利確値(bt_tp%)以上 → 利確値
+#       終値が終値損切(bt_sl_c%)以下 → 終値 / 保有 bt_sell_d 本 → 終値
+#   ・1銘柄につき同時に持つのは指値か建玉のどちらか1つ（保有中・指値中の再配信は見送り）
+#   ・株数は bt_lot 固定、手数料・スリッページは考慮しない
+# パラメータ名はサイドバー設定（saved_settings_*.json）のキーと同じ。
+
+DEFAULT_PARAMS = {
+    "push_r": float(batch.PUSH_R), "limit_d": batch.LIMIT_D, "bt_lot": 100, "bt_tp": 10.0,
+    "bt_sl_i": float(batch.SL_I), "bt_sl_c": 8.0, "bt_sell_d": 10,
+}
+
+EXIT_REASONS = {1: "利確", 2: "損切", 3: "終値損切", 4: "期日", 5: "未決済"}
+
+_PATTERN_CHUNK = 200_000
+
+
+def resolve_params(settings=None):
+    """サイドバー設定（st.session_state / 設定 JSON）から検証パラメータを取り出す。無いキーは既定値"""
+    settings = settings or {}
+    params = {}
+    for k, v in DEFAULT_PARAMS.items():
+        try:
+            params[k] = type(v)(float(settings.get(k, v)))
+        except (TypeError, ValueError):
+            params[k] = v
+    return params
+
+
+def _allowed_codes(codes, master):
+    """銘柄マスタの業種・規模区分を通る銘柄の真偽配列（マスタ無しなら全銘柄）"""
+    if master is None or master.empty:
+        return np.ones(len(codes), dtype=bool)
+    df = pd.merge(pd.DataFrame({'Code': codes.astype(str)}), master, on='Code', how='left')
+    return df['Code'].isin(batch.master_filter(df)['Code']).values
+
+
+# ---------- ① 標的の算出 ----------
+def window_features(panel, master=None):
+    """
+    push_r・到達度帯に依存しない、詰めた足ごとの窓の特徴量（14日高値・安値、終値、足切り通過）。
+    パラメータ探索ではこれを一度だけ作り、push_r / 到達度帯を変えた標的算出で使い回す。
+    """
+    n_codes, n_days = panel.shape[:2]
+    f = panel.field_index
+    vals, _, _ = panel.tail_valid(n_days)
+    valid = panel.valid_mask()
+    n_bars = valid.sum(axis=1)
+
+    # 有効足を右詰めにした配列の左に29本の NaN を足し、各足を末尾とする30本窓を作る
+    pad = np.full((n_codes, 29), np.nan)
+    win = {k: sliding_window_view(np.concatenate([pad, vals[:, :, f[k]].astype('float64')], axis=1), 30, axis=1)
+           for k in ("AdjH", "AdjL", "AdjC")}
+    h30, l30w, c30 = win["AdjH"], win["AdjL"], win["AdjC"]
+    n30 = (~np.isnan(c30)).sum(axis=2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        h14 = h30[:, :, -14:].max(axis=2)
+        l14 = l30w[:, :, -14:].min(axis=2)
+        l30 = np.where(np.isnan(l30w), np.inf, l30w).min(axis=2)
+        lc = c30[:, :, -1]
+        r30 = np.where(l30 > 0, lc / l30, 0)
+        base = ((n30 >= 14) & (lc >= batch.MIN_PRICE) & (r30 <= batch.MAX_R30)
+                & _allowed_codes(panel.codes, master)[:, None])
+
+    # 詰めた足の位置 → 営業日（休止日はその日までの直近の足で判定）
+    slot = np.cumsum(valid, axis=1) - 1 + (n_days - n_bars)[:, None]
+    has_bar = slot >= n_days - n_bars[:, None]
+    return {
+        "h14": h14, "l14": l14, "lc": lc, "base": base,
+        "windows": (h30, l30w, c30, n30),
+        "pattern_ok": np.ones((n_codes, n_days), dtype=bool),
+        "pattern_checked": np.zeros((n_codes, n_days), dtype=bool),
+        "slot": np.clip(slot, 0, n_days - 1), "has_bar": has_bar,
+    }
+
+
+def _exclude_patterns(feat, need):
+    """⚠️ need の窓のうち未判定のものだけ二重天井・三尊を判定し、feat に書き溜める"""
+    h30, l30w, c30, n30 = feat["windows"]
+    ci, ki = np.nonzero(need & ~feat["pattern_checked"])
+    for s in range(0, len(ci), _PATTERN_CHUNK):
+        i, k = ci[s:s + _PATTERN_CHUNK], ki[s:s + _PATTERN_CHUNK]
+        pats = detect_patterns(h30[i, k], l30w[i, k], c30[i, k], n30[i, k], "batch")
+        feat["pattern_ok"][i, k] = ~(pats["dt"] | pats["hs"])
+        feat["pattern_checked"][i, k] = True
+
+
+def signals_from_features(feat, push_r=batch.PUSH_R, reach_range=batch.REACH_RANGE, top_n=batch.TOP_N):
+    """
+    window_features の結果から、全銘柄 × 全営業日の配信判定を (銘柄, 日付) 配列で返す。
+    {'signal': 配信されたか, 'bt': 押し目買値, 'reach_pct': 到達度, 'candidate': 上位 top_n で切る前の通過判定}
+    """
+    h14, l14, lc = feat["h14"], feat["l14"], feat["lc"]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bt = h14 - (h14 - l14) * (push_r / 100.0)
+        denom = h14 - bt
+        reach = np.where(denom > 0, (h14 - lc) / denom * 100, 0)
+        cand = feat["base"] & (reach >= reach_range[0]) & (reach <= reach_range[1])
+    # 波形判定は他の条件を通った窓だけ
+    _exclude_patterns(feat, cand)
+    cand &= feat["pattern_ok"]
+
+    slot, has_bar = feat["slot"], feat["has_bar"]
+    n_codes, n_days = slot.shape
+    rows = np.arange(n_codes)[:, None]
+
+    def to_days(x, fill):
+        return np.where(has_bar, x[rows, slot], fill)
+
+    out = {"candidate": to_days(cand, False), "bt": to_days(bt, np.nan), "reach_pct": to_days(reach, np.nan)}
+    # 日ごとに到達度の上位 top_n（同値はコード順）
+    score = np.where(out["candidate"], out["reach_pct"], -np.inf)
+    order = np.argsort(-score, axis=0, kind='stable')
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(n_codes)[:, None].repeat(n_days, axis=1), axis=0)
+    out["signal"] = out["candidate"] & (rank < top_n)
+    return out
+
+
+def compute_signals(panel, push_r=batch.PUSH_R, master=None, top_n=batch.TOP_N, reach_range=batch.REACH_RANGE):
+    """全銘柄 × 全営業日の配信判定（window_features → signals_from_features）"""
+    return signals_from_features(window_features(panel, master), push_r, reach_range, top_n)
+
+
+# ---------- ② 売買の再生 ----------
+def simulate(panel, signals, params):
+    """配信判定から指値・約定・手仕舞いを営業日順に再生し、(約定表, 日次の損益曲線) を返す"""
+    n_codes, n_days = panel.shape[:2]
+    o, h, l, c = (panel.field(k).astype('float64') for k in ("AdjO", "AdjH", "AdjL", "AdjC"))
+    lot = params["bt_lot"]
+    tp_r, sl_r, slc_r = 1 + params["bt_tp"] / 100, 1 - params["bt_sl_i"] / 100, 1 - params["bt_sl_c"] / 100
+
+    order_px = np.full(n_codes, np.nan)      # 指値（NaN = 指値なし）
+    order_left = np.zeros(n_codes, dtype='int64')
+    order_day = np.full(n_codes, -1, dtype='int64')
+    entry_px = np.full(n_codes, np.nan)      # 建値（NaN = 建玉なし）
+    entry_day = np.full(n_codes, -1, dtype='int64')
+    held = np.zeros(n_codes, dtype='int64')
+    last_c = np.full(n_codes, np.nan)
+
+    trades = []
+    realized = np.zeros(n_days)
+    unrealized = np.zeros(n_days)
+    n_open = np.zeros(n_days, dtype='int64')
+
+    def book(mask, day, px, reason):
+        idx = np.flatnonzero(mask)
+        if len(idx):
+            trades.append((idx, order_day[idx], entry_day[idx], np.full(len(idx), day), entry_px[idx], px[idx],
+                           held[idx], np.full(len(idx), reason)))
+
+    with np.errstate(invalid='ignore'):
+        for j in range(n_days):
+            oj, hj, lj, cj = o[:, j], h[:, j], l[:, j], c[:, j]
+            bar = ~np.isnan(cj)
+            last_c = np.where(bar, cj, last_c)
+
+            # 手仕舞い（約定の翌営業日以降、足がある日だけ）
+            pos = ~np.isnan(entry_px) & bar & (entry_day < j)
+            held += pos
+            tp, sl, slc = entry_px * tp_r, entry_px * sl_r, entry_px * slc_r
+            gap_tp = pos & (oj >= tp)
+            gap_sl = pos & ~gap_tp & (oj <= sl)
+            rest = pos & ~gap_tp & ~gap_sl
+            hit_sl = rest & (lj <= sl)
+            hit_tp = rest & ~hit_sl & (hj >= tp)
+            rest &= ~hit_sl & ~hit_tp
+            cls_sl = rest & (cj <= slc)
+            timed = rest & ~cls_sl & (held >= params["bt_sell_d"])
+            exit_px = np.select([gap_tp | gap_sl, hit_sl, hit_tp, cls_sl | timed], [oj, sl, tp, cj], np.nan)
+            book(gap_tp | hit_tp, j, exit_px, 1)
+            book(gap_sl | hit_sl, j, exit_px, 2)
+            book(cls_sl, j, exit_px, 3)
+            book(timed, j, exit_px, 4)
+            done = gap_tp | gap_sl | hit_sl | hit_tp | cls_sl | timed
+            realized[j] = np.nansum((exit_px - entry_px)[done]) * lot
+            entry_px[done] = np.nan
+            held[done] = 0
+
+            # 指値の約定（配信の翌営業日から limit_d 営業日）
+            waiting = ~np.isnan(order_px) & (order_day < j)
+            fill = waiting & bar & (lj <= order_px)
+            entry_px = np.where(fill, np.minimum(oj, order_px), entry_px)
+            entry_day[fill] = j
+            order_left -= waiting
+            order_px[fill | (waiting & (order_left <= 0))] = np.nan
+
+            # 引け後の配信 → 翌営業日からの指値
+            new = signals["signal"][:, j] & np.isnan(order_px) & np.isnan(entry_px)
+            order_px[new] = signals["bt"][new, j]
+            order_left[new] = params["limit_d"]
+            order_day[new] = j
+
+            holding = ~np.isnan(entry_px)
+            n_open[j] = holding.sum()
+            unrealized[j] = np.nansum((last_c - entry_px)[holding]) * lot
+
+    # 期間末の建玉は最終終値で評価（統計からは除外）
+    book(~np.isnan(entry_px), n_days - 1, last_c, 5)
+
+    cols = ["row", "signal_day", "entry_day", "exit_day", "entry", "exit", "held", "reason"]
+    if trades:
+        parts = [np.concatenate(x) for x in zip(*trades)]
+    else:
+        parts = [np.array([], dtype=t) for t in ('int64', 'int64', 'int64', 'int64', 'float64', 'float64', 'int64', 'int64')]
+    t = pd.DataFrame(dict(zip(cols, parts)))
+    dates = pd.to_datetime(panel.dates)
+    trades_df = pd.DataFrame({
+        "Code": panel.codes[t["row"]].astype(str),
+        "SignalDate": dates[t["signal_day"].clip(lower=0)],
+        "EntryDate": dates[t["entry_day"]],
+        "ExitDate": dates[t["exit_day"]],
+        "Entry": t["entry"].values,
+        "Exit": t["exit"].values,
+        "Held": t["held"].values,
+        "Reason": t["reason"].map(EXIT_REASONS).values,
+    })
+    trades_df["PnL"] = (trades_df["Exit"] - trades_df["Entry"]) * lot
+    trades_df["Return(%)"] = (trades_df["Exit"] / trades_df["Entry"] - 1) * 100
+    trades_df = trades_df.sort_values(["ExitDate", "Code"], kind='stable').reset_index(drop=True)
+
+    equity = pd.DataFrame({
+        "realized": np.cumsum(realized),
+        "unrealized": unrealized,
+        "open_positions": n_open,
+    }, index=dates)
+    equity["equity"] = equity["realized"] + equity["unrealized"]
+    return trades_df, equity
+
+
+def summarize(trades, equity):
+    """決済済みの取引から 勝率・プロフィットファクター・最大ドローダウン などを集計する"""
+    closed = trades[trades["Reason"] != EXIT_REASONS[5]]
+    pnl = closed["PnL"]
+    gross_win, gross_loss = pnl[pnl > 0].sum(), -pnl[pnl < 0].sum()
+    peak = equity["equity"].cummax()
+    return {
+        "trades": int(len(closed)),
+        "open": int(len(trades) - len(closed)),
+        "win_rate": float((pnl > 0).mean() * 100) if len(closed) else 0.0,
+        "profit_factor": float(gross_win / gross_loss) if gross_loss > 0 else (float('inf') if gross_win > 0 else 0.0),
+        "total_pnl": float(pnl.sum()),
+        "avg_return_pct": float(closed["Return(%)"].mean()) if len(closed) else 0.0,
+        "avg_held": float(closed["Held"].mean()) if len(closed) else 0.0,
+        "max_drawdown": float((peak - equity["equity"]).max()) if len(equity) else 0.0,
+        "max_open": int(equity["open_positions"].max()) if len(equity) else 0,
+        "by_reason": closed["Reason"].value_counts().to_dict(),
+    }
+
+
+def run_backtest(panel, params=None, master=None, top_n=batch.TOP_N, reach_range=batch.REACH_RANGE):
+    """
+    パネル全期間で検証する。params はサイドバー設定と同じキー（resolve_params を通す）。
+    {'params', 'stats', 'trades', 'equity'} を返す。
+    """
+    params = resolve_params(params)
+    if len(panel):
+        signals = compute_signals(panel, params["push_r"], master, top_n, reach_range)
+    else:
+        signals = {"signal": np.zeros(panel.shape[:2], dtype=bool), "bt": np.zeros(panel.shape[:2])}
+    trades, equity = simulate(panel, signals, params)
+    return {"params": params, "stats": summarize(trades, equity), "trades": trades, "equity": equity}
+
+
+def check_parity(panel, days=None, push_r=batch.PUSH_R, master=None):
+    """
+    指定営業日（既定は末尾から10日おきに5日）ごとに、その日までのパネルで batch.py の集計
+    （summarize_panel → attach_targets → pick_targets）を回した結果と一括算出を突き合わせる。
+    上位で切る前の通過銘柄の集合と bt・到達度を比べ、不一致の (日付, コード, 内容) のリストを返す。
+    """
+    n_days = panel.shape[1]
+    days = list(days) if days is not None else [n_days - 1 - 10 * i for i in range(5) if n_days - 1 - 10 * i >= 0]
+    sig = compute_signals(panel, push_r, master, top_n=len(panel))
+    mism = []
+    for j in days:
+        sub = PricePanel(panel.codes, panel.dates[:j + 1], panel.values[:, :j + 1], panel.fields)
+        sum_df = batch.summarize_panel(sub)
+        if sum_df.empty:
+            picked = sum_df
+        else:
+            sum_df = batch.attach_targets(sum_df, push_r)
+            if master is not None and not master.empty:
+                sum_df = pd.merge(sum_df, master, on='Code', how='left')
+            picked = batch.pick_targets(sum_df, top_n=len(sum_df))
+        ref = {str(r.Code): (r.bt, r.reach_pct) for r in picked.itertuples()} if len(picked) else {}
+        rows = np.flatnonzero(sig["candidate"][:, j])
+        got = {str(panel.codes[i]): (sig["bt"][i, j], sig["reach_pct"][i, j]) for i in rows}
+        day = str(pd.Timestamp(panel.dates[j]).date())
+        for code in sorted(set(ref) | set(got)):
+            if code not in got or code not in ref:
+                mism.append((day, code, f"一括={code in got} batch={code in ref}"))
+            elif not np.allclose(got[code], ref[code], rtol=1e-9, equal_nan=True):
+                mism.append((day, code, f"一括={got[code]} batch={ref[code]}"))
+    return mism
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description="押し目狙撃戦略（batch.py の規則）のウォークフォワード検証")
+    parser.add_argument("--root", default=None, help="日足ストアのディレクトリ（既定は prices_store/）")
+    for k, v in DEFAULT_PARAMS.items():
+        parser.add_argument(f"--{k.replace('_', '-')}", dest=k, type=type(v), default=v)
+    parser.add_argument("--top-n", type=int, default=batch.TOP_N)
+    parser.add_argument("--trades", default=None, help="約定表を書き出す CSV のパス")
+    parser.add_argument("--check", action="store_true", help="batch.py の集計と突き合わせる")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    panel = PricePanel.from_store(root=args.root)
+    t1 = time.perf_counter()
+    if len(panel) == 0:
+        raise SystemExit("日足ストアが空です")
+    res = run_backtest(panel, {k: getattr(args, k) for k in DEFAULT_PARAMS}, top_n=args.top_n)
+    t2 = time.perf_counter()
+    s = res["stats"]
+    print(f"📦 {len(panel):,}銘柄 × {panel.shape[1]}営業日（読込 {t1 - t0:.2f}秒 / 検証 {t2 - t1:.2f}秒）")
+    print(f"📈 取引 {s['trades']:,}回（未決済 {s['open']}）/ 勝率 {s['win_rate']:.1f}% / PF {s['profit_factor']:.2f} / "
+          f"損益 {s['total_pnl']:+,.0f}円 / 平均 {s['avg_return_pct']:+.2f}% / 平均保有 {s['avg_held']:.1f}本")
+    print(f"📉 最大ドローダウン {s['max_drawdown']:,.0f}円 / 最大同時保有 {s['max_open']}銘柄 / 決済内訳 {s['by_reason']}")
+    if args.trades:
+        res["trades"].to_csv(args.trades, index=False, encoding="utf-8-sig")
+        print(f"💾 約定表を {args.trades} に書き出しました。")
+    if args.check:
+        mism = check_parity(panel, push_r=args.push_r)
+        print("✅ batch.py と完全一致" if not mism else f"⚠️ 不一致 {len(mism)}件: {mism[:10]}")
@@ -8,18 +8,19 @@ import re
 from io import BytesIO
 import time
 
+from rate_limiter import jquants_get
+import price_store
+from price_panel import PricePanel
+from pattern_engine import detect_patterns
+
 # --- 1. 環境変数 ---
 API_KEY = os.getenv("JQUANTS_API_KEY", os.getenv("JQ", "")).strip()
 DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK", os.getenv("DW", "")).strip()
 
-print(f"【システムログ】JQセンサー反応: {bool(API_KEY)} / Discordアンテナ反応: {bool(DISCORD_WEBHOOK)}")
-
-if not API_KEY or not DISCORD_WEBHOOK:
-    print("🚨 【緊急警告】必要な暗号鍵またはWebhook URLが欠落しています！")
-    exit(1)
-
 headers = {"x-api-key": API_KEY}
-BASE_URL = "https://api.jquants.com/v2"
+# 🧪 JQUANTS_BASE_URL でローカルの代役サーバー（jquants_stub_server.py）へ向け替えられる
+BASE_URL = os.getenv("JQUANTS_BASE_URL", "https://api.jquants.com/v2").rstrip("/")
+API_ROOT = BASE_URL.rsplit("/", 1)[0]
 
 # --- 2. 共通関数 ---
 def clean_df(df):
@@ -52,40 +53,45 @@ def get_old_codes():
         d = (base - timedelta(days=i)).strftime('%Y%m%d')
         for v in ["v2", "v1"]:
             try:
-                r = requests.get(f"https://api.jquants.com/{v}/listed/info?date={d}", headers=headers, timeout=10)
+                r = jquants_get(requests, f"{API_ROOT}/{v}/listed/info?date={d}", headers=headers, timeout=10)
                 if r.status_code == 200 and r.json().get("info"): return pd.DataFrame(r.json()["info"])['Code'].astype(str).tolist()
             except: pass
     return []
 
 def get_hist_data():
     base = datetime.utcnow() + timedelta(hours=9)
-    dates = []
-    days = 0
-    while len(dates) < 30:
-        d = base - timedelta(days=days)
-        if d.weekday() < 5: dates.append(d.strftime('%Y%m%d'))
-        days += 1
-    d_h = base - timedelta(days=180)
-    while d_h.weekday() >= 5: d_h -= timedelta(days=1)
-    dates.append(d_h.strftime('%Y%m%d'))
-    d_y = base - timedelta(days=365)
-    while d_y.weekday() >= 5: d_y -= timedelta(days=1)
-    dates.append(d_y.strftime('%Y%m%d'))
+    # 📅 祝日・年末年始を除いた営業日（休場日を毎回 API へ取りに行かない）
+    dates = price_store.expected_trading_days(base, 60)[-30:]
+    # 半年前・1年前はその日以前の直近営業日
+    dates.append(price_store.expected_trading_days(base - timedelta(days=180), 10)[-1])
+    dates.append(price_store.expected_trading_days(base - timedelta(days=365), 10)[-1])
     
-    rows = []
+    # 🗄️ 兵站Botの日足ストアにある日はディスクから、無い日だけAPIで補給
+    try:
+        missing = set(price_store.days_to_fetch(dates))
+        stored = set(price_store.list_days())
+    except Exception:
+        missing, stored = set(dates), set()
+    stored_days = [d for d in dates if d in stored and d not in missing]
+
     def fetch(dt):
         try:
-            r = requests.get(f"{BASE_URL}/equities/bars/daily?date={dt}", headers=headers, timeout=10)
-            if r.status_code == 200: return r.json().get("data", [])
+            r = jquants_get(requests, f"{BASE_URL}/equities/bars/daily?date={dt}", headers=headers, timeout=10)
+            if r.status_code == 200: return dt, r.json().get("data", [])
         except: pass
-        return []
-        
+        return dt, None
+
+    frames = [price_store.load_bars(days=stored_days)] if stored_days else []
     with concurrent.futures.ThreadPoolExecutor(max_workers=5) as exe:
-        futs = [exe.submit(fetch, dt) for dt in dates]
+        futs = [exe.submit(fetch, dt) for dt in dates if dt in missing]
         for f in concurrent.futures.as_completed(futs):
-            res = f.result()
-            if res: rows.extend(res)
-    return rows
+            dt, res = f.result()
+            if res: frames.append(price_store.records_to_frame(dt, res))
+            elif res is None and dt in stored: frames.append(price_store.load_bars(days=[dt]))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return PricePanel.empty()
+    return PricePanel.from_frame(pd.concat(frames, ignore_index=True))
 
 def check_double_top(df_sub):
     try:
@@ -155,55 +161,64 @@ def compress_name(name):
     for k, v in reps.items(): name = name.replace(k, v)
     return name[:9] + "…" if len(name) > 9 else name
 
-# --- 3. メインロジック ---
-def main():
-    print("データ取得開始...")
-    master_df = load_master()
-    old_codes = get_old_codes()
-    raw = get_hist_data()
-    
-    if not raw:
-        send_discord_notify("🚨 **データの取得に失敗しました。**")
-        return
-        
-    d_raw = pd.DataFrame(raw)
-    df = clean_df(d_raw).dropna(subset=['AdjC', 'AdjH', 'AdjL']).sort_values(['Code', 'Date'])
-    
-    df_30 = df.groupby('Code').tail(30)
-    df_14 = df_30.groupby('Code').tail(14)
-    counts = df_14.groupby('Code').size()
-    valid = counts[counts == 14].index
-    
-    if valid.empty:
-        send_discord_notify("🚨 **条件を満たすデータが存在しません。**")
-        return
+# --- 3. 集計（銘柄×日付パネルで全銘柄一括） ---
+def summarize_panel(panel):
+    """
+    各銘柄の有効な直近14本・30本と、それより前（半年前・1年前）から基礎統計を一括算出する。
+    直近30本の波形判定（is_dt / is_hs / is_db）も同じ配列のまま一括で付ける。
+    直近14本が揃わない銘柄は除外。
+    """
+    f = panel.field_index
+    v30, d30, n30 = panel.tail_valid(30)
+    v30 = v30.astype('float64')
+    valid = n30 >= 14
+    rows = np.flatnonzero(valid)
+    v30, d30, n30 = v30[rows], d30[rows], n30[rows]
+    if len(rows) == 0:
+        return pd.DataFrame()
 
-    df_14 = df_14[df_14['Code'].isin(valid)]
-    df_30 = df_30[df_30['Code'].isin(valid)]
-    df_past = df[~df.index.isin(df_30.index)]; df_past = df_past[df_past['Code'].isin(valid)]
-    
-    agg_14 = df_14.groupby('Code').agg(
-        lc=('AdjC', 'last'), 
-        prev_c=('AdjC', lambda x: x.iloc[-2] if len(x) > 1 else np.nan),
-        c_3days_ago=('AdjC', lambda x: x.iloc[-4] if len(x) > 3 else np.nan),
-        h14=('AdjH', 'max'), 
-        l14=('AdjL', 'min')
-    )
-    
-    idx_max = df_14.groupby('Code')['AdjH'].idxmax()
-    h_dates = df_14.loc[idx_max, ['Code', 'Date']].rename(columns={'Date': 'h_date'})
-    df_14_m = df_14.merge(h_dates, on='Code')
-    d_high = df_14_m[df_14_m['Date'] > df_14_m['h_date']].groupby('Code').size().rename('d_high')
-    
-    agg_30 = df_30.groupby('Code').agg(l30=('AdjL', 'min'))
-    agg_p = df_past.groupby('Code').agg(omax=('AdjH', 'max'), omin=('AdjL', 'min'))
-    sum_df = agg_14.join(d_high, how='left').fillna({'d_high': 0}).join(agg_30).join(agg_p).reset_index()
-    
-    # --- 🎯 狙撃パラメーター（大型株・25%押し仕様に変更） ---
-    push_r = 25  # 50%から25%押しへ変更（大型株は落ちにくいため浅めに設定）
-    limit_d = 4
-    sl_i = 8 
-    
+    c14 = v30[:, -14:, f['AdjC']]; h14 = v30[:, -14:, f['AdjH']]; l14 = v30[:, -14:, f['AdjL']]
+    sum_df = pd.DataFrame({
+        'Code': panel.codes[rows],
+        'lc': c14[:, -1],
+        'prev_c': c14[:, -2],
+        'c_3days_ago': c14[:, -4],
+        'h14': h14.max(axis=1),
+        'l14': l14.min(axis=1),
+        # 14日高値（同値なら最初の日）から後ろの本数
+        'd_high': (13 - h14.argmax(axis=1)).astype(float),
+        'l30': np.nanmin(v30[:, :, f['AdjL']], axis=1),
+    })
+
+    # 直近30本より前の有効足（半年前・1年前の参照日）
+    ok = panel.valid_mask()[rows]
+    from_end = np.cumsum(ok[:, ::-1], axis=1)[:, ::-1]
+    past = ok & (from_end > 30)
+    has_past = past.any(axis=1)
+    h_all = panel.values[rows, :, f['AdjH']]; l_all = panel.values[rows, :, f['AdjL']]
+    sum_df['omax'] = np.where(has_past, np.where(past, h_all, -np.inf).max(axis=1), np.nan)
+    sum_df['omin'] = np.where(has_past, np.where(past, l_all, np.inf).min(axis=1), np.nan)
+
+    # 波形判定（check_double_top / check_head_shoulders / check_double_bottom と同じ規則）
+    pats = detect_patterns(v30[:, :, f['AdjH']], v30[:, :, f['AdjL']], v30[:, :, f['AdjC']], n30, "batch")
+    sum_df['is_dt'] = pats['dt']
+    sum_df['is_hs'] = pats['hs']
+    sum_df['is_db'] = pats['db']
+    return sum_df
+
+# --- 🎯 狙撃パラメーター（大型株・25%押し仕様に変更） ---
+PUSH_R = 25  # 50%から25%押しへ変更（大型株は落ちにくいため浅めに設定）
+LIMIT_D = 4
+SL_I = 8
+MIN_PRICE = 500          # 終値の下限（円）
+MAX_R30 = 2.0            # 30日安値からの上昇倍率の上限
+REACH_RANGE = (50, 135)  # 到達度（%）の採用範囲：行き過ぎた暴落と遠すぎる標的を排除
+TOP_N = 15
+LARGE_SCALES = "Core30|Large70|Mid400"
+
+def attach_targets(sum_df, push_r=PUSH_R):
+    """summarize_panel の集計に 押し目買値(bt)・利確目標・到達度 などの判定列を付ける"""
+    sum_df = sum_df.copy()
     ur = sum_df['h14'] - sum_df['l14']
     sum_df['bt'] = sum_df['h14'] - (ur * (push_r / 100.0))
     sum_df['tp5'] = sum_df['bt'] * 1.05; sum_df['tp10'] = sum_df['bt'] * 1.10; sum_df['tp15'] = sum_df['bt'] * 1.15; sum_df['tp20'] = sum_df['bt'] * 1.20
@@ -218,38 +233,65 @@ def main():
     sum_df['daily_pct'] = np.where(sum_df['prev_c'] > 0, (sum_df['lc'] / sum_df['prev_c']) - 1, 0)
     sum_df['pct_3days'] = np.where(sum_df['c_3days_ago'] > 0, (sum_df['lc'] / sum_df['c_3days_ago']) - 1, 0)
     
-    dt_s = df_30.groupby('Code').apply(check_double_top).rename('is_dt')
-    hs_s = df_30.groupby('Code').apply(check_head_shoulders).rename('is_hs')
-    db_s = df_30.groupby('Code').apply(check_double_bottom).rename('is_db')
-    sum_df = sum_df.merge(dt_s, on='Code', how='left').merge(hs_s, on='Code', how='left').merge(db_s, on='Code', how='left')
-    sum_df = sum_df.fillna({'is_dt': False, 'is_hs': False, 'is_db': False})
-    
     sum_df['is_defense'] = (~sum_df['is_dt']) & (~sum_df['is_hs']) & (sum_df['lc'] <= (sum_df['l14'] * 1.03))
-    
-    if not master_df.empty: sum_df = pd.merge(sum_df, master_df, on='Code', how='left')
+    return sum_df
+
+def master_filter(df):
+    """銘柄マスタの列（Sector / Scale）があれば、業種・規模区分で絞り込む"""
+    if 'Sector' in df.columns:
+        df = df[df['Sector'].notna()]
+        df = df[df['Sector'] != '-']
+        # 医薬品（バイオ等）を除外
+        df = df[df['Sector'] != '医薬品']
+
+    # 🏢 【追加】規模区分で「大型・中型株（Core30, Large70, Mid400）」のみに厳選！
+    if 'Scale' in df.columns:
+        df = df[df['Scale'].astype(str).str.contains(LARGE_SCALES, na=False)]
+    return df
 
+def pick_targets(sum_df, top_n=TOP_N):
+    """attach_targets 済みの表から、基礎フィルターを通った到達度上位 top_n 銘柄を返す"""
     # --- 🛡️ 1. 基礎フィルター（完全防衛・大型株専用へ進化） ---
-    sum_df = sum_df[sum_df['lc'] >= 500]  
-    sum_df = sum_df[sum_df['r30'] <= 2.0]
+    sum_df = sum_df[sum_df['lc'] >= MIN_PRICE]  
+    sum_df = sum_df[sum_df['r30'] <= MAX_R30]
     
     # ⚠️ 危険波形（ダブルトップ・三尊）をリストから完全除外
     sum_df = sum_df[(~sum_df['is_dt']) & (~sum_df['is_hs'])]
-    
-    if 'Sector' in sum_df.columns:
-        sum_df = sum_df[sum_df['Sector'].notna()]
-        sum_df = sum_df[sum_df['Sector'] != '-']
-        # 医薬品（バイオ等）を除外
-        sum_df = sum_df[sum_df['Sector'] != '医薬品']
-
-    # 🏢 【追加】規模区分で「大型・中型株（Core30, Large70, Mid400）」のみに厳選！
-    if 'Scale' in sum_df.columns:
-        sum_df = sum_df[sum_df['Scale'].astype(str).str.contains("Core30|Large70|Mid400", na=False)]
+    sum_df = master_filter(sum_df)
 
     # 👇👇👇 【ここに追加】行き過ぎた暴落（到達度135%超え）と、遠すぎる標的を排除 👇👇👇
-    sum_df = sum_df[(sum_df['reach_pct'] >= 50) & (sum_df['reach_pct'] <= 135)]
+    sum_df = sum_df[(sum_df['reach_pct'] >= REACH_RANGE[0]) & (sum_df['reach_pct'] <= REACH_RANGE[1])]
     
     # --- 2. ソート ---
-    res = sum_df.sort_values('reach_pct', ascending=False).head(15)
+    return sum_df.sort_values('reach_pct', ascending=False).head(top_n)
+
+# --- 4. メインロジック ---
+def main():
+    print(f"【システムログ】JQセンサー反応: {bool(API_KEY)} / Discordアンテナ反応: {bool(DISCORD_WEBHOOK)}")
+    if not API_KEY or not DISCORD_WEBHOOK:
+        print("🚨 【緊急警告】必要な暗号鍵またはWebhook URLが欠落しています！")
+        exit(1)
+
+    print("データ取得開始...")
+    master_df = load_master()
+    old_codes = get_old_codes()
+    panel = get_hist_data()
+    
+    if len(panel) == 0:
+        send_discord_notify("🚨 **データの取得に失敗しました。**")
+        return
+        
+    sum_df = summarize_panel(panel)
+    
+    if sum_df.empty:
+        send_discord_notify("🚨 **条件を満たすデータが存在しません。**")
+        return
+    
+    sum_df = attach_targets(sum_df, PUSH_R)
+    if not master_df.empty: sum_df = pd.merge(sum_df, master_df, on='Code', how='left')
+
+    # --- 🛡️ 1. 基礎フィルター ＋ 2. ソート ---
+    res = pick_targets(sum_df)
 
     # --- 3. Discord用メッセージの構築 ---
     if len(res) == 0:
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import synthetic_market
+import fundamentals_store
+import indicator_state
+from price_panel import PricePanel
+from feature_store import FeatureTable
+from scan_core import (clean_df, compress_memory, calc_vector_indicators, get_fast_indicators,
+                       analyze_fundamental_momentum, analyze_formation_history, detect_sakata_patterns,
+                       check_double_top, check_head_shoulders, check_double_bottom, judge_tab3)
+import batch
+import backtester
+import pattern_engine
+import parallel_scan
+import formation_engine
+import sakata_engine
+import fundamental_screener
+import async_fetcher
+import jquants_stub_server
+from rate_limiter import TokenBucket, jquants_get
+
+# ==========================================
+# ⏱️ スクリーニング主要処理のベンチマーク（疑似マーケットで計測）
+# ==========================================
+# synthetic_market で全市場相当（既定 4,000銘柄 × 280営業日 ＋ 8四半期の決算）を作り、
+# TAB1 / TAB3 / batch.py が通る処理を「1銘柄ずつの関数」と「全銘柄一括の関数」の両方で測る。
+# ・1銘柄ずつの関数は --loop-codes 銘柄（既定 500）だけ回し、1銘柄あたりの時間も記録する
+# ・各ケースは --repeat 回測った最速値（と中央値）を採る
+# ・fetch グループは J-Quants 代役サーバー（jquants_stub_server）を同じプロセス内で立てて取得処理を測る
+# 結果は bench_results.jsonl に1実行1行の JSON で追記する（同じ条件の前回値との比も表示）。
+#
+#   python bench.py                       # 全ケース
+#   python bench.py --codes 500 --days 120 --only sakata,pattern
+#   python bench.py --compare             # 計測せず、直近2回の結果を比べる
+
+RESULTS_FILE = "bench_results.jsonl"
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+def _timeit(fn, repeat):
+    """fn を repeat 回実行し、(最速秒, 中央値秒, 最後の戻り値) を返す"""
+    times, out = [], None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t0)
+    return min(times), float(np.median(times)), out
+
+
+class Market:
+    """ベンチマーク用の入力一式（生成は計測に含めない）"""
+
+    def __init__(self, root, n_codes, n_days, n_quarters, seed, loop_codes):
+        t0 = time.perf_counter()
+        self.root = root
+        self.store = os.path.join(root, "prices_store")
+        self.bars, self.statements = synthetic_market.build_market(root, n_codes, n_days, n_quarters, seed)
+        self.histories = synthetic_market.statement_histories(self.statements)
+        self.table = fundamentals_store.FundamentalsTable.load(os.path.join(root, "fundamentals_store.npz"))
+        self.panel = PricePanel.from_store(root=self.store)
+        self.loop_rows = list(range(min(loop_codes, len(self.panel))))
+        self.loop_codes = [str(self.panel.codes[r]) for r in self.loop_rows]
+        # 1銘柄ずつの関数に渡す DataFrame（画面側が持っている形）
+        self.frames = [self.panel.code_frame(r) for r in self.loop_rows]
+        self.cleaned = clean_df(self.bars.copy())
+        self.setup_seconds = time.perf_counter() - t0
+
+
+# ---------- 計測ケース（名前, 方式, 処理した件数, 関数） ----------
+def _case_clean(m):
+    n = len(m.bars)
+    yield "clean_df", "frame", n, lambda: clean_df(m.bars.copy())
+    yield "compress_memory", "frame", n, lambda: compress_memory(m.bars.copy())
+
+
+def _case_indicators(m):
+    yield "calc_vector_indicators", "per_code", len(m.frames), \
+        lambda: [calc_vector_indicators(df.copy()) for df in m.frames]
+    yield "get_fast_indicators", "per_code", len(m.frames), \
+        lambda: [get_fast_indicators(df['AdjC'].values) for df in m.frames]
+    yield "FeatureTable.from_panel", "batched", len(m.panel), lambda: FeatureTable.from_panel(m.panel)
+    yield "indicator_state.build", "batched", len(m.panel), lambda: indicator_state.build(m.store)
+
+
+def _case_fundamentals(m):
+    raw = [m.histories[c] for c in m.loop_codes if c in m.histories]
+    norm = [m.table.get(c) for c in m.loop_codes if c in m.table]
+    yield "analyze_fundamental_momentum[raw]", "per_code", len(raw), \
+        lambda: [analyze_fundamental_momentum(df) for df in raw]
+    yield "analyze_fundamental_momentum[table]", "per_code", len(norm), \
+        lambda: [analyze_fundamental_momentum(df) for df in norm]
+    yield "FundamentalsTable.from_histories", "batched", len(m.histories), \
+        lambda: fundamentals_store.FundamentalsTable.from_histories(m.histories)
+    yield "evaluate_momentum", "batched", len(m.table), lambda: fundamental_screener.evaluate_momentum(m.table)
+
+
+def _case_formation(m):
+    yield "analyze_formation_history", "per_code", len(m.frames), \
+        lambda: [analyze_formation_history(df) for df in m.frames]
+    yield "scan_formations", "batched", len(m.panel), lambda: formation_engine.scan_formations(m.panel)
+
+
+def _case_sakata(m):
+    frames = [calc_vector_indicators(df.copy()) for df in m.frames]
+    yield "detect_sakata_patterns", "per_code", len(frames), \
+        lambda: [detect_sakata_patterns(df) for df in frames]
+    yield "scan_sakata", "batched", len(m.panel), lambda: sakata_engine.scan_sakata(m.panel)
+
+
+def _case_pattern(m):
+    tails = [df.tail(31) for df in m.frames]
+    yield "check_*[app]", "per_code", len(tails), \
+        lambda: [(check_double_top(d), check_head_shoulders(d), check_double_bottom(d)) for d in tails]
+    tails30 = [df.tail(30) for df in m.frames]
+    yield "check_*[batch]", "per_code", len(tails30), \
+        lambda: [(batch.check_double_top(d), batch.check_head_shoulders(d), batch.check_double_bottom(d))
+                 for d in tails30]
+    yield "scan_patterns[app]", "batched", len(m.panel), lambda: pattern_engine.scan_patterns(m.panel, 31, "app")
+    yield "scan_patterns[batch]", "batched", len(m.panel), lambda: pattern_engine.scan_patterns(m.panel, 30, "batch")
+
+
+def _case_batch(m):
+    yield "PricePanel.from_store", "batched", len(m.panel), lambda: PricePanel.from_store(root=m.store)
+    yield "batch.summarize_panel", "batched", len(m.panel), lambda: batch.summarize_panel(m.panel)
+    yield "backtester.run_backtest", "batched", len(m.panel), lambda: backtester.run_backtest(m.panel)
+
+
+def _scan_job(code, group):
+    """execute_chunked_scan の process_func の見本（pandas 主体の1銘柄処理）"""
+    df = calc_vector_indicators(group.copy())
+    if len(df) < 30:
+        return None
+    return {"Code": code, "RSI": float(df['RSI'].iloc[-1]), "sakata": len(detect_sakata_patterns(df)),
+            "formation": sum(len(x) for x in analyze_formation_history(df))}
+
+
+def _case_scan(m):
+    # --loop-codes 銘柄の1銘柄ずつ処理：スレッド版（従来）とプロセス版（共有メモリのパネル）
+    # python bench.py で動かすと _scan_job は __main__ の関数になり別プロセスへ送れないため、モジュールとして引き直す
+    import bench as bench_module
+    job = bench_module._scan_job
+    groups = list(zip(m.loop_codes, m.frames))
+    pairs = [(c, None) for c in m.loop_codes]
+    workers = max(os.cpu_count() or 1, 2)
+    yield "execute_chunked_scan[threads]", "batched", len(groups), \
+        lambda: parallel_scan.execute_chunked_scan(groups, job)
+    yield f"execute_chunked_scan_mp[{workers}]", "batched", len(pairs), \
+        lambda: parallel_scan.execute_chunked_scan_mp(pairs, job, panel=m.panel, max_workers=workers, min_items=0)
+
+
+def _case_tab3(m):
+    # TAB3 フェーズ1（scan_core.judge_tab3：陣形ランク＋業績推移表＋業績ランク）を全銘柄で
+    # スレッド版（従来）とプロセス版。銘柄数は MP_MIN_ITEMS を超えるのでプロセス版はそのままワーカーを起こす
+    days_ago = dict(zip(m.panel.codes.tolist(), formation_engine.scan_formations(m.panel)["buy_days_ago"].tolist()))
+    pairs = [(c, None) for c in m.panel.codes.tolist()]
+    workers = max(os.cpu_count() or 1, 2)
+    yield "judge_tab3[threads]", "batched", len(pairs), \
+        lambda: parallel_scan.execute_chunked_scan_mp(pairs, judge_tab3, "buy", days_ago, m.table, panel=m.panel,
+                                                      tail=260, max_workers=3, min_items=len(pairs) + 1)
+    yield f"judge_tab3_mp[{workers}]", "batched", len(pairs), \
+        lambda: parallel_scan.execute_chunked_scan_mp(pairs, judge_tab3, "buy", days_ago, m.table, panel=m.panel,
+                                                      tail=260, max_workers=workers, min_items=0)
+
+
+def _case_fetch(m):
+    # 代役サーバー（遅延・上限なし）に対する取得処理そのものの処理能力
+    server, base = jquants_stub_server.serve_in_thread(jquants_stub_server.StubMarket(m.bars, m.statements))
+    days = sorted(m.bars["Date"].unique())
+    limiter = TokenBucket(rpm=1e6, burst=64)
+    session = async_fetcher.make_session({"x-api-key": "bench"}, 8)
+    bar_jobs = [(d, f"{base}/equities/bars/daily?date={d}") for d in days]
+    fin_jobs = [(c, f"{base}/fins/summary?code={c}") for c in m.loop_codes]
+    try:
+        yield "jquants_get[bars/daily]", "per_day", len(days), \
+            lambda: [jquants_get(session, url, limiter=limiter, timeout=30).json() for _, url in bar_jobs]
+        yield "fetch_all[bars/daily]", "batched", len(days), \
+            lambda: async_fetcher.fetch_all(session, bar_jobs, lambda *a: None, concurrency=8, limiter=limiter, timeout=30)
+        yield "fetch_all[fins/summary]", "batched", len(fin_jobs), \
+            lambda: async_fetcher.fetch_all(session, fin_jobs, lambda *a: None, concurrency=8, limiter=limiter, timeout=30)
+    finally:
+        server.shutdown()
+        session.close()
+
+
+CASES = {
+    "clean": _case_clean,
+    "indicators": _case_indicators,
+    "fundamentals": _case_fundamentals,
+    "formation": _case_formation,
+    "sakata": _case_sakata,
+    "pattern": _case_pattern,
+    "batch": _case_batch,
+    "scan": _case_scan,
+    "tab3": _case_tab3,
+    "fetch": _case_fetch,
+}
+
+
+def run(n_codes=4000, n_days=280, n_quarters=8, seed=0, repeat=3, loop_codes=500, only=None, root=None):
+    """全ケースを計測して1実行分の結果（dict）を返す"""
+    own_root = root is None
+    root = root or tempfile.mkdtemp(prefix="bench_market_")
+    try:
+        m = Market(root, n_codes, n_days, n_quarters, seed, loop_codes)
+        results = []
+        for group, make in CASES.items():
+            if only and group not in only:
+                continue
+            for name, kind, items, fn in make(m):
+                best, median, _ = _timeit(fn, repeat)
+                results.append({
+                    "group": group, "case": name, "kind": kind, "items": int(items),
+                    "best_s": round(best, 6), "median_s": round(median, 6),
+                    "per_item_ms": round(best / max(items, 1) * 1000, 6),
+                })
+                print(f"  {name:<40} {kind:<9} {items:>7,} 件  {best * 1000:10.1f}ms  "
+                      f"({best / max(items, 1) * 1000:.4f}ms/件)")
+    finally:
+        if own_root:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        "run_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": {"codes": n_codes, "days": n_days, "quarters": n_quarters, "seed": seed,
+                   "repeat": repeat, "loop_codes": loop_codes},
+        "setup_s": round(m.setup_seconds, 3),
+        "results": results,
+    }
+
+
+def load_results(path=RESULTS_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(record, path=RESULTS_FILE):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def compare(new, old):
+    """同じケースの最速値の比（新 / 旧）を表示する。1 未満なら速くなっている"""
+    before = {r["case"]: r for r in old["results"]}
+    print(f"📊 {old.get('commit') or '?'} ({old['run_at']}) → {new.get('commit') or '?'} ({new['run_at']})")
+    for r in new["results"]:
+        o = before.get(r["case"])
+        if o is None or o["items"] != r["items"] or not o["best_s"]:
+            continue
+        ratio = r["best_s"] / o["best_s"]
+        mark = "🟢" if ratio < 0.9 else ("🔴" if ratio > 1.1 else "⚪")
+        print(f"  {mark} {r['case']:<40} {o['best_s'] * 1000:10.1f}ms → {r['best_s'] * 1000:10.1f}ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スクリーニング主要処理のベンチマーク")
+    parser.add_argument("--codes", type=int, default=4000)
+    parser.add_argument("--days", type=int, default=280)
+    parser.add_argument("--quarters", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--loop-codes", type=int, default=500, help="1銘柄ずつの関数を回す銘柄数")
+    parser.add_argument("--only", default="", help=f"計測するグループ（カンマ区切り: {','.join(CASES)}）")
+    parser.add_argument("--out", default=RESULTS_FILE)
+    parser.add_argument("--compare", action="store_true", help="計測せず、直近2回の結果を比べる")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        history = load_results(args.out)
+        if len(history) < 2:
+            raise SystemExit(f"{args.out} に比較できる結果が2件ありません")
+        compare(history[-1], history[-2])
+        return
+
+    only = {g.strip() for g in args.only.split(",") if g.strip()} or None
+    unknown = (only or set()) - set(CASES)
+    if unknown:
+        raise SystemExit(f"不明なグループ: {','.join(sorted(unknown))}")
+
+    print(f"⏱️ 疑似マーケット {args.codes:,} 銘柄 × {args.days} 営業日 / 決算 {args.quarters} 四半期 (seed={args.seed})")
+    record = run(args.codes, args.days, args.quarters, args.seed, args.repeat, args.loop_codes, only)
+    same = [r for r in load_results(args.out) if r.get("params") == record["params"]]
+    append_result(record, args.out)
+    print(f"✅ {len(record['results'])} ケースを {args.out} に記録しました（データ生成 {record['setup_s']:.1f}秒）")
+    if same:
+        compare(record, same[-1])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
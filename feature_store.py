@@ -0,0 +1,345 @@
+import os
+import numpy as np
+import pandas as pd
+
+import price_store
+import indicator_state
+from price_panel import PricePanel
+
+# ==========================================
+# 🧪 特徴量テーブル（銘柄 × 営業日 × 指標、夜間に全銘柄一括で焼き付け）
+# ==========================================
+# prices_store/features.npz
+#   codes   … 5桁コード（昇順）
+#   dates   … (銘柄, 本数) の日付（銘柄ごとの有効足を右詰め、足りない分は NaT）
+#   values  … (銘柄, 本数, 指標) の float32
+# 各指標は銘柄ごとの有効足の系列（1銘柄版の dropna 後の DataFrame と同じ並び）に対して、
+# pandas の rolling / ewm を「列 = 銘柄」の表にまとめて1回ずつ掛けて求める。
+# ・SMA25 / SMA75 / ATR / RSI … calc_vector_indicators と同じ式
+# ・MACD / MACD_Signal / MACD_Hist … get_fast_indicators と同じ式（12, 26, 9）
+# ・MA18 / MA50 … TAB3 のチャートと同じ単純移動平均（本数が揃うまで NaN）
+# ・BB_L3 … 20日ボリンジャーバンドの -3σ（check_oversold_ultimate が参照）
+# ・gc_days … MACD_Hist がプラスに転じてから何本目か（転換日 = 1、マイナス圏は 0）
+# 計算は保存済みの全履歴で行い（指数平滑の助走）、保存するのは直近 KEEP_DAYS 本。
+# 夜間の更新は sync()：indicator_state の途中状態を新着日ぶんだけ進め、その日の値を各銘柄の末尾へ1本ずつ足す
+# （銘柄数 × 新着日数。全履歴から作り直すのは表・状態が無い / 食い違うときと、分割・併合のあった銘柄だけ）。
+# features.npz は日足ストアと一緒に git へ保存し、app はそれを読むだけ（画面側では計算しない）。
+
+FEATURES_FILE = "features.npz"
+KEEP_DAYS = 260
+FEATURES = ["SMA25", "SMA75", "MA18", "MA50", "ATR", "RSI", "MACD", "MACD_Signal", "MACD_Hist", "BB_L3", "gc_days"]
+# 画面側が別名で読む列（render_technical_radar は MA25 を参照）
+ALIASES = {"MA25": "SMA25"}
+
+
+def _frame(x):
+    """(銘柄, 本数) → 列 = 銘柄 の DataFrame（pandas の rolling / ewm を列ごとに一括適用するため）"""
+    return pd.DataFrame(x.T)
+
+
+def compute_features(o, h, l, c, counts):
+    """
+    右詰め（左側 NaN 埋め）の (銘柄, 本数) 配列から全指標を求める。{指標: (銘柄, 本数) float32}
+    NaN 埋めの位置は計算に含めないため、各銘柄の値は有効足だけの系列で計算した値と一致する。
+    """
+    counts = np.asarray(counts)
+    C, H, L = _frame(c), _frame(h), _frame(l)
+    pad = C.isna()
+    out = {}
+
+    out["SMA25"] = C.rolling(window=25, min_periods=1).mean()
+    out["SMA75"] = C.rolling(window=75, min_periods=1).mean()
+    out["MA18"] = C.rolling(18).mean()
+    out["MA50"] = C.rolling(50).mean()
+
+    # Wilder ATR（14本未満の銘柄は全期間の単純平均）
+    c_prev = C.shift(1)
+    tr = np.fmax(np.fmax(H - L, (H - c_prev).abs()), (L - c_prev).abs())
+    atr_ewm = tr.ewm(alpha=1 / 14, adjust=False, min_periods=1).mean()
+    atr_short = tr.expanding(min_periods=1).mean()
+    out["ATR"] = pd.DataFrame(np.where((counts >= 14)[None, :], atr_ewm.values, atr_short.values))
+
+    # RSI（14本単純平均、初日の値幅は 0 扱い）
+    delta = C.diff()
+    gain = delta.where(delta > 0, 0.0).mask(pad).rolling(window=14, min_periods=1).mean()
+    loss = (-delta.where(delta < 0, 0.0)).mask(pad).rolling(window=14, min_periods=1).mean()
+    out["RSI"] = 100 - (100 / (1 + gain / loss.replace(0, 1e-10)))
+
+    # MACD(12, 26, 9)
+    macd = C.ewm(span=12, adjust=False).mean() - C.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    hist = macd - signal
+    out["MACD"], out["MACD_Signal"], out["MACD_Hist"] = macd, signal, hist
+
+    # ボリンジャーバンド -3σ（20本）
+    out["BB_L3"] = C.rolling(20).mean() - 3 * C.rolling(20).std()
+
+    arrays = {k: v.values.T.astype('float32') for k, v in out.items()}
+    for k in arrays:
+        arrays[k][pad.values.T] = np.nan
+
+    # GC 経過本数（MACD_Hist > 0 の連続本数）
+    pos = arrays["MACD_Hist"] > 0
+    run = np.zeros(pos.shape, dtype='float32')
+    for j in range(pos.shape[1]):
+        prev = run[:, j - 1] if j else 0
+        run[:, j] = np.where(pos[:, j], prev + 1, 0)
+    run[pad.values.T] = np.nan
+    arrays["gc_days"] = run
+    return arrays
+
+
+class FeatureTable:
+    """
+    銘柄ごとの有効足に対応した指標の表。latest() で全銘柄の最新値、code_frame() で1銘柄の時系列。
+    """
+
+    def __init__(self, codes, dates, values, fields=None):
+        self.codes = np.asarray(codes).astype('U')
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.values = values
+        self.fields = list(fields or FEATURES)
+        self.code_index = {c: i for i, c in enumerate(self.codes)}
+        self.field_index = {f: k for k, f in enumerate(self.fields)}
+
+    @classmethod
+    def empty(cls):
+        return cls(np.array([], dtype='U5'), np.empty((0, 0), dtype='datetime64[ns]'),
+                   np.empty((0, 0, len(FEATURES)), dtype='float32'))
+
+    @classmethod
+    def from_panel(cls, panel, keep=KEEP_DAYS):
+        """価格パネル（全履歴）から全銘柄の指標を一括計算し、直近 keep 本を残す"""
+        if len(panel) == 0:
+            return cls.empty()
+        n = len(panel.dates)
+        vals, dates, counts = panel.tail_valid(n, fields=("AdjC",))
+        f = panel.field_index
+        arrays = compute_features(*(vals[:, :, f[k]] for k in ("AdjO", "AdjH", "AdjL", "AdjC")), counts)
+        values = np.stack([arrays[k] for k in FEATURES], axis=2)
+        return cls(panel.codes, dates[:, -keep:], values[:, -keep:], FEATURES)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _col(self, name):
+        return self.field_index[ALIASES.get(name, name)]
+
+    def row(self, code):
+        return self.code_index.get(price_store.to_api_code(code))
+
+    def latest(self, name):
+        """全銘柄の最新足の値（self.codes の並び）"""
+        return self.values[:, -1, self._col(name)]
+
+    def last_dates(self):
+        return self.dates[:, -1]
+
+    def as_of(self):
+        """表の最新の営業日（YYYYMMDD）。空なら ''"""
+        last = self.last_dates()
+        last = last[~np.isnat(last)]
+        return pd.Timestamp(last.max()).strftime('%Y%m%d') if len(last) else ""
+
+    # ---------- 差分更新 ----------
+    def _ensure_rows(self, codes):
+        """codes の行番号（表に無い銘柄は空の行を足し、コード順に並べ直す）"""
+        missing = sorted({c for c in codes if c not in self.code_index})
+        if missing:
+            width = self.dates.shape[1]
+            codes_all = np.concatenate([self.codes, np.asarray(missing).astype('U')])
+            dates = np.concatenate([self.dates, np.full((len(missing), width), np.datetime64('NaT'), dtype='datetime64[ns]')])
+            values = np.concatenate([self.values, np.full((len(missing), width, len(self.fields)), np.nan, dtype='float32')])
+            order = np.argsort(codes_all, kind='stable')
+            self.codes, self.dates, self.values = codes_all[order], dates[order], values[order]
+            self.code_index = {c: i for i, c in enumerate(self.codes)}
+        return np.array([self.code_index[c] for c in codes], dtype='int64')
+
+    def _widen(self, width):
+        """本数（列）が width に満たなければ左側を空で埋めて広げる"""
+        extra = width - self.dates.shape[1]
+        if extra > 0:
+            self.dates = np.concatenate([np.full((len(self), extra), np.datetime64('NaT'), dtype='datetime64[ns]'), self.dates], axis=1)
+            self.values = np.concatenate([np.full((len(self), extra, len(self.fields)), np.nan, dtype='float32'), self.values], axis=1)
+
+    def append_day(self, state, dt_str, rows, keep=KEEP_DAYS):
+        """
+        指標状態を dt_str まで進めた直後に呼ぶ。その日に足のあった銘柄（状態の行番号 rows）の最新値を
+        各銘柄の末尾へ1本足す（古い1本は押し出す）。本数がちょうど 14 本になった銘柄のコードを返す
+        （ATR が単純平均から Wilder 平滑へ切り替わり、過去の足の値も変わるため全履歴から作り直す対象）。
+        """
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return []
+        codes = [state.codes[i] for i in rows]
+        cur = state.latest(rows)
+        closes = state.arrays["closes"][rows].astype('float64')
+        n = state.arrays["n"][rows]
+        with np.errstate(invalid='ignore'):
+            cur["MA18"] = np.where(n >= 18, closes[:, -18:].mean(axis=1), np.nan)
+            cur["MA50"] = np.where(n >= 50, closes[:, -50:].mean(axis=1), np.nan)
+            last20 = closes[:, -20:]
+            cur["BB_L3"] = np.where(n >= 20, last20.mean(axis=1) - 3 * last20.std(axis=1, ddof=1), np.nan)
+
+        t = self._ensure_rows(codes)
+        self._widen(min(keep, self.dates.shape[1] + 1))
+        gc = self.field_index["gc_days"]
+        prev_gc = np.nan_to_num(self.values[t, -1, gc])
+        self.values[t, :-1] = self.values[t, 1:]
+        self.dates[t, :-1] = self.dates[t, 1:]
+        self.dates[t, -1] = np.datetime64(pd.Timestamp(dt_str), 'ns')
+        for f, k in self.field_index.items():
+            if f != "gc_days":
+                self.values[t, -1, k] = cur[f]
+        self.values[t, -1, gc] = np.where(cur["MACD_Hist"] > 0, prev_gc + 1, 0)
+        return [c for c, cnt in zip(codes, n) if cnt == 14]
+
+    def replace_rows(self, other):
+        """other（一部の銘柄だけで作った表）の銘柄の行を丸ごと差し替える"""
+        if len(other) == 0:
+            return
+        t = self._ensure_rows(list(other.codes))
+        self._widen(other.dates.shape[1])
+        width = self.dates.shape[1]
+        o_dates, o_values = other.dates[:, -width:], other.values[:, -width:]
+        pad = width - o_dates.shape[1]
+        self.dates[t] = np.datetime64('NaT')
+        self.values[t] = np.nan
+        self.dates[t, pad:] = o_dates
+        self.values[t, pad:] = o_values[:, :, [other.field_index[f] for f in self.fields]]
+
+    def latest_for(self, codes, name, as_of=None):
+        """
+        codes（パネル等の並び）の最新値を引く。表に無い銘柄、または最新足の日付が as_of と
+        食い違う銘柄（表の焼き付け後に新しい日が届いた等）は NaN。
+        """
+        out = np.full(len(codes), np.nan, dtype='float32')
+        col = self._col(name)
+        for i, code in enumerate(codes):
+            r = self.row(code)
+            if r is None:
+                continue
+            if as_of is not None and self.dates[r, -1] != np.datetime64(as_of[i], 'ns'):
+                continue
+            out[i] = self.values[r, -1, col]
+        return out
+
+    def code_frame(self, code):
+        """1銘柄分（Date + 各指標 + 別名）の DataFrame。無ければ None"""
+        r = self.row(code)
+        if r is None:
+            return None
+        keep = ~np.isnat(self.dates[r])
+        df = pd.DataFrame(self.values[r][keep], columns=self.fields)
+        for alias, src in ALIASES.items():
+            df[alias] = df[src]
+        df.insert(0, 'Date', self.dates[r][keep])
+        return df
+
+    def attach(self, df, code, date_col='Date'):
+        """1銘柄の価格DataFrameに指標列を日付で突き合わせて足す（既にある列は上書きしない）"""
+        feats = self.code_frame(code)
+        if feats is None or df is None or df.empty:
+            return df
+        feats = feats[['Date'] + [c for c in feats.columns if c != 'Date' and c not in df.columns]]
+        left = df.copy()
+        key = pd.to_datetime(left[date_col]).values.astype('datetime64[ns]')
+        merged = pd.DataFrame({'_key': key}).merge(feats.rename(columns={'Date': '_key'}), on='_key', how='left')
+        for c in merged.columns:
+            if c != '_key':
+                left[c] = merged[c].values
+        return left
+
+    def save(self, root=None):
+        root = root or price_store.STORE_DIR
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, FEATURES_FILE)
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, codes=self.codes, dates=self.dates, values=self.values, fields=np.array(self.fields))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, root=None):
+        """保存済みの表を読む。無い・壊れている場合は None"""
+        path = os.path.join(root or price_store.STORE_DIR, FEATURES_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                return cls(z["codes"], z["dates"], z["values"], [str(f) for f in z["fields"]])
+        except Exception:
+            return None
+
+
+def build_from_store(root=None, keep=KEEP_DAYS, codes=None):
+    """日足ストアの全履歴から表を作る（codes を渡すとその銘柄だけ）"""
+    panel = PricePanel.from_store(codes=codes, root=root)
+    return FeatureTable.from_panel(panel, keep)
+
+
+def sync(table=None, state=None, root=None, dirty_codes=(), keep=KEEP_DAYS):
+    """
+    表と指標状態（indicator_state）をストアの最新日まで進める。(表, 状態, 進めた日数, 全再構築したか) を返す。
+    ・表が無い / 表と状態の取り込み日が食い違う / 状態が全再構築になった → 表も全履歴から作り直す
+    ・それ以外は新着日ごとに状態を1本進め、その日の値を表の末尾へ足す
+    ・dirty_codes（分割・併合）と、本数が 14 本に達した銘柄だけは全履歴から作り直して差し替える
+    """
+    table = FeatureTable.load(root) if table is None else table
+    state = indicator_state.IndicatorState.load(root) if state is None else state
+    if table is None or len(table) == 0 or not state.as_of or table.as_of() != state.as_of:
+        state, advanced, _ = indicator_state.sync(state, root, dirty_codes)
+        return build_from_store(root, keep), state, advanced, True
+
+    redo = set(map(price_store.to_api_code, dirty_codes))
+    state, advanced, rebuilt = indicator_state.sync(
+        state, root, dirty_codes, on_day=lambda d, rows: redo.update(table.append_day(state, d, rows, keep)))
+    if rebuilt:
+        return build_from_store(root, keep), state, advanced, True
+    if redo:
+        table.replace_rows(build_from_store(root, keep, codes=sorted(redo)))
+    return table, state, advanced, False
+
+
+def check_parity(table, panel, rows=None, rtol=1e-5):
+    """
+    表の値と calc_vector_indicators / get_fast_indicators（1銘柄ずつ・全履歴）を突き合わせる。
+    許容誤差を超えた (コード, 指標, 表の値, 個別の値) のリストを返す。
+    """
+    from scan_core import calc_vector_indicators, get_fast_indicators
+
+    rows = range(len(panel)) if rows is None else rows
+    mismatches = []
+    for r in rows:
+        code = panel.codes[r]
+        df = panel.code_frame(int(r))
+        feats = table.code_frame(code)
+        if df.empty or feats is None:
+            continue
+        full = calc_vector_indicators(df.copy())
+        full['MA18'] = full['AdjC'].rolling(18).mean()
+        full['MA50'] = full['AdjC'].rolling(50).mean()
+        full['BB_L3'] = full['AdjC'].rolling(20).mean() - 3 * full['AdjC'].rolling(20).std()
+        full = full.tail(len(feats)).reset_index(drop=True)
+        for col in ["SMA25", "SMA75", "MA18", "MA50", "ATR", "RSI", "BB_L3"]:
+            a, b = feats[col].values.astype('float64'), full[col].values.astype('float64')
+            bad = ~np.isclose(a, b, rtol=rtol, atol=1e-4, equal_nan=True)
+            if bad.any():
+                k = int(np.argmax(bad))
+                mismatches.append((code, col, float(a[k]), float(b[k])))
+        _, h1, h2, _ = get_fast_indicators(df['AdjC'].values)
+        if len(df) >= 15:
+            for col, ref, got in (("MACD_Hist", h1, feats["MACD_Hist"].iloc[-1]), ("MACD_Hist_Prev", h2, feats["MACD_Hist"].iloc[-2])):
+                if not np.isclose(float(got), float(ref), rtol=rtol, atol=1e-4):
+                    mismatches.append((code, col, float(got), float(ref)))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+
+    t0 = time.time()
+    table, state, advanced, rebuilt = sync()
+    state.save()
+    table.save()
+    mode = "全再構築" if rebuilt else f"差分更新 {advanced} 営業日"
+    print(f"特徴量テーブル（{mode}）: {len(table)} 銘柄 × {table.dates.shape[1]} 本 × {len(table.fields)} 指標 {time.time() - t0:.2f}秒")
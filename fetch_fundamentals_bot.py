@@ -1,149 +1,303 @@
-import time
-import requests
-import pandas as pd
-import pickle
-import os
-from datetime import datetime
-
-# ==========================================
-# ⚙️ J-Quants V2 API 設定（全方位・自動適応版）
-# ==========================================
-JQUANTS_API_KEY = os.getenv("JQUANTS_API_KEY", "").strip()
-BASE_URL = "https://api.jquants.com/v2"
-
-print(f"[{datetime.now()}] 🌙 兵站部隊（ファンダメンタルズ収集・V2自動適応版）出撃...")
-
-if not JQUANTS_API_KEY:
-    print("❌ エラー: JQUANTS_API_KEY が設定されていません。GitHub Secretsを確認してください。")
-    exit(1)
-
-headers = {'x-api-key': JQUANTS_API_KEY}
-session = requests.Session()
-session.headers.update(headers)
-
-# 1. 全銘柄コードの取得
-try:
-    print("📡 J-Quants V2 サーバーへ接続中（銘柄マスター取得）...")
-    r_info = session.get(f"{BASE_URL}/equities/master", timeout=10.0)
-    r_info.raise_for_status()
-    
-    res_json = r_info.json()
-    info_data = res_json.get("equities") or res_json.get("data") or res_json.get("info") or []
-    
-    all_codes = []
-    for d in info_data:
-        code = str(d.get("Code") or d.get("code") or "")
-        if code:
-            all_codes.append(code)
-            
-    print(f"✅ 接続成功！ 上場銘柄 {len(all_codes)} 件のリストを取得")
-except Exception as e:
-    print(f"❌ 接続・銘柄リスト取得失敗: {e}")
-    if 'r_info' in locals() and hasattr(r_info, 'text'):
-        print(f"📝 サーバー応答: {r_info.text}")
-    exit(1)
-
-# 2. 1.1秒の絶対防弾行進で全件取得（全方位キー自動適応型）
-fundamentals_db = {}
-total = len(all_codes)
-start_time = time.time()
-success_count = 0
-
-print(f"🚀 全 {total} 銘柄のファンダメンタルズ強襲索敵を開始します...")
-
-for i, code in enumerate(all_codes):
-    api_code = code if len(code) >= 5 else code + "0"
-    url = f"{BASE_URL}/fins/summary?code={api_code}"
-    
-    time.sleep(1.1) # 🛡️ 1.1秒の絶対待機
-    
-    try:
-        r = session.get(url, timeout=10.0)
-        if r.status_code == 200:
-            res_data = r.json()
-            # 💡 レスポンスのキー名（summary, statements, data, fins 等）のどれであっても自動キャッチ
-            data = (
-                res_data.get("summary") or 
-                res_data.get("statements") or 
-                res_data.get("data") or 
-                res_data.get("fins") or []
-            )
-            
-            if data:
-                success_count += 1
-                df = pd.DataFrame(data[-8:])
-                for col in df.columns:
-                    if col not in ['Date', 'DisclosedDate', 'LocalCode']:
-                        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-                fundamentals_db[api_code] = df
-                
-        elif r.status_code == 429:
-            print(f"⚠️ [429検知] サーバー負荷警報。10秒間、息を潜めます...", flush=True)
-            time.sleep(10.0)
-            
-        elapsed = time.time() - start_time
-        percent = ((i + 1) / total) * 100
-        
-        # 100銘柄ごと、または最初の数銘柄で状況を可視化
-        if (i + 1) <= 5 or (i + 1) % 100 == 0:
-            print(f"📡 [{i + 1}/{total}] ({percent:.1f}%) 銘柄: {api_code} 確保完了 (有効データ: {success_count}件, 経過: {elapsed:.1f}秒)", flush=True)
-            
-    except Exception as e:
-        continue
-
-# 3. ローカルDBとして保存
-db_path = os.path.join(os.path.dirname(__file__), "fundamentals_db.pkl")
-with open(db_path, "wb") as f:
-    pickle.dump(fundamentals_db, f)
-
-print(f"[{datetime.now()}] ✅ 全ミッション完了！ 総合計 {len(fundamentals_db)} 件の決算データを焼き付けました。")
-
-# ==========================================
-# 📈 4. 株価データ（過去約400日分）の一括収集
-# ==========================================
-from datetime import timedelta
-
-print("\n--- 📈 株価データ（日足）一括収集開始 ---")
-prices_db = {}
-base_date_jst = datetime.utcnow() + timedelta(hours=9)
-days_to_fetch = 400
-fetched_days = 0
-
-for i in range(days_to_fetch):
-    target_date = base_date_jst - timedelta(days=i)
-    # 土日は市場休場のためスキップ
-    if target_date.weekday() >= 5:
-        continue
-        
-    dt_str = target_date.strftime('%Y%m%d')
-    # 🎯 指定した1日分の全銘柄データを一括で返すAPIを使用[cite: 7]
-    url = f"{BASE_URL}/equities/bars/daily?date={dt_str}"
-    
-    time.sleep(1.1) # 🛡️ 1.1秒の絶対待機
-    
-    try:
-        r = session.get(url, timeout=10.0)
-        if r.status_code == 200:
-            res_json = r.json()
-            data = (
-                res_json.get("daily_quotes") or 
-                res_json.get("data") or 
-                res_json.get("results") or []
-            )
-            if data:
-                prices_db[dt_str] = data
-                fetched_days += 1
-                
-                if fetched_days % 20 == 0:
-                    print(f"📡 株価進捗: {fetched_days} 営業日分を取得完了...", flush=True)
-        elif r.status_code == 429:
-            print(f"⚠️ [429検知] 株価取得中にサーバー負荷警報。10秒間待機...", flush=True)
-            time.sleep(10.0)
-    except Exception as e:
-        continue
-
-prices_db_path = os.path.join(os.path.dirname(__file__), "prices_db.pkl")
-with open(prices_db_path, "wb") as f:
-    pickle.dump(prices_db, f)
-
-print(f"[{datetime.now()}] ✅ 株価データ全ミッション完了！ {fetched_days}営業日分の株価データを焼き付けました。")
+import time
+import requests
+import pandas as pd
+import os
+import json
+from datetime import datetime, timedelta
+
+import argparse
+import price_store
+import fundamentals_store
+import feature_store
+from rate_limiter import jquants_get
+import async_fetcher
+
+# ==========================================
+# ⚙️ 起動オプション
+# ==========================================
+parser = argparse.ArgumentParser(description="J-Quants 兵站Bot（ファンダメンタルズ・日足の夜間収集）")
+parser.add_argument("--full-rebuild", action="store_true",
+                    help="差分取得を行わず、決算は全銘柄を個別取得、日足は過去約400日分を全日取り直す")
+parser.add_argument("--concurrency", type=int, default=int(os.getenv("JQUANTS_CONCURRENCY", async_fetcher.DEFAULT_CONCURRENCY)),
+                    help="同時に発射するリクエスト数（発射間隔そのものはレートリミッターが管理）")
+args = parser.parse_args()
+
+# ==========================================
+# ⚙️ J-Quants V2 API 設定（全方位・自動適応版）
+# ==========================================
+JQUANTS_API_KEY = os.getenv("JQUANTS_API_KEY", "").strip()
+# 🧪 JQUANTS_BASE_URL でローカルの代役サーバー（jquants_stub_server.py）へ向け替えられる
+BASE_URL = os.getenv("JQUANTS_BASE_URL", "https://api.jquants.com/v2").rstrip("/")
+
+print(f"[{datetime.now()}] 🌙 兵站部隊（ファンダメンタルズ収集・V2自動適応版）出撃...")
+
+if not JQUANTS_API_KEY:
+    print("❌ エラー: JQUANTS_API_KEY が設定されていません。GitHub Secretsを確認してください。")
+    exit(1)
+
+headers = {'x-api-key': JQUANTS_API_KEY}
+session = async_fetcher.make_session(headers, args.concurrency)
+
+# 1. 全銘柄コードの取得
+try:
+    print("📡 J-Quants V2 サーバーへ接続中（銘柄マスター取得）...")
+    r_info = jquants_get(session, f"{BASE_URL}/equities/master", timeout=10.0)
+    r_info.raise_for_status()
+    
+    res_json = r_info.json()
+    info_data = res_json.get("equities") or res_json.get("data") or res_json.get("info") or []
+    
+    all_codes = []
+    for d in info_data:
+        code = str(d.get("Code") or d.get("code") or "")
+        if code:
+            all_codes.append(code)
+            
+    print(f"✅ 接続成功！ 上場銘柄 {len(all_codes)} 件のリストを取得")
+except Exception as e:
+    print(f"❌ 接続・銘柄リスト取得失敗: {e}")
+    if 'r_info' in locals() and hasattr(r_info, 'text'):
+        print(f"📝 サーバー応答: {r_info.text}")
+    exit(1)
+
+# ==========================================
+# 🧰 共通ヘルパー（ページング吸収・履歴マージ）
+# ==========================================
+HISTORY_LEN = 8
+
+def extract_fins(res_data):
+    # 💡 レスポンスのキー名（summary, statements, data, fins 等）のどれであっても自動キャッチ
+    return (
+        res_data.get("summary") or 
+        res_data.get("statements") or 
+        res_data.get("data") or 
+        res_data.get("fins") or []
+    )
+
+def extract_bars(res_json):
+    return (
+        res_json.get("daily_quotes") or
+        res_json.get("data") or
+        res_json.get("results") or []
+    )
+
+def to_history_df(rows, code):
+    # 📚 列名の揺れ・文字列数値はここで一度だけ正規化（開示日昇順）
+    return fundamentals_store.normalize_history(rows, code)
+
+def is_corrupt(df):
+    """欠損・破損した履歴（型崩れ、空、開示日が読めない）を検知する"""
+    if not isinstance(df, pd.DataFrame) or df.empty or 'DiscDate' not in df.columns:
+        return True
+    # 旧Botは開示日まで数値化して 0 埋めしていたため、正規化時に欠損化された日付しか無ければ破損
+    return not df['DiscDate'].notna().any()
+
+def merge_history(old_df, rows, code):
+    """既存の銘柄別履歴に新着開示をマージし、直近 HISTORY_LEN 件に整える"""
+    new_df = to_history_df(rows, code)
+    merged = new_df if is_corrupt(old_df) else pd.concat([old_df, new_df], ignore_index=True)
+    merged = merged.drop_duplicates(subset=['DiscDate', 'DiscTime', 'DocType', 'CurPerType', 'CurPerEn'], keep='last')
+    merged = merged.sort_values('DiscDate', kind='stable')
+    return merged.tail(HISTORY_LEN).reset_index(drop=True)
+
+def record_code(rec):
+    code = str(rec.get("Code") or rec.get("LocalCode") or rec.get("code") or "")
+    return code if len(code) >= 5 or not code else code + "0"
+
+# ==========================================
+# 📥 2. 既存DBの読込 ＆ 差分同期の起点決定
+# ==========================================
+state_path = os.path.join(os.path.dirname(__file__), "fundamentals_state.json")
+
+# 📚 正規化済みカラムナ・ストア（旧 fundamentals_db.pkl しか無ければ初回のみ移植）
+fundamentals_db = {}
+if not args.full_rebuild:
+    try:
+        fundamentals_db = fundamentals_store.load_table().to_dict()
+    except Exception as e:
+        print(f"⚠️ 既存DBの読込に失敗（全件取り直しへ移行）: {e}")
+        fundamentals_db = {}
+
+sync_state = {}
+if not args.full_rebuild and os.path.exists(state_path):
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            sync_state = json.load(f)
+    except Exception:
+        sync_state = {}
+
+today_jst = (datetime.utcnow() + timedelta(hours=9)).date()
+# 決算データが存在しない銘柄（ETF・REIT等）の空振り記録: {コード: 確認日}
+EMPTY_RECHECK_DAYS = 30
+empty_codes = {
+    c: d for c, d in sync_state.get("empty_codes", {}).items()
+    if (today_jst - datetime.strptime(d, "%Y%m%d").date()).days < EMPTY_RECHECK_DAYS
+}
+if sync_state.get("last_sync"):
+    # 前回同期日も含めて取り直す（前回実行後に出た当日開示を拾うため）
+    since = datetime.strptime(sync_state["last_sync"], "%Y%m%d").date()
+else:
+    since = today_jst - timedelta(days=7)
+
+# ==========================================
+# 📡 3. 開示日ベースの一括取得（新着分だけを既存履歴へマージ）
+# ==========================================
+start_time = time.time()
+updated_codes = set()
+failed_dates = set()  # 取得・マージに失敗した開示日（次回ここから取り直す）
+
+if fundamentals_db:
+    n_days = (today_jst - since).days + 1
+    print(f"🚀 開示日ベース差分同期: {since.strftime('%Y-%m-%d')} 〜 {today_jst.strftime('%Y-%m-%d')} ({n_days}日分)")
+
+    def on_disclosures(dt_str, status, rows):
+        if status != 200:
+            failed_dates.add(dt_str)
+            print(f"⚠️ {dt_str} の開示取得に失敗 (HTTP {status}) ➔ 次回取り直します")
+            return
+        by_code = {}
+        for rec in rows:
+            code = record_code(rec)
+            if code:
+                by_code.setdefault(code, []).append(rec)
+        try:
+            for code, recs in by_code.items():
+                fundamentals_db[code] = merge_history(fundamentals_db.get(code), recs, code)
+                updated_codes.add(code)
+        except Exception as e:
+            failed_dates.add(dt_str)
+            print(f"⚠️ {dt_str} の開示マージに失敗: {e} ➔ 次回取り直します")
+            return
+        print(f"📡 {dt_str}: 開示 {len(rows)} 件 / {len(by_code)} 銘柄をマージ", flush=True)
+
+    date_jobs = []
+    for i in range(n_days):
+        dt_str = (since + timedelta(days=i)).strftime('%Y%m%d')
+        date_jobs.append((dt_str, f"{BASE_URL}/fins/summary?date={dt_str}"))
+    async_fetcher.fetch_all(session, date_jobs, on_disclosures, extract=extract_fins, concurrency=args.concurrency)
+else:
+    print("🗄️ 既存DBなし（またはフルリビルド指定）: 全銘柄を個別取得します。")
+
+# ==========================================
+# 🛡️ 4. 欠損・破損銘柄のみ個別取得でフォールバック
+# ==========================================
+fallback_codes = []
+for code in all_codes:
+    api_code = code if len(code) >= 5 else code + "0"
+    if api_code in updated_codes or api_code in empty_codes:
+        continue
+    if is_corrupt(fundamentals_db.get(api_code)):
+        fallback_codes.append(api_code)
+
+total = len(fallback_codes)
+success_count = 0
+done_count = 0
+print(f"🚀 欠損・破損 {total} 銘柄のファンダメンタルズ強襲索敵を開始します...（同時実行 {args.concurrency}）")
+
+def on_code_history(api_code, status, data):
+    global success_count, done_count
+    done_count += 1
+    if status == 200 and data:
+        success_count += 1
+        fundamentals_db[api_code] = to_history_df(data, api_code).tail(HISTORY_LEN).reset_index(drop=True)
+    elif status == 200:
+        empty_codes[api_code] = today_jst.strftime('%Y%m%d')
+    elif status == 429:
+        print(f"⚠️ [429検知] 冷却後も制限解除されず: {api_code} は次回に持ち越します。", flush=True)
+
+    # 100銘柄ごと、または最初の数銘柄で状況を可視化
+    if done_count <= 5 or done_count % 100 == 0:
+        elapsed = time.time() - start_time
+        percent = (done_count / total) * 100
+        print(f"📡 [{done_count}/{total}] ({percent:.1f}%) 銘柄: {api_code} 確保完了 (有効データ: {success_count}件, 経過: {elapsed:.1f}秒)", flush=True)
+
+code_jobs = [(api_code, f"{BASE_URL}/fins/summary?code={api_code}") for api_code in fallback_codes]
+async_fetcher.fetch_all(session, code_jobs, on_code_history, extract=extract_fins, concurrency=args.concurrency)
+
+# 5. ローカルDBとして保存（全銘柄を1本の列指向テーブルへ）
+fund_frames = [df for df in fundamentals_db.values() if isinstance(df, pd.DataFrame) and not df.empty]
+fundamentals_store.FundamentalsTable.from_frame(
+    pd.concat(fund_frames, ignore_index=True) if fund_frames else None
+).save()
+# 取り損ねた開示日があれば、最も古い失敗日の前日までを同期済みとする（次回はその失敗日から取り直す）
+last_sync = today_jst
+if failed_dates:
+    last_sync = datetime.strptime(min(failed_dates), "%Y%m%d").date() - timedelta(days=1)
+    print(f"⚠️ 開示取得の失敗 {len(failed_dates)} 日分: 同期済みを {last_sync.strftime('%Y-%m-%d')} に留めます。")
+with open(state_path, "w", encoding="utf-8") as f:
+    json.dump({"last_sync": last_sync.strftime('%Y%m%d'), "empty_codes": empty_codes}, f)
+
+print(f"[{datetime.now()}] ✅ 全ミッション完了！ 総合計 {len(fundamentals_db)} 件の決算データを焼き付けました。（差分更新 {len(updated_codes)} 銘柄 / 個別取得 {success_count} 銘柄, {time.time() - start_time:.1f}秒）")
+
+# ==========================================
+# 📈 6. 株価データ（過去約400日分）の差分収集
+# ==========================================
+print("\n--- 📈 株価データ（日足）差分収集開始 ---")
+# 🗄️ 旧 prices_db.pkl が残っていれば、初回のみカラムナ・ストアへ移植
+legacy_prices_path = os.path.join(os.path.dirname(__file__), "prices_db.pkl")
+if not price_store.list_days() and os.path.exists(legacy_prices_path):
+    migrated = price_store.migrate_from_pickle(legacy_prices_path)
+    print(f"🗄️ 旧 prices_db.pkl から {migrated} 営業日分をストアへ移植しました。")
+
+base_date_jst = datetime.utcnow() + timedelta(hours=9)
+days_to_fetch = 400
+expected_days = price_store.expected_trading_days(base_date_jst, days_to_fetch)
+
+if args.full_rebuild:
+    target_days = expected_days
+    print(f"🔁 フルリビルド指定: {len(target_days)} 営業日分をすべて取り直します。")
+else:
+    # 🎯 ストアに無い日・確定前に取得した日だけを狙い撃ち
+    target_days = price_store.days_to_fetch(expected_days)
+    print(f"🎯 差分取得: 候補 {len(expected_days)} 日中、未取得・要更新 {len(target_days)} 日のみ取得します。")
+
+fetched_days = 0
+refetched = set()
+split_events = []  # [(日付, {コード: 調整係数})]
+
+def on_bars(dt_str, status, data):
+    global fetched_days
+    if status == 200 and data:
+        # 🗄️ 届いた1日分ずつ列指向ファイルへ即時焼き付け（巨大dictをメモリに溜めない）
+        price_store.write_day(dt_str, data)
+        refetched.add(dt_str)
+        factors = price_store.extract_adj_factors(data)
+        if factors:
+            split_events.append((dt_str, factors))
+        fetched_days += 1
+
+        if fetched_days % 20 == 0:
+            print(f"📡 株価進捗: {fetched_days} 営業日分を取得完了...", flush=True)
+    elif status == 200:
+        # 休場日などの空振りを記録（確定後の空振りは次回以降スキップ）
+        price_store.mark_empty(dt_str)
+    elif status == 429:
+        print(f"⚠️ [429検知] 冷却後も制限解除されず: {dt_str} は次回に持ち越します。", flush=True)
+
+# 🎯 指定した1日分の全銘柄データを一括で返すAPIを使用（新しい日から順に並行取得）
+bar_jobs = [(dt_str, f"{BASE_URL}/equities/bars/daily?date={dt_str}") for dt_str in sorted(target_days, reverse=True)]
+async_fetcher.fetch_all(session, bar_jobs, on_bars, extract=extract_bars, concurrency=args.concurrency)
+
+# 遡及調整は古い分割から順に適用する（並行取得で到着順が入れ替わるため）
+split_events.sort(key=lambda x: x[0])
+
+# ✂️ 分割・併合が発生した銘柄は、今回取り直していない過去日を遡及調整
+for dt_str, factors in split_events:
+    touched = price_store.apply_adjustment(factors, dt_str, skip_days=refetched)
+    print(f"✂️ {dt_str}: 分割・併合 {len(factors)} 銘柄を検知 ➔ 過去 {touched} 日分を遡及調整しました。")
+
+print(f"[{datetime.now()}] ✅ 株価データ全ミッション完了！ {fetched_days}営業日分の株価データを焼き付けました。（ストア保有: {len(price_store.list_days())}営業日）")
+
+# ==========================================
+# 🔁 7. 指標の途中状態と特徴量テーブル（全銘柄 × 直近260本の指標）を新着日ぶんだけ前進
+# ==========================================
+# 状態を1日進めるごとにその日の指標を表の末尾へ足す（全履歴の再計算は表・状態が無いときだけ）。
+# 分割・併合で過去日が書き換わった銘柄だけは全履歴から作り直す
+split_codes = {c for _, factors in split_events for c in factors}
+feat_start = time.time()
+feature_table, ind_state, ind_days, ind_rebuilt = feature_store.sync(dirty_codes=split_codes)
+ind_state.save()
+feature_table.save()
+ind_mode = "全再構築" if ind_rebuilt else f"差分更新（分割再計算 {len(split_codes)} 銘柄）"
+print(f"[{datetime.now()}] 🧪 指標状態・特徴量テーブルを{ind_mode}: {ind_days} 営業日を取り込み（as_of {ind_state.as_of}, "
+      f"{len(feature_table)} 銘柄 × {feature_table.dates.shape[1]} 本 × {len(feature_table.fields)} 指標, {time.time() - feat_start:.1f}秒）")
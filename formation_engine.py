@@ -0,0 +1,115 @@
+import numpy as np
+
+from scan_core import analyze_formation_history
+
+# ==========================================
+# ⚡ チャート陣形の一括探知（全銘柄 × 直近65本をベクトル演算）
+# ==========================================
+# analyze_formation_history（1銘柄ずつ・1行ずつ）と同じ4規則を、価格パネルの
+# 右詰め配列に対してまとめて評価する。
+# ・買い①: 2日前終値 < 3日前安値、前日終値 > 2日前高値、当日終値 > 前日終値
+# ・買い②: 2日前安値 ≤ MA18、前日・当日の安値 > MA18（18日線の上抜け初動）
+# ・売り①②: 上記の鏡写し
+# MA18 は直近65本の窓の中だけで計算する（先頭17本は NaN ＝ 不成立）。
+
+WINDOW = 65
+MA_SPAN = 18
+
+
+def _rolling_mean(x, span):
+    """行ごとの単純移動平均（先頭 span-1 本は NaN）"""
+    out = np.full(x.shape, np.nan)
+    if x.shape[1] < span:
+        return out
+    cs = np.cumsum(np.concatenate([np.zeros((x.shape[0], 1)), x], axis=1), axis=1)
+    out[:, span - 1:] = (cs[:, span:] - cs[:, :-span]) / span
+    return out
+
+
+def formation_signals(panel, window=WINDOW):
+    """
+    パネル全銘柄の陣形フラグを返す。
+    {'buy': (銘柄, window) bool, 'sell': 同, 'dates': (銘柄, window) datetime64, 'ready': (銘柄,) bool}
+    ready は「有効な終値が window 本以上ある」銘柄（足りない銘柄のフラグはすべて False）。
+    """
+    vals, dates, counts = panel.tail_valid(window, fields=("AdjC",))
+    f = panel.field_index
+    h = vals[:, :, f["AdjH"]].astype('float64')
+    l = vals[:, :, f["AdjL"]].astype('float64')
+    c = vals[:, :, f["AdjC"]].astype('float64')
+    ma = _rolling_mean(c, MA_SPAN)
+    ready = counts >= window
+
+    buy = np.zeros(c.shape, dtype=bool)
+    sell = np.zeros(c.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        m3 = slice(0, -3); m2 = slice(1, -2); m1 = slice(2, -1); q0 = slice(3, None)
+        buy1 = (c[:, m2] < l[:, m3]) & (c[:, m1] > h[:, m2]) & (c[:, q0] > c[:, m1])
+        buy2 = (l[:, m2] <= ma[:, m2]) & (l[:, m1] > ma[:, m1]) & (l[:, q0] > ma[:, q0])
+        sell1 = (c[:, m2] > h[:, m3]) & (c[:, m1] < l[:, m2]) & (c[:, q0] < c[:, m1])
+        sell2 = (h[:, m2] >= ma[:, m2]) & (h[:, m1] < ma[:, m1]) & (h[:, q0] < ma[:, q0])
+    buy[:, 3:] = (buy1 | buy2) & ready[:, None]
+    sell[:, 3:] = (sell1 | sell2) & ready[:, None]
+    return {"buy": buy, "sell": sell, "dates": dates, "ready": ready}
+
+
+def days_since_last(flags):
+    """各銘柄の最後のシグナルが何本前か（0 = 最新足）。シグナルなしは -1"""
+    n = flags.shape[1]
+    last = n - 1 - np.argmax(flags[:, ::-1], axis=1)
+    return np.where(flags.any(axis=1), (n - 1) - last, -1)
+
+
+def scan_formations(panel, window=WINDOW):
+    """
+    全銘柄の陣形サマリー。
+    {'codes', 'buy_days_ago', 'sell_days_ago', 'signals'} を返す（days_ago はシグナルなしで -1）。
+    """
+    sig = formation_signals(panel, window)
+    return {
+        "codes": panel.codes,
+        "buy_days_ago": days_since_last(sig["buy"]),
+        "sell_days_ago": days_since_last(sig["sell"]),
+        "signals": sig,
+    }
+
+
+def signal_dates(sig, row, side="buy"):
+    """1銘柄分のシグナル発生日リスト（analyze_formation_history の戻り値と同じ形）"""
+    return list(sig["dates"][row][sig[side][row]])
+
+
+def check_parity(panel, rows=None, window=WINDOW):
+    """
+    一括探知と analyze_formation_history（1銘柄ずつ）を突き合わせる。
+    不一致の (コード, 側, 一括の日付, 個別の日付) のリストを返す（空なら完全一致）。
+    """
+    sig = formation_signals(panel, window)
+    rows = range(len(panel)) if rows is None else rows
+    mismatches = []
+    for r in rows:
+        df = panel.code_frame(int(r))
+        b_slow, s_slow = analyze_formation_history(df)
+        for side, slow in (("buy", b_slow), ("sell", s_slow)):
+            fast = set(np.datetime64(d, 'ns') for d in signal_dates(sig, r, side))
+            slow = set(np.datetime64(d, 'ns') for d in slow)
+            if fast != slow:
+                mismatches.append((panel.codes[r], side, sorted(fast), sorted(slow)))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+    from price_panel import PricePanel
+    import price_store
+
+    days = price_store.list_days()[-260:]
+    panel = PricePanel.from_store(days=days)
+    if len(panel) == 0:
+        raise SystemExit("日足ストアが空です（兵站Botを先に実行してください）")
+    t0 = time.time()
+    res = scan_formations(panel)
+    print(f"一括探知: {len(panel)} 銘柄 {(time.time() - t0) * 1000:.1f}ms "
+          f"(買いシグナルあり {(res['buy_days_ago'] >= 0).sum()} / 売りシグナルあり {(res['sell_days_ago'] >= 0).sum()} 銘柄)")
+    bad = check_parity(panel)
+    print("✅ 個別探知と完全一致" if not bad else f"❌ 不一致 {len(bad)} 件: {bad[:5]}")
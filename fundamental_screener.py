@@ -0,0 +1,133 @@
+import numpy as np
+
+from price_store import to_api_code
+from scan_core import analyze_fundamental_momentum
+from fundamentals_store import DERIVED_FIELDS
+
+# ==========================================
+# ⚡ ファンダメンタルズ・モメンタム一括判定（全銘柄ベクトル演算版）
+# ==========================================
+# analyze_fundamental_momentum（1銘柄ずつ）と同じ規則を、正規化テーブルの
+# 派生列（_Q / _QoQ）に対して全銘柄まとめて評価する。
+# ・直近3実績四半期の売上がすべてプラス
+# ・買い: 直近2期の利益がすべて非負、売上≥sales_req・営業益≥15・経常益≥ord_req・EPS≥15（%、2期連続）
+#         直近期の営業益・経常益・EPSがすべて20%以上なら S級
+# ・売り: 売上<5・営業益<10・経常益<5・EPS<10（%、2期連続）、直近2期がすべて赤字なら S級
+
+
+def has_derived(table):
+    return hasattr(table, "columns") and "Sales_QoQ" in getattr(table, "columns", {})
+
+
+def _last_actual_rows(table):
+    """銘柄ごとの直近3実績行（テーブル行番号）。実績が3行未満の銘柄は -1"""
+    n_codes = len(table.codes)
+    actual = ~np.isnan(table.columns["Sales_Q"])
+    code_of_row = np.repeat(np.arange(n_codes), np.diff(table.offsets))
+    act_idx = np.flatnonzero(actual)
+    counts = np.bincount(code_of_row[act_idx], minlength=n_codes)
+    ends = np.cumsum(counts) - 1
+    rows = np.full((n_codes, 3), -1, dtype='int64')
+    ok = counts >= 3
+    for k in range(3):
+        rows[ok, k] = act_idx[ends[ok] - k]
+    return rows
+
+
+def evaluate_momentum(table, mode="buy", sales_req=7.0, ord_req=15.0):
+    """
+    全銘柄の (合格, S級) を真偽配列で返す（table.codes と同じ並び）。
+    """
+    cols = table.columns
+    rows = _last_actual_rows(table)
+    ok = rows[:, 0] >= 0
+    r0, r1, r2 = (np.where(ok, rows[:, k], 0) for k in range(3))
+
+    def q(f, r, fb=None):
+        v = cols[f + "_Q"][r]
+        return np.where(v == 0.0, cols[fb + "_Q"][r], v) if fb else v
+
+    def gr(f, r):
+        return np.nan_to_num(cols[f + "_QoQ"][r], nan=0.0)
+
+    ok &= (q("Sales", r0) > 0) & (q("Sales", r1) > 0) & (q("Sales", r2) > 0)
+    op0, op1 = q("OP", r0), q("OP", r1)
+    od0, od1 = q("OdP", r0), q("OdP", r1)
+    ep0, ep1 = q("EPS", r0, "NP"), q("EPS", r1, "NP")
+    s_g0, s_g1 = gr("Sales", r0), gr("Sales", r1)
+    op_g0, op_g1 = gr("OP", r0), gr("OP", r1)
+    od_g0, od_g1 = gr("OdP", r0), gr("OdP", r1)
+    ep_g0, ep_g1 = gr("EPS", r0), gr("EPS", r1)
+
+    if mode == "buy":
+        ok &= ~((op0 < 0) | (od0 < 0) | (ep0 < 0) | (op1 < 0) | (od1 < 0) | (ep1 < 0))
+        ok &= (s_g0 >= sales_req) & (s_g1 >= sales_req)
+        ok &= (op_g0 >= 15.0) & (op_g1 >= 15.0)
+        ok &= (od_g0 >= ord_req) & (od_g1 >= ord_req)
+        ok &= (ep_g0 >= 15.0) & (ep_g1 >= 15.0)
+        s_rank = ok & (op_g0 >= 20.0) & (od_g0 >= 20.0) & (ep_g0 >= 20.0)
+    elif mode == "sell":
+        ok &= (s_g0 < 5.0) & (s_g1 < 5.0)
+        ok &= (op_g0 < 10.0) & (op_g1 < 10.0)
+        ok &= (od_g0 < 5.0) & (od_g1 < 5.0)
+        ok &= (ep_g0 < 10.0) & (ep_g1 < 10.0)
+        s_rank = ok & (op0 < 0) & (od0 < 0) & (ep0 < 0) & (op1 < 0) & (od1 < 0) & (ep1 < 0)
+    else:
+        ok = np.zeros(len(table.codes), dtype=bool)
+        s_rank = ok
+    return ok, s_rank
+
+
+def screen_momentum(table, codes, mode="buy", sales_req=7.0, ord_req=15.0):
+    """
+    codes（4桁/5桁、入力順を保持）を一括判定し、(S級コード, A級コード) を返す。
+    返すコードは入力された表記のまま。
+    """
+    ok, s_rank = evaluate_momentum(table, mode, sales_req, ord_req)
+    hit_s, hit_a = [], []
+    for code in codes:
+        i = table.code_index.get(to_api_code(code))
+        if i is None or not ok[i]:
+            continue
+        (hit_s if s_rank[i] else hit_a).append(str(code))
+    return hit_s, hit_a
+
+
+def check_parity(table, codes=None, params=((7.0, 15.0), (0.0, 0.0), (20.0, 30.0))):
+    """
+    一括判定と analyze_fundamental_momentum（1銘柄ずつ）の結果を突き合わせる。
+    個別側には派生列（_Q / _QoQ / _YoY / _TTM_YoY）を落とした正規化済みの履歴を渡し、
+    派生列を使わない従来のループ（累計値から四半期を切り出す経路）で判定させる。
+    不一致の (モード, sales_req, ord_req, コード, 一括, 個別) のリストを返す（空なら完全一致）。
+    """
+    codes = table.keys() if codes is None else list(codes)
+    mismatches = []
+    plain = {}
+    for code in codes:
+        df = table.get(code)
+        plain[code] = None if df is None else df.drop(columns=[c for c in DERIVED_FIELDS if c in df.columns])
+    for mode in ("buy", "sell"):
+        for sales_req, ord_req in params:
+            hit_s, hit_a = screen_momentum(table, codes, mode, sales_req, ord_req)
+            fast = {c: "S" for c in hit_s}
+            fast.update({c: "A" for c in hit_a})
+            for code in codes:
+                is_hit, rank = analyze_fundamental_momentum(plain[code], mode, sales_req, ord_req)
+                slow = ("S" if "S級" in rank else "A") if is_hit else None
+                if fast.get(str(code)) != slow:
+                    mismatches.append((mode, sales_req, ord_req, code, fast.get(str(code)), slow))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+    import fundamentals_store
+
+    table = fundamentals_store.load_table()
+    if not has_derived(table):
+        raise SystemExit("派生列つきの決算ストアが見つかりません（兵站Botを先に実行してください）")
+    t0 = time.time()
+    evaluate_momentum(table, "buy")
+    print(f"一括判定: {len(table)} 銘柄 {(time.time() - t0) * 1000:.1f}ms")
+    bad = check_parity(table)
+    print("✅ 個別判定と完全一致" if not bad else f"❌ 不一致 {len(bad)} 件: {bad[:10]}")
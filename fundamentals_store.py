@@ -0,0 +1,290 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from price_store import to_api_code
+
+# ==========================================
+# 📚 決算カラムナ・ストア（全銘柄を1本の縦持ち表 + 銘柄オフセット索引）
+# ==========================================
+# fundamentals_store.npz
+#   codes    … 5桁コード（昇順）
+#   offsets  … 銘柄 i の行は offsets[i]:offsets[i+1]（開示日の昇順）
+#   各列     … 正規化済みの列（日付は datetime64、数値は float64、欠損は NaN）
+#
+# 取込時に列名の揺れ（V1/V2・大文字小文字）と文字列数値（"1,234"）を一度だけ
+# 解決するため、画面側は find_c / to_flt を毎回回さずに済む。
+
+STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fundamentals_store.npz")
+LEGACY_PICKLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fundamentals_db.pkl")
+
+DATE_FIELDS = ["DiscDate", "CurPerEn"]
+TEXT_FIELDS = ["DiscTime", "DocType", "CurPerType"]
+VALUE_FIELDS = ["Sales", "OP", "OdP", "NP", "EPS"]
+COLUMNS = ["Code"] + DATE_FIELDS + TEXT_FIELDS + VALUE_FIELDS
+
+# 取込時に算出する派生列（<列>_Q: 単独四半期、_QoQ: 前四半期比%、_YoY: 前年同期比%、_TTM_YoY: 直近4四半期合計の前年比%）
+DERIVED_SUFFIXES = ["_Q", "_QoQ", "_YoY", "_TTM_YoY"]
+DERIVED_FIELDS = [f + sfx for sfx in DERIVED_SUFFIXES for f in VALUE_FIELDS]
+# 純利益とEPSは片方が 0（未開示）ならもう片方で代用して伸び率を出す
+GROWTH_FALLBACK = {"NP": "EPS", "EPS": "NP"}
+
+# 正規名 → 取込元の候補列（先頭ほど優先、大文字小文字は区別しない）
+ALIASES = {
+    "DiscDate": ["DiscDate", "DisclosedDate", "Date"],
+    "CurPerEn": ["CurPerEn", "CurrentPeriodEndDate"],
+    "DiscTime": ["DiscTime", "DisclosedTime"],
+    "DocType": ["DocType", "TypeOfDocument"],
+    "CurPerType": ["CurPerType", "TypeOfCurrentPeriod", "type"],
+    "Sales": ["Sales", "NetSales", "net_sales"],
+    "OP": ["OP", "OperatingProfit", "operating_profit"],
+    "OdP": ["OdP", "OrdinaryProfit", "ordinary_profit"],
+    "NP": ["NP", "Profit", "netincome"],
+    "EPS": ["EPS", "EarningsPerShare", "eps"],
+}
+
+
+def _find_col(df, names):
+    lower = {str(c).lower(): c for c in reversed(list(df.columns))}
+    for n in names:
+        if n.lower() in lower:
+            return lower[n.lower()]
+    return None
+
+
+def to_numeric_col(s):
+    """'1,234' や空文字を含む列を float64 へ（読めない値は NaN）"""
+    if pd.api.types.is_numeric_dtype(s):
+        return s.astype('float64')
+    return pd.to_numeric(s.astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce').astype('float64')
+
+
+def to_date_col(s):
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.astype('datetime64[ns]')
+    # 旧Botは日付まで数値化して 0 埋めしていたため、2000年より前は欠損扱い
+    d = pd.to_datetime(s.astype(str), errors='coerce')
+    return d.where(d > pd.Timestamp('2000-01-01'))
+
+
+def normalize_history(df, code=None):
+    """
+    API / 旧DBの決算DataFrame（列名まちまち）を正規列の表に揃え、開示日の昇順に並べる。
+    code を省略した場合は Code / LocalCode 列から取る。
+    """
+    if df is None or len(df) == 0:
+        return pd.DataFrame({c: pd.Series(dtype=_dtype_of(c)) for c in COLUMNS})
+    if not isinstance(df, pd.DataFrame):
+        df = pd.DataFrame(df)
+
+    out = pd.DataFrame(index=range(len(df)))
+    if code is not None:
+        out["Code"] = to_api_code(code)
+    else:
+        c_code = _find_col(df, ["Code", "LocalCode"])
+        out["Code"] = df[c_code].astype(str).map(to_api_code).values if c_code else ""
+
+    for field in DATE_FIELDS:
+        src = _find_col(df, ALIASES[field])
+        out[field] = to_date_col(df[src]).values if src else np.datetime64('NaT', 'ns')
+    for field in TEXT_FIELDS:
+        src = _find_col(df, ALIASES[field])
+        out[field] = df[src].fillna('').astype(str).values if src else ""
+    for field in VALUE_FIELDS:
+        src = _find_col(df, ALIASES[field])
+        out[field] = to_numeric_col(df[src]).values if src else np.nan
+
+    return out.sort_values("DiscDate", kind="stable").reset_index(drop=True)
+
+
+def _growth(cur, prev):
+    """(cur - prev) / |prev| × 100。prev が 0・欠損なら NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g = (cur - prev) / np.abs(prev) * 100.0
+    return g.where(prev.notna() & (prev != 0))
+
+
+def _with_fallback(df, field, suffix):
+    v = df[field + suffix]
+    alt = GROWTH_FALLBACK.get(field)
+    return v if alt is None else v.where(v != 0, df[alt + suffix])
+
+
+def add_quarterly_columns(df):
+    """
+    累計（YTD）の決算値を単独四半期に直し、前四半期比・前年同期比・通年比を付け足す。
+    ・実績行 = 売上 > 0 または 経常益 > 0（予想修正だけの行は対象外、派生列は NaN）
+    ・1Q（種別に 1Q/Q1 を含む、または売上が前の実績行より減った行）は累計 = 単独
+    ・それ以外は直前の実績行との差分を単独四半期とする
+    入力は Code ごとに開示日昇順で並んでいること。
+    """
+    df = df.drop(columns=[c for c in DERIVED_FIELDS if c in df.columns])
+    derived = pd.DataFrame(np.nan, index=df.index, columns=DERIVED_FIELDS)
+    if df.empty:
+        return pd.concat([df, derived], axis=1)
+
+    raw = df[VALUE_FIELDS].fillna(0.0)
+    actual = (raw["Sales"] > 0) | (raw["OdP"] > 0)
+    a = raw[actual]
+    g = df.loc[actual, "Code"].values
+    grp = a.groupby(g, sort=False)
+    prev = grp.shift(1)
+    first = prev["Sales"].isna()
+
+    p_type = df.loc[actual, "CurPerType"].fillna('').astype(str)
+    is_q1 = p_type.str.contains('1Q', regex=False) | p_type.str.contains('Q1', regex=False)
+    is_q1 |= (a["Sales"] < prev["Sales"]) & (prev["Sales"] > 0)
+
+    q = a.where(is_q1 | first, a - prev)
+    q.columns = [f + "_Q" for f in VALUE_FIELDS]
+    q_grp = q.groupby(g, sort=False)
+    ttm = q_grp.rolling(4, min_periods=4).sum().reset_index(level=0, drop=True).reindex(q.index)
+    ttm.columns = [f + "_TTM" for f in VALUE_FIELDS]
+    block = pd.concat([q, ttm], axis=1)
+
+    for f in VALUE_FIELDS:
+        eff_q = _with_fallback(block, f, "_Q")
+        eff_ttm = _with_fallback(block, f, "_TTM")
+        derived.loc[actual, f + "_Q"] = q[f + "_Q"].values
+        derived.loc[actual, f + "_QoQ"] = _growth(eff_q, eff_q.groupby(g, sort=False).shift(1)).values
+        derived.loc[actual, f + "_YoY"] = _growth(eff_q, eff_q.groupby(g, sort=False).shift(4)).values
+        derived.loc[actual, f + "_TTM_YoY"] = _growth(eff_ttm, eff_ttm.groupby(g, sort=False).shift(4)).values
+    return pd.concat([df, derived], axis=1)
+
+
+def _dtype_of(col):
+    if col in DATE_FIELDS:
+        return 'datetime64[ns]'
+    if col in VALUE_FIELDS or col in DERIVED_FIELDS:
+        return 'float64'
+    return object
+
+
+class FundamentalsTable:
+    """
+    全銘柄の決算履歴を列ごとの配列で保持する読み取り専用テーブル。
+    get(code) で1銘柄分を O(1) で切り出せる（旧 dict-of-DataFrame と同じ使い勝手）。
+    """
+
+    def __init__(self, codes, offsets, columns):
+        self.codes = np.asarray(codes)
+        self.offsets = np.asarray(offsets, dtype='int64')
+        self.columns = columns
+        self.code_index = {str(c): i for i, c in enumerate(self.codes)}
+
+    @classmethod
+    def from_frame(cls, df):
+        """正規化済みの縦持ち表から組み立てる（銘柄内の並び順は保持、派生列はここで再計算）"""
+        if df is None or df.empty:
+            return cls(np.array([], dtype='U5'), np.zeros(1, dtype='int64'),
+                       {c: np.array([], dtype=_dtype_of(c) if c not in TEXT_FIELDS else 'U1')
+                        for c in COLUMNS + DERIVED_FIELDS if c != "Code"})
+        df = df.sort_values("Code", kind="stable").reset_index(drop=True)
+        df = add_quarterly_columns(df)
+        codes, starts = np.unique(df["Code"].astype(str).values, return_index=True)
+        offsets = np.append(starts, len(df)).astype('int64')
+        columns = {}
+        for c in df.columns:
+            if c == "Code":
+                continue
+            if c in TEXT_FIELDS:
+                columns[c] = df[c].fillna('').astype(str).to_numpy(dtype=str)
+            elif pd.api.types.is_datetime64_any_dtype(df[c]):
+                columns[c] = df[c].values.astype('datetime64[ns]')
+            else:
+                columns[c] = df[c].values.astype('float64')
+        return cls(codes.astype('U'), offsets, columns)
+
+    @classmethod
+    def from_histories(cls, histories):
+        """{コード: 決算DataFrame} から組み立てる（列名の揺れはここで正規化）"""
+        frames = [normalize_history(df, code) for code, df in histories.items()
+                  if isinstance(df, pd.DataFrame) and not df.empty]
+        return cls.from_frame(pd.concat(frames, ignore_index=True) if frames else None)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return to_api_code(code) in self.code_index
+
+    def keys(self):
+        return [str(c) for c in self.codes]
+
+    def _slice(self, code):
+        i = self.code_index.get(to_api_code(code))
+        if i is None:
+            return None
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def get(self, code, default=None):
+        """1銘柄分の決算履歴（正規列・開示日昇順）。無ければ default"""
+        sl = self._slice(code)
+        if sl is None:
+            return default
+        df = pd.DataFrame({c: arr[sl] for c, arr in self.columns.items()})
+        df.insert(0, "Code", to_api_code(code))
+        return df
+
+    def to_dict(self):
+        return {c: self.get(c) for c in self.keys()}
+
+    def to_frame(self):
+        n = self.offsets[-1]
+        df = pd.DataFrame({c: arr[:n] for c, arr in self.columns.items()})
+        df.insert(0, "Code", np.repeat(self.codes, np.diff(self.offsets)))
+        return df
+
+    def save(self, path=None):
+        path = path or STORE_PATH
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, codes=self.codes, offsets=self.offsets,
+                            **{f"col_{c}": arr for c, arr in self.columns.items()})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or STORE_PATH
+        with np.load(path, allow_pickle=False) as z:
+            columns = {k[4:]: z[k] for k in z.files if k.startswith("col_")}
+            return cls(z["codes"], z["offsets"], columns)
+
+
+def load_table(path=None, legacy_path=None):
+    """ストアを読む。無ければ旧 fundamentals_db.pkl から組み立てる（どちらも無ければ空）"""
+    path = path or STORE_PATH
+    if os.path.exists(path):
+        return FundamentalsTable.load(path)
+    legacy_path = legacy_path or LEGACY_PICKLE_PATH
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "rb") as f:
+            return FundamentalsTable.from_histories(pickle.load(f))
+    return FundamentalsTable.from_frame(None)
+
+
+def check_parity(table, histories, rtol=1e-9):
+    """
+    表の1銘柄分と、その銘柄だけを normalize_history → add_quarterly_columns に通した結果を突き合わせる。
+    histories は {コード: 決算DataFrame}（取込元の列名のまま）。不一致の (コード, 列, 表の値, 個別の値) のリストを返す。
+    """
+    mismatches = []
+    for code, src in histories.items():
+        ref = add_quarterly_columns(normalize_history(src, code))
+        got = table.get(code)
+        if got is None or len(got) != len(ref):
+            mismatches.append((to_api_code(code), "rows", None if got is None else len(got), len(ref)))
+            continue
+        for c in COLUMNS[1:] + DERIVED_FIELDS:
+            a, b = got[c].values, ref[c].values
+            if c in DATE_FIELDS:
+                bad = a.astype('datetime64[ns]') != b.astype('datetime64[ns]')
+                bad &= ~(np.isnat(a.astype('datetime64[ns]')) & np.isnat(b.astype('datetime64[ns]')))
+            elif c in TEXT_FIELDS:
+                bad = a.astype(str) != b.astype(str)
+            else:
+                bad = ~np.isclose(a.astype('float64'), b.astype('float64'), rtol=rtol, equal_nan=True)
+            if bad.any():
+                k = int(np.argmax(bad))
+                mismatches.append((to_api_code(code), c, a[k], b[k]))
+    return mismatches
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from price_store import to_api_code
+
+# ==========================================
+# 💾 J-Quants 応答のディスクキャッシュ（再起動をまたいで API 枠を節約する）
+# ==========================================
+# 締まった期の決算は後から変わらない（過去日の日足もほぼ変わらない）。それを TTL 切れや再起動のたびに取り直さないよう、
+# 200 応答の本文を http_cache/ に1応答 = 1ファイル（zlib 圧縮）で保存し、次からはディスクから返す。
+# ・rate_limiter.jquants_get が session.http_cache を見て、発射前に引く。当たればトークンも消費せず、
+#   tracer の API回数にも数えない（取りに行った分だけが API回数）
+# ・エンドポイントごとの保存期間（policy）
+#     /equities/bars/daily   … 期間の終わり（date / to）が昨日以前なら BARS_TTL、今日を含むなら TODAY_TTL
+#                              （分割・併合があると過去日の Adj 値が遡って変わるため永久にはしない）
+#     /fins/statements・summary … date 指定の過去日は永久、code 指定は新しい期が増えるので DAILY_TTL
+#     /fins/announcement・dividend、銘柄マスター … DAILY_TTL
+#     pagination_key 付き（2ページ目以降）・それ以外 … 保存しない
+#   保存期間は保存した時点で決める。今日を含む応答は TTL で切れ、翌日以降に取り直した応答は長く持つ
+# ・分割・併合が prices_store の manifest（splits）に記録されたら drop_split_bars で、
+#   その分割日より前の日足のうち分割日以前に保存した応答を捨てる（BARS_TTL を待たずに取り直す）
+# ・ファイルの合計が max_bytes を超えたら、最後に使われた（mtime）のが古いものから消す
+# 環境変数 HTTP_CACHE_DIR（空文字で無効）/ HTTP_CACHE_MB / HTTP_CACHE_TODAY_TTL / HTTP_CACHE_DAILY_TTL /
+# HTTP_CACHE_BARS_TTL で変更できる。
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_cache"))
+HTTP_CACHE_MB = float(os.getenv("HTTP_CACHE_MB", "512"))
+TODAY_TTL = float(os.getenv("HTTP_CACHE_TODAY_TTL", "600"))
+DAILY_TTL = float(os.getenv("HTTP_CACHE_DAILY_TTL", str(24 * 3600)))
+BARS_TTL = float(os.getenv("HTTP_CACHE_BARS_TTL", str(7 * 24 * 3600)))
+
+PERMANENT = None   # 期限なし
+NO_STORE = 0       # 保存しない
+
+SUFFIX = ".bin"
+
+
+def today_jst(ts=None):
+    """日本時間の今日（YYYYMMDD）。ts（UNIX 時刻）を渡せばその日"""
+    now = datetime.utcnow() if ts is None else datetime.utcfromtimestamp(ts)
+    return (now + timedelta(hours=9)).strftime('%Y%m%d')
+
+
+def _ymd(value):
+    """'2026-01-05' / '20260105' → '20260105'（読めなければ None）"""
+    digits = "".join(ch for ch in str(value or "") if ch.isdigit())
+    return digits[:8] if len(digits) >= 8 else None
+
+
+def policy(url, today=None):
+    """url の保存期間（秒）。PERMANENT = 永久、NO_STORE = 保存しない"""
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/")
+    q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    today = today or today_jst()
+
+    if "pagination_key" in q:
+        # 続きのページはキーが取得のたびに変わり、同じ URL で二度と引かれない
+        return NO_STORE
+    if path.endswith("/equities/bars/daily"):
+        end = _ymd(q.get("date") or q.get("to"))
+        if end and end < today:
+            return BARS_TTL
+        return TODAY_TTL
+    if path.endswith("/fins/statements") or path.endswith("/fins/summary"):
+        day = _ymd(q.get("date"))
+        if day and "code" not in q:
+            return PERMANENT if day < today else TODAY_TTL
+        return DAILY_TTL
+    if path.endswith("/fins/announcement") or path.endswith("/fins/dividend"):
+        return DAILY_TTL
+    if path.endswith("/equities/master") or path.endswith("/listed/info"):
+        day = _ymd(q.get("date"))
+        return PERMANENT if day and day < today else DAILY_TTL
+    return NO_STORE
+
+
+class HttpCache:
+    def __init__(self, root=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._bytes = None    # ディスク上の合計（初回に数える）
+        self.counts = {"hit": 0, "miss": 0, "expired": 0, "store": 0, "evict": 0}
+
+    def _path(self, url):
+        return os.path.join(self.root, hashlib.sha1(url.encode("utf-8")).hexdigest() + SUFFIX)
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.root) as it:
+                for e in it:
+                    if e.name.endswith(SUFFIX):
+                        try:
+                            st = e.stat()
+                            entries.append((st.st_mtime, st.st_size, e.path))
+                        except OSError:
+                            pass
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _disk_bytes(self):
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self._scan())
+        return self._bytes
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            meta = json.loads(f.readline())
+            body = zlib.decompress(f.read())
+        return meta, body
+
+    def lookup(self, url):
+        """保存済みで期限内なら requests.Response を返す（無ければ None）"""
+        if policy(url) == NO_STORE:
+            return None
+        path = self._path(url)
+        try:
+            meta, body = self._read(path)
+        except (OSError, ValueError, zlib.error):
+            with self._lock:
+                self.counts["miss"] += 1
+            return None
+        if meta.get("url") != url:
+            with self._lock:
+                self.counts["miss"] += 1
+            return None
+        expires = meta.get("expires")
+        if expires is not None and expires <= time.time():
+            self._remove(path)
+            with self._lock:
+                self.counts["expired"] += 1
+            return None
+        try:
+            os.utime(path)   # 最後に使った時刻（追い出しの順番）
+        except OSError:
+            pass
+        with self._lock:
+            self.counts["hit"] += 1
+
+        r = requests.Response()
+        r.status_code = meta.get("status", 200)
+        r._content = body
+        r.url = url
+        r.encoding = meta.get("encoding")
+        r.headers.update(meta.get("headers") or {})
+        r.from_cache = True
+        return r
+
+    def store(self, url, resp):
+        """200 応答を保存する（保存しない種類・失敗応答は何もしない）"""
+        ttl = policy(url)
+        if ttl == NO_STORE or getattr(resp, "status_code", None) != 200 or getattr(resp, "from_cache", False):
+            return False
+        meta = {
+            "url": url,
+            "status": 200,
+            "encoding": resp.encoding,
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() == "content-type"},
+            "stored": time.time(),
+            "expires": None if ttl is PERMANENT else time.time() + ttl,
+        }
+        data = json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n" + zlib.compress(resp.content, 6)
+        if len(data) > self.max_bytes:
+            return False
+        path = self._path(url)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            self._disk_bytes()
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            try:
+                old = os.path.getsize(path)
+            except OSError:
+                old = 0
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            self._remove(tmp)
+            return False
+        with self._lock:
+            self._bytes += len(data) - old
+            self.counts["store"] += 1
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+        return True
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        with self._lock:
+            if self._bytes is not None and not path.endswith(".tmp"):
+                self._bytes -= size
+        return size
+
+    def _evict(self):
+        """最後に使われたのが古い順に、合計が上限の 9 割を切るまで消す"""
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._bytes = total
+            self.counts["evict"] += removed
+
+    def drop_split_bars(self, splits):
+        """
+        分割・併合で遡及調整された日足の応答を捨てる。消した件数を返す。
+        splits は price_store の manifest["splits"]（{分割日: {コード: 係数}}）。
+        期間の終わりが分割日より前で、分割日以前に保存した /equities/bars/daily の応答が対象
+        （code 指定の応答は分割した銘柄のものだけ）。
+        """
+        if not splits:
+            return 0
+        removed = 0
+        for _, _, path in self._scan():
+            try:
+                meta, _ = self._read(path)
+            except (OSError, ValueError, zlib.error):
+                continue
+            parts = urlsplit(meta.get("url", ""))
+            if not parts.path.rstrip("/").endswith("/equities/bars/daily"):
+                continue
+            q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            end = _ymd(q.get("date") or q.get("to"))
+            stored = today_jst(meta.get("stored", 0))
+            code = q.get("code")
+            for day, codes in splits.items():
+                if end and end < day and stored <= day and (code is None or to_api_code(code) in codes):
+                    self._remove(path)
+                    removed += 1
+                    break
+        return removed
+
+    def clear(self):
+        for _, _, path in self._scan():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = 0
+
+    def stats(self):
+        entries = self._scan()
+        with self._lock:
+            return {"root": self.root, "entries": len(entries), "bytes": sum(s for _, s, _ in entries),
+                    "max_bytes": self.max_bytes, **self.counts}
+
+
+# アプリの api_session に付ける共通キャッシュ（プロセスで1つ。ディスクは再起動後も残る）
+HTTP_CACHE = HttpCache() if HTTP_CACHE_DIR else None
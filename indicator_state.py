@@ -0,0 +1,323 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+import price_store
+
+# ==========================================
+# 🔁 テクニカル指標の差分更新エンジン（銘柄ごとの途中状態を保持）
+# ==========================================
+# prices_store/indicator_state.npz に、各銘柄の「直近の営業日まで進めた途中状態」を持つ。
+#   closes   … 直近75本の終値（右詰め、足りない分は NaN）→ SMA25/75・RSI の窓
+#   atr      … Wilder ATR（alpha=1/14 の指数平滑）と、14本未満用の TR 累計
+#   ema12 / ema26 / signal / hist … MACD(12,26,9) の指数平滑値と直近5本のヒストグラム
+# 新しい営業日が届いたら、その日の1ファイルだけを読んで全銘柄を1本ずつ進める
+# （夜間更新は 銘柄数 × 新着日数 で済み、全履歴を毎回計算し直さない）。
+# 夜間は feature_store.sync がこの状態を1日ずつ進め、その日の値を特徴量テーブルの末尾へ足す（app はその表を読む）。
+# 配列の行は price_store の銘柄辞書番号（追記専用）と一致させる。
+#
+# 計算式は calc_vector_indicators / get_fast_indicators と同じ（pandas の ewm(adjust=False) と
+# 同じ漸化式、rolling(min_periods=1) と同じ窓の取り方）。
+
+STATE_FILE = "indicator_state.npz"
+BUFFER = 75  # SMA75 まで賄える終値の保持本数
+HIST_KEEP = 5
+ATR_ALPHA = 1 / 14
+RSI_SPAN = 14
+PRICE_FIELDS = ["AdjO", "AdjH", "AdjL", "AdjC"]
+
+_ARRAYS = {
+    # 名前: (dtype, 初期値, 列数)
+    "n": ('int64', 0, None),
+    "closes": ('float32', np.nan, BUFFER),
+    "atr": ('float64', np.nan, None),
+    "tr_sum": ('float64', 0.0, None),
+    "ema12": ('float64', np.nan, None),
+    "ema26": ('float64', np.nan, None),
+    "signal": ('float64', np.nan, None),
+    "hist": ('float64', 0.0, HIST_KEEP),
+}
+
+
+def _span_alpha(span):
+    # pandas の ewm(span=…) と同じ経路で alpha を出す（2/(span+1) とは丸めが異なることがある）
+    return 1.0 / (1.0 + (span - 1) / 2.0)
+
+
+def _ewm_step(prev, x, alpha):
+    """ewm(adjust=False) の1ステップ。prev が NaN（初回）なら x そのもの"""
+    old = 1.0 - alpha
+    return np.where(np.isnan(prev), x, (old * prev + alpha * x) / (old + alpha))
+
+
+class IndicatorState:
+    """
+    全銘柄の指標途中状態。advance() で1営業日ずつ進め、snapshot() で最新値を取り出す。
+    as_of: 最後に取り込んだ営業日（YYYYMMDD）、stamps: 取り込んだ日の取得時刻（manifest と照合する）
+    """
+
+    def __init__(self, codes=None, arrays=None, as_of="", stamps=None):
+        self.codes = list(codes or [])
+        self.arrays = arrays or {k: self._blank(k, len(self.codes)) for k in _ARRAYS}
+        self.as_of = as_of
+        self.stamps = dict(stamps or {})
+
+    @staticmethod
+    def _blank(name, n):
+        dtype, fill, width = _ARRAYS[name]
+        shape = (n,) if width is None else (n, width)
+        return np.full(shape, fill, dtype=dtype)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _grow(self, codes):
+        """銘柄辞書が伸びた分だけ行を足す（既存行はそのまま）"""
+        extra = len(codes) - len(self.codes)
+        if extra <= 0:
+            return
+        self.codes = list(codes)
+        for k in _ARRAYS:
+            self.arrays[k] = np.concatenate([self.arrays[k], self._blank(k, extra)])
+
+    def reset_rows(self, rows):
+        for k in _ARRAYS:
+            self.arrays[k][rows] = self._blank(k, 1)[0]
+
+    # ---------- 更新 ----------
+    def advance(self, code_idx, o, h, l, c):
+        """
+        1営業日分（code_idx の銘柄だけ）を1本進める。終値が欠損の銘柄はその日を飛ばす
+        （1銘柄版の dropna 後の系列と同じ扱い）。進めた行番号を返す。
+        """
+        a = self.arrays
+        keep = ~np.isnan(c)
+        rows = np.asarray(code_idx)[keep]
+        h, l, c = h[keep], l[keep], c[keep]
+        if len(rows) == 0:
+            return rows
+
+        # True Range（初日は前日終値が無いので 高値-安値）
+        cp = a["closes"][rows, -1]
+        tr = np.fmax(np.fmax(h - l, np.abs(h - cp)), np.abs(l - cp)).astype('float64')
+        prev = a["atr"][rows]
+        a["atr"][rows] = np.where(np.isnan(tr), prev, _ewm_step(prev, tr, ATR_ALPHA))
+        a["tr_sum"][rows] += np.nan_to_num(tr)
+
+        a["closes"][rows, :-1] = a["closes"][rows, 1:]
+        a["closes"][rows, -1] = c
+
+        x = c.astype('float64')
+        a["ema12"][rows] = _ewm_step(a["ema12"][rows], x, _span_alpha(12))
+        a["ema26"][rows] = _ewm_step(a["ema26"][rows], x, _span_alpha(26))
+        macd = a["ema12"][rows] - a["ema26"][rows]
+        a["signal"][rows] = _ewm_step(a["signal"][rows], macd, _span_alpha(9))
+        a["hist"][rows, :-1] = a["hist"][rows, 1:]
+        a["hist"][rows, -1] = macd - a["signal"][rows]
+        a["n"][rows] += 1
+        return rows
+
+    def advance_day(self, dt_str, root=None, rows=None):
+        """ストアの1日分を読んで進める。rows を渡すとその銘柄（辞書番号）だけ。進めた行番号を返す"""
+        part = price_store.read_day(dt_str, PRICE_FIELDS, rows, root)
+        return self.advance(part["code_idx"], part["AdjO"], part["AdjH"], part["AdjL"], part["AdjC"])
+
+    # ---------- 参照 ----------
+    def _rsi(self, rows=slice(None)):
+        """calc_vector_indicators の RSI（直近14本の値幅の単純平均、初日の値幅は 0 扱い）"""
+        a = self.arrays
+        win = a["closes"][rows, -(RSI_SPAN + 1):].astype('float64')
+        delta = np.diff(win, axis=1)
+        # 系列の初日（前日が NaN）の値幅は pandas の diff → where で 0 になる
+        delta = np.where(np.isnan(win[:, :-1]) & ~np.isnan(win[:, 1:]), 0.0, delta)
+        count = np.minimum(a["n"][rows], RSI_SPAN)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gain = np.nansum(np.where(delta > 0, delta, 0.0), axis=1) / count
+            loss = np.nansum(np.where(delta < 0, -delta, 0.0), axis=1) / count
+            rs = gain / np.where(loss == 0, 1e-10, loss)
+            return (100 - (100 / (1 + rs))).astype('float32')
+
+    def _rsi_fast(self):
+        """get_fast_indicators の RSI（直近14本の値幅合計、15本未満は 50）"""
+        p = self.arrays["closes"][:, -(RSI_SPAN + 1):]
+        diff = np.diff(p, axis=1)
+        g = np.sum(np.maximum(diff, 0), axis=1)
+        l = np.sum(np.abs(np.minimum(diff, 0)), axis=1)
+        with np.errstate(invalid='ignore'):
+            rsi = 100 - (100 / (1 + (g / (l + 1e-10))))
+        return np.where(self.arrays["n"] >= RSI_SPAN + 1, rsi, 50.0)
+
+    def latest(self, rows=slice(None)):
+        """
+        rows の銘柄の最新足の指標（calc_vector_indicators と同じ SMA25 / SMA75 / ATR / RSI、MACD 一式）。
+        {指標: 配列}。MACD_Hist は本数で 0 に丸めない生の値（特徴量テーブルへ足す用）
+        """
+        a = self.arrays
+        n = a["n"][rows]
+        closes = a["closes"][rows].astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sma25 = np.nanmean(closes[:, -25:], axis=1) if len(n) else np.empty(0)
+            sma75 = np.nanmean(closes, axis=1) if len(n) else np.empty(0)
+            atr = np.where(n >= 14, a["atr"][rows], a["tr_sum"][rows] / n)
+        return {
+            "SMA25": sma25.astype('float32'),
+            "SMA75": sma75.astype('float32'),
+            "ATR": atr.astype('float32'),
+            "RSI": self._rsi(rows),
+            "MACD": a["ema12"][rows] - a["ema26"][rows],
+            "MACD_Signal": a["signal"][rows],
+            "MACD_Hist": a["hist"][rows, -1],
+        }
+
+    def snapshot(self):
+        """全銘柄の最新の指標値（1本も無い銘柄は除く）"""
+        a = self.arrays
+        n = a["n"]
+        hist = np.where(n[:, None] >= RSI_SPAN + 1, a["hist"], 0.0)
+        cur = self.latest()
+        df = pd.DataFrame({
+            "Code": np.asarray(self.codes, dtype=object),
+            "Bars": n,
+            "AdjC": a["closes"][:, -1],
+            "SMA25": cur["SMA25"],
+            "SMA75": cur["SMA75"],
+            "ATR": cur["ATR"],
+            "RSI": cur["RSI"],
+            "RSI_Fast": self._rsi_fast(),
+            "MACD": cur["MACD"],
+            "MACD_Signal": cur["MACD_Signal"],
+            "MACD_Hist": hist[:, -1],
+            "MACD_Hist_Prev": hist[:, -2],
+        })
+        return df[n > 0].reset_index(drop=True)
+
+    def fast_indicators(self, code):
+        """get_fast_indicators と同じ (rsi, hist, hist_prev, 直近5本の hist) を状態から返す"""
+        code = price_store.to_api_code(code)
+        try:
+            i = self.codes.index(code)
+        except ValueError:
+            return 50.0, 0.0, 0.0, np.zeros(HIST_KEEP)
+        if self.arrays["n"][i] < RSI_SPAN + 1:
+            return 50.0, 0.0, 0.0, np.zeros(HIST_KEEP)
+        hist = self.arrays["hist"][i]
+        return float(self._rsi_fast()[i]), hist[-1], hist[-2], hist.copy()
+
+    # ---------- 保存 ----------
+    def save(self, root=None):
+        root = root or price_store.STORE_DIR
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, STATE_FILE)
+        tmp = path + ".tmp.npz"
+        meta = json.dumps({"codes": self.codes, "as_of": self.as_of, "stamps": self.stamps}, ensure_ascii=False)
+        np.savez_compressed(tmp, meta=np.array(meta), **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, root=None):
+        """保存済みの状態を読む。無い・壊れている・形式が古い場合は空の状態"""
+        path = os.path.join(root or price_store.STORE_DIR, STATE_FILE)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                meta = json.loads(str(z["meta"]))
+                arrays = {k: z[k] for k in _ARRAYS}
+            return cls(meta["codes"], arrays, meta.get("as_of", ""), meta.get("stamps"))
+        except Exception:
+            return cls()
+
+
+def _day_stamp(manifest, dt_str):
+    info = manifest["days"].get(dt_str)
+    return "" if info is None else str(info.get("fetched_at", ""))
+
+
+def build(root=None, days=None):
+    """ストアの全履歴（または days）から状態を一から組み立てる"""
+    state = IndicatorState()
+    return _replay(state, root, days)
+
+
+def _replay(state, root, days=None, rows=None, on_day=None):
+    manifest = price_store.load_manifest(root)
+    state._grow(price_store.load_code_dict(root))
+    days = price_store.list_days(root) if days is None else days
+    for d in days:
+        advanced = state.advance_day(d, root, rows)
+        if rows is None:
+            state.as_of = d
+            state.stamps[d] = _day_stamp(manifest, d)
+            if on_day is not None:
+                on_day(d, advanced)
+    return state
+
+
+def sync(state=None, root=None, dirty_codes=(), on_day=None):
+    """
+    状態をストアの最新日まで進める。(状態, 進めた日数, 全再構築したか) を返す。
+    ・取り込み済みの日がストアで取り直されていたら（manifest の取得時刻が変わった / 消えた）全再構築
+    ・dirty_codes（分割・併合で過去日が遡及調整された銘柄）はその銘柄だけ全履歴から作り直す
+    ・それ以外は as_of より新しい日だけを1日ずつ読んで進める。on_day を渡すと、1日進めるごとに
+      on_day(日付, 進めた行番号) を呼ぶ（全再構築のときは呼ばない）
+    """
+    state = IndicatorState.load(root) if state is None else state
+    days = price_store.list_days(root)
+    manifest = price_store.load_manifest(root)
+    day_set = set(days)
+
+    stale = [d for d, stamp in state.stamps.items() if d not in day_set or _day_stamp(manifest, d) != stamp]
+    if not state.as_of or stale:
+        state = build(root, days)
+        return state, len(days), True
+
+    state._grow(price_store.load_code_dict(root))
+    done = [d for d in days if d <= state.as_of]
+    if dirty_codes and done:
+        index = {c: i for i, c in enumerate(state.codes)}
+        rows = np.array(sorted({index[c] for c in map(price_store.to_api_code, dirty_codes) if c in index}), dtype='int32')
+        if len(rows):
+            state.reset_rows(rows)
+            _replay(state, root, done, rows)
+
+    new_days = [d for d in days if d > state.as_of]
+    _replay(state, root, new_days, on_day=on_day)
+    return state, len(new_days), False
+
+
+def check_parity(state, panel, rows=None, rtol=1e-5):
+    """
+    状態の最新値と calc_vector_indicators / get_fast_indicators（1銘柄ずつ・全履歴から計算）を突き合わせる。
+    panel は状態と同じ日付範囲の価格パネル。許容誤差を超えた (コード, 列, 差分値, 全計算値) のリストを返す。
+    （RSI・SMA は単純平均の足し合わせ順が違うため float32 の丸め1つ分ずれることがある）
+    """
+    from scan_core import calc_vector_indicators, get_fast_indicators
+
+    snap = state.snapshot().set_index("Code")
+    rows = range(len(panel)) if rows is None else rows
+    mismatches = []
+    for r in rows:
+        code = panel.codes[r]
+        df = panel.code_frame(int(r))
+        if df.empty or code not in snap.index:
+            continue
+        full = calc_vector_indicators(df.copy()).iloc[-1]
+        rsi_f, h1, h2, _ = get_fast_indicators(df['AdjC'].values)
+        s = snap.loc[code]
+        pairs = [("SMA25", full['SMA25']), ("SMA75", full['SMA75']), ("ATR", full['ATR']),
+                 ("RSI", full['RSI']), ("RSI_Fast", rsi_f), ("MACD_Hist", h1), ("MACD_Hist_Prev", h2)]
+        for col, ref in pairs:
+            if not np.isclose(float(s[col]), float(ref), rtol=rtol, atol=1e-4, equal_nan=True):
+                mismatches.append((code, col, float(s[col]), float(ref)))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+
+    t0 = time.time()
+    state, advanced, rebuilt = sync()
+    state.save()
+    mode = "全再構築" if rebuilt else "差分更新"
+    print(f"指標状態 {mode}: {advanced} 営業日 / {len(state.snapshot())} 銘柄 (as_of {state.as_of}) {time.time() - t0:.2f}秒")
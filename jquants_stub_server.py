@@ -0,0 +1,402 @@
+import json
+import time
+import random
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import synthetic_market
+from price_store import to_api_code
+
+# ==========================================
+# 🧪 J-Quants 代役サーバー（オフラインでの取得スループット・429 対応の検証用）
+# ==========================================
+# synthetic_market の疑似データを J-Quants と同じ URL・同じ JSON の形で返すローカル HTTP サーバー。
+# 本番の API 枠を消費せずに、兵站Bot / batch.py / app.py の取得処理を端から端まで回せる。
+#
+#   python jquants_stub_server.py --port 8765 --latency-ms 80 --rpm 60 --p429 0.02 --p5xx 0.01
+#   JQUANTS_BASE_URL=http://127.0.0.1:8765/v2 JQUANTS_API_KEY=dummy python fetch_fundamentals_bot.py
+#
+# 提供するエンドポイント（/v1・/v2 どちらの接頭辞でも可）
+#   /equities/bars/daily   … code / date / from / to（V2 列名: O,H,L,C,Vo,AdjFactor,AdjO..）→ {"data"}
+#   /equities/master       … 全銘柄の銘柄マスター → {"data"}
+#   /listed/info           … 旧 V1 の銘柄一覧（batch.py の旧銘柄判定用）→ {"info"}
+#   /fins/summary          … code / date（V2 列名: DiscDate, Sales, OP ..）→ {"data"}
+#   /fins/statements       … code / date（V1 列名: DisclosedDate, NetSales ..）→ {"statements"}
+#   /fins/announcement     … 次回の決算発表予定 → {"announcement"}
+#   /fins/dividend         … code（中間・期末配当）→ {"dividend"}
+#   /_stats                … 代役サーバー自身の集計（レート制限の対象外）
+# 件数が page_size を超える応答は pagination_key で分割する。
+#
+# 負荷・障害の再現
+#   latency / jitter … 1リクエストごとの応答遅延（秒）
+#   rpm              … APIキーごとの毎分上限（直近60秒の件数で判定、超過は 429 + Retry-After）
+#   p429 / p5xx      … 上限とは無関係に 429 / 5xx を確率で混ぜる（seed で再現可能）
+
+V1_BAR_NAMES = {"O": "Open", "H": "High", "L": "Low", "C": "Close", "Vo": "Volume", "AdjFactor": "AdjustmentFactor",
+                "AdjO": "AdjustmentOpen", "AdjH": "AdjustmentHigh", "AdjL": "AdjustmentLow",
+                "AdjC": "AdjustmentClose", "AdjVo": "AdjustmentVolume"}
+V2_FIN_NAMES = {"DisclosedDate": "DiscDate", "DisclosedTime": "DiscTime", "LocalCode": "Code",
+                "TypeOfDocument": "DocType", "TypeOfCurrentPeriod": "CurPerType", "CurrentPeriodEndDate": "CurPerEn",
+                "NetSales": "Sales", "OperatingProfit": "OP", "OrdinaryProfit": "OdP", "Profit": "NP",
+                "EarningsPerShare": "EPS"}
+
+SECTORS = ["水産・農林業", "建設業", "食料品", "化学", "医薬品", "機械", "電気機器", "輸送用機器", "精密機器",
+           "情報・通信業", "卸売業", "小売業", "銀行業", "不動産業", "サービス業"]
+MARKETS = ["プライム", "スタンダード", "グロース"]
+SCALES = ["TOPIX Core30", "TOPIX Large70", "TOPIX Mid400", "TOPIX Small 1", "TOPIX Small 2", "-"]
+
+
+def _to_iso(d):
+    """'20260105' / '2026-01-05' → '2026-01-05'（読めなければ None）"""
+    if not d:
+        return None
+    d = str(d).strip()
+    if len(d) == 8 and d.isdigit():
+        return f"{d[:4]}-{d[4:6]}-{d[6:]}"
+    return d if len(d) == 10 else None
+
+
+class StubMarket:
+    """代役サーバーが返すデータ一式（縦持ちの表と、コード・日付ごとの行番号索引）"""
+
+    def __init__(self, bars, statements):
+        bars = bars.rename(columns={v: k for k, v in V1_BAR_NAMES.items()})
+        self.bars = bars.reset_index(drop=True)
+        self.statements = statements.reset_index(drop=True)
+        self.summary = self.statements.rename(columns=V2_FIN_NAMES)
+        self.codes = sorted(self.bars["Code"].unique())
+        self.bars_by_date = self.bars.groupby("Date").indices
+        self.bars_by_code = self.bars.groupby("Code").indices
+        self.fins_by_date = self.statements.groupby("DisclosedDate").indices
+        self.fins_by_code = self.statements.groupby("LocalCode").indices
+        self.master = self._make_master()
+        self.announcement = self._make_announcement()
+        self.dividend = self._make_dividend()
+
+    @classmethod
+    def generate(cls, n_codes=4000, n_days=280, n_quarters=8, seed=0):
+        return cls(synthetic_market.generate_bars(n_codes, n_days, seed),
+                   synthetic_market.generate_statements(n_codes, n_quarters, seed))
+
+    def _make_master(self):
+        rng = np.random.default_rng(7)
+        n = len(self.codes)
+        sector = rng.integers(0, len(SECTORS), n)
+        market = rng.choice(len(MARKETS), n, p=[0.45, 0.4, 0.15])
+        scale = rng.choice(len(SCALES), n, p=[0.01, 0.02, 0.1, 0.2, 0.5, 0.17])
+        return pd.DataFrame({
+            "Date": synthetic_market.END_DATE,
+            "Code": self.codes,
+            "CoName": [f"テスト{c[:4]}" for c in self.codes],
+            "CoNameEn": [f"TEST {c[:4]}" for c in self.codes],
+            "S33Nm": np.asarray(SECTORS)[sector],
+            "MktNm": np.asarray(MARKETS)[market],
+            "ScaleCat": np.asarray(SCALES)[scale],
+        })
+
+    def _make_announcement(self):
+        """直近の決算の 3か月後を次回の発表予定日とする"""
+        last = self.statements[self.statements["NetSales"] != ""].groupby("LocalCode").tail(1)
+        nxt = pd.to_datetime(last["DisclosedDate"]) + pd.DateOffset(months=3)
+        kinds = {"1Q": "2Q", "2Q": "3Q", "3Q": "FY", "FY": "1Q"}
+        return pd.DataFrame({
+            "Date": nxt.dt.strftime('%Y-%m-%d').values,
+            "Code": last["LocalCode"].values,
+            "CompanyName": [f"テスト{c[:4]}" for c in last["LocalCode"]],
+            "FiscalQuarter": [kinds[k] for k in last["TypeOfCurrentPeriod"]],
+            "FiscalYear": "3月31日",
+        }).reset_index(drop=True)
+
+    def _make_dividend(self):
+        """中間（2Q）・期末（FY）の決算ごとに、累計EPSの3割を1株配当とする"""
+        st = self.statements[self.statements["TypeOfCurrentPeriod"].isin(["2Q", "FY"]) & (self.statements["NetSales"] != "")]
+        eps = pd.to_numeric(st["EarningsPerShare"], errors="coerce")
+        interim = st["TypeOfCurrentPeriod"] == "2Q"
+        rate = np.maximum(np.round(np.where(interim, eps, eps / 2) * 0.3), 0)
+        rec = pd.to_datetime(st["CurrentPeriodEndDate"])
+        df = pd.DataFrame({
+            "AnnouncementDate": st["DisclosedDate"].values,
+            "Code": st["LocalCode"].values,
+            "RecordDate": rec.dt.strftime('%Y-%m-%d').values,
+            "ExDate": (rec - pd.offsets.BDay(1)).dt.strftime('%Y-%m-%d').values,
+            "PayableDate": (rec + pd.DateOffset(months=3)).dt.strftime('%Y-%m-%d').values,
+            "InterimFinalCode": np.where(interim, "1", "2"),
+            "GrossDividendRate": rate,
+        })
+        return df.sort_values(["Code", "AnnouncementDate"], kind="stable").reset_index(drop=True)
+
+    # ---------- 問い合わせ ----------
+    def bars_query(self, code=None, date=None, date_from=None, date_to=None):
+        if date:
+            idx = self.bars_by_date.get(date, [])
+        else:
+            idx = self.bars_by_code.get(code, [])
+        df = self.bars.iloc[idx]
+        if code and date:
+            df = df[df["Code"] == code]
+        if date_from:
+            df = df[df["Date"] >= date_from]
+        if date_to:
+            df = df[df["Date"] <= date_to]
+        return df
+
+    def fins_query(self, code=None, date=None, v2=True):
+        idx = self.fins_by_date.get(date, []) if date else self.fins_by_code.get(code, [])
+        src = self.summary if v2 else self.statements
+        df = src.iloc[idx]
+        if code and date:
+            df = df[df["Code" if v2 else "LocalCode"] == code]
+        return df
+
+
+class StubState:
+    """サーバー全体で共有する設定・レート制限の記録・集計（スレッド間はロックで保護）"""
+
+    def __init__(self, market, latency=0.0, jitter=0.0, rpm=0, p429=0.0, p5xx=0.0, page_size=5000,
+                 api_key=None, seed=0):
+        self.market = market
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.rpm = int(rpm or 0)
+        self.p429 = float(p429)
+        self.p5xx = float(p5xx)
+        self.page_size = max(1, int(page_size))
+        self.api_key = api_key
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._hits = {}
+        self.stats = {"requests": 0, "ok": 0, "limited": 0, "injected_429": 0, "injected_5xx": 0,
+                      "not_found": 0, "bad_request": 0, "unauthorized": 0, "rows": 0}
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def draw(self):
+        """(遅延秒, 乱数) を1組引く（seed 固定で再現できるよう、ロック内で順に引く）"""
+        with self._lock:
+            return self.latency + self._rng.uniform(0, self.jitter), self._rng.random()
+
+    def admit(self, key):
+        """直近60秒の件数が rpm 未満なら記録して 0、超過なら Retry-After 秒を返す"""
+        if not self.rpm:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.setdefault(key, deque())
+            while hits and now - hits[0] >= 60.0:
+                hits.popleft()
+            if len(hits) >= self.rpm:
+                return max(1, int(np.ceil(60.0 - (now - hits[0]))))
+            hits.append(now)
+            return 0
+
+
+def _records(df):
+    return df.to_dict(orient="records")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None  # make_server で StubState を差し込む
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _page(self, key, df, params):
+        """page_size 件ずつに区切り、続きがあれば pagination_key を付ける"""
+        try:
+            start = int(params.get("pagination_key", "0") or 0)
+        except ValueError:
+            start = 0
+        end = start + self.state.page_size
+        body = {key: _records(df.iloc[start:end])}
+        if end < len(df):
+            body["pagination_key"] = str(end)
+        self.state.count("rows", len(body[key]))
+        return body
+
+    def do_GET(self):
+        st = self.state
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip("/")
+        for prefix in ("/v1", "/v2"):
+            if path.startswith(prefix + "/"):
+                path = path[len(prefix):]
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+
+        if path == "/_stats":
+            with st._lock:
+                self._send(200, dict(st.stats))
+            return
+
+        st.count("requests")
+        api_key = self.headers.get("x-api-key") or self.headers.get("Authorization", "")
+        if not api_key or (st.api_key and api_key != st.api_key):
+            st.count("unauthorized")
+            self._send(401, {"message": "The incoming token is invalid or expired."})
+            return
+
+        delay, roll = st.draw()
+        if delay > 0:
+            time.sleep(delay)
+
+        wait = st.admit(api_key)
+        if wait:
+            st.count("limited")
+            self._send(429, {"message": "Rate limit exceeded."}, {"Retry-After": wait})
+            return
+        if roll < st.p429:
+            st.count("injected_429")
+            self._send(429, {"message": "Rate limit exceeded."}, {"Retry-After": 1})
+            return
+        if roll < st.p429 + st.p5xx:
+            st.count("injected_5xx")
+            code = (500, 502, 503, 504)[int(roll * 1e6) % 4]
+            self._send(code, {"message": "Internal Server Error"})
+            return
+
+        route = ROUTES.get(path)
+        if route is None:
+            st.count("not_found")
+            self._send(404, {"message": f"Not Found: {path}"})
+            return
+        try:
+            body = route(self, params)
+        except ValueError as e:
+            st.count("bad_request")
+            self._send(400, {"message": str(e)})
+            return
+        st.count("ok")
+        self._send(200, body)
+
+    # ---------- エンドポイント ----------
+    def bars_daily(self, params):
+        code = params.get("code")
+        code = to_api_code(code) if code else None
+        date = _to_iso(params.get("date"))
+        if not code and not date:
+            raise ValueError("This API requires at least 1 parameter as follows; 'date','code'.")
+        df = self.state.market.bars_query(code, date, _to_iso(params.get("from")), _to_iso(params.get("to")))
+        return self._page("data", df, params)
+
+    def equities_master(self, params):
+        df = self.state.market.master
+        if params.get("code"):
+            df = df[df["Code"] == to_api_code(params["code"])]
+        return self._page("data", df, params)
+
+    def listed_info(self, params):
+        df = self.state.market.master.rename(columns={"CoName": "CompanyName", "CoNameEn": "CompanyNameEnglish",
+                                                      "S33Nm": "Sector33CodeName", "MktNm": "MarketCodeName",
+                                                      "ScaleCat": "ScaleCategory"})
+        return self._page("info", df, params)
+
+    def _fins(self, params, v2):
+        code = params.get("code")
+        code = to_api_code(code) if code else None
+        date = _to_iso(params.get("date"))
+        if not code and not date:
+            raise ValueError("This API requires at least 1 parameter as follows; 'date','code'.")
+        return self.state.market.fins_query(code, date, v2)
+
+    def fins_summary(self, params):
+        return self._page("data", self._fins(params, True), params)
+
+    def fins_statements(self, params):
+        return self._page("statements", self._fins(params, False), params)
+
+    def fins_announcement(self, params):
+        df = self.state.market.announcement
+        if params.get("code"):
+            df = df[df["Code"] == to_api_code(params["code"])]
+        return self._page("announcement", df, params)
+
+    def fins_dividend(self, params):
+        code = params.get("code")
+        if not code:
+            raise ValueError("This API requires at least 1 parameter as follows; 'code'.")
+        df = self.state.market.dividend
+        df = df[df["Code"] == to_api_code(code)]
+        return self._page("dividend", df, params)
+
+
+ROUTES = {
+    "/equities/bars/daily": StubHandler.bars_daily,
+    "/equities/master": StubHandler.equities_master,
+    "/listed/info": StubHandler.listed_info,
+    "/fins/summary": StubHandler.fins_summary,
+    "/fins/statements": StubHandler.fins_statements,
+    "/fins/announcement": StubHandler.fins_announcement,
+    "/fins/dividend": StubHandler.fins_dividend,
+}
+
+
+def make_server(market, host="127.0.0.1", port=8765, **config):
+    """代役サーバーを組み立てる（config は StubState の引数）。port=0 なら空きポート"""
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(market, **config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_thread(market, host="127.0.0.1", port=0, **config):
+    """
+    バックグラウンドのスレッドで起動し、(サーバー, BASE_URL) を返す。
+    ベンチマーク・検証スクリプト用（終わったら server.shutdown()）。
+    """
+    server = make_server(market, host, port, **config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url_of(server)
+
+
+def base_url_of(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v2"
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="J-Quants 代役サーバー（疑似データ）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--codes", type=int, default=4000)
+    parser.add_argument("--days", type=int, default=280)
+    parser.add_argument("--quarters", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="1リクエストごとの応答遅延")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="遅延に上乗せする一様乱数の幅")
+    parser.add_argument("--rpm", type=int, default=0, help="APIキーごとの毎分上限（0 = 無制限）")
+    parser.add_argument("--p429", type=float, default=0.0, help="429 を混ぜる確率")
+    parser.add_argument("--p5xx", type=float, default=0.0, help="5xx を混ぜる確率")
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--api-key", default=None, help="指定時はこのキー以外を 401 にする")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    market = StubMarket.generate(args.codes, args.days, args.quarters, args.seed)
+    server = make_server(market, args.host, args.port, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                         rpm=args.rpm, p429=args.p429, p5xx=args.p5xx, page_size=args.page_size,
+                         api_key=args.api_key, seed=args.seed)
+    print(f"🧪 疑似データ {len(market.codes):,} 銘柄 × {len(market.bars_by_date)} 営業日を準備（{time.time() - t0:.1f}秒）")
+    print(f"🚀 J-Quants 代役サーバー起動: {base_url_of(server)}")
+    print(f"   JQUANTS_BASE_URL={base_url_of(server)} を設定すると app.py / batch.py / 兵站Bot がこちらへ接続します。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
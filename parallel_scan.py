@@ -0,0 +1,185 @@
+import gc
+import os
+import sys
+import concurrent.futures
+import multiprocessing
+
+from price_panel import release_blocks
+
+# ==========================================
+# ⚙️ 銘柄ごとスキャンの実行エンジン（スレッド版 / プロセス版）
+# ==========================================
+# execute_chunked_scan    … 従来のスレッドプール版（GIL のため pandas 主体の処理ではほぼ並列にならない）
+# execute_chunked_scan_mp … プロセスプール版。process_func の呼び方と結果の集め方は従来と同じ
+#   ・価格パネルは共有メモリに一度だけ置き、ワーカーは起動時に読み取り専用で貼り付ける
+#     （(code, group) の group を pickle で毎回送らない。ワーカー側で panel.code_frame から作り直す）
+#   ・process_func と *args はワーカー起動時に1回だけ渡す（チャンクごとに送るのは銘柄コードだけ）
+#   ・1タスク = 1チャンク（既定 200銘柄まで、ワーカー数 × 4 個以上に割る）。チャンクごとにワーカー内で強制GC
+#   ・ワーカーは forkserver（無ければ spawn）で起こす。Streamlit の多スレッドのプロセスを丸ごと fork しない
+# process_func は import できるモジュールの関数であること（app.py の中の関数や lambda は別プロセスへ送れない）。
+# 送れない関数・ワーカー1以下・銘柄数が MP_MIN_ITEMS 未満のときは自動でスレッド版に切り替える
+# （ワーカーの起動に 1〜2 秒かかるため、数十銘柄ならスレッド版の方が速い）。
+# 環境変数 SCAN_WORKERS（ワーカー数。既定は CPU 数）/ SCAN_MP_MIN_ITEMS で変更できる。
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "0")) or None
+MP_MIN_ITEMS = int(os.getenv("SCAN_MP_MIN_ITEMS", "300"))
+
+
+def execute_chunked_scan(codes_or_groups, process_func, *args, max_workers=3, chunk_size=200, progress=None):
+    """
+    OOM（メモリ枯渇）を回避するためのマイクロバッチ実行エンジン。
+    引数のリストをchunk_sizeごとに分割し、1チャンク終わるごとに強制GCを発動する。
+    progress(済んだ件数, 全件数) を渡せば1チャンクごとに呼ぶ。
+    """
+    all_results = []
+
+    # codes_or_groups は [code1, code2...] または [(code, group), ...] のリストを想定
+    for i in range(0, len(codes_or_groups), chunk_size):
+        chunk = codes_or_groups[i:i + chunk_size]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if isinstance(chunk[0], tuple): # (code, group) の場合 (TAB2, TAB3など)
+                futs = [executor.submit(process_func, c, g, *args) for c, g in chunk]
+            else: # code 単体の場合
+                futs = [executor.submit(process_func, c, *args) for c in chunk]
+
+            for f in concurrent.futures.as_completed(futs):
+                try:
+                    res = f.result()
+                    if res:
+                        if isinstance(res, list):
+                            all_results.extend(res)
+                        else:
+                            all_results.append(res)
+                except Exception:
+                    pass
+
+        # 🚨 チャンクごとに役目を終えた一時メモリを強制焼却（ガベージコレクション）
+        gc.collect()
+        if progress:
+            progress(min(i + chunk_size, len(codes_or_groups)), len(codes_or_groups))
+
+    return all_results
+
+
+# ---------- プロセス版 ----------
+# ワーカー側の状態（initializer で1回だけ組み立てる）
+_WORKER = {}
+
+
+def worker_panel():
+    """
+    プロセス版のワーカー内で、共有メモリ上の価格パネル（PricePanel）を返す。
+    コード単体で呼ばれる process_func が自分でデータを引くときに使う。
+    ワーカー外（スレッド版に切り替わったときを含む）では None。
+    """
+    return _WORKER.get("panel")
+
+
+def _importable(fn):
+    """別プロセスへ名前で送れる関数か（モジュールから同じ名前で引ける）"""
+    mod = getattr(fn, "__module__", None)
+    qual = getattr(fn, "__qualname__", "")
+    if not mod or mod == "__main__" or "<locals>" in qual or "<lambda>" in qual:
+        return False
+    obj = sys.modules.get(mod)
+    for part in qual.split("."):
+        obj = getattr(obj, part, None)
+    return obj is fn
+
+
+def _mp_context(module):
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" not in methods:
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    # forkserver が最初に起動するときに重いモジュールを読み込んでおく（以降のワーカーはそこから fork）
+    ctx.set_forkserver_preload(["numpy", "pandas", "price_panel", module])
+    return ctx
+
+
+def _init_worker(layout):
+    from price_panel import PricePanel
+    keep = _WORKER.setdefault("blocks", [])
+    _WORKER["panel"] = PricePanel.attach(layout["panel"], keep) if layout["panel"] else None
+    _WORKER["func"] = layout["func"]
+    _WORKER["args"] = layout["args"]
+    _WORKER["tail"] = layout["tail"]
+
+
+def _run_chunk(chunk):
+    """
+    1チャンク分を処理して結果のリストを返す。
+    chunk の要素は ('code', コード) / ('panel', コード) / ('group', (コード, group))。
+    """
+    fn, args, panel, tail = _WORKER["func"], _WORKER["args"], _WORKER["panel"], _WORKER["tail"]
+    out = []
+    for kind, item in chunk:
+        try:
+            if kind == "code":
+                res = fn(item, *args)
+            elif kind == "panel":
+                res = fn(item, panel.code_frame(panel.row(item), tail=tail), *args)
+            else:
+                res = fn(item[0], item[1], *args)
+            if res:
+                if isinstance(res, list):
+                    out.extend(res)
+                else:
+                    out.append(res)
+        except Exception:
+            pass
+    gc.collect()
+    return out
+
+
+def execute_chunked_scan_mp(codes_or_groups, process_func, *args, panel=None, max_workers=None, chunk_size=200,
+                            tail=None, progress=None, min_items=None):
+    """
+    execute_chunked_scan のプロセスプール版（引数・戻り値の約束は同じ）。
+    ・[(code, group), ...] を渡し panel も渡した場合、panel にある銘柄の group はワーカー側で
+      panel.code_frame(行, tail) から作る（panel に無い銘柄だけ group を送る）
+    ・[code, ...] を渡した場合は process_func(code, *args)。panel を渡せば worker_panel() で引ける
+    結果はチャンク順に連結する。progress(済んだ件数, 全件数) で親プロセス側の進捗を受け取れる。
+    銘柄数が min_items（既定 MP_MIN_ITEMS）未満ならスレッド版で回す。
+    """
+    if not codes_or_groups:
+        return []
+    max_workers = max_workers or SCAN_WORKERS or os.cpu_count() or 1
+    min_items = MP_MIN_ITEMS if min_items is None else min_items
+    if max_workers <= 1 or len(codes_or_groups) < min_items or not _importable(process_func):
+        if panel is not None:
+            codes_or_groups = [(it[0], panel.code_frame(panel.row(it[0]), tail=tail))
+                               if isinstance(it, tuple) and panel.row(it[0]) is not None else it
+                               for it in codes_or_groups]
+        return execute_chunked_scan(codes_or_groups, process_func, *args, max_workers=max(max_workers, 1),
+                                    chunk_size=chunk_size, progress=progress)
+
+    items = []
+    for it in codes_or_groups:
+        if not isinstance(it, tuple):
+            items.append(("code", it))
+        elif panel is not None and panel.row(it[0]) is not None:
+            items.append(("panel", it[0]))
+        else:
+            items.append(("group", it))
+    size = max(1, min(chunk_size, -(-len(items) // (max_workers * 4))))
+    chunks = [items[i:i + size] for i in range(0, len(items), size)]
+
+    blocks = []
+    results = []
+    try:
+        layout = {"panel": panel.share(blocks) if panel is not None else None,
+                  "func": process_func, "args": args, "tail": tail}
+        ctx = _mp_context(process_func.__module__)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(chunks)), mp_context=ctx,
+                                                    initializer=_init_worker, initargs=(layout,)) as exe:
+            done = 0
+            for chunk, part in zip(chunks, exe.map(_run_chunk, chunks)):
+                results.extend(part)
+                done += len(chunk)
+                if progress:
+                    progress(done, len(items))
+    finally:
+        release_blocks(blocks)
+    return results
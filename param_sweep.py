@@ -0,0 +1,181 @@
+import os
+import time
+import itertools
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+import batch
+import backtester
+from price_panel import PricePanel, share_array, attach_array, release_blocks
+
+# ==========================================
+# 🔬 押し目狙撃戦略のパラメータ探索（backtester をプロセスプールで並列に回す）
+# ==========================================
+# push_r × 到達度帯 × bt_tp × bt_sl_i × bt_sell_d の格子（既定 432通り）を総当たりし、順位表を作る。
+# ・価格パネルと標的の配信判定は共有メモリ（multiprocessing.shared_memory）に一度だけ置き、
+#   ワーカーは起動時にそれを読み取り専用で貼り付ける（組み合わせごとに pickle で送らない）
+# ・窓の特徴量（backtester.window_features）は親プロセスで一度だけ作り、
+#   push_r × 到達度帯ごとの配信判定はそこから作って使い回す（波形判定も同じ窓は1回だけ）
+# ・各ワーカーがやるのは売買の再生（backtester.simulate）と集計だけ
+# Streamlit のプロセスでは回さず、CLI（または夜間ジョブ）で SWEEP_FILE に書き出し、画面は結果を読むだけ。
+
+SWEEP_FILE = os.getenv("SWEEP_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sweep_results.csv"))
+
+DEFAULT_GRID = {
+    "push_r": [25.0, 50.0, 61.8],
+    "reach": [batch.REACH_RANGE, (70, 135), (50, 110), (80, 120)],
+    "bt_tp": [5.0, 10.0, 15.0, 20.0],
+    "bt_sl_i": [5.0, 8.0, 10.0],
+    "bt_sell_d": [5, 10, 15],
+}
+
+STAT_COLS = ["trades", "win_rate", "profit_factor", "total_pnl", "avg_return_pct", "avg_held", "max_drawdown", "max_open"]
+
+# ワーカー側で共有メモリから組み立てた入力（プロセスごとに1回）
+_WORKER = {}
+
+
+def expand_grid(grid=None, base=None):
+    """
+    格子 → 組み合わせのリスト。各要素は (配信判定のキー (push_r, 到達度下限, 上限), backtester の params)。
+    格子に無いキーは base（サイドバー設定と同じキー）か既定値。
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    base = backtester.resolve_params(base)
+    sim_keys = [k for k in grid if k not in ("push_r", "reach")]
+    combos = []
+    for push_r, reach in itertools.product(grid["push_r"], grid["reach"]):
+        for values in itertools.product(*(grid[k] for k in sim_keys)):
+            params = backtester.resolve_params({**base, "push_r": push_r, **dict(zip(sim_keys, values))})
+            combos.append(((params["push_r"], float(reach[0]), float(reach[1])), params))
+    return combos
+
+
+def _init_worker(layout):
+    """プロセスプールの initializer：共有メモリを貼り付けて PricePanel と配信判定を組み立てる"""
+    keep = _WORKER.setdefault("blocks", [])
+    _WORKER["panel"] = PricePanel.attach(layout["panel"], keep)
+    _WORKER["signals"] = {key: {"signal": attach_array(sig, keep), "bt": attach_array(bt, keep)}
+                          for key, (sig, bt) in layout["signals"].items()}
+
+
+def _run_combo(task):
+    key, params = task
+    trades, equity = backtester.simulate(_WORKER["panel"], _WORKER["signals"][key], params)
+    stats = backtester.summarize(trades, equity)
+    return {"push_r": key[0], "reach_lo": key[1], "reach_hi": key[2],
+            **{k: params[k] for k in ("bt_tp", "bt_sl_i", "bt_sell_d", "bt_sl_c", "limit_d", "bt_lot")},
+            **{k: stats[k] for k in STAT_COLS}}
+
+
+# ---------- 探索 ----------
+def rank_results(rows, sort_by="profit_factor", min_trades=30):
+    """結果行 → 順位表。取引数が min_trades 未満の組は順位の後ろに回す"""
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    df["enough"] = df["trades"] >= min_trades
+    df = df.sort_values(["enough", sort_by, "total_pnl"], ascending=False, kind='stable').drop(columns="enough")
+    df.insert(0, "rank", np.arange(1, len(df) + 1))
+    return df.reset_index(drop=True)
+
+
+def run_sweep(panel, grid=None, base=None, master=None, workers=None, sort_by="profit_factor", min_trades=30,
+              top_n=batch.TOP_N, progress=None):
+    """
+    格子を総当たりして順位表（DataFrame）を返す。
+    workers=1 なら同じプロセスで順に回す（一致検証・デバッグ用）。progress(済, 全) で進捗を受け取れる。
+    """
+    combos = expand_grid(grid, base)
+    feat = backtester.window_features(panel, master)
+    signals = {}
+    for key in dict.fromkeys(k for k, _ in combos):
+        sig = backtester.signals_from_features(feat, key[0], key[1:], top_n)
+        signals[key] = {"signal": sig["signal"], "bt": sig["bt"]}
+    del feat
+
+    workers = workers or os.cpu_count() or 1
+    rows = []
+    if workers <= 1:
+        _WORKER.update(panel=panel, signals=signals)
+        try:
+            for n, task in enumerate(combos, 1):
+                rows.append(_run_combo(task))
+                if progress:
+                    progress(n, len(combos))
+        finally:
+            _WORKER.clear()
+        return rank_results(rows, sort_by, min_trades)
+
+    blocks = []
+    try:
+        layout = {
+            "panel": panel.share(blocks),
+            "signals": {key: (share_array(s["signal"], blocks), share_array(s["bt"], blocks)) for key, s in signals.items()},
+        }
+        del signals
+        chunk = max(1, len(combos) // (workers * 8))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(layout,)) as exe:
+            for n, row in enumerate(exe.map(_run_combo, combos, chunksize=chunk), 1):
+                rows.append(row)
+                if progress:
+                    progress(n, len(combos))
+    finally:
+        release_blocks(blocks)
+    return rank_results(rows, sort_by, min_trades)
+
+
+def load_results(path=SWEEP_FILE):
+    """書き出した順位表を読む。無ければ空の DataFrame"""
+    if not path or not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_csv(path)
+
+
+def _floats(text):
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="押し目狙撃戦略のパラメータ探索（並列）")
+    parser.add_argument("--root", default=None, help="日足ストアのディレクトリ（既定は prices_store/）")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカー数（既定は CPU 数、1 なら逐次）")
+    parser.add_argument("--push-r", default=None, help="例: 25,50,61.8")
+    parser.add_argument("--reach", default=None, help="到達度帯。例: 50-135,70-135")
+    parser.add_argument("--bt-tp", default=None)
+    parser.add_argument("--bt-sl-i", default=None)
+    parser.add_argument("--bt-sell-d", default=None)
+    parser.add_argument("--sort-by", default="profit_factor", choices=STAT_COLS)
+    parser.add_argument("--min-trades", type=int, default=30)
+    parser.add_argument("--out", default=SWEEP_FILE)
+    parser.add_argument("--show", type=int, default=15, help="表示する上位件数")
+    args = parser.parse_args()
+
+    grid = {}
+    for k in ("push_r", "bt_tp", "bt_sl_i", "bt_sell_d"):
+        v = getattr(args, k)
+        if v:
+            grid[k] = _floats(v)
+    if args.reach:
+        grid["reach"] = [tuple(_floats(band.replace("-", ","))) for band in args.reach.split(",") if "-" in band]
+
+    t0 = time.perf_counter()
+    panel = PricePanel.from_store(root=args.root)
+    if len(panel) == 0:
+        raise SystemExit("日足ストアが空です")
+    n_combos = len(expand_grid(grid))
+    print(f"🔬 {len(panel):,}銘柄 × {panel.shape[1]}営業日 / {n_combos}通り / ワーカー {args.workers or os.cpu_count()}")
+
+    def report(done, total):
+        if done % max(1, total // 10) == 0 or done == total:
+            print(f"  … {done}/{total}（{time.perf_counter() - t0:.1f}秒）")
+
+    res = run_sweep(panel, grid, workers=args.workers, sort_by=args.sort_by, min_trades=args.min_trades, progress=report)
+    res.to_csv(args.out, index=False, encoding="utf-8-sig")
+    print(f"✅ {len(res)}通りを {time.perf_counter() - t0:.1f}秒で評価し、{args.out} に書き出しました。")
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        print(res.head(args.show).to_string(index=False))
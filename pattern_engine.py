@@ -0,0 +1,167 @@
+import numpy as np
+
+# ==========================================
+# ⚡ 天井・底の波形一括判定（二重天井・三尊・二重底）
+# ==========================================
+# 1銘柄ずつの check_double_top / check_head_shoulders / check_double_bottom と同じ規則を、
+# 右詰めの (銘柄, 本数) 配列に対して全銘柄まとめて評価する。
+# ・極値候補: 両隣以上（谷は以下）の足。直前に採用した極値から gap 本以内の候補は捨てる（先着優先）
+#   → この「先着で間引く」処理だけは時間方向に順送りが必要なので、本数ぶん（30回程度）配列演算を回す
+# ・二重天井: 直近2山が5%以内、間の谷が山の95%未満、終値が右の山の97%未満
+#   （最終足が前日高値を上回っていれば、それも山として扱う）
+# ・三尊:     中央の山が両肩より高く、両肩が10%以内、終値が右肩の97%未満
+# ・二重底:   直近2谷が5%以内、間の山が谷の104%超、終値が右の谷の101%超
+#
+# app.py と batch.py では最小本数と間引き幅が異なるため、プロファイルで切り替える。
+# （batch 版二重底の「末尾2本目を谷に足す」規則は、ループ内の判定と同一条件なので結果に影響しない）
+
+PROFILES = {
+    # 名前: {波形: (最小本数, 間引き幅)}
+    "app": {"dt": (6, 1), "hs": (8, 1), "db": (6, 1)},
+    "batch": {"dt": (15, 3), "hs": (20, 2), "db": (15, 3)},
+}
+
+
+def _pick_extrema(x, gap, lowest=False, keep=3, trailing=False):
+    """
+    各行の極値を先着順に間引きながら拾い、直近 keep 個の位置を返す（足りない分は -1）。
+    x は右詰め（左側が NaN 埋め）の (銘柄, 本数) 配列。
+    """
+    n, w = x.shape
+    picks = np.full((n, keep), -1, dtype='int64')
+    if w < 3:
+        return picks
+    with np.errstate(invalid='ignore'):
+        mid, left, right = x[:, 1:-1], x[:, :-2], x[:, 2:]
+        if lowest:
+            cand = (mid <= left) & (mid <= right)
+        else:
+            cand = (mid >= left) & (mid >= right)
+    for j in range(1, w - 1):
+        last = picks[:, -1]
+        take = cand[:, j - 1] & ((last < 0) | (j - last > gap))
+        if take.any():
+            picks[take, :-1] = picks[take, 1:]
+            picks[take, -1] = j
+    if trailing:
+        with np.errstate(invalid='ignore'):
+            rising = x[:, -1] > x[:, -2]
+        last = picks[:, -1]
+        take = rising & ((last < 0) | ((w - 1) - last > gap))
+        picks[take, :-1] = picks[take, 1:]
+        picks[take, -1] = w - 1
+    return picks
+
+
+def _take(x, idx):
+    return np.take_along_axis(x, np.clip(idx, 0, None)[:, None], axis=1)[:, 0]
+
+
+def _range_reduce(x, lo, hi, fn, fill):
+    """各行の x[lo:hi+1] を fn（np.min / np.max）で集約する"""
+    pos = np.arange(x.shape[1])[None, :]
+    mask = (pos >= lo[:, None]) & (pos <= hi[:, None])
+    return fn(np.where(mask, x, fill), axis=1)
+
+
+def detect_patterns(h, l, c, counts, profile="batch"):
+    """
+    h, l, c: 右詰めの (銘柄, 本数) 配列、counts: 各銘柄の有効本数。
+    {'dt': 二重天井, 'hs': 三尊, 'db': 二重底} の真偽配列を返す。
+    """
+    prof = PROFILES[profile]
+    counts = np.asarray(counts)
+    last_c = c[:, -1]
+    out = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 🔴 二重天井
+        min_len, gap = prof["dt"]
+        pk = _pick_extrema(h, gap, keep=2, trailing=True)
+        p1, p2 = pk[:, 0], pk[:, 1]
+        v1, v2 = _take(h, p1), _take(h, p2)
+        valley = _range_reduce(l, p1, p2, np.min, np.inf)
+        out["dt"] = ((counts >= min_len) & (p1 >= 0)
+                     & (np.abs(v2 - v1) / np.maximum(v2, v1) < 0.05)
+                     & (valley < np.minimum(v1, v2) * 0.95)
+                     & (last_c < v2 * 0.97))
+
+        # 🔴 三尊
+        min_len, gap = prof["hs"]
+        pk = _pick_extrema(h, gap, keep=3)
+        v1, v2, v3 = _take(h, pk[:, 0]), _take(h, pk[:, 1]), _take(h, pk[:, 2])
+        out["hs"] = ((counts >= min_len) & (pk[:, 0] >= 0)
+                     & (v2 > v1) & (v2 > v3)
+                     & (np.abs(v3 - v1) / np.maximum(v3, v1) < 0.10)
+                     & (last_c < v3 * 0.97))
+
+        # 🟢 二重底
+        min_len, gap = prof["db"]
+        vk = _pick_extrema(l, gap, lowest=True, keep=2)
+        q1, q2 = vk[:, 0], vk[:, 1]
+        w1, w2 = _take(l, q1), _take(l, q2)
+        peak = _range_reduce(h, q1, q2, np.max, -np.inf)
+        out["db"] = ((counts >= min_len) & (q1 >= 0)
+                     & (np.abs(w2 - w1) / np.minimum(w2, w1) < 0.05)
+                     & (peak > np.maximum(w1, w2) * 1.04)
+                     & (last_c > w2 * 1.01))
+    return out
+
+
+def scan_patterns(panel, window=30, profile="batch"):
+    """価格パネル全銘柄の直近 window 本（有効足のみ）で3波形を判定する"""
+    vals, _, counts = panel.tail_valid(window)
+    f = panel.field_index
+    return detect_patterns(vals[:, :, f["AdjH"]], vals[:, :, f["AdjL"]], vals[:, :, f["AdjC"]], counts, profile)
+
+
+def detect_frame(df_sub, profile="app"):
+    """1銘柄のDataFrame（AdjH/AdjL/AdjC）を判定する。{'dt','hs','db'} → bool"""
+    h = df_sub['AdjH'].values[None, :]
+    l = df_sub['AdjL'].values[None, :]
+    c = df_sub['AdjC'].values[None, :]
+    res = detect_patterns(h, l, c, [len(df_sub)], profile)
+    return {k: bool(v[0]) for k, v in res.items()}
+
+
+def check_parity(panel, window=30, profile="batch"):
+    """
+    一括判定と1銘柄ずつの判定関数（app 版は scan_core、batch 版は batch.py）を突き合わせる。
+    不一致の (コード, 波形, 一括, 個別) のリストを返す（空なら完全一致）。
+    """
+    import pandas as pd
+    if profile == "app":
+        from scan_core import check_double_top, check_head_shoulders, check_double_bottom
+    else:
+        from batch import check_double_top, check_head_shoulders, check_double_bottom
+    funcs = {"dt": check_double_top, "hs": check_head_shoulders, "db": check_double_bottom}
+
+    vals, dates, counts = panel.tail_valid(window)
+    f = panel.field_index
+    fast = detect_patterns(vals[:, :, f["AdjH"]], vals[:, :, f["AdjL"]], vals[:, :, f["AdjC"]], counts, profile)
+    mismatches = []
+    for r in range(len(panel)):
+        m = ~np.isnat(dates[r])
+        df_sub = pd.DataFrame(vals[r][m], columns=panel.fields)
+        for key, fn in funcs.items():
+            slow = bool(fn(df_sub))
+            if bool(fast[key][r]) != slow:
+                mismatches.append((panel.codes[r], key, bool(fast[key][r]), slow))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+    from price_panel import PricePanel
+    import price_store
+
+    panel = PricePanel.from_store(days=price_store.list_days()[-40:])
+    if len(panel) == 0:
+        raise SystemExit("日足ストアが空です（兵站Botを先に実行してください）")
+    for prof, win in (("batch", 30), ("app", 31)):
+        t0 = time.time()
+        res = scan_patterns(panel, win, prof)
+        print(f"[{prof}] 一括判定: {len(panel)} 銘柄 {(time.time() - t0) * 1000:.1f}ms "
+              f"(二重天井 {res['dt'].sum()} / 三尊 {res['hs'].sum()} / 二重底 {res['db'].sum()})")
+        bad = check_parity(panel, win, prof)
+        print("  ✅ 個別判定と完全一致" if not bad else f"  ❌ 不一致 {len(bad)} 件: {bad[:5]}")
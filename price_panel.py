@@ -0,0 +1,245 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import price_store
+from price_store import FIELDS, to_api_code
+
+# ==========================================
+# 🧊 銘柄 × 営業日 × 列 の密パネル（float32）
+# ==========================================
+# values[銘柄行, 日付列, 列番号] の3次元配列に全銘柄の日足を敷き詰める。
+# ・code_index / date_index で1銘柄・1日を O(1) で引ける
+# ・field('AdjC') で (銘柄, 日付) の2次元ビューが取れ、全銘柄一括のベクトル演算ができる
+# ・欠損（未上場・休止・取得漏れ）は NaN
+# 縦持ちDataFrameを毎回 .str[:4].isin → groupby する代わりに使う。
+
+OHLC = ("AdjO", "AdjH", "AdjL", "AdjC")
+
+
+# ---------- 共有メモリ（別プロセスへ pickle せずに配列を渡す） ----------
+def share_array(arr, blocks):
+    """
+    配列を共有メモリへ写し、別プロセスで attach_array に渡す (名前, 形, 型) を返す。
+    作った SharedMemory は blocks に積む（使い終わったら呼び出し側で release_blocks）。
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    blocks.append(shm)
+    return (shm.name, arr.shape, arr.dtype.str)
+
+
+def attach_array(spec, keep):
+    """share_array の返り値から読み取り専用の配列ビューを作る。SharedMemory は keep に積んで生かしておく"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    keep.append(shm)
+    arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    arr.flags.writeable = False
+    return arr
+
+
+def release_blocks(blocks):
+    """share_array で作った共有メモリを閉じて破棄する"""
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+    blocks.clear()
+
+
+def _to_datetime64(d):
+    if isinstance(d, str) and len(d) == 8 and d.isdigit():
+        d = f"{d[:4]}-{d[4:6]}-{d[6:]}"
+    return np.datetime64(pd.Timestamp(d), 'ns')
+
+
+class PricePanel:
+    """
+    codes: 5桁コード配列、dates: 昇順の日付配列、values: (銘柄, 日付, 列) の float32 配列。
+    読み取り専用で共有する前提（スレッド・セッション間で使い回してよい）。
+    """
+
+    def __init__(self, codes, dates, values, fields=None):
+        self.codes = np.asarray(codes, dtype=object)
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.values = values
+        self.fields = list(fields or FIELDS)
+        self.code_index = {c: i for i, c in enumerate(self.codes)}
+        self.date_index = {d: j for j, d in enumerate(self.dates)}
+        self.field_index = {f: k for k, f in enumerate(self.fields)}
+        self._prefix_index = None
+
+    # ---------- 構築 ----------
+    @classmethod
+    def empty(cls, fields=None):
+        fields = list(fields or FIELDS)
+        return cls([], [], np.empty((0, 0, len(fields)), dtype='float32'), fields)
+
+    @classmethod
+    def from_frame(cls, df, fields=None):
+        """縦持ちDataFrame（Code, Date, 各列）から組み立てる。同じ銘柄・日付の重複は後勝ち"""
+        fields = list(fields or FIELDS)
+        if df is None or df.empty or 'Code' not in df.columns or 'Date' not in df.columns:
+            return cls.empty(fields)
+        codes, row = np.unique(df['Code'].astype(str).map(to_api_code).values, return_inverse=True)
+        dates, col = np.unique(pd.to_datetime(df['Date']).values.astype('datetime64[ns]'), return_inverse=True)
+        values = np.full((len(codes), len(dates), len(fields)), np.nan, dtype='float32')
+        for k, f in enumerate(fields):
+            if f in df.columns:
+                values[row, col, k] = pd.to_numeric(df[f], errors='coerce').values.astype('float32')
+        return cls(codes, dates, values, fields)
+
+    @classmethod
+    def from_store(cls, days=None, codes=None, fields=None, root=None):
+        """日足ストアから直接組み立てる（縦持ちDataFrameを経由しない）"""
+        fields = list(fields or FIELDS)
+        code_dict = price_store.load_code_dict(root)
+        available = price_store.list_days(root)
+        if days is not None:
+            available_set = set(available)
+            available = sorted(d for d in days if d in available_set)
+        if not available or not code_dict:
+            return cls.empty(fields)
+
+        # 辞書番号 → パネル行番号（対象外は -1）
+        if codes is None:
+            picked = np.arange(len(code_dict), dtype='int32')
+        else:
+            index = {c: i for i, c in enumerate(code_dict)}
+            picked = np.array(sorted({index[c] for c in map(to_api_code, codes) if c in index}), dtype='int32')
+        row_of = np.full(len(code_dict), -1, dtype='int64')
+        row_of[picked] = np.arange(len(picked))
+
+        values = np.full((len(picked), len(available), len(fields)), np.nan, dtype='float32')
+        filt = None if codes is None else picked
+        for j, d in enumerate(available):
+            part = price_store.read_day(d, fields, filt, root)
+            rows = row_of[part["code_idx"]]
+            for k, f in enumerate(fields):
+                values[rows, j, k] = part[f]
+
+        dates = [_to_datetime64(d) for d in available]
+        panel = cls(np.asarray(code_dict, dtype=object)[picked], dates, values, fields)
+        # 期間中に1本も無い銘柄（上場廃止済み等）は落とし、from_frame と同じくコード順に並べる
+        keep = np.flatnonzero(panel.valid_mask().any(axis=1))
+        return panel.take(keep[np.argsort(panel.codes[keep].astype(str), kind='stable')])
+
+    def share(self, blocks):
+        """values を共有メモリへ置き、別プロセスで PricePanel.attach に渡す辞書を返す"""
+        return {"codes": self.codes, "dates": self.dates, "fields": self.fields,
+                "values": share_array(np.ascontiguousarray(self.values), blocks)}
+
+    @classmethod
+    def attach(cls, spec, keep):
+        """share() の辞書から、共有メモリ上の values をそのまま使う読み取り専用パネルを組み立てる"""
+        return cls(spec["codes"], spec["dates"], attach_array(spec["values"], keep), spec["fields"])
+
+    # ---------- 参照 ----------
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def row(self, code):
+        """銘柄コード（4桁/5桁）→ 行番号。無ければ None"""
+        return self.code_index.get(to_api_code(code))
+
+    def rows(self, codes):
+        """
+        銘柄コード群 → 行番号配列（入力順、重複・欠番は除外）。
+        4桁指定は先頭4桁が一致する全銘柄（優先株等の5桁目違いも含む）に当てる。
+        """
+        if self._prefix_index is None:
+            prefix = {}
+            for i, c in enumerate(self.codes):
+                prefix.setdefault(str(c)[:4], []).append(i)
+            self._prefix_index = prefix
+        out = []
+        for c in codes:
+            c = str(c).replace('.0', '').strip()
+            if len(c) >= 5:
+                i = self.code_index.get(c)
+                hits = [] if i is None else [i]
+            else:
+                hits = self._prefix_index.get(c, [])
+            out.extend(hits)
+        return np.array(list(dict.fromkeys(out)), dtype='int64')
+
+    def col(self, date):
+        """日付（'YYYYMMDD' / Timestamp / datetime64）→ 列番号。無ければ None"""
+        return self.date_index.get(_to_datetime64(date))
+
+    def field(self, name):
+        """(銘柄, 日付) の2次元ビュー"""
+        return self.values[:, :, self.field_index[name]]
+
+    def series(self, code, name="AdjC"):
+        i = self.row(code)
+        return None if i is None else self.values[i, :, self.field_index[name]]
+
+    def valid_mask(self, fields=OHLC):
+        """指定列がすべて埋まっている (銘柄, 日付) の真偽配列"""
+        ks = [self.field_index[f] for f in fields if f in self.field_index]
+        return ~np.isnan(self.values[:, :, ks]).any(axis=2)
+
+    def code_frame(self, code_or_row, tail=None, dropna=True):
+        """1銘柄分を従来の groupby グループと同じ形（Code, Date, 各列）のDataFrameで返す"""
+        i = code_or_row if isinstance(code_or_row, (int, np.integer)) else self.row(code_or_row)
+        if i is None:
+            return pd.DataFrame(columns=['Code', 'Date'] + self.fields)
+        block = self.values[i]
+        dates = self.dates
+        if dropna:
+            keep = ~np.isnan(block[:, self.field_index["AdjC"]]) if "AdjC" in self.field_index else slice(None)
+            block, dates = block[keep], dates[keep]
+        if tail is not None:
+            block, dates = block[-tail:], dates[-tail:]
+        df = pd.DataFrame(block, columns=self.fields)
+        df.insert(0, 'Date', dates)
+        df.insert(0, 'Code', self.codes[i])
+        return df
+
+    # ---------- 切り出し ----------
+    def take(self, rows):
+        rows = np.asarray(rows, dtype='int64')
+        return PricePanel(self.codes[rows], self.dates, self.values[rows], self.fields)
+
+    def select(self, codes):
+        return self.take(self.rows(codes))
+
+    def tail(self, n):
+        """直近 n 営業日（列）だけのビュー"""
+        return PricePanel(self.codes, self.dates[-n:], self.values[:, -n:], self.fields)
+
+    def tail_valid(self, n, fields=OHLC):
+        """
+        銘柄ごとに「有効な直近 n 本」を右詰めで集める（groupby('Code').tail(n) 相当）。
+        (値 (銘柄, n, 列), 日付 (銘柄, n), 本数) を返す。足りない分は NaN / NaT で左側を埋める。
+        """
+        valid = self.valid_mask(fields)
+        # 各位置から末尾までの有効本数（1 = 最新の有効足）
+        from_end = np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+        sel = valid & (from_end <= n)
+        ci, di = np.nonzero(sel)
+        slot = n - from_end[ci, di]
+        out = np.full((len(self.codes), n, len(self.fields)), np.nan, dtype='float32')
+        out[ci, slot] = self.values[ci, di]
+        out_dates = np.full((len(self.codes), n), np.datetime64('NaT'), dtype='datetime64[ns]')
+        out_dates[ci, slot] = self.dates[di]
+        counts = np.minimum(valid.sum(axis=1), n)
+        return out, out_dates, counts
+
+    def to_frame(self, dropna=True):
+        """縦持ちDataFrame（Code, Date, 各列）に戻す"""
+        ci, di = np.nonzero(self.valid_mask(("AdjC",)) if dropna else np.ones(self.shape[:2], dtype=bool))
+        df = pd.DataFrame(self.values[ci, di], columns=self.fields)
+        df.insert(0, 'Date', self.dates[di])
+        df.insert(0, 'Code', self.codes[ci])
+        return df
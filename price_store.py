@@ -0,0 +1,362 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🗄️ 日足カラムナ・ストア（1営業日 = 1ファイル / 追記専用）
+# ==========================================
+# prices_store/
+#   codes.json        … 銘柄コード辞書（追記専用。インデックス = 辞書番号）
+#   manifest.json     … 取得記録（日付ごとの取得時刻・行数、空振りだった日、遡及調整済みの分割・併合）
+#   20260105.npz      … その日の全銘柄分（code_idx:int32 + OHLCV:float32 の列）
+#
+# 各 .npz は列ごとに独立して読み出せるため、N日 × M銘柄 × 必要列だけを
+# ロードでき、巨大pickleを丸ごと復元する必要がない。
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prices_store")
+CODES_FILE = "codes.json"
+MANIFEST_FILE = "manifest.json"
+FIELDS = ["AdjO", "AdjH", "AdjL", "AdjC", "Volume"]
+
+# 🚨 V1/V2・調整前後のキー名揺れを吸収する候補表（先頭ほど優先）
+FIELD_CANDIDATES = {
+    "AdjO": ["AdjO", "AdjustmentOpen", "Open", "O"],
+    "AdjH": ["AdjH", "AdjustmentHigh", "High", "H"],
+    "AdjL": ["AdjL", "AdjustmentLow", "Low", "L"],
+    "AdjC": ["AdjC", "AdjustmentClose", "Close", "C"],
+    "Volume": ["AdjVo", "AdjustmentVolume", "Vo", "Volume"],
+}
+
+_write_lock = threading.Lock()
+
+
+def _root(root=None):
+    return root or STORE_DIR
+
+
+def to_api_code(code):
+    """4桁コードを J-Quants 形式の5桁に揃える（'.0' 混入も除去）"""
+    c = str(code).replace('.0', '').strip()
+    return c if len(c) >= 5 else c + "0"
+
+
+def load_code_dict(root=None):
+    path = os.path.join(_root(root), CODES_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json_atomic(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_manifest(root=None):
+    path = os.path.join(_root(root), MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"days": {}, "empty": {}, "splits": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            m = json.load(f)
+        m.setdefault("days", {})
+        m.setdefault("empty", {})
+        m.setdefault("splits", {})
+        return m
+    except Exception:
+        return {"days": {}, "empty": {}, "splits": {}}
+
+
+def _update_manifest(root, dt_str, rows=None, fetched_at=None):
+    m = load_manifest(root)
+    stamp = fetched_at or pd.Timestamp.now(tz='Asia/Tokyo').isoformat()
+    if rows:
+        m["days"][dt_str] = {"rows": int(rows), "fetched_at": stamp}
+        m["empty"].pop(dt_str, None)
+    else:
+        m["empty"][dt_str] = stamp
+    _save_json_atomic(os.path.join(root, MANIFEST_FILE), m)
+
+
+def mark_empty(dt_str, root=None):
+    """休場日などでデータが無かった日を記録し、次回以降の無駄撃ちを防ぐ"""
+    root = _root(root)
+    with _write_lock:
+        os.makedirs(root, exist_ok=True)
+        _update_manifest(root, dt_str)
+
+
+def bars_to_columns(records):
+    """APIの生レコード（dictのリスト）を (コード配列, {列: float32配列}) に変換する"""
+    if records is None or len(records) == 0:
+        return np.array([], dtype=object), {f: np.array([], dtype='float32') for f in FIELDS}
+
+    df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+    if 'Code' not in df.columns and 'code' in df.columns:
+        df = df.rename(columns={'code': 'Code'})
+    if 'Code' not in df.columns:
+        return np.array([], dtype=object), {f: np.array([], dtype='float32') for f in FIELDS}
+
+    codes = df['Code'].astype(str).map(to_api_code).values
+    cols = {}
+    for field, candidates in FIELD_CANDIDATES.items():
+        vals = np.full(len(df), np.nan, dtype='float32')
+        for src in candidates:
+            if src in df.columns:
+                # 行ごとに「最初に値が入っている候補列」を採用する
+                v = pd.to_numeric(df[src], errors='coerce').values.astype('float32')
+                vals = np.where(np.isnan(vals), v, vals)
+        cols[field] = vals
+    return codes, cols
+
+
+def write_day(dt_str, records, root=None):
+    """1営業日分の生レコードをストアに焼き付ける。書き込んだ行数を返す"""
+    root = _root(root)
+    codes, cols = bars_to_columns(records)
+    if len(codes) == 0:
+        return 0
+
+    with _write_lock:
+        os.makedirs(root, exist_ok=True)
+        code_dict = load_code_dict(root)
+        index = {c: i for i, c in enumerate(code_dict)}
+        new_codes = [c for c in dict.fromkeys(codes) if c not in index]
+        if new_codes:
+            for c in new_codes:
+                index[c] = len(code_dict)
+                code_dict.append(c)
+            _save_json_atomic(os.path.join(root, CODES_FILE), code_dict)
+
+        code_idx = np.fromiter((index[c] for c in codes), dtype='int32', count=len(codes))
+        order = np.argsort(code_idx, kind='stable')
+        arrays = {"code_idx": code_idx[order]}
+        for f in FIELDS:
+            arrays[f] = cols[f][order]
+
+        _save_day_arrays(root, dt_str, arrays)
+        _update_manifest(root, dt_str, rows=len(codes))
+    return len(codes)
+
+
+def _save_day_arrays(root, dt_str, arrays):
+    path = os.path.join(root, f"{dt_str}.npz")
+    tmp = path + ".tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def extract_adj_factors(records):
+    """当日レコードから調整係数（分割・併合）が 1 以外の銘柄を {コード: 係数} で返す"""
+    if records is None or len(records) == 0:
+        return {}
+    df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+    f_col = next((c for c in ['AdjFactor', 'AdjustmentFactor'] if c in df.columns), None)
+    c_col = 'Code' if 'Code' in df.columns else ('code' if 'code' in df.columns else None)
+    if not f_col or not c_col:
+        return {}
+    fac = pd.to_numeric(df[f_col], errors='coerce')
+    hit = fac.notna() & (fac > 0) & ((fac - 1.0).abs() > 1e-9)
+    return {to_api_code(c): float(v) for c, v in zip(df.loc[hit, c_col], fac[hit])}
+
+
+def apply_adjustment(code_factors, before_dt, root=None, skip_days=()):
+    """
+    分割・併合の発生時、before_dt より前の保存済み日足を遡及調整する。
+    （価格 × 係数、出来高 ÷ 係数。J-Quants の調整済み値と同じ基準に揃える）
+    skip_days: 同じ実行内で取り直した日（既に新基準で調整済み）は対象外にする
+    適用した (分割日, 銘柄) は manifest の splits に記録し、同じ分割日を取り直しても二重に掛けない。
+    """
+    root = _root(root)
+    if not code_factors:
+        return 0
+    with _write_lock:
+        m = load_manifest(root)
+        applied = m["splits"].setdefault(before_dt, {})
+        code_factors = {c: f for c, f in code_factors.items() if c not in applied}
+        if not code_factors:
+            return 0
+        index = {c: i for i, c in enumerate(load_code_dict(root))}
+        targets = {index[c]: f for c, f in code_factors.items() if c in index}
+        applied.update({c: float(f) for c, f in code_factors.items()})
+        if not targets:
+            os.makedirs(root, exist_ok=True)
+            _save_json_atomic(os.path.join(root, MANIFEST_FILE), m)
+            return 0
+        t_idx = np.fromiter(targets.keys(), dtype='int32')
+        t_fac = np.fromiter(targets.values(), dtype='float64')
+        order = np.argsort(t_idx)
+        t_idx, t_fac = t_idx[order], t_fac[order]
+        touched = 0
+        for d in list_days(root):
+            if d >= before_dt or d in skip_days:
+                continue
+            with np.load(os.path.join(root, f"{d}.npz")) as z:
+                arrays = {k: z[k] for k in z.files}
+            hit = np.isin(arrays["code_idx"], t_idx)
+            if not hit.any():
+                continue
+            fac = t_fac[np.searchsorted(t_idx, arrays["code_idx"][hit])]
+            for f in ["AdjO", "AdjH", "AdjL", "AdjC"]:
+                arrays[f][hit] = (arrays[f][hit] * fac).astype('float32')
+            arrays["Volume"][hit] = (arrays["Volume"][hit] / fac).astype('float32')
+            _save_day_arrays(root, d, arrays)
+            touched += 1
+        _save_json_atomic(os.path.join(root, MANIFEST_FILE), m)
+    return touched
+
+
+def expected_trading_days(end_dt, calendar_days=400):
+    """end_dt から遡って calendar_days 日分の営業日候補（YYYYMMDD, 昇順）を返す"""
+    try:
+        import jpholiday
+    except ImportError:
+        jpholiday = None
+    days = []
+    for i in range(calendar_days):
+        d = end_dt - pd.Timedelta(days=i)
+        if d.weekday() >= 5:
+            continue
+        # 年末年始（12/31〜1/3）は東証休場
+        if (d.month == 12 and d.day == 31) or (d.month == 1 and d.day <= 3):
+            continue
+        if jpholiday is not None and jpholiday.is_holiday(d.date() if hasattr(d, 'date') else d):
+            continue
+        days.append(d.strftime('%Y%m%d'))
+    return sorted(days)
+
+
+def days_to_fetch(expected_days, root=None, finalize_hour=18):
+    """
+    差分取得の対象日を割り出す。
+    ・ストアに無い日（空振り記録も無い日）
+    ・確定前（当日 finalize_hour 時より前）に取得した日、空振りだった日 → 取り直し
+    """
+    m = load_manifest(root)
+    stored = set(list_days(root))
+
+    def finalized(dt_str, stamp):
+        try:
+            t = pd.Timestamp(stamp)
+            if t.tzinfo is None:
+                t = t.tz_localize('Asia/Tokyo')
+            fin = pd.Timestamp(f"{dt_str[:4]}-{dt_str[4:6]}-{dt_str[6:]} {finalize_hour:02d}:00", tz='Asia/Tokyo')
+            return t >= fin
+        except Exception:
+            return False
+
+    targets = []
+    for d in expected_days:
+        if d in stored:
+            info = m["days"].get(d)
+            # manifest 導入前のファイルは確定済みとみなす
+            if info is None or finalized(d, info.get("fetched_at")):
+                continue
+        elif d in m["empty"] and finalized(d, m["empty"][d]):
+            continue
+        targets.append(d)
+    return targets
+
+
+def list_days(root=None):
+    """ストアに存在する営業日（YYYYMMDD）を昇順で返す"""
+    root = _root(root)
+    if not os.path.isdir(root):
+        return []
+    return sorted(f[:8] for f in os.listdir(root) if f.endswith(".npz") and f[:8].isdigit() and len(f) == 12)
+
+
+def read_day(dt_str, fields=None, code_idx_filter=None, root=None):
+    """1日分のファイルから必要な列だけを読む。{'code_idx': …, 列: …} を返す"""
+    fields = FIELDS if fields is None else fields
+    path = os.path.join(_root(root), f"{dt_str}.npz")
+    with np.load(path) as z:
+        idx = z["code_idx"]
+        mask = None
+        if code_idx_filter is not None:
+            mask = np.isin(idx, code_idx_filter)
+            idx = idx[mask]
+        out = {"code_idx": idx}
+        for f in fields:
+            arr = z[f]
+            out[f] = arr[mask] if mask is not None else arr
+    return out
+
+
+def load_bars(days=None, codes=None, fields=None, root=None):
+    """
+    ストアから縦持ちDataFrame（Code, Date, 各列）を組み立てる。
+    days: 読み込む営業日のリスト（None で全日）、codes: 銘柄コード（4桁/5桁混在可、None で全銘柄）
+    """
+    root = _root(root)
+    fields = FIELDS if fields is None else list(fields)
+    code_dict = load_code_dict(root)
+    available = list_days(root)
+    if days is not None:
+        available_set = set(available)
+        available = [d for d in days if d in available_set]
+    days = available
+    if not days or not code_dict:
+        return pd.DataFrame(columns=['Code', 'Date'] + fields)
+
+    code_filter = None
+    if codes is not None:
+        index = {c: i for i, c in enumerate(code_dict)}
+        code_filter = np.array([index[c] for c in map(to_api_code, codes) if c in index], dtype='int32')
+
+    idx_parts, date_parts, col_parts = [], [], {f: [] for f in fields}
+    for d in days:
+        part = read_day(d, fields, code_filter, root)
+        n = len(part["code_idx"])
+        if n == 0:
+            continue
+        idx_parts.append(part["code_idx"])
+        date_parts.append(np.full(n, np.datetime64(f"{d[:4]}-{d[4:6]}-{d[6:]}", 'ns')))
+        for f in fields:
+            col_parts[f].append(part[f])
+
+    if not idx_parts:
+        return pd.DataFrame(columns=['Code', 'Date'] + fields)
+
+    code_idx = np.concatenate(idx_parts)
+    df = pd.DataFrame({
+        'Code': np.asarray(code_dict, dtype=object)[code_idx],
+        'Date': np.concatenate(date_parts),
+    })
+    for f in fields:
+        df[f] = np.concatenate(col_parts[f])
+    return df.sort_values(['Code', 'Date']).reset_index(drop=True)
+
+
+def records_to_frame(dt_str, records):
+    """ストアを経由せず、APIの生レコードを load_bars と同じ形の縦持ちDataFrameにする"""
+    codes, cols = bars_to_columns(records)
+    df = pd.DataFrame({
+        'Code': codes.astype(object),
+        'Date': np.full(len(codes), np.datetime64(f"{dt_str[:4]}-{dt_str[4:6]}-{dt_str[6:]}", 'ns')),
+    })
+    for f in FIELDS:
+        df[f] = cols[f]
+    return df
+
+
+def migrate_from_pickle(pkl_path, root=None):
+    """旧形式 prices_db.pkl（日付 → 生JSONリスト）をストアへ移植する"""
+    import pickle
+    if not os.path.exists(pkl_path):
+        return 0
+    with open(pkl_path, "rb") as f:
+        legacy = pickle.load(f)
+    done = set(list_days(root))
+    migrated = 0
+    for dt_str, records in sorted(legacy.items()):
+        if dt_str in done:
+            continue
+        if write_day(dt_str, records, root):
+            migrated += 1
+    return migrated
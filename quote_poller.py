@@ -0,0 +1,156 @@
+import os
+import re
+import time
+import threading
+from datetime import datetime, timedelta
+
+import yf_gateway
+
+# ==========================================
+# 📡 場中の現在値ポーラー（サーバープロセスに1本のスレッド・全セッション共有のスナップショット）
+# ==========================================
+# 交戦モニターの保有銘柄や TAB3 の標的の現在値を、画面の再実行のたびに取りに行くと数秒止まる。
+# ここでは
+# ・各セッションは watch(持ち主, コード群) で「見たい銘柄」を届けるだけ（通信しない）
+# ・裏のスレッドが一定間隔で、全セッションの見たい銘柄の和集合を yf_gateway.latest_prices で1回にまとめて取り、
+#   スナップショットを差し替える。画面は snapshot() を読むだけなので待たない
+# ・取得の回数は開いているタブの数に比例しない（和集合を1回取るだけ）
+# ・WATCH_TTL の間 watch が来なかった持ち主（閉じたタブ）の銘柄は和集合から外れる
+# ・場中（平日 9:00〜15:30 JST）は POLL_SEC ごと、それ以外は IDLE_SEC ごとに取る。新しい銘柄が届いたらすぐ取る
+# 環境変数 QUOTE_POLL_SEC / QUOTE_IDLE_SEC / QUOTE_WATCH_TTL で変更できる。
+
+# yf_gateway の相場キャッシュが切れる頃に取りに行く（早すぎるとキャッシュを読むだけになる）
+POLL_SEC = float(os.getenv("QUOTE_POLL_SEC", str(yf_gateway.QUOTE_TTL)))
+IDLE_SEC = float(os.getenv("QUOTE_IDLE_SEC", "600"))
+WATCH_TTL = float(os.getenv("QUOTE_WATCH_TTL", "900"))
+
+_CODE_RE = re.compile(r"\s*(\d{3}[0-9A-Z])")
+
+
+def normalize_code(value):
+    """'7203' / '72030' / 7203.0 / '7203 トヨタ' → '7203'（読めなければ None）"""
+    m = _CODE_RE.match(str(value).replace('.0', ''))
+    return m.group(1) if m else None
+
+
+def market_open(now=None):
+    """東証の場中か（平日 9:00〜15:30 JST。祝日は見ない）"""
+    now = now or datetime.utcnow() + timedelta(hours=9)
+    if now.weekday() >= 5:
+        return False
+    hm = now.hour * 60 + now.minute
+    return 9 * 60 <= hm <= 15 * 60 + 30
+
+
+class QuotePoller:
+    def __init__(self, fetch=None, interval=POLL_SEC, idle_interval=IDLE_SEC, watch_ttl=WATCH_TTL):
+        self.fetch = fetch or yf_gateway.latest_prices
+        self.interval = float(interval)
+        self.idle_interval = float(idle_interval)
+        self.watch_ttl = float(watch_ttl)
+        self._lock = threading.Lock()
+        self._watch = {}      # 持ち主 -> (最後に watch した時刻, コードの集合)
+        self._quotes = {}     # コード -> (現在値, 取得時刻)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_poll = None
+        self.last_error = None
+        self.counts = {"polls": 0, "codes": 0, "errors": 0}
+
+    # ---------- セッション側（通信しない） ----------
+    def watch(self, owner, codes):
+        """owner（セッション）が見たい銘柄を届ける。未取得の銘柄があればポーラーを起こす"""
+        wanted = {c for c in (normalize_code(x) for x in codes) if c}
+        with self._lock:
+            self._watch[owner] = (time.time(), wanted)
+            fresh = bool(wanted - self._quotes.keys())
+        if fresh:
+            self._wake.set()
+        return wanted
+
+    def unwatch(self, owner):
+        with self._lock:
+            self._watch.pop(owner, None)
+
+    def watched(self):
+        """期限内の持ち主が見たい銘柄の和集合（期限切れの持ち主はここで外す）"""
+        now = time.time()
+        with self._lock:
+            for owner in [o for o, (t, _) in self._watch.items() if now - t > self.watch_ttl]:
+                del self._watch[owner]
+            return set().union(*(codes for _, codes in self._watch.values()))
+
+    def snapshot(self, codes=None):
+        """{コード: (現在値, 取得時刻)}。codes を渡せばその銘柄だけ（未取得のものは含めない）"""
+        with self._lock:
+            if codes is None:
+                return dict(self._quotes)
+            keys = (normalize_code(c) for c in codes)
+            return {k: self._quotes[k] for k in keys if k in self._quotes}
+
+    def prices(self, codes=None):
+        """{コード: 現在値}（snapshot の値だけ）"""
+        return {c: p for c, (p, _) in self.snapshot(codes).items()}
+
+    # ---------- ポーラー側 ----------
+    def poll_once(self):
+        """見たい銘柄をまとめて1回取り、スナップショットに反映する。取れた件数を返す"""
+        codes = sorted(self.watched())
+        if not codes:
+            return 0
+        try:
+            got = self.fetch(codes)
+        except Exception as e:
+            with self._lock:
+                self.counts["errors"] += 1
+                self.last_error = repr(e)
+            return 0
+        stamp = time.time()
+        with self._lock:
+            for code, price in got.items():
+                if price is not None and price == price:
+                    self._quotes[code] = (float(price), stamp)
+            # 誰も見なくなった銘柄は捨てる（スナップショットが膨らみ続けないように）
+            live = set(codes)
+            for code in [c for c in self._quotes if c not in live]:
+                del self._quotes[code]
+            self.last_poll = stamp
+            self.counts["polls"] += 1
+            self.counts["codes"] += len(got)
+        return len(got)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.poll_once()
+            self._wake.wait(self.interval if market_open() else self.idle_interval)
+
+    def start(self):
+        """裏のスレッドを起こす（起動済みなら何もしない）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="quote-poller", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        with self._lock:
+            return {"running": self.running, "owners": len(self._watch), "quotes": len(self._quotes),
+                    "last_poll": self.last_poll, "last_error": self.last_error, **self.counts}
+
+
+# サーバープロセスで1つ（全セッション共有）
+POLLER = QuotePoller()
@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import threading
+
+import tracer
+
+# ==========================================
+# 🚦 J-Quants 共通レートリミッター（プロセス全体で1個のトークンバケツ）
+# ==========================================
+# ・プランの「毎分リクエスト数」から発射間隔を決め、burst 個までは連射を許可
+# ・429 を受けたら全スレッド共通で冷却（Retry-After 優先、無ければ指数バックオフ）
+# ・app.py（全セッション共有）/ batch.py / 兵站Bot が同じ仕組みで通信する
+
+PLAN_RPM = {"free": 5, "light": 60, "standard": 120, "premium": 500}
+DEFAULT_PLAN = "light"
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケツ（GCRA 方式: 予約制で公平に順番待ちさせる）。
+    rpm: 毎分の許容リクエスト数、burst: 連続で即時発射できる最大数
+    """
+
+    def __init__(self, rpm, burst=1, base_cooldown=2.0, max_cooldown=60.0):
+        self.rpm = float(rpm)
+        self.burst = max(1, int(burst))
+        self.interval = 60.0 / self.rpm
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._tat = 0.0             # 次トークンの理論到着時刻（monotonic）
+        self._cooldown_until = 0.0  # 429 冷却の解除時刻
+        self._strikes = 0           # 連続 429 回数（指数バックオフ用）
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now, self._cooldown_until)
+            allowed_at = tat - (self.burst - 1) * self.interval
+            self._tat = tat + self.interval
+            return max(0.0, allowed_at - now)
+
+    def acquire(self):
+        """発射許可が出るまで待機する。待った秒数を返す"""
+        waited = 0.0
+        while True:
+            wait = self._reserve()
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+            with self._lock:
+                # 待機中に他スレッドが 429 を踏んだら、冷却明けに予約し直す
+                if time.monotonic() >= self._cooldown_until:
+                    return waited
+
+    async def acquire_async(self):
+        """asyncio 版の acquire（イベントループを塞がずに順番待ちする）"""
+        waited = 0.0
+        while True:
+            wait = self._reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                waited += wait
+            with self._lock:
+                if time.monotonic() >= self._cooldown_until:
+                    return waited
+
+    def cooldown(self, seconds=None):
+        """429 検知時に全体を冷却させる。適用した冷却秒数を返す"""
+        with self._lock:
+            self._strikes += 1
+            if seconds is None:
+                seconds = min(self.base_cooldown * (2 ** (self._strikes - 1)), self.max_cooldown)
+            until = time.monotonic() + seconds
+            self._cooldown_until = max(self._cooldown_until, until)
+            self._tat = max(self._tat, self._cooldown_until)
+            return seconds
+
+    def success(self):
+        with self._lock:
+            self._strikes = 0
+
+
+def retry_after(resp):
+    try:
+        v = resp.headers.get("Retry-After")
+        return float(v) if v is not None else None
+    except Exception:
+        return None
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def _rpm_from_env():
+    rpm = os.getenv("JQUANTS_RPM", "").strip()
+    if rpm:
+        return float(rpm)
+    plan = os.getenv("JQUANTS_PLAN", DEFAULT_PLAN).strip().lower()
+    return float(PLAN_RPM.get(plan, PLAN_RPM[DEFAULT_PLAN]))
+
+
+def configure(rpm=None, burst=None, plan=None):
+    """プロセス共通リミッターを（再）設定する。未指定は環境変数 → Lightプラン既定"""
+    global _limiter
+    if rpm is None and plan:
+        rpm = PLAN_RPM.get(str(plan).lower())
+    rpm = float(rpm) if rpm else _rpm_from_env()
+    burst = int(burst) if burst else int(os.getenv("JQUANTS_BURST", "1") or 1)
+    with _limiter_lock:
+        _limiter = TokenBucket(rpm, burst)
+    return _limiter
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenBucket(_rpm_from_env(), int(os.getenv("JQUANTS_BURST", "1") or 1))
+    return _limiter
+
+
+def jquants_get(session, url, retries=3, limiter=None, **kwargs):
+    """
+    リミッター経由の GET。429 は共通冷却をかけてから再試行する。
+    session には requests.Session でも requests モジュールでも渡せる。
+    session に http_cache（http_cache.HttpCache）が付いていれば発射前に引き、当たればリミッターも API回数も使わない。
+    """
+    cache = getattr(session, "http_cache", None) if "params" not in kwargs else None
+    if cache is not None:
+        hit = cache.lookup(url)
+        if hit is not None:
+            return hit
+    limiter = limiter or get_limiter()
+    r = None
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        tracer.count_api()
+        r = session.get(url, **kwargs)
+        if r.status_code != 429:
+            limiter.success()
+            if cache is not None:
+                cache.store(url, r)
+            return r
+        limiter.cooldown(retry_after(r))
+    return r
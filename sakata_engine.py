@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+
+from pattern_engine import detect_patterns
+
+# ==========================================
+# 🏮 酒田五法の全銘柄一括スキャン
+# ==========================================
+# detect_sakata_patterns（1銘柄ずつ・DataFrameコピー＋ all(...) ループ）と同じ規則を、
+# 価格パネルの右詰め配列に対して全銘柄まとめて評価する。
+# ・高値圏 / 安値圏: 直近14本（最新足を除く）のレンジ内位置 > 0.7 / < 0.3、または RSI > 65 / < 35
+# ・三尊 / 三山: 直近30本の高値の山（両隣より高い足）が3つ以上 ＋ 高値圏
+# ・二重天井 / 二重底: 直近31本を pattern_engine（app 版）で判定 ＋ 高値圏 / 安値圏
+# ・赤三先・黒三兵・売三空（高値圏）、陰の極み・赤三兵・買三空・たくり（安値圏）: 直近3〜4本の配列比較
+# 陰の極みは BB_L3 が無いと判定できない（1銘柄版も BB_L3 列が無ければ不成立）。
+# BB_L3 は夜間の特徴量テーブル（feature_store）から引く。
+
+SCAN_WINDOW = 31
+RSI_SPAN = 14
+
+# (キー, ラベル, 種別) … 並びは detect_sakata_patterns が返す順
+PATTERNS = [
+    ("sanzon", "【酒田・三尊】", "bear"),
+    ("sanzan", "【酒田・三山】", "bear"),
+    ("double_top", "【酒田・二重天井】", "bear"),
+    ("aka_sansen", "【酒田・赤三先】", "bear"),
+    ("kuro_sanpei", "【酒田・黒三兵】", "bear"),
+    ("uri_sanku", "【酒田・売三空】", "bull"),
+    ("in_kiwami", "【酒田・陰の極み】", "bull"),
+    ("aka_sanpei", "【酒田・赤三兵】", "bull"),
+    ("kai_sanku", "【酒田・買三空】", "bear"),
+    ("double_bottom", "【酒田・二重底】", "bull"),
+    ("takuri", "【酒田・たくり】", "bull"),
+]
+LABELS = {k: label for k, label, _ in PATTERNS}
+KINDS = {k: kind for k, _, kind in PATTERNS}
+
+
+def rsi_matrix(c):
+    """
+    行ごとの RSI（calc_vector_indicators と同じ14本単純平均式・float32）。
+    c は右詰め（左側 NaN 埋め）の (銘柄, 本数) 配列。NaN 埋めの位置は計算に含めない。
+    """
+    frame = pd.DataFrame(np.asarray(c).T)
+    delta = frame.diff()
+    pad = frame.isna()
+    gain = delta.where(delta > 0, 0.0).mask(pad)
+    loss = (-delta.where(delta < 0, 0.0)).mask(pad)
+    gain = gain.rolling(window=RSI_SPAN, min_periods=1).mean()
+    loss = loss.rolling(window=RSI_SPAN, min_periods=1).mean()
+    rs = gain / loss.replace(0, 1e-10)
+    return (100 - (100 / (1 + rs))).astype('float32').values.T
+
+
+def _last_strict_peaks(x, keep=3):
+    """各行で両隣より高い足（厳密な山）の直近 keep 個の値。足りない分は NaN"""
+    n, w = x.shape
+    with np.errstate(invalid='ignore'):
+        cand = np.zeros((n, w), dtype=bool)
+        cand[:, 1:-1] = (x[:, 1:-1] > x[:, :-2]) & (x[:, 1:-1] > x[:, 2:])
+    pos = np.where(cand, np.arange(w)[None, :], -1)
+    last = np.sort(pos, axis=1)[:, -keep:]
+    vals = np.take_along_axis(x, np.clip(last, 0, None), axis=1)
+    return np.where(last >= 0, vals, np.nan), cand.sum(axis=1)
+
+
+def sakata_flags(o, h, l, c, counts, rsi=None, bb_l3=None):
+    """
+    右詰めの (銘柄, 本数) 配列から各パターンの成立フラグを返す。{キー: (銘柄,) bool}
+    rsi / bb_l3 は最新足の値（(銘柄,) 配列）。rsi 省略時は 50 扱い、bb_l3 省略時は陰の極みを判定しない。
+    最新足から SCAN_WINDOW 本以上さかのぼる必要はない（それより古い列は無視する）。
+    """
+    o, h, l, c = (x[:, -SCAN_WINDOW:] for x in (o, h, l, c))
+    n = len(c)
+    counts = np.minimum(np.asarray(counts), c.shape[1])
+    dtype = c.dtype
+    rsi = np.full(n, 50.0, dtype=dtype) if rsi is None else np.asarray(rsi)
+    ok = counts >= 5
+    flags = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 直近14本（最新足を除く）のレンジ内位置
+        h14 = np.where(np.isnan(h[:, -15:-1]), -np.inf, h[:, -15:-1]).max(axis=1).astype(dtype)
+        l14 = np.where(np.isnan(l[:, -15:-1]), np.inf, l[:, -15:-1]).min(axis=1).astype(dtype)
+        rng = h14 - l14
+        pos = np.where(rng > 0, (c[:, -1] - l14) / rng, 0.5)
+        high = ok & ((pos > 0.7) | (rsi > 65))
+        low = ok & ((pos < 0.3) | (rsi < 35))
+
+        # 三尊・三山（直近30本の厳密な山）
+        pk, n_peaks = _last_strict_peaks(h[:, -30:])
+        three = high & (n_peaks >= 3)
+        sanzon = three & (pk[:, 1] > pk[:, 0]) & (pk[:, 1] > pk[:, 2])
+        flags["sanzon"] = sanzon
+        flags["sanzan"] = three & ~sanzon
+
+        wave = detect_patterns(h, l, c, counts, "app")
+        flags["double_top"] = wave["dt"] & high & ~sanzon
+
+        c3, o3 = c[:, -3:], o[:, -3:]
+        up3 = (c3 > o3).all(axis=1) & (c[:, -2] > c[:, -3]) & (c[:, -1] > c[:, -2])
+        down3 = (c3 < o3).all(axis=1) & (c[:, -2] < c[:, -3]) & (c[:, -1] < c[:, -2])
+        gap_down = (h[:, -3:] < l[:, -4:-1]).all(axis=1)
+        gap_up = (l[:, -3:] > h[:, -4:-1]).all(axis=1)
+        flags["aka_sansen"] = high & up3
+        flags["kuro_sanpei"] = high & down3
+        flags["uri_sanku"] = high & gap_down
+
+        # 下ヒゲ（たくり・陰の極み共通）
+        lc, lo, ll, lh = c[:, -1], o[:, -1], l[:, -1], h[:, -1]
+        body = np.abs(lc - lo)
+        shadow = np.minimum(lc, lo) - ll
+        full = lh - ll
+        tail_long = (full > 0) & (shadow > body * 2.5) & (shadow / full > 0.6)
+
+        if bb_l3 is None:
+            flags["in_kiwami"] = np.zeros(n, dtype=bool)
+        else:
+            flags["in_kiwami"] = low & (counts >= 20) & (lc <= np.asarray(bb_l3)) & (rsi <= 25) & tail_long
+        flags["aka_sanpei"] = low & up3
+        flags["kai_sanku"] = low & gap_up
+        flags["double_bottom"] = wave["db"] & low
+        flags["takuri"] = low & tail_long
+    return {k: flags[k] for k, _, _ in PATTERNS}
+
+
+def scan_sakata(panel, window=SCAN_WINDOW, bb_l3=None, features=None):
+    """
+    パネル全銘柄の「最新足時点」の酒田パターン。
+    {'codes', 'dates'（各銘柄の最新足の日付）, 'rsi', 'flags'} を返す。
+    RSI は直近 window 本の中で計算する（最新足の値は直近15本だけで決まる）。
+    features（feature_store.FeatureTable）を渡すと、最新足の日付が一致する銘柄は
+    夜間に焼き付けた RSI（全履歴）と BB_L3 を使う（陰の極みも判定できる）。
+    """
+    vals, dates, counts = panel.tail_valid(window)
+    f = panel.field_index
+    o, h, l, c = (vals[:, :, f[k]] for k in ("AdjO", "AdjH", "AdjL", "AdjC"))
+    rsi = rsi_matrix(c)[:, -1] if len(c) else np.empty(0, dtype='float32')
+    if features is not None and len(c):
+        as_of = dates[:, -1]
+        stored = features.latest_for(panel.codes, "RSI", as_of)
+        rsi = np.where(np.isnan(stored), rsi, stored)
+        if bb_l3 is None:
+            bb_l3 = features.latest_for(panel.codes, "BB_L3", as_of)
+    flags = sakata_flags(o, h, l, c, counts, rsi, bb_l3)
+    return {"codes": panel.codes, "dates": dates[:, -1], "rsi": rsi, "flags": flags}
+
+
+def labels_of(result, row):
+    """1銘柄分の成立ラベル（detect_sakata_patterns の label 列と同じ並び）"""
+    return [LABELS[k] for k, _, _ in PATTERNS if result["flags"][k][row]]
+
+
+def to_frame(result):
+    """パターンが1つ以上点灯した銘柄の一覧（Code, Date, RSI, Patterns, Bull, Bear）"""
+    flags = result["flags"]
+    hit = np.zeros(len(result["codes"]), dtype=bool)
+    bull = np.zeros(len(result["codes"]), dtype='int64')
+    bear = np.zeros(len(result["codes"]), dtype='int64')
+    for k, _, kind in PATTERNS:
+        hit |= flags[k]
+        if kind == "bull":
+            bull += flags[k]
+        else:
+            bear += flags[k]
+    rows = np.flatnonzero(hit)
+    return pd.DataFrame({
+        "Code": result["codes"][rows].astype(str),
+        "Date": result["dates"][rows],
+        "RSI": result["rsi"][rows],
+        "Patterns": [labels_of(result, r) for r in rows],
+        "Bull": bull[rows],
+        "Bear": bear[rows],
+    })
+
+
+def check_parity(panel, window=SCAN_WINDOW):
+    """
+    一括スキャンと detect_sakata_patterns（1銘柄ずつ・同じ直近 window 本＋RSI列）を突き合わせる。
+    不一致の (コード, 一括ラベル, 個別ラベル) のリストを返す（空なら完全一致）。
+    """
+    from scan_core import detect_sakata_patterns
+
+    res = scan_sakata(panel, window)
+    vals, dates, _ = panel.tail_valid(window)
+    mismatches = []
+    for r in range(len(panel)):
+        m = ~np.isnat(dates[r])
+        df = pd.DataFrame(vals[r][m], columns=panel.fields)
+        df.insert(0, 'Date', dates[r][m])
+        # calc_vector_indicators と同じ式で1銘柄ずつ RSI を付ける
+        delta = df['AdjC'].diff()
+        gain = delta.where(delta > 0, 0.0).rolling(window=RSI_SPAN, min_periods=1).mean()
+        loss = (-delta.where(delta < 0, 0.0)).rolling(window=RSI_SPAN, min_periods=1).mean()
+        df['RSI'] = (100 - (100 / (1 + gain / loss.replace(0, 1e-10)))).astype('float32')
+        slow = [p["label"] for p in detect_sakata_patterns(df)]
+        fast = labels_of(res, r)
+        if fast != slow:
+            mismatches.append((panel.codes[r], fast, slow))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import time
+    from price_panel import PricePanel
+    import price_store
+
+    panel = PricePanel.from_store(days=price_store.list_days()[-40:])
+    if len(panel) == 0:
+        raise SystemExit("日足ストアが空です（兵站Botを先に実行してください）")
+    t0 = time.time()
+    res = scan_sakata(panel)
+    print(f"一括スキャン: {len(panel)} 銘柄 {(time.time() - t0) * 1000:.1f}ms")
+    for k, label, _ in PATTERNS:
+        print(f"  {label}: {int(res['flags'][k].sum())} 銘柄")
+    bad = check_parity(panel)
+    print("✅ 個別判定と完全一致" if not bad else f"❌ 不一致 {len(bad)} 件: {bad[:5]}")
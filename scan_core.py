@@ -0,0 +1,838 @@
+import numpy as np
+import pandas as pd
+
+import fundamentals_store
+from pattern_engine import detect_frame
+
+# ==========================================
+# 🧮 スキャン共通の純粋関数群（Streamlit 非依存）
+# ==========================================
+# app.py から切り出した判定ロジック。app.py はここから import して使い、
+# 一括エンジンの一致検証・ベンチマークからも同じ関数を呼べるようにしている。
+
+
+# ==========================================
+# 🧹 取得データの整形・圧縮
+# ==========================================
+def clean_df(df):
+    if df is None or df.empty: 
+        return pd.DataFrame()
+    
+    # 🚨 補修：小文字の 'code' を強制的に大文字の 'Code' に統一
+    if 'code' in df.columns and 'Code' not in df.columns:
+        df = df.rename(columns={'code': 'Code'})
+
+    # 🚨 出来高の欠損を防ぐ柔軟な抽出
+    vol_candidates = ['AdjustmentVolume', 'Volume', 'volume', 'Vol', 'Vo']
+    for c in vol_candidates:
+        if c in df.columns and c != 'AdjustmentVolume':
+            df = df.rename(columns={c: 'AdjustmentVolume'})
+            break
+
+    # 🚨 重複リネームによる2次元化(DataFrame化)を完全に防ぐ
+    if 'AdjustmentClose' in df.columns:
+        p_map = {
+            'AdjustmentOpen': 'AdjO', 'AdjustmentHigh': 'AdjH', 
+            'AdjustmentLow': 'AdjL', 'AdjustmentClose': 'AdjC'
+        }
+    else:
+        p_map = {
+            'Open': 'AdjO', 'High': 'AdjH', 'Low': 'AdjL', 'Close': 'AdjC',
+            'O': 'AdjO', 'H': 'AdjH', 'L': 'AdjL', 'C': 'AdjC'
+        }
+        
+    df = df.rename(columns=p_map)
+
+    # 🛡️ 万が一重複列が発生していても「最初の1列」だけを残す
+    df = df.loc[:, ~df.columns.duplicated(keep='first')]
+
+    keep = ['Code', 'Date', 'AdjO', 'AdjH', 'AdjL', 'AdjC', 'AdjustmentVolume']
+    df = df[[c for c in keep if c in df.columns]].copy()
+    
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df['Date'])
+        
+    for col in ['AdjO', 'AdjH', 'AdjL', 'AdjC', 'AdjustmentVolume']:
+        if col in df.columns:
+            # 1次元データ(Series)としてfloat32キャスト
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+            
+    if 'Code' in df.columns:
+        df['Code'] = df['Code'].astype('category')
+        
+    # 🚨 最終防壁：データ内に 'Code' 列が存在しない場合でもエラーで落ちないように動的ソート
+    sort_keys = [k for k in ['Code', 'Date'] if k in df.columns]
+    
+    return df.dropna(subset=['AdjC']).sort_values(sort_keys).reset_index(drop=True)
+
+def compress_memory(df):
+    """データフレームのメモリサイズを強制的に半減させる極限圧縮処理"""
+    if df is None or df.empty:
+        return df
+        
+    # 浮動小数点の圧縮 (float64 -> float32)
+    float_cols = df.select_dtypes(include=['float64']).columns
+    df[float_cols] = df[float_cols].astype('float32')
+    
+    # 整数の圧縮 (int64 -> int32)
+    int_cols = df.select_dtypes(include=['int64']).columns
+    df[int_cols] = df[int_cols].astype('int32')
+    
+    # 🚨 開発参謀パッチ：システムの中核列（日付やコード）はカテゴリ圧縮から除外する
+    exclude_cols = ['Date', 'Code', 'Date_Str', 'Date_x', 'Date_y'] 
+    
+    # オブジェクト型（文字列等）で種類が少ないものをカテゴリ化
+    for col in df.select_dtypes(include=['object']).columns:
+        if col not in exclude_cols: # 🚨 除外リストにない列だけを圧縮対象とする
+            if df[col].nunique() / len(df) < 0.5:
+                df[col] = df[col].astype('category')
+            
+    return df
+
+
+# ==========================================
+# 🧠 ファンダメンタルズ解析エンジン（QoQ・直近2期連続・絶対防弾版）
+# ==========================================
+def analyze_fundamental_momentum(df, mode="buy", sales_req=7.0, ord_req=15.0):
+    import pandas as pd
+    try:
+        if df is None or len(df) < 3:
+            return False, ""
+        
+        # 📚 正規化テーブルなら取込時に算出済みの単独四半期・前期比をそのまま使う
+        if 'Sales_QoQ' in df.columns:
+            act = df[df['Sales_Q'].notna()]
+            if len(act) < 3:
+                return False, ""
+            q0, q1, q2 = act.iloc[-1], act.iloc[-2], act.iloc[-3]
+
+            def q_val(row, f, fb=None):
+                v = float(row[f + '_Q'])
+                return float(row[fb + '_Q']) if v == 0.0 and fb else v
+
+            def q_gr(row, f):
+                v = row[f + '_QoQ']
+                return 0.0 if pd.isna(v) else float(v)
+
+            if q_val(q0, 'Sales') <= 0 or q_val(q1, 'Sales') <= 0 or q_val(q2, 'Sales') <= 0:
+                return False, ""
+            q0_op, q1_op = q_val(q0, 'OP'), q_val(q1, 'OP')
+            q0_ord, q1_ord = q_val(q0, 'OdP'), q_val(q1, 'OdP')
+            q0_eps, q1_eps = q_val(q0, 'EPS', 'NP'), q_val(q1, 'EPS', 'NP')
+            s_q0, op_q0, or_q0, ep_q0 = q_gr(q0, 'Sales'), q_gr(q0, 'OP'), q_gr(q0, 'OdP'), q_gr(q0, 'EPS')
+            s_q1, op_q1, or_q1, ep_q1 = q_gr(q1, 'Sales'), q_gr(q1, 'OP'), q_gr(q1, 'OdP'), q_gr(q1, 'EPS')
+        else:
+            cols = [str(c).lower() for c in df.columns]
+            def find_c(*names):
+                for n in names:
+                    if n.lower() in cols: return df.columns[cols.index(n.lower())]
+                return None
+
+            c_sales = find_c('Sales', 'NetSales', 'net_sales')
+            c_op = find_c('OP', 'OperatingProfit', 'operating_profit')
+            c_ord = find_c('OdP', 'OrdinaryProfit', 'ordinary_profit')
+            c_eps = find_c('EPS', 'EarningsPerShare', 'eps')
+            c_profit = find_c('NP', 'Profit', 'netincome')
+            c_type = find_c('CurPerType', 'TypeOfCurrentPeriod', 'type')
+        
+            if not c_sales or not c_ord:
+                return False, ""
+
+            def to_flt(v):
+                # 📚 正規化済みテーブルは数値のまま届くので文字列解析を通さない
+                if isinstance(v, (float, int, np.floating, np.integer)):
+                    return 0.0 if v != v else float(v)
+                try:
+                    if pd.isna(v) or str(v).strip() == '': return 0.0
+                    return float(str(v).replace(',', ''))
+                except:
+                    return 0.0
+
+            actual_mask = (df[c_sales].apply(to_flt) > 0) | (df[c_ord].apply(to_flt) > 0)
+            actual_df = df[actual_mask].copy().reset_index(drop=True)
+        
+            if len(actual_df) < 3:
+                return False, ""
+            
+            std_df = actual_df.copy()
+        
+            for i in range(1, len(actual_df)):
+                curr_sales = to_flt(actual_df[c_sales].iloc[i])
+                prev_sales = to_flt(actual_df[c_sales].iloc[i-1])
+                curr_type = str(actual_df[c_type].iloc[i]) if c_type else ""
+            
+                is_q1 = False
+                if '1Q' in curr_type or 'Q1' in curr_type:
+                    is_q1 = True
+                elif curr_sales < prev_sales and prev_sales > 0:
+                    is_q1 = True
+                
+                if not is_q1:
+                    for col in filter(None, [c_sales, c_op, c_ord, c_eps, c_profit]):
+                        try:
+                            c_val = to_flt(actual_df[col].iloc[i])
+                            p_val = to_flt(actual_df[col].iloc[i-1])
+                            std_df.iat[i, std_df.columns.get_loc(col)] = c_val - p_val
+                        except Exception:
+                            pass
+                        
+            q0 = std_df.iloc[-1] 
+            q1 = std_df.iloc[-2]
+            q2 = std_df.iloc[-3]
+        
+            def get_val(row, primary_col, fallback_col=None):
+                v = to_flt(row.get(primary_col, 0.0)) if primary_col else 0.0
+                if v == 0.0 and fallback_col:
+                    v = to_flt(row.get(fallback_col, 0.0))
+                return v
+
+            q0_sales = get_val(q0, c_sales)
+            q1_sales = get_val(q1, c_sales)
+            q2_sales = get_val(q2, c_sales)
+        
+            q0_op = get_val(q0, c_op)
+            q1_op = get_val(q1, c_op)
+            q2_op = get_val(q2, c_op)
+        
+            q0_ord = get_val(q0, c_ord)
+            q1_ord = get_val(q1, c_ord)
+            q2_ord = get_val(q2, c_ord)
+        
+            q0_eps = get_val(q0, c_eps, c_profit)
+            q1_eps = get_val(q1, c_eps, c_profit)
+            q2_eps = get_val(q2, c_eps, c_profit)
+
+            if q0_sales <= 0 or q1_sales <= 0 or q2_sales <= 0:
+                return False, ""
+
+            def calc_gr(c, p):
+                if p == 0: return 0.0
+                return ((c - p) / abs(p)) * 100.0
+
+            s_q0 = calc_gr(q0_sales, q1_sales)
+            op_q0 = calc_gr(q0_op, q1_op)
+            or_q0 = calc_gr(q0_ord, q1_ord)
+            ep_q0 = calc_gr(q0_eps, q1_eps)
+
+            s_q1 = calc_gr(q1_sales, q2_sales)
+            op_q1 = calc_gr(q1_op, q2_op)
+            or_q1 = calc_gr(q1_ord, q2_ord)
+            ep_q1 = calc_gr(q1_eps, q2_eps)
+        
+        if mode == "buy":
+            # 利益がマイナスなら不合格（成長率がプラスでも赤字なら買わない）
+            if q0_op < 0 or q0_ord < 0 or q0_eps < 0 or q1_op < 0 or q1_ord < 0 or q1_eps < 0:
+                return False, ""
+                
+            if not (s_q0 >= sales_req and s_q1 >= sales_req): return False, ""
+            if not (op_q0 >= 15.0 and op_q1 >= 15.0): return False, ""
+            if not (or_q0 >= ord_req and or_q1 >= ord_req): return False, ""
+            if not (ep_q0 >= 15.0 and ep_q1 >= 15.0): return False, ""
+            
+            if op_q0 >= 20.0 and or_q0 >= 20.0 and ep_q0 >= 20.0:
+                return True, "S級🎯"
+            return True, "A級🟢"
+            
+        elif mode == "sell":
+            # 🚨 修正：赤字なら無条件合格とする小細工を排除。純粋に計算されたパーセンテージだけで判定する。
+            if not (s_q0 < 5.0 and s_q1 < 5.0): return False, ""
+            if not (op_q0 < 10.0 and op_q1 < 10.0): return False, ""
+            if not (or_q0 < 5.0 and or_q1 < 5.0): return False, ""
+            if not (ep_q0 < 10.0 and ep_q1 < 10.0): return False, ""
+            
+            if q0_op < 0 and q0_ord < 0 and q0_eps < 0 and q1_op < 0 and q1_ord < 0 and q1_eps < 0:
+                return True, "S級💀"
+            return True, "A級📉"
+            
+    except Exception:
+        pass
+    return False, ""
+
+
+def screen_fundamentals_code(code, local_db, mode="buy", sales_req=7.0, ord_req=15.0):
+    """
+    TAB1/TAB2 フェーズ2の1銘柄判定（派生列の無い旧ストア用。execute_chunked_scan(_mp) の process_func）。
+    合格なら (コード, ランク)、それ以外は None。
+    """
+    api_code = str(code) if len(str(code)) >= 5 else str(code) + "0"
+    df_fins = local_db.get(api_code, None) if local_db else None
+    if df_fins is None or df_fins.empty:
+        return None
+    is_hit, rank = analyze_fundamental_momentum(df_fins, mode=mode, sales_req=sales_req, ord_req=ord_req)
+    return (str(code), rank) if is_hit else None
+
+
+# ==========================================
+# 📊 チャート陣形（3日反転・18日線ブレイク）の履歴探知
+# ==========================================
+def analyze_formation_history(df):
+    """過去3ヶ月分のデータから、買い/空売りフォーメーション（ルール①・②）を探知する"""
+    import pandas as pd
+    buy_signals = []
+    sell_signals = []
+    
+    if df is None or len(df) < 65:
+        return buy_signals, sell_signals
+        
+    cols = [str(c).lower() for c in df.columns]
+    def get_c(*names):
+        for n in names:
+            if n.lower() in cols: return df.columns[cols.index(n.lower())]
+        return None
+
+    # 日足ストア由来のデータは調整後の AdjH / AdjL しか持たないため、それも候補に入れる
+    c_h, c_l, c_c = get_c('high', 'h', 'adjh'), get_c('low', 'l', 'adjl'), get_c('close', 'adjc', 'c')
+    c_d = get_c('date', 'd')
+    if not all([c_h, c_l, c_c, c_d]): return [], []
+
+    df_recent = df.tail(65).reset_index(drop=True)
+    
+    # ルール②用の18日移動平均線
+    if 'MA18' not in df_recent.columns:
+        df_recent['MA18'] = df_recent[c_c].rolling(18).mean()
+    
+    for i in range(3, len(df_recent)):
+        m3_h, m3_l = float(df_recent.loc[i-3, c_h]), float(df_recent.loc[i-3, c_l])
+        m2_h, m2_l, m2_c = float(df_recent.loc[i-2, c_h]), float(df_recent.loc[i-2, c_l]), float(df_recent.loc[i-2, c_c])
+        m1_h, m1_l, m1_c = float(df_recent.loc[i-1, c_h]), float(df_recent.loc[i-1, c_l]), float(df_recent.loc[i-1, c_c])
+        q0_h, q0_l, q0_c = float(df_recent.loc[i, c_h]), float(df_recent.loc[i, c_l]), float(df_recent.loc[i, c_c])
+        
+        ma18_m2 = float(df_recent.loc[i-2, 'MA18'])
+        ma18_m1 = float(df_recent.loc[i-1, 'MA18'])
+        ma18_q0 = float(df_recent.loc[i, 'MA18'])
+        
+        curr_date = df_recent.loc[i, c_d]
+
+        # 🔵 買いルール①（3日間反転）
+        buy_cond1 = (m2_c < m3_l) and (m1_c > m2_h) and (q0_c > m1_c)
+        # 🔵 買いルール②（今日と昨日の安値 > 18日MA ※初動検知）
+        buy_cond2 = (m2_l <= ma18_m2) and (m1_l > ma18_m1) and (q0_l > ma18_q0)
+        
+        if buy_cond1 or buy_cond2:
+            buy_signals.append(curr_date)
+            
+        # 🔴 空売りルール①（3日間崩壊）
+        sell_cond1 = (m2_c > m3_h) and (m1_c < m2_l) and (q0_c < m1_c)
+        # 🔴 空売りルール②（今日と昨日の高値 < 18日MA ※初動検知）
+        sell_cond2 = (m2_h >= ma18_m2) and (m1_h < ma18_m1) and (q0_h < ma18_q0)
+        
+        if sell_cond1 or sell_cond2:
+            sell_signals.append(curr_date)
+            
+    return list(set(buy_signals)), list(set(sell_signals))
+
+
+# ==========================================
+# 🏔️ 天井・底の波形判定（二重天井・三尊・二重底・陰の極み）
+# ==========================================
+def check_double_top(df_sub):
+    try:
+        v = df_sub['AdjH'].values
+        c = df_sub['AdjC'].values
+        l = df_sub['AdjL'].values
+        if len(v) < 6: return False
+        peaks = []
+        for i in range(1, len(v)-1):
+            if v[i] == max(v[i-1:i+2]):
+                if not peaks or (i - peaks[-1][0] > 1): peaks.append((i, v[i]))
+        if len(v) >= 2 and v[-1] > v[-2]:
+            if not peaks or (len(v)-1 - peaks[-1][0] > 1): peaks.append((len(v)-1, v[-1]))
+        if len(peaks) >= 2:
+            p2_idx, p2_val = peaks[-1]
+            p1_idx, p1_val = peaks[-2]
+            if abs(p2_val - p1_val) / max(p2_val, p1_val) < 0.05:
+                valley = min(l[p1_idx:p2_idx+1]) if p2_idx > p1_idx else p1_val
+                if valley < min(p1_val, p2_val) * 0.95 and c[-1] < p2_val * 0.97: return True
+        return False
+    except: return False
+
+def check_head_shoulders(df_sub):
+    try:
+        v = df_sub['AdjH'].values
+        c = df_sub['AdjC'].values
+        if len(v) < 8: return False
+        peaks = []
+        for i in range(1, len(v)-1):
+            if v[i] == max(v[i-1:i+2]):
+                if not peaks or (i - peaks[-1][0] > 1): peaks.append((i, v[i]))
+        if len(peaks) >= 3:
+            p3_idx, p3_val = peaks[-1]
+            p2_idx, p2_val = peaks[-2]
+            p1_idx, p1_val = peaks[-3]
+            if p2_val > p1_val and p2_val > p3_val and abs(p3_val - p1_val) / max(p3_val, p1_val) < 0.10 and c[-1] < p3_val * 0.97: 
+                return True
+        return False
+    except: return False
+
+def check_double_bottom(df_sub):
+    try:
+        l = df_sub['AdjL'].values
+        c = df_sub['AdjC'].values
+        h = df_sub['AdjH'].values
+        if len(l) < 6: return False
+        valleys = []
+        for i in range(1, len(l)-1):
+            if l[i] == min(l[i-1:i+2]):
+                if not valleys or (i - valleys[-1][0] > 1): valleys.append((i, l[i]))
+        if len(valleys) >= 2:
+            v2_idx, v2_val = valleys[-1]
+            v1_idx, v1_val = valleys[-2]
+            if abs(v2_val - v1_val) / min(v2_val, v1_val) < 0.05:
+                peak = max(h[v1_idx:v2_idx+1]) if v2_idx > v1_idx else v1_val
+                if peak > max(v1_val, v2_val) * 1.04 and c[-1] > v2_val * 1.01: return True
+        return False
+    except: return False
+
+def check_oversold_ultimate(df_sub):
+    try:
+        if len(df_sub) < 20: return False
+        t = df_sub.iloc[-1]
+        lc, lo, ll, lh, bbl3, rsi = t['AdjC'], t['AdjO'], t['AdjL'], t['AdjH'], t['BB_L3'], t['RSI']
+        if lc <= bbl3 and rsi <= 25:
+            body_v = abs(lc - lo)
+            shadow_l = min(lc, lo) - ll
+            full_rng = lh - ll
+            if full_rng > 0 and shadow_l > (body_v * 2.5) and (shadow_l / full_rng) > 0.6: 
+                return True
+        return False
+    except: return False
+
+# ==========================================
+# 🏮 酒田五法レーダー（1銘柄）
+# ==========================================
+def detect_sakata_patterns(df):
+    """
+    酒田五法のフォーメーションを検知する防弾仕様の精密レーダー。
+    データ構造の不整合を自動修復し、いかなる場合もクラッシュを許さない。
+    """
+    if df is None or len(df) < 5: 
+        return []
+        
+    # 必須カラムチェック（データ欠損によるクラッシュを物理的に封殺）
+    required = ['AdjO', 'AdjH', 'AdjL', 'AdjC', 'Date']
+    if not all(col in df.columns for col in required):
+        return []
+
+    patterns = []
+    
+    # メモリ効率化のため、列のコピーとnumpy配列への展開
+    df_work = df.copy()
+    c = df_work['AdjC'].values
+    o = df_work['AdjO'].values
+    h = df_work['AdjH'].values
+    l = df_work['AdjL'].values
+    d = df_work['Date'].values
+    
+    # RSIの安全取得（存在しない場合は中立の50として扱う）
+    rsi = df_work['RSI'].values if 'RSI' in df_work.columns else np.full(len(df), 50.0)
+    
+    # スイング判定用の期間高値安値計算
+    h14_max = df_work['AdjH'].tail(15).iloc[:-1].max()
+    l14_min = df_work['AdjL'].tail(15).iloc[:-1].min()
+    rng = h14_max - l14_min
+    
+    pos = (c[-1] - l14_min) / rng if rng > 0 else 0.5
+    # 二重天井・二重底は直近31本を一括判定（check_double_top / check_double_bottom と同じ規則）
+    wave = detect_frame(df.tail(31), "app")
+    
+    is_high_zone = pos > 0.7 or rsi[-1] > 65
+    is_low_zone = pos < 0.3 or rsi[-1] < 35
+
+    # 頂点検知ロジック（効率化のためtail(30)のAdjHを参照）
+    tail_30 = df_work.tail(30)
+    h30 = tail_30['AdjH'].values
+    peaks = []
+    for i in range(1, len(h30)-1):
+        if h30[i] > h30[i-1] and h30[i] > h30[i+1]:
+            peaks.append({"val": h30[i], "idx": i})
+    
+    # --- パターン検知ロジック (論理構造は維持) ---
+    if len(peaks) >= 3 and is_high_zone:
+        if peaks[-2]['val'] > peaks[-3]['val'] and peaks[-2]['val'] > peaks[-1]['val']:
+            patterns.append({"date": d[-1], "label": "【酒田・三尊】", "text": "🔴 【酒田・三尊】天井圏での最終警戒形態。三つの仏、崩落の予兆。即時撤退。", "color": "#ef5350", "type": "bear"})
+        else:
+            patterns.append({"date": d[-1], "label": "【酒田・三山】", "text": "🔴 【酒田・三山】高値圏での三連ピーク。買い勢力の限界露呈。利確の急所。", "color": "#ef5350", "type": "bear"})
+
+    if wave['dt'] and is_high_zone:
+        if not any(p['label'] == "【酒田・三尊】" for p in patterns):
+            patterns.append({"date": d[-1], "label": "【酒田・二重天井】", "text": "🔴 【酒田・二重天井】天井圏での双峰。上昇エネルギーの枯渇。崩落へのカウントダウン。", "color": "#ef5350", "type": "bear"})
+
+    # 赤三兵/黒三兵・三空の判定（インデックスアクセスを整理）
+    if is_high_zone:
+        if all(c[i] > o[i] for i in range(-3, 0)) and all(c[i] > c[i-1] for i in range(-2, 0)):
+            patterns.append({"date": d[-1], "label": "【酒田・赤三先】", "text": "🔴 【酒田・赤三先】高値圏での三連陽。買い枯れの兆候。新規買いは罠。", "color": "#ef5350", "type": "bear"})
+        if all(c[i] < o[i] for i in range(-3, 0)) and all(c[i] < c[i-1] for i in range(-2, 0)):
+            patterns.append({"date": d[-1], "label": "【酒田・黒三兵】", "text": "🔴 【酒田・黒三兵】高値圏での崩壊合図。暴落の狼煙。即時撤退。", "color": "#ef5350", "type": "bear"})
+        
+        # 厳格検知：3回連続で「当日の高値」が「前日の安値」を下回る（完全な下落窓）
+        if all(h[i] < l[i-1] for i in range(-3, 0)):
+            patterns.append({"date": d[-1], "label": "【酒田・売三空】", "text": "🟢 【酒田・売り三空】三度の窓。売り枯れの極み。反転狙撃好機。", "color": "#26a69a", "type": "bull"})
+
+    if is_low_zone:
+        if check_oversold_ultimate(df):
+            patterns.append({"date": d[-1], "label": "【酒田・陰の極み】", "text": "🟢 【酒田・陰の極み】底打ち最終波形。売り枯れの果て。反転攻勢の急所。狙撃準備。", "color": "#26a69a", "type": "bull"})
+        if all(c[i] > o[i] for i in range(-3, 0)) and all(c[i] > c[i-1] for i in range(-2, 0)):
+            patterns.append({"date": d[-1], "label": "【酒田・赤三兵】", "text": "🟢 【酒田・赤三兵】安値圏からの狼煙。底打ち反転。追撃準備。", "color": "#26a69a", "type": "bull"})
+            
+        # 厳格検知：3回連続で「当日の安値」が「前日の高値」を上回る（完全な上昇窓）
+        if all(l[i] > h[i-1] for i in range(-3, 0)):
+            patterns.append({"date": d[-1], "label": "【酒田・買三空】", "text": "🔴 【酒田・買い三空】最終噴出。過熱の極致。利確の急所。", "color": "#ef5350", "type": "bear"})
+
+    if wave['db'] and is_low_zone:
+        patterns.append({"date": d[-1], "label": "【酒田・二重底】", "text": "🟢 【酒田・二重底】底堅い反転波形を確認。底打ちの最終局面。狙撃準備。", "color": "#26a69a", "type": "bull"})
+    
+    # たくり線（下ヒゲ）の検知
+    body_v = abs(c[-1] - o[-1])
+    shadow_l = min(c[-1], o[-1]) - l[-1]
+    full_rng = h[-1] - l[-1]
+    if full_rng > 0 and shadow_l > (body_v * 2.5) and (shadow_l / full_rng) > 0.6 and is_low_zone:
+        patterns.append({"date": d[-1], "label": "【酒田・たくり】", "text": "🟢 【酒田・たくり線】大底圏での強烈な反発。絶好の買場。攻勢の起点。", "color": "#26a69a", "type": "bull"})
+
+    return patterns
+
+
+# ==========================================
+# 📐 テクニカル指標（SMA・Wilder ATR・RSI・MACD）
+# ==========================================
+def calc_vector_indicators(df):
+    """完全ベクトル化されたテクニカル指標計算（14日Wilder式・実数ATR完全換装版）"""
+    if df is None or df.empty or len(df) < 2:
+        return df
+
+    # 動的な列名取得（すれ違い防止回路）
+    close_col = 'AdjC' if 'AdjC' in df.columns else 'Close'
+    high_col = 'AdjH' if 'AdjH' in df.columns else 'High'
+    low_col = 'AdjL' if 'AdjL' in df.columns else 'Low'
+    
+    if close_col not in df.columns:
+        return df
+
+    # 1. 移動平均線 (float32で計算結果を保持)
+    df['SMA25'] = df[close_col].rolling(window=25, min_periods=1).mean().astype('float32')
+    df['SMA75'] = df[close_col].rolling(window=75, min_periods=1).mean().astype('float32')
+
+    # ====================================================================
+    # 🎯 2. 【完全浄化】14日Wilder式 実数ATR計算（ハイブリッド安全装置）
+    # ====================================================================
+    if high_col in df.columns and low_col in df.columns:
+        c_prev = df[close_col].shift(1)
+        tr1 = df[high_col] - df[low_col]
+        tr2 = (df[high_col] - c_prev).abs()
+        tr3 = (df[low_col] - c_prev).abs()
+        
+        # True Rangeの算出
+        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+        
+        # 🛡️ Wilder式ATR（RMA: 修正移動平均 = alpha 1/14 の指数平滑）
+        if len(df) >= 14:
+            df['ATR_Standard'] = tr.ewm(alpha=1/14, adjust=False, min_periods=1).mean().astype('float32')
+        else:
+            # 14日未満の場合は単純平均で代用
+            df['ATR_Standard'] = tr.rolling(window=len(df), min_periods=1).mean().astype('float32')
+        
+        del c_prev, tr1, tr2, tr3, tr
+    else:
+        # 究極のフェイルセーフ（High/Lowが存在しない等の異常時のみ）
+        df['ATR_Standard'] = (df[close_col] * 0.05).astype('float32')
+        
+    # 互換性のため、小文字の 'atr' 列にも同じ実数値をセット
+    df['atr'] = df['ATR_Standard']
+    df['ATR'] = df['ATR_Standard']
+    # ====================================================================
+
+    # 3. RSIの完全ベクトル化計算
+    delta = df[close_col].diff()
+    gain = delta.where(delta > 0, 0.0).rolling(window=14, min_periods=1).mean()
+    loss = (-delta.where(delta < 0, 0.0)).rolling(window=14, min_periods=1).mean()
+    
+    # ゼロ除算回避とRSI算出
+    rs = gain / loss.replace(0, 1e-10) 
+    df['RSI'] = (100 - (100 / (1 + rs))).astype('float32')
+
+    del delta, gain, loss, rs
+    return df
+
+def get_fast_indicators(prices):
+    if len(prices) < 15: return 50.0, 0.0, 0.0, np.zeros(5)
+    p = np.array(prices, dtype='float32')
+    ema12 = pd.Series(p).ewm(span=12, adjust=False).mean().values
+    ema26 = pd.Series(p).ewm(span=26, adjust=False).mean().values
+    macd = ema12 - ema26
+    signal = pd.Series(macd).ewm(span=9, adjust=False).mean().values
+    hist = macd - signal
+    diff = np.diff(p[-15:])
+    g = np.sum(np.maximum(diff, 0))
+    l = np.sum(np.abs(np.minimum(diff, 0)))
+    rsi = 100 - (100 / (1 + (g / (l + 1e-10))))
+    return rsi, hist[-1], hist[-2], hist[-5:]
+
+
+# ==========================================
+# 📑 業績推移表（ローカルDB → 直近4四半期＋通年の前年同期比）
+# ==========================================
+YOY_TABLE_COLS = [("売上(%)", "Sales"), ("営業益(%)", "OP"), ("経常益(%)", "OdP"), ("純利益(%)", "NP"), ("EPS(%)", "EPS")]
+
+def _yoy_table_from_derived(df_target):
+    """正規化テーブルの派生列（_YoY / _TTM_YoY）から TAB3 の業績表を組み立てる"""
+    act = df_target[df_target['Sales_Q'].notna()].reset_index(drop=True)
+    if len(act) < 2: return None
+
+    def fmt(v):
+        return "-" if pd.isna(v) else float(v)
+
+    def fmt_date(d):
+        return d.strftime('%Y-%m-%d') if pd.notna(d) and hasattr(d, 'strftime') else '-'
+
+    results = []
+    for i in range(1, 5):
+        if len(act) < i:
+            q_date = '-'
+        else:
+            q_date = fmt_date(act['DiscDate'].iloc[-i])
+        row = {"期間": f"直近 Q{i}", "開示日": q_date}
+        for label, f in YOY_TABLE_COLS:
+            row[label] = fmt(act[f + '_YoY'].iloc[-i]) if len(act) >= i + 4 else "-"
+        results.append(row)
+
+    if len(act) >= 8:
+        row = {"期間": "🌟 通年(直近1年)", "開示日": "-"}
+        for label, f in YOY_TABLE_COLS:
+            row[label] = fmt(act[f + '_TTM_YoY'].iloc[-1])
+        results.append(row)
+    return pd.DataFrame(results[::-1])
+
+def fetch_fundamental_history_local(code, local_db):
+    """【通信完全ゼロ】ローカルDBから四半期推移・通年業績を抽出・計算する（YoY統一版）"""
+    try:
+        if local_db is None or len(local_db) == 0: return None
+
+        str_code = str(code).strip()[:4]
+        df_target = None
+        
+        if isinstance(local_db, (dict, fundamentals_store.FundamentalsTable)):
+            api_code = str_code if len(str_code) >= 5 else str_code + "0"
+            df_target = local_db.get(api_code)
+            if df_target is None:
+                df_target = local_db.get(str_code) 
+            if df_target is None or len(df_target) == 0: return None
+            df_target = df_target.copy().reset_index(drop=True)
+            
+        elif isinstance(local_db, pd.DataFrame):
+            c_code_col = 'Code' if 'Code' in local_db.columns else ('code' if 'code' in local_db.columns else None)
+            if not c_code_col: return None
+            mask = local_db[c_code_col].astype(str).str.startswith(str_code)
+            df_target = local_db[mask].copy().reset_index(drop=True)
+
+        if df_target is None or len(df_target) == 0: return None
+
+        # 📚 正規化テーブルなら取込時に算出済みの前年同期比を並べるだけ
+        if 'Sales_YoY' in df_target.columns:
+            return _yoy_table_from_derived(df_target)
+
+        cols = [str(c).lower() for c in df_target.columns]
+        def find_c(*names):
+            for n in names:
+                if n.lower() in cols: return df_target.columns[cols.index(n.lower())]
+            return None
+
+        c_sales = find_c('Sales', 'NetSales', 'net_sales')
+        c_op = find_c('OP', 'OperatingProfit', 'operating_profit')
+        c_ord = find_c('OdP', 'OrdinaryProfit', 'ordinary_profit')
+        c_eps = find_c('EPS', 'EarningsPerShare', 'eps')
+        c_profit = find_c('NP', 'Profit', 'netincome')
+        c_type = find_c('CurPerType', 'TypeOfCurrentPeriod')
+        c_date = find_c('DiscDate', 'DisclosedDate', 'Date')
+
+        def to_flt(v):
+            if isinstance(v, (float, int, np.floating, np.integer)):
+                return 0.0 if v != v else float(v)
+            try: 
+                if pd.isna(v) or str(v).strip() == '': return 0.0
+                return float(str(v).replace(',', '').strip())
+            except: return 0.0
+
+        if c_date:
+            df_target[c_date] = pd.to_datetime(df_target[c_date], errors='coerce')
+            df_target = df_target.sort_values(by=c_date).reset_index(drop=True)
+
+        actual_mask = (df_target[c_sales].apply(to_flt) > 0) if c_sales else pd.Series([True]*len(df_target))
+        actual_df = df_target[actual_mask].copy().reset_index(drop=True)
+
+        if len(actual_df) < 2: return None
+
+        std_df = actual_df.copy()
+        for i in range(1, len(actual_df)):
+            curr_type = str(actual_df[c_type].iloc[i]) if c_type else ""
+            c_s = to_flt(actual_df[c_sales].iloc[i]) if c_sales else 0.0
+            p_s = to_flt(actual_df[c_sales].iloc[i-1]) if c_sales else 0.0
+            
+            is_q1 = ('1Q' in curr_type or 'Q1' in curr_type) or (c_s < p_s and p_s > 0)
+
+            if not is_q1:
+                for col in filter(None, [c_sales, c_op, c_ord, c_profit, c_eps]):
+                    if col in std_df.columns:
+                        try: 
+                            val_c = to_flt(actual_df[col].iloc[i])
+                            val_p = to_flt(actual_df[col].iloc[i-1])
+                            std_df.iat[i, std_df.columns.get_loc(col)] = val_c - val_p
+                        except: pass
+
+        def calc_yoy(c, p):
+            if p == 0.0 or p is None: return "-"
+            return ((c - p) / abs(p)) * 100.0
+
+        def get_v(row, primary, fallback=None):
+            if row is None: return 0.0
+            v = to_flt(row.get(primary, 0.0)) if primary else 0.0
+            if v == 0.0 and fallback and fallback in row.index:
+                v = to_flt(row.get(fallback, 0.0))
+            return v
+
+        results = []
+        for i in range(1, 5):
+            # YoY（4つ前＝前年同期との比較）
+            if len(std_df) < i + 4:
+                q_cur = std_df.iloc[-i] if len(std_df) >= i else None
+                dis_date = '-'
+                if q_cur is not None:
+                    dis_date = q_cur.get(c_date, '-')
+                    if pd.notna(dis_date) and hasattr(dis_date, 'strftime'): 
+                        dis_date = dis_date.strftime('%Y-%m-%d')
+                results.append({"期間": f"直近 Q{i}", "開示日": str(dis_date), 
+                                "売上(%)": "-", "営業益(%)": "-", "経常益(%)": "-", "純利益(%)": "-", "EPS(%)": "-"})
+                continue
+                
+            q_cur = std_df.iloc[-i]
+            q_yoy = std_df.iloc[-(i+4)]
+            
+            dis_date = q_cur.get(c_date, '-')
+            if pd.notna(dis_date) and hasattr(dis_date, 'strftime'): 
+                dis_date = dis_date.strftime('%Y-%m-%d')
+                if dis_date == '1970-01-01': dis_date = '-'
+            else:
+                dis_date = '-'
+                
+            results.append({
+                "期間": f"直近 Q{i}", "開示日": str(dis_date),
+                "売上(%)": calc_yoy(get_v(q_cur, c_sales), get_v(q_yoy, c_sales)),
+                "営業益(%)": calc_yoy(get_v(q_cur, c_op), get_v(q_yoy, c_op)),
+                "経常益(%)": calc_yoy(get_v(q_cur, c_ord), get_v(q_yoy, c_ord)),
+                "純利益(%)": calc_yoy(get_v(q_cur, c_profit, c_eps), get_v(q_yoy, c_profit, c_eps)),
+                "EPS(%)": calc_yoy(get_v(q_cur, c_eps, c_profit), get_v(q_yoy, c_eps, c_profit)),
+            })
+
+        # 通年データ（YoY）
+        if len(std_df) >= 8:
+            y_cur = std_df.iloc[-4:].apply(lambda x: pd.to_numeric(x, errors='coerce')).sum(numeric_only=True)
+            y_prv = std_df.iloc[-8:-4].apply(lambda x: pd.to_numeric(x, errors='coerce')).sum(numeric_only=True)
+            results.append({
+                "期間": "🌟 通年(直近1年)", "開示日": "-",
+                "売上(%)": calc_yoy(get_v(y_cur, c_sales), get_v(y_prv, c_sales)),
+                "営業益(%)": calc_yoy(get_v(y_cur, c_op), get_v(y_prv, c_op)),
+                "経常益(%)": calc_yoy(get_v(y_cur, c_ord), get_v(y_prv, c_ord)),
+                "純利益(%)": calc_yoy(get_v(y_cur, c_profit, c_eps), get_v(y_prv, c_profit, c_eps)),
+                "EPS(%)": calc_yoy(get_v(y_cur, c_eps, c_profit), get_v(y_prv, c_eps, c_profit)),
+            })
+        
+        if len(results) == 0: return None
+        return pd.DataFrame(results[::-1])
+    except Exception as e:
+        return None
+
+
+# ==========================================
+# 🎯 TAB3：1銘柄の陣形・業績判定（S/A/B・YoYベース）
+# ==========================================
+def _yoy_value(r, col):
+    if r.empty: return None
+    v = r[col].iloc[0]
+    if isinstance(v, str) and v == "-": return None
+    try: return float(v)
+    except: return None
+
+
+def rank_tab3_funda(f_df, mode):
+    """業績推移表（fetch_fundamental_history_local の戻り値）の直近2四半期から業績ランク（S/A/B/対象外）"""
+    if f_df is None or f_df.empty:
+        return "対象外"
+    q1_row = f_df[f_df["期間"] == "直近 Q1"]
+    q2_row = f_df[f_df["期間"] == "直近 Q2"]
+
+    if mode == "buy":
+        # YoY基準の数値を参照
+        def count_misses(r):
+            vals = [_yoy_value(r, label) for label in ("売上(%)", "営業益(%)", "経常益(%)", "純利益(%)", "EPS(%)")]
+            if None in vals: return 99
+            s, op, ord_p, np_p, eps = vals
+            m = 0
+            if s < 7.0: m += 1
+            if op < 20.0: m += 1
+            if ord_p < 20.0: m += 1
+            if np_p < 20.0: m += 1
+            if eps < 20.0: m += 1
+            return m
+
+        q1_miss = count_misses(q1_row)
+        q2_miss = count_misses(q2_row)
+        if q1_miss == 0:
+            if q2_miss == 0: return "S"
+            elif q2_miss == 1: return "A"
+            elif 2 <= q2_miss <= 4: return "B"
+
+    elif mode == "sell":
+        if not q1_row.empty and not q2_row.empty:
+            vals = [_yoy_value(r, label) for r in (q1_row, q2_row) for label in ("営業益(%)", "経常益(%)", "純利益(%)", "EPS(%)")]
+            if None not in vals:
+                lt_5 = sum(1 for v in vals if v < 5.0)
+                lt_10 = sum(1 for v in vals if 5.0 <= v < 10.0)
+                ge_10 = sum(1 for v in vals if v >= 10.0)
+
+                if ge_10 == 0:
+                    if lt_5 == 8: return "S"
+                    elif lt_5 == 7 and lt_10 == 1: return "A"
+                    elif lt_5 == 6 and lt_10 == 2: return "B"
+    return "対象外"
+
+
+def rank_tab3_signal(days_ago, mode):
+    """最終シグナルが何本前か（-1 はシグナルなし）から陣形ランク（S/A/B/対象外）"""
+    if mode == "buy":
+        if 0 <= days_ago <= 2: return "S"
+        elif days_ago == 3: return "A"
+        elif days_ago == 4: return "B"
+    elif mode == "sell":
+        if days_ago == 0: return "S"
+        elif days_ago == 1: return "A"
+        elif 0 <= days_ago <= 3: return "B"
+    return "対象外"
+
+
+def judge_tab3(code, df, mode, days_ago, local_db):
+    """
+    TAB3 フェーズ1の1銘柄判定（execute_chunked_scan(_mp) の process_func）。
+    df は直近260本の日足、days_ago は {コード: 最終シグナルが何本前か}（formation_engine の一括探知）。
+    4本未満なら None。
+    """
+    if df is None or df.empty or len(df) < 4:
+        return None
+    code_int = int(str(code)[:4])
+
+    turnover = 0.0
+    try:
+        q0 = df.iloc[-1]
+        v_col = 'Volume' if 'Volume' in df.columns else ('Vo' if 'Vo' in df.columns else None)
+        c_col = 'AdjC' if 'AdjC' in df.columns else ('Close' if 'Close' in df.columns else None)
+        if v_col and c_col: turnover = float(q0[v_col]) * float(q0[c_col])
+    except: pass
+
+    rank_signal = rank_tab3_signal(int(days_ago.get(code, -1)), mode)
+    f_df = fetch_fundamental_history_local(code_int, local_db)
+    rank_funda = rank_tab3_funda(f_df, mode)
+
+    is_hit = False
+    rank_str = ""
+    if rank_funda != "対象外" and rank_signal != "対象外":
+        is_hit = True
+        badge = "🎯" if mode == "buy" else "💀"
+        rank_str = f"{badge}業績:{rank_funda}級 / 陣形:{rank_signal}級"
+    return {"code": code_int, "is_hit": is_hit, "rank": rank_str, "turnover": turnover, "fund": f_df}
@@ -0,0 +1,186 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🤝 プロセス共通の結果キャッシュ（全セッション共有・同時実行の一本化・容量上限つきLRU）
+# ==========================================
+# Streamlit はブラウザのセッションごとにスクリプトを別スレッドで走らせるが、モジュールはプロセスで1つ。
+# ここに置いた ResultCache は全セッションから見える。
+# ・キーは (スキャン種別, パラメータ, データ版)。データ版が変われば（19時の入れ替え・決算ストア更新など）別キーになる
+# ・同じキーの計算が走っている間に来た要求は、その計算の完了を待って同じ結果を受け取る（single-flight）
+#   先行の計算が例外で失敗したら待っていた側にも同じ例外を投げる。
+#   st.stop() / st.rerun() のような中断（Exception 以外）なら、待っていた側のうち1つが計算し直す
+# ・結果の推定バイト数の合計が max_bytes を超えたら、最後に使われたのが古いものから捨てる
+# 環境変数 SCAN_CACHE_MB で SCAN_CACHE の上限（MB）を変更できる。
+
+SCAN_CACHE_MB = float(os.getenv("SCAN_CACHE_MB", "256"))
+
+
+def estimate_size(obj, _seen=None):
+    """キャッシュ容量の見積もり（DataFrame / ndarray は実データ量、コンテナは中身を辿る）"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, _seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), _seen)
+    return size
+
+
+def _freeze(v):
+    """パラメータをキーに使える形（ハッシュ可能・順序固定）にする"""
+    if isinstance(v, dict):
+        return tuple(sorted((str(k), _freeze(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple)):
+        return tuple(_freeze(x) for x in v)
+    if isinstance(v, (set, frozenset)):
+        return tuple(sorted(_freeze(x) for x in v))
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+
+def scan_key(kind, params, version):
+    """(スキャン種別, パラメータ, データ版) のキャッシュキー"""
+    return (kind, _freeze(params), _freeze(version))
+
+
+def file_version(*paths):
+    """ファイル群の (更新時刻ns, サイズ)。データ版の一部に使う（無いファイルは None）"""
+    out = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+class _Flight:
+    """計算中の1キー（待ち合わせ用）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.aborted = False
+
+
+class ResultCache:
+    def __init__(self, max_bytes, name="cache"):
+        self.max_bytes = int(max_bytes)
+        self.name = name
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key -> (value, size)
+        self._flights = {}
+        self._bytes = 0
+        self.counts = {"hit": 0, "wait": 0, "miss": 0, "error": 0, "evict": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key][0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        size = estimate_size(value)
+        if key in self._data:
+            self._bytes -= self._data.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._data:
+            _, (_, s) = self._data.popitem(last=False)
+            self._bytes -= s
+            self.counts["evict"] += 1
+
+    def get_or_compute(self, key, fn, on_wait=None):
+        """
+        キャッシュにあればそれを、無ければ fn() を計算して入れて返す。(値, 'hit' / 'wait' / 'miss') を返す。
+        同じキーを別スレッドが計算中なら on_wait() を呼んでから完了を待つ（'wait'）。
+        """
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    self.counts["hit"] += 1
+                    return self._data[key][0], "hit"
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    self.counts["wait"] += 1
+
+            if leader:
+                try:
+                    value = fn()
+                except BaseException as e:
+                    flight.error = e
+                    flight.aborted = not isinstance(e, Exception)
+                    with self._lock:
+                        self._flights.pop(key, None)
+                        self.counts["error"] += 1
+                    flight.event.set()
+                    raise
+                with self._lock:
+                    self._store(key, value)
+                    self._flights.pop(key, None)
+                    self.counts["miss"] += 1
+                flight.value = value
+                flight.event.set()
+                return value, "miss"
+
+            if on_wait:
+                on_wait()
+            flight.event.wait()
+            if flight.error is None:
+                return flight.value, "wait"
+            if not flight.aborted:
+                raise flight.error
+            # 先行が中断しただけなら、もう一度（今度は自分が計算役になり得る）
+
+    def invalidate(self, kind=None):
+        """kind（キーの先頭要素）が一致するもの、省略時は全件を捨てる"""
+        with self._lock:
+            for key in [k for k in self._data if kind is None or (isinstance(k, tuple) and k and k[0] == kind)]:
+                self._bytes -= self._data.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {"name": self.name, "entries": len(self._data), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "inflight": len(self._flights), **self.counts}
+
+
+# スキャン結果用（プロセスで1つ）
+SCAN_CACHE = ResultCache(SCAN_CACHE_MB * 1024 * 1024, name="scan")
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import pandas as pd
+
+import price_store
+import fundamentals_store
+
+# ==========================================
+# 🧪 疑似マーケット生成器（J-Quants と同じ形の日足・決算を決定的に作る）
+# ==========================================
+# ベンチマーク・一致検証用。同じ seed からは毎回まったく同じデータが出る。
+# ・日足: /prices/daily_quotes（V1 列名）の形。値は文字列ではなく数値。
+#   幾何ランダムウォーク＋銘柄ごとのトレンド・ボラ、1円刻み（同値の山・谷も自然に出る）、
+#   約1%の欠測（売買停止）、約0.5%の銘柄で期間中に株式分割（調整前 / 調整後の両列を持つ）
+# ・決算: /fins/statements（V1 列名）の形。値は J-Quants と同じく文字列（累計・YTD）。
+#   3月決算・四半期ごと（1Q/2Q/3Q/FY）、約1割の銘柄に業績予想修正だけの行を混ぜる
+# 営業日は土日だけを除いた平日（祝日カレンダーには依存しない）。
+
+END_DATE = "2025-12-30"
+
+
+def trading_days(n_days, end=END_DATE):
+    """end までの直近 n_days 営業日（平日）を 'YYYY-MM-DD' の昇順で返す"""
+    return [d.strftime('%Y-%m-%d') for d in pd.bdate_range(end=end, periods=n_days)]
+
+
+def market_codes(n_codes):
+    """5桁の銘柄コード（1301 から連番、J-Quants 形式）"""
+    return [f"{1301 + i}0" for i in range(n_codes)]
+
+
+def generate_bars(n_codes=4000, n_days=280, seed=0):
+    """全銘柄 × 全営業日の日足（縦持ち、V1 列名）を返す"""
+    rng = np.random.default_rng(seed)
+    days = trading_days(n_days)
+    codes = market_codes(n_codes)
+
+    base = np.exp(rng.uniform(np.log(150), np.log(12000), n_codes))
+    drift = rng.normal(0.0003, 0.0010, n_codes)
+    vol = rng.uniform(0.012, 0.035, n_codes)
+    ret = rng.normal(drift, vol, (n_days, n_codes))
+    close = base * np.exp(np.cumsum(ret, axis=0))
+    gap = rng.normal(0, 0.35, (n_days, n_codes)) * vol
+    open_ = close * np.exp(-ret + gap)
+    wick = np.abs(rng.normal(0, 0.5, (2, n_days, n_codes))) * vol
+    high = np.maximum(open_, close) * (1 + wick[0])
+    low = np.minimum(open_, close) * (1 - wick[1])
+    volume = np.round(np.exp(rng.normal(11, 1.2, n_codes)) * np.exp(rng.normal(0, 0.4, (n_days, n_codes))), -2)
+
+    # 株式分割（分割日以降の調整前価格が 1/ratio、当日の AdjustmentFactor = 1/ratio）
+    factor = np.ones((n_days, n_codes))
+    raw_scale = np.ones((n_days, n_codes))
+    split_codes = np.flatnonzero(rng.random(n_codes) < 0.005)
+    for i in split_codes:
+        day = int(rng.integers(n_days // 4, n_days))
+        ratio = float(rng.choice([2, 3, 5]))
+        factor[day, i] = 1 / ratio
+        raw_scale[:day, i] = ratio
+
+    adj = [np.round(x) for x in (open_, high, low, close)]
+    adj[1] = np.maximum(adj[1], np.maximum(adj[0], adj[3]))
+    adj[2] = np.minimum(adj[2], np.minimum(adj[0], adj[3]))
+    raw = [a * raw_scale for a in adj]
+
+    present = rng.random((n_days, n_codes)) >= 0.01
+    di, ci = np.nonzero(present)
+    df = pd.DataFrame({
+        "Date": np.asarray(days)[di],
+        "Code": np.asarray(codes)[ci],
+        "Open": raw[0][di, ci], "High": raw[1][di, ci], "Low": raw[2][di, ci], "Close": raw[3][di, ci],
+        "Volume": (volume / raw_scale)[di, ci],
+        "AdjustmentFactor": factor[di, ci],
+        "AdjustmentOpen": adj[0][di, ci], "AdjustmentHigh": adj[1][di, ci],
+        "AdjustmentLow": adj[2][di, ci], "AdjustmentClose": adj[3][di, ci],
+        "AdjustmentVolume": volume[di, ci],
+    })
+    return df
+
+
+def _fiscal_quarters(n_quarters, end=END_DATE):
+    """3月決算の直近 n_quarters 期の (期末日, 種別) を古い順に返す"""
+    q_ends = pd.date_range(end=pd.Timestamp(end) - pd.Timedelta(days=45), periods=n_quarters, freq='QE-MAR')
+    kinds = {6: "1Q", 9: "2Q", 12: "3Q", 3: "FY"}
+    return [(d, kinds[d.month]) for d in q_ends]
+
+
+def generate_statements(n_codes=4000, n_quarters=8, seed=0):
+    """全銘柄の決算短信（縦持ち、V1 列名、累計値は文字列）を返す"""
+    rng = np.random.default_rng(seed + 1)
+    codes = market_codes(n_codes)
+    # 累計値が正しくなるよう期首（1Q）から積み上げ、出力するのは直近 n_quarters 期だけ
+    quarters = _fiscal_quarters(n_quarters + 3)
+    while quarters[0][1] != "1Q":
+        quarters.pop(0)
+    skip = len(quarters) - n_quarters
+    n_q = len(quarters)
+
+    sales0 = np.exp(rng.uniform(np.log(2e9), np.log(5e11), n_codes))
+    growth = rng.normal(0.02, 0.06, n_codes)
+    margin = rng.uniform(0.02, 0.18, n_codes)
+    shares = np.exp(rng.uniform(np.log(5e6), np.log(5e8), n_codes))
+    q_sales = sales0 * np.exp(np.cumsum(rng.normal(growth, 0.05, (n_q, n_codes)), axis=0))
+    q_op = q_sales * np.clip(margin + rng.normal(0, 0.03, (n_q, n_codes)), -0.1, None)
+    q_od = q_op * rng.uniform(0.95, 1.08, (n_q, n_codes))
+    q_np = q_od * rng.uniform(0.6, 0.72, (n_q, n_codes))
+
+    rows = []
+    ytd = np.zeros((4, n_codes))
+    for q, (end, kind) in enumerate(quarters):
+        if kind == "1Q":
+            ytd[:] = 0
+        ytd += np.stack([q_sales[q], q_op[q], q_od[q], q_np[q]])
+        lag = rng.integers(30, 46, n_codes)
+        if q < skip:
+            continue
+        for i, code in enumerate(codes):
+            disc = end + pd.Timedelta(days=int(lag[i]))
+            rows.append({
+                "DisclosedDate": disc.strftime('%Y-%m-%d'), "DisclosedTime": "15:00:00", "LocalCode": code,
+                "TypeOfDocument": f"{kind}FinancialStatements_Consolidated_JP", "TypeOfCurrentPeriod": kind,
+                "CurrentPeriodEndDate": end.strftime('%Y-%m-%d'),
+                "NetSales": f"{ytd[0, i]:.0f}", "OperatingProfit": f"{ytd[1, i]:.0f}",
+                "OrdinaryProfit": f"{ytd[2, i]:.0f}", "Profit": f"{ytd[3, i]:.0f}",
+                "EarningsPerShare": f"{ytd[3, i] / shares[i]:.2f}",
+            })
+    # 業績予想修正だけの行（実績欄は空）
+    revised = np.flatnonzero(rng.random(n_codes) < 0.1)
+    for i in revised:
+        end, _ = quarters[int(rng.integers(skip, n_q))]
+        rows.append({
+            "DisclosedDate": (end + pd.Timedelta(days=20)).strftime('%Y-%m-%d'), "DisclosedTime": "16:00:00",
+            "LocalCode": codes[i], "TypeOfDocument": "EarnForecastRevision", "TypeOfCurrentPeriod": "FY",
+            "CurrentPeriodEndDate": end.strftime('%Y-%m-%d'),
+            "NetSales": "", "OperatingProfit": "", "OrdinaryProfit": "", "Profit": "", "EarningsPerShare": "",
+        })
+    return pd.DataFrame(rows)
+
+
+def statement_histories(statements):
+    """決算短信の縦持ち表 → {5桁コード: 決算DataFrame}（旧 fundamentals_db.pkl と同じ形）"""
+    return {code: g.reset_index(drop=True) for code, g in statements.groupby("LocalCode", sort=True)}
+
+
+def write_price_store(bars, root):
+    """日足を日付ごとに price_store へ焼き付ける（root は空のディレクトリ）"""
+    for dt, g in bars.groupby("Date", sort=True):
+        price_store.write_day(dt.replace('-', ''), g, root)
+    return price_store.list_days(root)
+
+
+def build_market(root, n_codes=4000, n_days=280, n_quarters=8, seed=0):
+    """
+    root に疑似マーケット一式（prices_store/ と fundamentals_store.npz）を作る。
+    (日足DataFrame, 決算DataFrame) を返す。
+    """
+    bars = generate_bars(n_codes, n_days, seed)
+    statements = generate_statements(n_codes, n_quarters, seed)
+    write_price_store(bars, os.path.join(root, "prices_store"))
+    table = fundamentals_store.FundamentalsTable.from_histories(statement_histories(statements))
+    table.save(os.path.join(root, "fundamentals_store.npz"))
+    return bars, statements
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="疑似マーケット（日足・決算ストア）を生成する")
+    parser.add_argument("root", help="出力先ディレクトリ")
+    parser.add_argument("--codes", type=int, default=4000)
+    parser.add_argument("--days", type=int, default=280)
+    parser.add_argument("--quarters", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    bars, statements = build_market(args.root, args.codes, args.days, args.quarters, args.seed)
+    print(f"✅ 日足 {len(bars):,} 行 / 決算 {len(statements):,} 行を {args.root} に生成しました。")
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュール（price_store など）をそのまま import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def synthetic_store(tmp_path_factory):
+    """疑似マーケット（200銘柄 × 280営業日、分割・欠測入り）を焼き付けた日足ストアのディレクトリ"""
+    import synthetic_market
+    root = str(tmp_path_factory.mktemp("market") / "prices_store")
+    synthetic_market.write_price_store(synthetic_market.generate_bars(n_codes=200, n_days=280, seed=0), root)
+    return root
+
+
+@pytest.fixture(scope="session")
+def synthetic_market(synthetic_store):
+    """synthetic_store の全履歴を読んだ価格パネル"""
+    from price_panel import PricePanel
+    return PricePanel.from_store(root=synthetic_store)
@@ -0,0 +1,7 @@
+import backtester
+
+
+def test_signals_match_batch_summary(synthetic_market):
+    sig = backtester.compute_signals(synthetic_market, backtester.batch.PUSH_R, None, top_n=len(synthetic_market))
+    assert sig["candidate"].any()
+    assert backtester.check_parity(synthetic_market) == []
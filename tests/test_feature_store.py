@@ -0,0 +1,12 @@
+import feature_store
+
+
+def test_table_matches_per_code_indicators(synthetic_market):
+    table = feature_store.FeatureTable.from_panel(synthetic_market)
+    assert len(table) == len(synthetic_market)
+    assert feature_store.check_parity(table, synthetic_market) == []
+
+
+def test_saved_table_round_trips(synthetic_market, tmp_path):
+    feature_store.FeatureTable.from_panel(synthetic_market).save(str(tmp_path))
+    assert feature_store.check_parity(feature_store.FeatureTable.load(str(tmp_path)), synthetic_market) == []
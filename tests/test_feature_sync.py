@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import feature_store
+import indicator_state
+import synthetic_market
+from price_panel import PricePanel
+
+
+@pytest.fixture(scope="module")
+def split_market():
+    """全銘柄の日足と、(既存の日, 新着5日) の分け目。末尾の銘柄は途中上場（14本をまたぐ銘柄・新着日に初登場する銘柄）"""
+    bars = synthetic_market.generate_bars(n_codes=120, n_days=280, seed=5)
+    days = sorted(bars["Date"].unique())
+    codes = synthetic_market.market_codes(120)
+    bars = bars[~((bars["Code"] == codes[-1]) & (bars["Date"] < days[-17]))]
+    bars = bars[~((bars["Code"] == codes[-2]) & (bars["Date"] < days[-3]))]
+    return bars, days[-5]
+
+
+def _write(bars, root, since=None, until=None):
+    part = bars
+    if since is not None:
+        part = part[part["Date"] >= since]
+    if until is not None:
+        part = part[part["Date"] < until]
+    synthetic_market.write_price_store(part, root)
+
+
+@pytest.mark.parametrize("dirty", [(), ("13050",)])
+def test_incremental_sync_matches_full_rebuild(split_market, tmp_path, dirty):
+    bars, cut = split_market
+    root = str(tmp_path / "prices_store")
+    _write(bars, root, until=cut)
+    table, state, _, rebuilt = feature_store.sync(root=root)
+    assert rebuilt
+    table.save(root)
+    state.save(root)
+
+    _write(bars, root, since=cut)
+    table, state, advanced, rebuilt = feature_store.sync(root=root, dirty_codes=dirty)
+    assert (advanced, rebuilt) == (5, False)
+
+    panel = PricePanel.from_store(root=root)
+    assert feature_store.check_parity(table, panel) == []
+    assert indicator_state.check_parity(state, panel) == []
+
+    # 差分で足した表と全履歴から作った表が、全指標・全本数で一致する
+    full = feature_store.build_from_store(root)
+    assert list(table.codes) == list(full.codes)
+    assert ((table.dates == full.dates) | (np.isnat(table.dates) & np.isnat(full.dates))).all()
+    assert np.allclose(table.values, full.values, rtol=1e-4, atol=1e-3, equal_nan=True)
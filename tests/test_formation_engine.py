@@ -0,0 +1,9 @@
+import formation_engine
+
+
+def test_batched_signals_match_per_code_history(synthetic_market):
+    panel = synthetic_market.tail(260)
+    res = formation_engine.scan_formations(panel)
+    # 一致が「シグナル無し同士」でないことの確認
+    assert (res["buy_days_ago"] >= 0).any() and (res["sell_days_ago"] >= 0).any()
+    assert formation_engine.check_parity(panel) == []
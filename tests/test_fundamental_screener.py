@@ -0,0 +1,22 @@
+import pytest
+
+import fundamentals_store
+import synthetic_market
+from fundamental_screener import check_parity, screen_momentum
+
+
+@pytest.fixture(scope="module")
+def table():
+    statements = synthetic_market.generate_statements(n_codes=300, n_quarters=8, seed=3)
+    return fundamentals_store.FundamentalsTable.from_histories(synthetic_market.statement_histories(statements))
+
+
+def test_vectorized_screen_matches_per_code_loop(table):
+    assert check_parity(table) == []
+
+
+def test_parity_covers_hits_in_both_modes(table):
+    # 一致が「全部ハズレ同士」でないことの確認
+    codes = table.keys()
+    assert sum(map(len, screen_momentum(table, codes, "buy", 0.0, 0.0))) > 0
+    assert sum(map(len, screen_momentum(table, codes, "sell"))) > 0
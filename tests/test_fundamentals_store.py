@@ -0,0 +1,20 @@
+import pytest
+
+import fundamentals_store
+import synthetic_market
+
+
+@pytest.fixture(scope="module")
+def histories():
+    return synthetic_market.statement_histories(synthetic_market.generate_statements(n_codes=200, n_quarters=8, seed=1))
+
+
+def test_table_matches_per_code_normalization(histories):
+    table = fundamentals_store.FundamentalsTable.from_histories(histories)
+    assert fundamentals_store.check_parity(table, histories) == []
+
+
+def test_saved_table_round_trips(histories, tmp_path):
+    path = str(tmp_path / "fundamentals_store.npz")
+    fundamentals_store.FundamentalsTable.from_histories(histories).save(path)
+    assert fundamentals_store.check_parity(fundamentals_store.load_table(path), histories) == []
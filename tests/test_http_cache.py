@@ -0,0 +1,47 @@
+import os
+import time
+
+import requests
+
+import http_cache
+
+BASE = "https://api.example/v2"
+
+
+def _resp(body=b'{"data": []}'):
+    r = requests.Response()
+    r.status_code = 200
+    r._content = body
+    r.encoding = "utf-8"
+    return r
+
+
+def test_past_bars_expire_and_continuation_pages_are_not_stored():
+    today = "20260110"
+    assert http_cache.policy(f"{BASE}/equities/bars/daily?date=20260105", today) == http_cache.BARS_TTL
+    assert http_cache.policy(f"{BASE}/equities/bars/daily?date=20260110", today) == http_cache.TODAY_TTL
+    assert http_cache.policy(f"{BASE}/equities/bars/daily?date=20260105&pagination_key=abc", today) == http_cache.NO_STORE
+    assert http_cache.policy(f"{BASE}/fins/summary?date=20260105&pagination_key=abc", today) == http_cache.NO_STORE
+    assert http_cache.policy(f"{BASE}/fins/summary?date=20260105", today) is http_cache.PERMANENT
+
+
+def test_split_drops_bars_stored_before_it(tmp_path, monkeypatch):
+    cache = http_cache.HttpCache(root=str(tmp_path))
+    urls = {
+        "old_day": f"{BASE}/equities/bars/daily?date=20260102",
+        "split_code": f"{BASE}/equities/bars/daily?code=1301&from=20250101&to=20260105",
+        "other_code": f"{BASE}/equities/bars/daily?code=7203&from=20250101&to=20260105",
+        "after": f"{BASE}/equities/bars/daily?date=20260106",
+        "fins": f"{BASE}/fins/summary?date=20260105",
+    }
+    stored_at = time.mktime((2026, 1, 6, 12, 0, 0, 0, 0, 0))
+    monkeypatch.setattr(http_cache.time, "time", lambda: stored_at)
+    monkeypatch.setattr(http_cache, "today_jst", lambda ts=None: "20260107" if ts is None else "20260106")
+    for url in urls.values():
+        assert cache.store(url, _resp())
+
+    # 分割日より後に保存した応答は調整済みなので残す
+    assert cache.drop_split_bars({"20260105": {"13010": 0.5}}) == 0
+    assert cache.drop_split_bars({"20260106": {"13010": 0.5}}) == 2
+    left = {k for k, url in urls.items() if os.path.exists(cache._path(url))}
+    assert left == {"other_code", "after", "fins"}
@@ -0,0 +1,7 @@
+import indicator_state
+
+
+def test_state_matches_full_history_indicators(synthetic_store, synthetic_market):
+    state = indicator_state.build(synthetic_store)
+    assert len(state.snapshot()) == len(synthetic_market)
+    assert indicator_state.check_parity(state, synthetic_market) == []
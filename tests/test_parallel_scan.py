@@ -0,0 +1,44 @@
+import pytest
+
+import fundamentals_store
+import parallel_scan
+import synthetic_market as market
+from formation_engine import scan_formations
+from scan_core import judge_tab3, screen_fundamentals_code
+
+
+@pytest.fixture(scope="module")
+def table():
+    return fundamentals_store.FundamentalsTable.from_histories(
+        market.statement_histories(market.generate_statements(n_codes=200, n_quarters=8, seed=2)))
+
+
+def _frame_of(results):
+    """judge_tab3 の結果を比べられる形に（業績表は中身で比べる）"""
+    return {d["code"]: (d["is_hit"], d["rank"], d["turnover"], None if d["fund"] is None else d["fund"].to_dict())
+            for d in results}
+
+
+@pytest.mark.parametrize("mode", ["buy", "sell"])
+def test_tab3_judge_processes_match_threads(synthetic_market, table, mode):
+    panel = synthetic_market
+    days_ago = dict(zip(panel.codes.tolist(), scan_formations(panel)[f"{mode}_days_ago"].tolist()))
+    items = [(c, None) for c in panel.codes.tolist()]
+    threads = parallel_scan.execute_chunked_scan_mp(items, judge_tab3, mode, days_ago, table, panel=panel, tail=260,
+                                                    max_workers=1)
+    procs = parallel_scan.execute_chunked_scan_mp(items, judge_tab3, mode, days_ago, table, panel=panel, tail=260,
+                                                  max_workers=2, min_items=0)
+    assert len(threads) == len(panel)
+    assert any(d["is_hit"] for d in threads)
+    assert [d["code"] for d in procs] == [int(str(c)[:4]) for c in panel.codes]
+    assert _frame_of(procs) == _frame_of(threads)
+
+
+def test_fundamentals_screen_processes_match_threads(table):
+    legacy = {c: table.get(c)[fundamentals_store.COLUMNS] for c in table.keys()}   # 派生列の無い旧ストアの形
+    codes = [c[:4] for c in table.keys()]
+    threads = parallel_scan.execute_chunked_scan_mp(codes, screen_fundamentals_code, legacy, "buy", max_workers=1)
+    procs = parallel_scan.execute_chunked_scan_mp(codes, screen_fundamentals_code, legacy, "buy", max_workers=2,
+                                                  min_items=0)
+    assert threads and sorted(threads) == sorted(procs)
+    assert procs == [h for h in (screen_fundamentals_code(c, legacy, "buy") for c in codes) if h]
@@ -0,0 +1,10 @@
+import pytest
+
+import pattern_engine
+
+
+@pytest.mark.parametrize("profile, window", [("batch", 30), ("app", 31)])
+def test_batched_patterns_match_per_code_checks(synthetic_market, profile, window):
+    res = pattern_engine.scan_patterns(synthetic_market, window, profile)
+    assert res["dt"].any() and res["hs"].any() and res["db"].any()
+    assert pattern_engine.check_parity(synthetic_market, window, profile) == []
@@ -0,0 +1,39 @@
+import price_store
+
+
+def _bar(code, close, factor=1.0):
+    return {"Code": code, "Date": "", "AdjO": close, "AdjH": close, "AdjL": close, "AdjC": close,
+            "AdjVo": 1000.0, "AdjFactor": factor}
+
+
+def _ingest(root, dt, records):
+    """兵站Bot / app と同じ手順：1日分を書き込み、分割・併合があれば過去日を遡及調整"""
+    price_store.write_day(dt, records, root=root)
+    factors = price_store.extract_adj_factors(records)
+    return price_store.apply_adjustment(factors, dt, root=root, skip_days={dt})
+
+
+def test_same_split_day_written_twice_adjusts_history_once(tmp_path):
+    root = str(tmp_path)
+    _ingest(root, "20260105", [_bar("13010", 1000.0), _bar("72030", 2000.0)])
+    split_day = [_bar("13010", 500.0, factor=0.5), _bar("72030", 2000.0)]
+
+    assert _ingest(root, "20260106", split_day) == 1
+    # 確定前に取得した日は次回取り直される（同じ分割日をもう一度書き込む）
+    assert _ingest(root, "20260106", split_day) == 0
+
+    prev = price_store.load_bars(days=["20260105"], root=root).set_index("Code")
+    assert prev.loc["13010", "AdjC"] == 500.0
+    assert prev.loc["13010", "Volume"] == 2000.0
+    assert prev.loc["72030", "AdjC"] == 2000.0
+    assert price_store.load_manifest(root)["splits"] == {"20260106": {"13010": 0.5}}
+
+
+def test_split_on_another_day_still_applies(tmp_path):
+    root = str(tmp_path)
+    _ingest(root, "20260105", [_bar("13010", 1000.0)])
+    _ingest(root, "20260106", [_bar("13010", 500.0, factor=0.5)])
+    _ingest(root, "20260107", [_bar("13010", 250.0, factor=0.5)])
+
+    bars = price_store.load_bars(root=root).set_index("Date")["AdjC"]
+    assert list(bars.values) == [250.0, 250.0, 250.0]
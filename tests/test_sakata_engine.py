@@ -0,0 +1,7 @@
+import sakata_engine
+
+
+def test_batched_scan_matches_detect_sakata_patterns(synthetic_market):
+    res = sakata_engine.scan_sakata(synthetic_market)
+    assert sum(int(v.sum()) for v in res["flags"].values()) > 0
+    assert sakata_engine.check_parity(synthetic_market) == []
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==========================================
+# ⏱️ 処理段階トレーサー（入れ子のスパンで「どこに何秒かかったか」を記録）
+# ==========================================
+# with tracer.span("TAB1 買いスキャン"):            … コンテキストマネージャ
+#     with tracer.span("Phase1 価格足切り"): ...
+# @tracer.trace("チャート描画")                    … デコレータ
+# sp = tracer.start("Phase2"); ...; tracer.end(sp) … 既存の長いブロックを字下げし直さずに囲む
+#
+# ・各スパンは 経過秒・API呼び出し回数・処理件数 を持つ
+#   API回数は rate_limiter.jquants_get / async_fetcher が発射ごとに count_api() で自動計上する
+# ・スパンの入れ子はスレッドごとに管理する（Streamlit のセッションは別スレッドなので混ざらない）
+#   ワーカースレッドへ仕事を投げるときは bind(fn) で呼び出し元のスパンを引き継ぐ
+# ・一番外側のスパンが閉じたら1行の JSON（入れ子ごと）を TRACE_FILE へ追記する
+#   環境変数 SCAN_TRACE_FILE で出力先を変更、空文字なら書き出さない
+
+TRACE_FILE = os.getenv("SCAN_TRACE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "trace_log.jsonl"))
+
+
+class Span:
+    """1つの処理段階。children に入れ子の段階を持つ"""
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs or {})
+        self.children = []
+        self.started_at = datetime.now()
+        self.seconds = None
+        self.api_calls = 0
+        self.rows = 0
+        self.error = None
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self.seconds is not None
+
+    def elapsed(self):
+        """経過秒（閉じていれば確定値、開いていれば現在までの値）"""
+        return self.seconds if self.closed else time.perf_counter() - self._t0
+
+    def add_rows(self, n):
+        with self._lock:
+            self.rows += int(n)
+
+    def count_api(self, n=1):
+        with self._lock:
+            self.api_calls += int(n)
+
+    def total_api_calls(self):
+        return self.api_calls + sum(c.total_api_calls() for c in list(self.children))
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "seconds": round(self.elapsed(), 6),
+            "api_calls": self.total_api_calls(),
+            "rows": self.rows,
+            "attrs": self.attrs,
+            "error": self.error,
+            "children": [c.to_dict() for c in list(self.children)],
+        }
+
+    def breakdown(self):
+        """
+        表示用に入れ子を平らにした行のリスト（深さ優先）。
+        share は一番外側のスパンに対する割合（%）、api_calls は子孫を含む合計。
+        """
+        total = self.elapsed() or 1e-12
+        out = []
+
+        def walk(sp, depth):
+            out.append({"depth": depth, "name": sp.name, "seconds": sp.elapsed(),
+                        "share": sp.elapsed() / total * 100, "api_calls": sp.total_api_calls(),
+                        "rows": sp.rows, "error": sp.error})
+            for c in list(sp.children):
+                walk(c, depth + 1)
+
+        walk(self, 0)
+        return out
+
+
+class Tracer:
+    def __init__(self, path=TRACE_FILE, keep=50):
+        self.path = path
+        self.keep = keep
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    # ---------- スレッドごとの状態 ----------
+    def _stack(self):
+        st = getattr(self._local, "stack", None)
+        if st is None:
+            st = self._local.stack = []
+        return st
+
+    def _finished(self):
+        done = getattr(self._local, "finished", None)
+        if done is None:
+            done = self._local.finished = []
+        return done
+
+    def current(self):
+        st = self._stack()
+        return st[-1] if st else None
+
+    # ---------- スパンの開閉 ----------
+    def start(self, name, **attrs):
+        """スパンを開いて返す（end で閉じる）。開いているスパンがあればその子になる"""
+        parent = self.current()
+        sp = Span(name, parent, attrs)
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(sp)
+        self._stack().append(sp)
+        return sp
+
+    def end(self, span, rows=None, error=None):
+        """
+        span を閉じて経過秒を返す。span より内側で閉じ忘れたスパン（途中の st.stop() 等）もまとめて閉じる。
+        一番外側のスパンなら JSON 1行を書き出す。
+        """
+        if span.closed:
+            return span.seconds
+        if rows is not None:
+            span.add_rows(rows)
+        if error is not None:
+            span.error = str(error)
+        st = self._stack()
+        if span in st:
+            while st:
+                sp = st.pop()
+                if not sp.closed:
+                    sp.seconds = time.perf_counter() - sp._t0
+                if sp is span:
+                    break
+        else:
+            span.seconds = time.perf_counter() - span._t0
+        if span.parent is None:
+            done = self._finished()
+            done.append(span)
+            del done[:-self.keep]
+            self.write(span)
+        return span.seconds
+
+    @contextmanager
+    def span(self, name, **attrs):
+        sp = self.start(name, **attrs)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            self.end(sp)
+
+    def trace(self, name=None, **attrs):
+        """関数全体を1つのスパンで囲むデコレータ（名前省略時は関数名）"""
+        def deco(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(label, **attrs):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def bind(self, fn):
+        """
+        呼び出し元スレッドで開いているスパンを、fn を実行するワーカースレッドにも引き継ぐ。
+        executor.submit(tracer.bind(fetch_one), code) のように使う。
+        """
+        parent = self.current()
+        if parent is None:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            st = self._stack()
+            st.append(parent)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                # ワーカー内で閉じ忘れた子スパンごと取り除く
+                while st:
+                    sp = st.pop()
+                    if sp is parent:
+                        break
+                    if not sp.closed:
+                        sp.seconds = time.perf_counter() - sp._t0
+        return wrapper
+
+    # ---------- 計上 ----------
+    def count_api(self, n=1):
+        sp = self.current()
+        if sp is not None:
+            sp.count_api(n)
+
+    def add_rows(self, n):
+        sp = self.current()
+        if sp is not None:
+            sp.add_rows(n)
+
+    # ---------- 結果の取り出し ----------
+    def drain(self):
+        """このスレッドで閉じた一番外側のスパンを古い順に返し、手元の記録を空にする"""
+        done = self._finished()
+        out = list(done)
+        done.clear()
+        return out
+
+    def write(self, span):
+        if not self.path:
+            return
+        try:
+            line = json.dumps({"pid": os.getpid(), **span.to_dict()}, ensure_ascii=False, default=str)
+            with self._write_lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception:
+            pass
+
+
+def load_traces(path=TRACE_FILE, name=None):
+    """書き出した JSON 行を読む（name 指定時はその名前の一番外側のスパンだけ）"""
+    if not path or not os.path.exists(path):
+        return []
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if name is None or rec.get("name") == name:
+                out.append(rec)
+    return out
+
+
+def breakdown_of(record):
+    """to_dict() / load_traces() の辞書版の breakdown（Span.breakdown と同じ列）"""
+    total = record.get("seconds") or 1e-12
+    out = []
+
+    def walk(rec, depth):
+        out.append({"depth": depth, "name": rec["name"], "seconds": rec["seconds"],
+                    "share": rec["seconds"] / total * 100, "api_calls": rec.get("api_calls", 0),
+                    "rows": rec.get("rows", 0), "error": rec.get("error")})
+        for c in rec.get("children", []):
+            walk(c, depth + 1)
+
+    walk(record, 0)
+    return out
+
+
+# プロセス共通のトレーサー（モジュール関数として使う）
+TRACER = Tracer()
+start = TRACER.start
+end = TRACER.end
+span = TRACER.span
+trace = TRACER.trace
+bind = TRACER.bind
+current = TRACER.current
+count_api = TRACER.count_api
+add_rows = TRACER.add_rows
+drain = TRACER.drain
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="トレースログ（JSON行）の集計")
+    parser.add_argument("--path", default=TRACE_FILE)
+    parser.add_argument("--name", default=None, help="一番外側のスパン名で絞り込む")
+    parser.add_argument("--last", type=int, default=1, help="直近何件を内訳表示するか")
+    args = parser.parse_args()
+
+    records = load_traces(args.path, args.name)
+    if not records:
+        raise SystemExit(f"{args.path} にトレースがありません")
+    for rec in records[-args.last:]:
+        print(f"\n⏱️ {rec['name']} ({rec['started_at']}) 総計 {rec['seconds']:.2f}秒 / API {rec['api_calls']}回")
+        for row in breakdown_of(rec):
+            err = f"  ⚠️ {row['error']}" if row["error"] else ""
+            print(f"  {'  ' * row['depth']}{row['name']:<30} {row['seconds']:8.3f}秒 {row['share']:5.1f}%  "
+                  f"API {row['api_calls']:>4}  件数 {row['rows']:>7,}{err}")
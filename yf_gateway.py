@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+import concurrent.futures
+
+import pandas as pd
+
+# ==========================================
+# 🌐 yfinance 窓口（複数銘柄を1回の一括ダウンロードにまとめる・TTL つきキャッシュ）
+# ==========================================
+# 銘柄ごとに yf.Ticker(...).history() / .info を呼ぶと、30銘柄の更新で 30往復以上になる。
+# ここを通せば
+#   latest_prices(codes)         … 最新値。キャッシュに無い銘柄を yf.download の1回にまとめて取る
+#   history(symbols, period)     … 日足。同じく複数銘柄を1回で取る（^N225 など指数もそのまま渡せる）
+#   info_fields(codes, fields)   … .info の必要な項目だけ。yfinance に一括の口が無いので、
+#                                   キャッシュに無い銘柄だけを小さなスレッドプールで取る
+# ・別スレッド（Streamlit の別セッション・並列スキャンのワーカー）から同じ時期に来た要求は、
+#   COALESCE_SEC だけ待って1つのバッチにまとめる。取得中の銘柄を別の要求が欲しがったら、その完了を待って相乗りする
+# ・取れた値は種類ごとの TTL（QUOTE_TTL / HISTORY_TTL / INFO_TTL）の間使い回す。取れなかった銘柄は
+#   MISS_TTL の間だけ「無し」を覚えておき、毎回取りに行かない
+# 環境変数 YF_QUOTE_TTL / YF_HISTORY_TTL / YF_INFO_TTL / YF_MISS_TTL / YF_COALESCE_MS / YF_BATCH_SIZE で変更できる。
+
+QUOTE_TTL = float(os.getenv("YF_QUOTE_TTL", "60"))
+HISTORY_TTL = float(os.getenv("YF_HISTORY_TTL", "600"))
+INFO_TTL = float(os.getenv("YF_INFO_TTL", str(6 * 3600)))
+MISS_TTL = float(os.getenv("YF_MISS_TTL", "120"))
+COALESCE_SEC = float(os.getenv("YF_COALESCE_MS", "50")) / 1000.0
+BATCH_SIZE = int(os.getenv("YF_BATCH_SIZE", "200"))
+INFO_WORKERS = 4
+WAIT_TIMEOUT = 60.0
+
+_MISSING = object()
+
+
+def to_symbol(code):
+    """'7203' / '72030' / '7203.0' → '7203.T'。'^N225' や '.T' 付きはそのまま"""
+    s = str(code).replace('.0', '').strip()
+    if s.startswith("^") or "." in s:
+        return s
+    if len(s) == 5 and s.endswith("0"):
+        s = s[:4]
+    return f"{s}.T"
+
+
+def _split_download(df, symbols):
+    """yf.download の結果（1銘柄なら平たい列、複数なら (銘柄, 項目) の2段列）→ {symbol: DataFrame}"""
+    out = {}
+    if df is None or df.empty:
+        return out
+    if isinstance(df.columns, pd.MultiIndex):
+        level = next((i for i in range(df.columns.nlevels) if set(symbols) & set(df.columns.get_level_values(i))), None)
+        if level is None:
+            return out
+        for sym in symbols:
+            if sym in df.columns.get_level_values(level):
+                part = df.xs(sym, axis=1, level=level).dropna(how="all")
+                if not part.empty:
+                    out[sym] = part
+    elif len(symbols) == 1:
+        part = df.dropna(how="all")
+        if not part.empty:
+            out[symbols[0]] = part
+    return out
+
+
+class _Batch:
+    """まとめて取得する1回分（待ち合わせ用）"""
+
+    def __init__(self):
+        self.symbols = []
+        self.values = {}
+        self.event = threading.Event()
+
+
+class YFGateway:
+    def __init__(self, coalesce=COALESCE_SEC, batch_size=BATCH_SIZE):
+        self.coalesce = coalesce
+        self.batch_size = max(1, int(batch_size))
+        self._lock = threading.Lock()
+        self._cache = {}     # (種類, symbol) -> (取得時刻, 値 or _MISSING)
+        self._pending = {}   # (種類, symbol) -> 取得中の _Batch
+        self._open = {}      # 種類 -> まだ締め切っていない _Batch
+        self.counts = {"hit": 0, "wait": 0, "fetched": 0, "round_trips": 0, "errors": 0}
+
+    # ---------- 共通：まとめ取り ----------
+    def _get_many(self, kind, symbols, ttl, fetch_many):
+        """
+        symbols の値を {symbol: 値} で返す（取れなかったものは含めない）。
+        キャッシュに無いものは、同じ時期の要求とまとめて fetch_many(symbols) で1回に取る。
+        """
+        now = time.time()
+        out, waits, leader, batch = {}, {}, False, None
+        with self._lock:
+            for sym in dict.fromkeys(symbols):
+                key = (kind, sym)
+                hit = self._cache.get(key)
+                if hit is not None and now - hit[0] < (ttl if hit[1] is not _MISSING else min(ttl, MISS_TTL)):
+                    self.counts["hit"] += 1
+                    if hit[1] is not _MISSING:
+                        out[sym] = hit[1]
+                    continue
+                if key in self._pending:
+                    self.counts["wait"] += 1
+                    waits.setdefault(id(self._pending[key]), (self._pending[key], []))[1].append(sym)
+                    continue
+                if batch is None:
+                    batch = self._open.get(kind)
+                    if batch is None:
+                        batch = self._open[kind] = _Batch()
+                        leader = True
+                batch.symbols.append(sym)
+                self._pending[key] = batch
+                waits.setdefault(id(batch), (batch, []))[1].append(sym)
+
+        if leader:
+            values = {}
+            try:
+                if self.coalesce > 0:
+                    time.sleep(self.coalesce)   # 同じ時期の要求が相乗りしてくるのを少し待つ
+                with self._lock:
+                    self._open.pop(kind, None)
+                    todo = list(batch.symbols)
+                for i in range(0, len(todo), self.batch_size):
+                    part = todo[i:i + self.batch_size]
+                    try:
+                        values.update(fetch_many(part))
+                    except Exception:
+                        with self._lock:
+                            self.counts["errors"] += 1
+                    with self._lock:
+                        self.counts["round_trips"] += 1
+                stamp = time.time()
+                with self._lock:
+                    for sym in todo:
+                        self._cache[(kind, sym)] = (stamp, values.get(sym, _MISSING))
+                    self.counts["fetched"] += len(values)
+            finally:
+                # 中断されても待っている側を解放する（取れなかった分は値なし）
+                with self._lock:
+                    if self._open.get(kind) is batch:
+                        self._open.pop(kind)
+                    for sym in batch.symbols:
+                        self._pending.pop((kind, sym), None)
+                batch.values = values
+                batch.event.set()
+
+        for b, syms in waits.values():
+            b.event.wait(WAIT_TIMEOUT)
+            for sym in syms:
+                if sym in b.values:
+                    out[sym] = b.values[sym]
+        return out
+
+    # ---------- 取得の中身 ----------
+    @staticmethod
+    def _download(symbols, period, interval):
+        import yfinance as yf
+        df = yf.download(symbols if len(symbols) > 1 else symbols[0], period=period, interval=interval,
+                         group_by="ticker", auto_adjust=False, threads=True, progress=False)
+        return _split_download(df, symbols)
+
+    def _fetch_quotes(self, symbols):
+        out = {}
+        for sym, df in self._download(symbols, "5d", "1d").items():
+            close = df["Close"].dropna() if "Close" in df.columns else pd.Series(dtype=float)
+            if not close.empty:
+                out[sym] = float(close.iloc[-1])
+        return out
+
+    @staticmethod
+    def _fetch_info(symbols):
+        import yfinance as yf
+
+        def one(sym):
+            try:
+                info = yf.Ticker(sym).info
+                return sym, dict(info) if info else None
+            except Exception:
+                return sym, None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(INFO_WORKERS, len(symbols))) as exe:
+            return {sym: info for sym, info in exe.map(one, symbols) if info}
+
+    # ---------- 公開 API ----------
+    def latest_prices(self, codes):
+        """{code: 最新値}（取れなかった銘柄は含めない）。キーは渡されたコードのまま"""
+        syms = {c: to_symbol(c) for c in codes}
+        got = self._get_many("quote", list(syms.values()), QUOTE_TTL, self._fetch_quotes)
+        return {c: got[s] for c, s in syms.items() if s in got}
+
+    def history(self, symbols, period="3mo", interval="1d"):
+        """{symbol: 日足 DataFrame}。symbols は '^N225' や '7203.T'（4桁コードも可）"""
+        syms = {s: to_symbol(s) for s in symbols}
+        got = self._get_many(("history", period, interval), list(syms.values()), HISTORY_TTL,
+                             lambda part: self._download(part, period, interval))
+        return {s: got[y].copy() for s, y in syms.items() if y in got}
+
+    def info_fields(self, codes, fields):
+        """{code: {項目: 値}}（.info の中から fields のうち有るものだけ。取れなかった銘柄は含めない）"""
+        syms = {c: to_symbol(c) for c in codes}
+        got = self._get_many("info", list(syms.values()), INFO_TTL, self._fetch_info)
+        return {c: {f: got[s][f] for f in fields if f in got[s]} for c, s in syms.items() if s in got}
+
+    def invalidate(self, kind=None):
+        """kind（'quote' / 'info' / 'history'）のキャッシュを捨てる。省略時は全部"""
+        with self._lock:
+            for key in [k for k in self._cache if kind is None or k[0] == kind or (isinstance(k[0], tuple) and k[0][0] == kind)]:
+                del self._cache[key]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._cache), "pending": len(self._pending), **self.counts}
+
+
+# プロセスで1つ（全セッション・全スレッドで共有）
+GATEWAY = YFGateway()
+latest_prices = GATEWAY.latest_prices
+history = GATEWAY.history
+info_fields = GATEWAY.info_fields